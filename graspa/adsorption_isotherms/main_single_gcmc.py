@@ -2,13 +2,28 @@ import configparser
 import math
 import os
 import re
-import shutil
+import sys
 import threading
 import time
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from queue import Queue
 from threading import Lock
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_atoms import read_cif_atoms
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.energy_grid import read_mixing_rules
+from ht_utils.framework_descriptors import framework_descriptors
+from ht_utils.forcefield import ForceFieldCache, PRUNED_FF_FILES
+from ht_utils.gcmc import AVOGADRO, bulk_fugacity, loading_units, read_critical_constants, read_pseudo_atom_masses
+from ht_utils.p1_cache import find_p1_cif
+from ht_utils.preflight import run_preflight, write_preflight_report
+from ht_utils.reweighting import gcmc_isotherm
+from ht_utils.staging import link_file, link_directory_files
+from ht_utils.symmetry import expand_to_p1
+from ht_utils.widom_grid import GAS_CONSTANT, henry_coefficient, read_molecule_definition, read_pseudo_atom_charges
+
 def get_unit_cell(cif_location, cutoff):
     with open(cif_location, 'r') as f:
         text = f.readlines()
@@ -48,158 +63,17 @@ def get_unit_cell(cif_location, cutoff):
 
 
 def generate_simulation_input(template: str, cutoff: float, cif_dir: str,
-                              cif_file: str, temperature: float, pressure: float):
-    unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+                              cif_file: str, temperature: float, pressure: float, catalog=None):
+    # 优先从结构目录(cif_catalog.sqlite)中读取UnitCells参数，避免重复解析cif文件
+    unitcell = None
+    if catalog is not None:
+        unitcell = catalog.get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+    if unitcell is None:
+        unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
     cif_name = cif_file[:-4]
     return template.format(cif_name=cif_name, cutoff=cutoff, unitcell=unitcell, Temperature=temperature, Pressure=pressure)
 
 
-def process_forcefield_files(cmd_dir, input_text):
-    # 从输入文本中获取框架名称
-    def get_frameworks_from_input(input_text):
-        frameworks = []
-        for line in input_text.splitlines():
-            if "FrameworkName" in line:
-                spline = line.split()
-                spline.pop(0)
-                frameworks = spline
-        return frameworks
-
-    # 从输入文本中获取吸附物名称
-    def get_adsorbates_from_input(input_text):
-        adsorbates = []
-        for line in input_text.splitlines():
-            if "Component" in line:
-                spline = line.split()
-                adsorbates.append(spline[3])
-        return adsorbates
-
-    # 读取框架伪原子的标签
-    def read_Framework_pseudoAtoms(filename):
-        ncols = 0
-        count = 0
-        labels = []
-        with open(filename) as f:
-            for line in f:
-                if("_atom_" in line):
-                    ncols += 1
-                if(ncols > 0 and count > 0 and not("_atom_" in line)):
-                    spline = line.split()
-                    if not (ncols == len(spline)):
-                        raise Exception("CIF FILE WRONG!")
-                    label = spline[0]
-                    label = ''.join(i for i in label if not i.isdigit())
-                    labels.append(label)
-                count += 1
-        labels = list(set(labels))
-        return labels
-
-    # 读取分子伪原子的标签
-    def read_Molecule_pseudoAtoms(filename):
-        count = 0
-        NAtom = 0
-        Atomcount = 0
-        labels = []
-        with open(filename) as f:
-            for line in f:
-                if(count == 5):
-                    spline = line.split()
-                    NAtom = int(spline[0])
-                if("atomic positions" in line):
-                    start = count
-                if(NAtom > 0 and 'atomic positions' in line):
-                    Atomcount = 0
-                if(NAtom > 0 and Atomcount < NAtom and not("#" in line) and count > 5):
-                    spline = line.split()
-                    if len(spline) > 1:
-                        labels.append(spline[1])
-                        Atomcount += 1
-                count += 1
-        labels = list(set(labels))
-        return labels
-
-    # 处理力场文件
-    def Process_ForceFieldFile(Labels, dir_path):
-        input_file    = os.path.join(dir_path, "force_field_mixing_rules.def")
-        original_file = os.path.join(dir_path, "original_force_field_mixing_rules.def")
-        output_file   = os.path.join(dir_path, "output_force_field_mixing_rules.def")
-        shutil.copy(input_file, original_file)
-        count = 0
-        newlines=len(Labels)
-        oldlines=0
-        with open(original_file) as fr:
-            with open(output_file, 'w') as fw:
-                for line in fr:
-                    if(count == 5):
-                        spline = line.split()
-                        oldlines = int(spline[0])
-                        line = str(int(newlines)) + '\n'
-                    if(count < 7 or count >= (7 + oldlines)):
-                        fw.write(line)
-                    else:
-                        spline  = line.split()
-                        if spline:
-                            element = spline[0]
-                            if(element in Labels):
-                                fw.write(line)
-                    count += 1
-
-    # 处理伪原子文件
-    def Process_PseudoAtomsFile(Labels, dir_path):
-        input_file    = os.path.join(dir_path, "pseudo_atoms.def")
-        original_file = os.path.join(dir_path, "original_pseudo_atoms.def")
-        output_file   = os.path.join(dir_path, "output_pseudo_atoms.def")
-        shutil.copy(input_file, original_file)
-        count = 0
-        newlines=len(Labels)
-        oldlines=0
-        with open(original_file) as fr:
-            with open(output_file, 'w') as fw:
-                for line in fr:
-                    if(count == 1):
-                        spline = line.split()
-                        oldlines = int(spline[0])
-                        line = str(int(newlines)) + '\n'
-                    if(count < 3):
-                        fw.write(line)
-                    else:
-                        spline  = line.split()
-                        if spline:
-                            element = spline[0]
-                            if(element in Labels):
-                                fw.write(line)
-                    count += 1
-
-    # 获取框架名称和吸附物名称
-    frameworks = get_frameworks_from_input(input_text)
-    adsorbates = get_adsorbates_from_input(input_text)
-    Frameworklabels = []
-    Adsorbatelabels = []
-    # 遍历框架名称，读取框架伪原子的标签
-    for framework in frameworks:
-        cif_path = os.path.join(cmd_dir, framework + '.cif')
-        if os.path.exists(cif_path):
-            Frameworklabels.extend(read_Framework_pseudoAtoms(cif_path))
-    # 遍历吸附物名称，读取分子伪原子的标签
-    for adsorbate in adsorbates:
-        def_path = os.path.join(cmd_dir, adsorbate + '.def')
-        if os.path.exists(def_path):
-            Adsorbatelabels.extend(read_Molecule_pseudoAtoms(def_path))
-    # 合并框架和吸附物的标签
-    Labels = []
-    Labels.extend(Frameworklabels)
-    Labels.extend(Adsorbatelabels)
-    # 处理力场文件和伪原子文件
-    Process_ForceFieldFile(Labels, cmd_dir)
-    Process_PseudoAtomsFile(Labels, cmd_dir)
-    # 覆盖原始文件
-    shutil.move(os.path.join(cmd_dir, "output_force_field_mixing_rules.def"), os.path.join(cmd_dir, "force_field_mixing_rules.def"))
-    shutil.move(os.path.join(cmd_dir, "output_pseudo_atoms.def"), os.path.join(cmd_dir, "pseudo_atoms.def"))
-    # 删除 original 文件
-    os.remove(os.path.join(cmd_dir, "original_force_field_mixing_rules.def"))
-    os.remove(os.path.join(cmd_dir, "original_pseudo_atoms.def"))
-
-
 def wait_for_task_finish(output_txt_path, timeout=3600, interval=5):
     """等待Output.txt出现END OF PROGRAM，超时单位秒"""
     waited = 0
@@ -214,7 +88,7 @@ def wait_for_task_finish(output_txt_path, timeout=3600, interval=5):
     return False
 
 def work(cif_dir: str, cif_file: str, gRASPA_dir: str, result_file: str, components: str, headers: str, input_text: str,
-         lock: Lock, q: Queue, pressure: float):
+         lock: Lock, q: Queue, pressure: float, ff_cache: ForceFieldCache, catalog=None):
     cif_name = cif_file[:-4]
     curr_dir = os.path.abspath(os.path.dirname(__file__))
     output_dir = os.path.join(curr_dir, "gRASPA_Output")
@@ -222,19 +96,17 @@ def work(cif_dir: str, cif_file: str, gRASPA_dir: str, result_file: str, compone
     cmd_dir = os.path.join(output_dir, cif_name, str(pressure))
     if not os.path.exists(cmd_dir):
         os.makedirs(cmd_dir)
-    # 复制cif文件到工作目录
-    shutil.copy(os.path.join(cif_dir, cif_file), cmd_dir)
-    
-    # 复制single_FF目录下的所有文件到工作目录
-    FF_dir = os.path.join(curr_dir, "single_FF")   
-    for filename in os.listdir(FF_dir):
-        src_file = os.path.join(FF_dir, filename)
-        dst_file = os.path.join(cmd_dir, filename)
-        if os.path.isfile(src_file):
-            shutil.copy(src_file, dst_file)
-
-    # 处理力场文件
-    process_forcefield_files(cmd_dir, input_text)
+    # 链接cif文件和不需要修改的力场文件（分子.def、force_field.def等）到工作目录，
+    # force_field_mixing_rules.def和pseudo_atoms.def在处理力场文件时单独写入
+    link_file(find_p1_cif(cif_dir, cif_file), os.path.join(cmd_dir, cif_file))
+    FF_dir = os.path.join(curr_dir, "single_FF")
+    link_directory_files(FF_dir, cmd_dir, exclude=PRUNED_FF_FILES)
+
+    # 处理力场文件（修剪后的力场文件按伪原子标签缓存，同一框架只生成一次）
+    framework_labels = None
+    if catalog is not None:
+        framework_labels = catalog.get_labels(os.path.join(cif_dir, cif_file))
+    ff_cache.stage(cmd_dir, input_text, cif_dir, framework_labels)
     
     cmd = ["gRASPA"]
     sim_input_path = os.path.join(cmd_dir, "simulation.input")
@@ -357,6 +229,229 @@ def write_error(result_file, pressure):
         f.close()
 
 
+def henry_work(args):
+    '''
+        在子进程中用能量网格Widom插入计算单个结构的亨利系数（只计算Lennard-Jones作用），
+        返回(cif名, {'henry': mol/kg/Pa, 'henry_error', 'heat': kJ/mol, 'molecules_per_mol_kg': 1 mol/kg对应的
+        模拟盒子分子数, 'density': 框架密度kg/m^3})
+    '''
+    cif_dir, cif_file, params, names, positions, cutoff, temperature, spacing, shifted, tail_corrections, \
+        insertions, masses = args
+    cif_name = cif_file[:-4]
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif_file))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+        result = henry_coefficient(structure, params, names, positions, temperature, cutoff, spacing, shifted,
+                                   tail_corrections, insertions, masses=masses)
+        descriptors = framework_descriptors(structure, masses)
+        # 模拟盒子的晶胞数与gRASPA的UnitCells相同
+        cells = 1
+        for n in get_unit_cell(os.path.join(cif_dir, cif_file), cutoff).split():
+            cells *= int(n)
+        res = {'henry': result['Henry_coefficient'], 'henry_error': result['Henry_coefficient_error'],
+               'heat': result['Heat_of_adsorption'],
+               'molecules_per_mol_kg': float(descriptors['framework_mass_g/mol']) / 1000 * cells,
+               'density': float(descriptors['Framework_density_kg/m^3'])}
+    except Exception as e:
+        return cif_name, e
+    return cif_name, res
+
+
+def get_henry_result(henry: dict, component: str, molar_mass: float, pressure: float, warning: str):
+    '''
+        亨利区的解析吸附量 K_H P，列与get_result()相同，误差 P dK_H 记录在warning列中
+    '''
+    mol_kg = henry['henry'] * pressure
+    res = {"pressure": str(pressure), "finished": "True"}
+    res[component + "_Heat_of_adsorption_kJ/mol"] = "{:.10f}".format(henry['heat'])
+    res[component + "_loading_molecules"] = "{:.10f}".format(mol_kg * henry['molecules_per_mol_kg'])
+    res[component + "_loading_mg/g"] = "{:.10f}".format(mol_kg * molar_mass)
+    res[component + "_loading_mol/kg"] = "{:.10f}".format(mol_kg)
+    res[component + "_loading_g/L"] = "{:.10f}".format(mol_kg * molar_mass * henry['density'] / 1000)
+    res["warning"] = warning + "Henry regime K_H*P, error {:.3g} mol/kg; ".format(henry['henry_error'] * pressure)
+    return res
+
+
+def henry_prescreen(cif_dir, cifs, cutoffvdm, max_tasks, temperature, henry_options, component):
+    '''
+        对所有结构并行计算亨利系数，返回({cif名: henry_work的结果}, 吸附质摩尔质量)
+        力场与分子定义取自single_FF，计算失败的结构不在返回的字典中（所有压力都运行gRASPA）
+        亨利系数只包含Lennard-Jones作用，吸附质带电荷时（如CO2）低压下的吸附量被明显低估，因此不允许使用
+    '''
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    ff_dir = os.path.join(cur_path, "single_FF")
+    _, spacing, insertions = henry_options
+    names, positions = read_molecule_definition(os.path.join(ff_dir, component + ".def"))
+    params, shifted, tail_corrections = read_mixing_rules(ff_dir)
+    masses = read_pseudo_atom_masses(ff_dir)
+    molar_mass = sum(masses[name] for name in names)
+    charges = read_pseudo_atom_charges(ff_dir)
+    if any(charges.get(name, 0.0) != 0 for name in names):
+        print("{}带电荷，亨利系数不包含静电作用，不能使用henry_prescreen，请设置henry_prescreen = no！"
+              "({} is charged and the Henry coefficient has no electrostatics, set henry_prescreen = no !)".format(
+                  component, component))
+        exit()
+
+    tasks = [(cif_dir, cif, params, names, positions, cutoffvdm, temperature, spacing, shifted, tail_corrections,
+              insertions, masses) for cif in cifs]
+    henry = {}
+    with ProcessPoolExecutor(max_workers=max_tasks) as pool:
+        for cif_name, result in pool.map(henry_work, tasks):
+            if isinstance(result, Exception):
+                print("\033[0;37;41m\n{} Henry error: {} !\n\033[0m".format(cif_name, repr(result)))
+            else:
+                henry[cif_name] = result
+    return henry, molar_mass
+
+
+def get_reweighting_rows(structure, result, component, molar_mass, cells, pressures, warning, min_effective,
+                         masses=None):
+    '''
+        把reweight_isotherm的结果转换为与get_result()相同的列，返回(结果行列表, 误差行列表)
+        分子数为模拟盒子（超晶胞）中的分子数，吸附热由涨落公式得到(kJ/mol)，与gRASPA的符号相同（吸附放热时为负值）
+        masses为力场的{伪原子: 质量}，框架质量与gRASPA一致
+    '''
+    # 每个晶胞的体积(L)，用于换算g/L
+    cell_volume = float(structure.volume()) * 1e-27
+    rows, error_rows = [], []
+    for i, pressure in enumerate(pressures):
+        row_warning = warning
+        if result['effective_samples'][i] < min_effective:
+            row_warning += "low effective samples ({:.0f}); ".format(result['effective_samples'][i])
+        # reweight_isotherm的heat为等量吸附热q_st（正值），吸附热为-q_st
+        for rows_list, molecules, heat in ((rows, result['n'][i][0], -result['heat'][i][0]),
+                                           (error_rows, result['n_error'][i][0], result['heat_error'][i][0])):
+            units = loading_units(structure, molecules / cells, molar_mass, masses)
+            res = {"pressure": str(pressure), "finished": "True", "warning": row_warning}
+            res[component + "_Heat_of_adsorption_kJ/mol"] = "{:.10f}".format(heat * GAS_CONSTANT / 1000)
+            res[component + "_loading_molecules"] = "{:.10f}".format(molecules)
+            res[component + "_loading_mg/g"] = "{:.10f}".format(units['mg/g'])
+            res[component + "_loading_mol/kg"] = "{:.10f}".format(units['mol/kg'])
+            res[component + "_loading_g/L"] = "{:.10f}".format(molecules / cells * molar_mass / AVOGADRO / cell_volume)
+            rows_list.append(res)
+    return rows, error_rows
+
+
+def reweighting_work(args):
+    '''
+        在子进程中用NumPy GCMC模拟单个结构的少数几个压力，记录每个循环的(分子数, 能量)，
+        再由多直方图重加权得到配置的所有压力（以及附近温度）下的吸附量、吸附热与误差
+        返回(cif名, {温度: (结果行列表, 误差行列表)})
+    '''
+    cif_dir, cif_file, params, component, atom, molar_mass, critical, fugacity_coefficient, cutoff, temperature, \
+        pressures, target_temperatures, spacing, shifted, cycles, initialization_cycles, bootstrap, min_effective, \
+        warning, masses = args
+    cif_name = cif_file[:-4]
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif_file))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+
+        def fugacity(pressure, t):
+            # 模板中设置了FugacityCoefficient时使用该值，否则由Peng-Robinson状态方程计算
+            return bulk_fugacity(t, pressure, [critical], None, [fugacity_coefficient])[0]
+
+        isotherm = gcmc_isotherm(structure, params, [atom], fugacity, pressures, temperature, target_temperatures,
+                                 cutoff, spacing, shifted, cycles, initialization_cycles, min_effective, bootstrap)
+        warning += "reweighted from simulations at {} Pa; ".format(' '.join("{:g}".format(p)
+                                                                          for p in isotherm['simulated']))
+        res = {}
+        for t in [temperature] + list(target_temperatures):
+            res[t] = get_reweighting_rows(structure, isotherm[t], component, molar_mass, isotherm['cells'], pressures,
+                                          warning, min_effective, masses)
+    except Exception as e:
+        return cif_name, e
+    return cif_name, res
+
+
+def get_reweighting_result_files(cur_path, cif_name, temperature, target_temperatures):
+    '''
+        重加权模式的结果文件：{温度: (结果文件, 误差文件)}，模拟温度为<cif名>.csv，附近温度为<cif名>_<温度>K.csv
+    '''
+    files = {temperature: (os.path.join(cur_path, f"{cif_name}.csv"), os.path.join(cur_path, f"{cif_name}_errors.csv"))}
+    for t in target_temperatures:
+        files[t] = (os.path.join(cur_path, f"{cif_name}_{t:g}K.csv"),
+                    os.path.join(cur_path, f"{cif_name}_{t:g}K_errors.csv"))
+    return files
+
+
+def reweighting_main(cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressures, preflight, reweighting_options,
+                     template, components, headers):
+    '''
+        重加权模式：力场参数取自reweighting_forcefield_dir（为空时使用single_FF），只支持单原子Lennard-Jones吸附质
+        每个结构在一个子进程中自适应地选择模拟的压力，结果与误差按gRASPA模式的列写入每个温度的csv文件
+    '''
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    ff_dir, target_temperatures, spacing, cycles, initialization_cycles, bootstrap, min_effective = reweighting_options
+    if len(ff_dir) == 0:
+        ff_dir = os.path.join(cur_path, "single_FF")
+    component = components[0]
+    def_location = os.path.join(ff_dir, component + ".def")
+    if not os.path.isfile(def_location):
+        print("找不到吸附质的分子定义文件！(The molecule definition of the adsorbate is not found !) " + def_location)
+        exit()
+    molecule_atoms, _ = read_molecule_definition(def_location)
+    if len(molecule_atoms) != 1:
+        print("reweighting模式只支持单原子吸附质！(The reweighting engine only supports single-site adsorbates !) "
+              + component)
+        exit()
+    atom = molecule_atoms[0]
+    params, shifted, _ = read_mixing_rules(ff_dir)
+    masses = read_pseudo_atom_masses(ff_dir)
+    molar_mass = masses[atom]
+    critical = read_critical_constants(def_location)
+    m = re.search(r'^\s*FugacityCoefficient\s+(\S+)', template, re.MULTILINE)
+    fugacity_coefficient = float(m.group(1)) if m is not None else None
+    if cycles is None:
+        m = re.search(r'^\s*NumberOfProductionCycles\s+(\S+)', template, re.MULTILINE)
+        cycles = int(m.group(1)) if m is not None else 1000
+    if initialization_cycles is None:
+        m = re.search(r'^\s*NumberOfInitializationCycles\s+(\S+)', template, re.MULTILINE)
+        initialization_cycles = int(m.group(1)) if m is not None else 500
+    warning = ""
+    if read_pseudo_atom_charges(ff_dir).get(atom, 0.0) != 0:
+        warning = "Coulomb interactions of {} not included; ".format(component)
+
+    def create_result_files(cif_name):
+        for files in get_reweighting_result_files(cur_path, cif_name, temperature, target_temperatures).values():
+            for result_file in files:
+                with open(result_file, 'w') as f:
+                    f.write(",".join(headers) + "\n")
+
+    # 预检查：不使用电荷，只检查晶胞、原子loop和伪原子
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, "", ff_dir, max_tasks)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            create_result_files(cif[:-4])
+            for result_file, _ in get_reweighting_result_files(cur_path, cif[:-4], temperature,
+                                                               target_temperatures).values():
+                for p in pressures:
+                    write_error(result_file, p)
+
+    tasks = [(cif_dir, cif, params, component, atom, molar_mass, critical, fugacity_coefficient, cutoffvdm,
+              temperature, pressures, target_temperatures, spacing, shifted, cycles, initialization_cycles, bootstrap,
+              min_effective, warning, masses) for cif in cifs]
+    with ProcessPoolExecutor(max_workers=max_tasks) as pool:
+        for cif_name, result in pool.map(reweighting_work, tasks):
+            create_result_files(cif_name)
+            files = get_reweighting_result_files(cur_path, cif_name, temperature, target_temperatures)
+            if isinstance(result, Exception):
+                for result_file, _ in files.values():
+                    for p in pressures:
+                        write_error(result_file, p)
+                print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(result)))
+                continue
+            for t, (rows, error_rows) in result.items():
+                for row, error_row in zip(rows, error_rows):
+                    write_result(files[t][0], row, headers)
+                    write_result(files[t][1], error_row, headers)
+            print("\033[0;30;42m\n{} has completed\n\033[0m".format(cif_name))
+
+    print("\033[0;30;42m\n完成！(Finish)\n\033[0m")
+
+
 def check_parameters():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
@@ -380,6 +475,64 @@ def check_parameters():
         print("缺少的选项 (missing options) : " + str(missing_options))
         exit()
 
+    # 可选参数：修剪后力场文件的缓存目录，可在不同批次的计算之间共享
+    ff_cache_dir = os.path.abspath(config.get(section, 'ff_cache_dir', fallback='ff_cache'))
+
+    # 可选参数：调度前并行检查所有cif文件，提前剔除必然失败的结构
+    preflight = config.get(section, 'preflight', fallback='yes').strip().lower() == 'yes'
+
+    # 可选参数：等温线的计算方式，graspa为每个压力运行一次gRASPA，reweighting为NumPy GCMC加多直方图重加权
+    engine = config.get(section, 'isotherm_engine', fallback='graspa').strip().lower()
+    reweighting_ff_dir = config.get(section, 'reweighting_forcefield_dir', fallback='').strip()
+    reweighting_temperatures = config.get(section, 'reweighting_temperatures', fallback='').strip()
+    gcmc_spacing = config.get(section, 'gcmc_grid_spacing', fallback='0.2')
+    gcmc_cycles = config.get(section, 'gcmc_cycles', fallback='').strip()
+    gcmc_initialization_cycles = config.get(section, 'gcmc_initialization_cycles', fallback='').strip()
+    bootstrap_samples = config.get(section, 'bootstrap_samples', fallback='20')
+    min_effective_samples = config.get(section, 'min_effective_samples', fallback='50')
+
+    if engine not in ('graspa', 'reweighting'):
+        print("isotherm_engine只能为graspa或reweighting！(isotherm_engine must be graspa or reweighting !)")
+        exit()
+
+    try:
+        reweighting_temperatures = [float(t) for t in reweighting_temperatures.replace(',', ' ').split()]
+        gcmc_spacing = float(gcmc_spacing)
+        gcmc_cycles = int(gcmc_cycles) if len(gcmc_cycles) > 0 else None
+        gcmc_initialization_cycles = int(gcmc_initialization_cycles) if len(gcmc_initialization_cycles) > 0 else None
+        bootstrap_samples = int(bootstrap_samples)
+        min_effective_samples = float(min_effective_samples)
+    except:
+        print("reweighting_temperatures、gcmc_grid_spacing与min_effective_samples必须为数字，"
+              "gcmc_cycles、gcmc_initialization_cycles与bootstrap_samples必须为整数！"
+              "(reweighting_temperatures, gcmc_grid_spacing and min_effective_samples must be numerical, gcmc_cycles, "
+              "gcmc_initialization_cycles and bootstrap_samples must be integers !)")
+        exit()
+
+    if len(reweighting_ff_dir) > 0:
+        reweighting_ff_dir = os.path.abspath(reweighting_ff_dir)
+        if not os.path.isfile(os.path.join(reweighting_ff_dir, "force_field_mixing_rules.def")):
+            print('reweighting_forcefield_dir中没有force_field_mixing_rules.def！'
+                  '(There is no force_field_mixing_rules.def in reweighting_forcefield_dir !)')
+            exit()
+    # 可选参数：先用能量网格Widom插入计算亨利系数，K_H P低于henry_loading_threshold(mol/kg)的压力不运行gRASPA
+    henry_prescreen = config.get(section, 'henry_prescreen', fallback='no').strip().lower() == 'yes'
+    henry_loading_threshold = config.get(section, 'henry_loading_threshold', fallback='0.01')
+    henry_grid_spacing = config.get(section, 'henry_grid_spacing', fallback='0.3')
+    henry_insertions = config.get(section, 'henry_insertions', fallback='200000')
+    try:
+        henry_loading_threshold = float(henry_loading_threshold)
+        henry_grid_spacing = float(henry_grid_spacing)
+        henry_insertions = int(henry_insertions)
+    except:
+        print("henry_loading_threshold与henry_grid_spacing必须为数字，henry_insertions必须为整数！"
+              "(henry_loading_threshold and henry_grid_spacing must be numerical, henry_insertions must be integer !)")
+        exit()
+    henry_options = (henry_loading_threshold, henry_grid_spacing, henry_insertions) if henry_prescreen else None
+
+    reweighting_options = (reweighting_ff_dir, reweighting_temperatures, gcmc_spacing, gcmc_cycles,
+                           gcmc_initialization_cycles, bootstrap_samples, min_effective_samples)
+
     graspa_dir = option_dic['gRASPA_dir']
     cif_dir = option_dic['cif_location']
     cutoffvdm = option_dic['CutOffVDM']
@@ -393,7 +546,8 @@ def check_parameters():
     if len(cif_dir) > 0:
         cif_dir = os.path.abspath(cif_dir)
 
-    if not os.path.exists(graspa_dir):
+    # reweighting模式不需要gRASPA
+    if engine == 'graspa' and not os.path.exists(graspa_dir):
         print('gRASPA目录无效！(Invalid gRASPA_dir!)')
         exit()
 
@@ -430,7 +584,8 @@ def check_parameters():
         cifs = []
         cifs.append(os.path.basename(cif_dir))
         cif_dir = os.path.dirname(cif_dir)
-        return graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks
+        return graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressure, ff_cache_dir, preflight, engine, \
+            reweighting_options, henry_options
 
     cifs = os.listdir(cif_dir)
     dels = []
@@ -443,14 +598,15 @@ def check_parameters():
         print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
         exit()
 
-    return graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressure
+    return graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressure, ff_cache_dir, preflight, engine, \
+        reweighting_options, henry_options
 
 
 def main():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
-    graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressures = check_parameters()
-    lock = Lock()
+    graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressures, ff_cache_dir, preflight, engine, \
+        reweighting_options, henry_options = check_parameters()
 
     with open("simulation_template.input", "r") as f:
         template = f.read()                                         
@@ -461,12 +617,38 @@ def main():
         exit()
     headers = get_field_headers(components)
 
+    if engine == 'reweighting':
+        reweighting_main(cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressures, preflight, reweighting_options,
+                         template, components, headers)
+        return
+
+    catalog = open_catalog(cif_dir)
+    ff_cache = ForceFieldCache(os.path.join(cur_path, "single_FF"), ff_cache_dir)
+    lock = Lock()
+
     output_dir = os.path.join(cur_path, "gRASPA_Output")
     if os.path.exists(output_dir):
         print("gRASPA_Output目录已存在，请手动删除后重试！(The gRASPA_Output fold already exists, please delete it and try again !)")
         exit()
     os.makedirs(output_dir)
 
+    # 预检查：剔除必然失败的结构，并在其结果文件中为每个压力写入错误行
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, template, os.path.join(cur_path, "single_FF"), max_tasks, graspa=True)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            result_file = os.path.join(cur_path, f"{cif[:-4]}.csv")
+            with open(result_file, 'w') as f:
+                f.write(",".join(headers) + "\n")
+            for p in pressures:
+                write_error(result_file, p)
+
+    # 亨利区预筛选：K_H P低于阈值的压力直接写入解析吸附量
+    henry = {}
+    if henry_options is not None:
+        henry, molar_mass = henry_prescreen(cif_dir, cifs, cutoffvdm, max_tasks, temperature, henry_options,
+                                            components[0])
+
     q = Queue(maxsize=max_tasks)
     for i in range(max_tasks):
         q.put(1)
@@ -485,13 +667,22 @@ def main():
                 else:
                     f.write(headers[i] + "\n")
             f.close()
-        for p in pressures:
+        gcmc_pressures = pressures
+        if cif_name in henry:
+            gcmc_pressures = []
+            for p in pressures:
+                if henry[cif_name]['henry'] * p < henry_options[0]:
+                    write_result(result_file, get_henry_result(henry[cif_name], components[0], molar_mass, p, ""),
+                                 headers)
+                else:
+                    gcmc_pressures.append(p)
+        for p in gcmc_pressures:
             q.get()
             input_text = generate_simulation_input(
                 template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif, 
-                temperature=float(temperature), pressure=float(p))
+                temperature=float(temperature), pressure=float(p), catalog=catalog)
             thread = threading.Thread(target=work, args=(cif_dir, cif, graspa_dir,
-                                                         result_file, components, headers, input_text, lock, q, p))
+                                                         result_file, components, headers, input_text, lock, q, p, ff_cache, catalog))
             thread.start()
             threads.append(thread)
             time.sleep(0.3)
@@ -2,13 +2,20 @@ import configparser
 import math
 import os
 import re
-import shutil
+import sys
 import threading
 import time
 import subprocess
 from queue import Queue
 from threading import Lock
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.forcefield import ForceFieldCache, PRUNED_FF_FILES
+from ht_utils.p1_cache import find_p1_cif
+from ht_utils.preflight import run_preflight, write_preflight_report
+from ht_utils.staging import link_file, link_directory_files
+
 def get_unit_cell(cif_location, cutoff):
     with open(cif_location, 'r') as f:
         text = f.readlines()
@@ -48,158 +55,17 @@ def get_unit_cell(cif_location, cutoff):
 
 
 def generate_simulation_input(template: str, cutoff: float, cif_dir: str,
-                              cif_file: str, temperature: float, pressure: float):
-    unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+                              cif_file: str, temperature: float, pressure: float, catalog=None):
+    # 优先从结构目录(cif_catalog.sqlite)中读取UnitCells参数，避免重复解析cif文件
+    unitcell = None
+    if catalog is not None:
+        unitcell = catalog.get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+    if unitcell is None:
+        unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
     cif_name = cif_file[:-4]
     return template.format(cif_name=cif_name, cutoff=cutoff, unitcell=unitcell, Temperature=temperature, Pressure=pressure)
 
 
-def process_forcefield_files(cmd_dir, input_text):
-    # 从输入文本中获取框架名称
-    def get_frameworks_from_input(input_text):
-        frameworks = []
-        for line in input_text.splitlines():
-            if "FrameworkName" in line:
-                spline = line.split()
-                spline.pop(0)
-                frameworks = spline
-        return frameworks
-
-    # 从输入文本中获取吸附物名称
-    def get_adsorbates_from_input(input_text):
-        adsorbates = []
-        for line in input_text.splitlines():
-            if "Component" in line:
-                spline = line.split()
-                adsorbates.append(spline[3])
-        return adsorbates
-
-    # 读取框架伪原子的标签
-    def read_Framework_pseudoAtoms(filename):
-        ncols = 0
-        count = 0
-        labels = []
-        with open(filename) as f:
-            for line in f:
-                if("_atom_" in line):
-                    ncols += 1
-                if(ncols > 0 and count > 0 and not("_atom_" in line)):
-                    spline = line.split()
-                    if not (ncols == len(spline)):
-                        raise Exception("CIF FILE WRONG!")
-                    label = spline[0]
-                    label = ''.join(i for i in label if not i.isdigit())
-                    labels.append(label)
-                count += 1
-        labels = list(set(labels))
-        return labels
-
-    # 读取分子伪原子的标签
-    def read_Molecule_pseudoAtoms(filename):
-        count = 0
-        NAtom = 0
-        Atomcount = 0
-        labels = []
-        with open(filename) as f:
-            for line in f:
-                if(count == 5):
-                    spline = line.split()
-                    NAtom = int(spline[0])
-                if("atomic positions" in line):
-                    start = count
-                if(NAtom > 0 and 'atomic positions' in line):
-                    Atomcount = 0
-                if(NAtom > 0 and Atomcount < NAtom and not("#" in line) and count > 5):
-                    spline = line.split()
-                    if len(spline) > 1:
-                        labels.append(spline[1])
-                        Atomcount += 1
-                count += 1
-        labels = list(set(labels))
-        return labels
-
-    # 处理力场文件
-    def Process_ForceFieldFile(Labels, dir_path):
-        input_file    = os.path.join(dir_path, "force_field_mixing_rules.def")
-        original_file = os.path.join(dir_path, "original_force_field_mixing_rules.def")
-        output_file   = os.path.join(dir_path, "output_force_field_mixing_rules.def")
-        shutil.copy(input_file, original_file)
-        count = 0
-        newlines=len(Labels)
-        oldlines=0
-        with open(original_file) as fr:
-            with open(output_file, 'w') as fw:
-                for line in fr:
-                    if(count == 5):
-                        spline = line.split()
-                        oldlines = int(spline[0])
-                        line = str(int(newlines)) + '\n'
-                    if(count < 7 or count >= (7 + oldlines)):
-                        fw.write(line)
-                    else:
-                        spline  = line.split()
-                        if spline:
-                            element = spline[0]
-                            if(element in Labels):
-                                fw.write(line)
-                    count += 1
-
-    # 处理伪原子文件
-    def Process_PseudoAtomsFile(Labels, dir_path):
-        input_file    = os.path.join(dir_path, "pseudo_atoms.def")
-        original_file = os.path.join(dir_path, "original_pseudo_atoms.def")
-        output_file   = os.path.join(dir_path, "output_pseudo_atoms.def")
-        shutil.copy(input_file, original_file)
-        count = 0
-        newlines=len(Labels)
-        oldlines=0
-        with open(original_file) as fr:
-            with open(output_file, 'w') as fw:
-                for line in fr:
-                    if(count == 1):
-                        spline = line.split()
-                        oldlines = int(spline[0])
-                        line = str(int(newlines)) + '\n'
-                    if(count < 3):
-                        fw.write(line)
-                    else:
-                        spline  = line.split()
-                        if spline:
-                            element = spline[0]
-                            if(element in Labels):
-                                fw.write(line)
-                    count += 1
-
-    # 获取框架名称和吸附物名称
-    frameworks = get_frameworks_from_input(input_text)
-    adsorbates = get_adsorbates_from_input(input_text)
-    Frameworklabels = []
-    Adsorbatelabels = []
-    # 遍历框架名称，读取框架伪原子的标签
-    for framework in frameworks:
-        cif_path = os.path.join(cmd_dir, framework + '.cif')
-        if os.path.exists(cif_path):
-            Frameworklabels.extend(read_Framework_pseudoAtoms(cif_path))
-    # 遍历吸附物名称，读取分子伪原子的标签
-    for adsorbate in adsorbates:
-        def_path = os.path.join(cmd_dir, adsorbate + '.def')
-        if os.path.exists(def_path):
-            Adsorbatelabels.extend(read_Molecule_pseudoAtoms(def_path))
-    # 合并框架和吸附物的标签
-    Labels = []
-    Labels.extend(Frameworklabels)
-    Labels.extend(Adsorbatelabels)
-    # 处理力场文件和伪原子文件
-    Process_ForceFieldFile(Labels, cmd_dir)
-    Process_PseudoAtomsFile(Labels, cmd_dir)
-    # 覆盖原始文件
-    shutil.move(os.path.join(cmd_dir, "output_force_field_mixing_rules.def"), os.path.join(cmd_dir, "force_field_mixing_rules.def"))
-    shutil.move(os.path.join(cmd_dir, "output_pseudo_atoms.def"), os.path.join(cmd_dir, "pseudo_atoms.def"))
-    # 删除 original 文件
-    os.remove(os.path.join(cmd_dir, "original_force_field_mixing_rules.def"))
-    os.remove(os.path.join(cmd_dir, "original_pseudo_atoms.def"))
-
-
 def wait_for_task_finish(output_txt_path, timeout=3600, interval=5):
     """等待Output.txt出现END OF PROGRAM，超时单位秒"""
     waited = 0
@@ -214,26 +80,24 @@ def wait_for_task_finish(output_txt_path, timeout=3600, interval=5):
     return False
 
 def work(cif_dir: str, cif_file: str, gRASPA_dir: str, result_file: str, components: str, headers: str, input_text: str,
-         lock: Lock, q: Queue):
+         lock: Lock, q: Queue, ff_cache: ForceFieldCache, catalog=None):
     cif_name = cif_file[:-4]
     curr_dir = os.path.abspath(os.path.dirname(__file__))
     output_dir = os.path.join(curr_dir, "gRASPA_Output")
     cmd_dir = os.path.join(output_dir, cif_name)
     if not os.path.exists(cmd_dir):
         os.makedirs(cmd_dir)
-    # 复制cif文件到工作目录
-    shutil.copy(os.path.join(cif_dir, cif_file), cmd_dir)
-    
-    # 复制mix_FF目录下的所有文件到工作目录
-    FF_dir = os.path.join(curr_dir, "mix_FF")   
-    for filename in os.listdir(FF_dir):
-        src_file = os.path.join(FF_dir, filename)
-        dst_file = os.path.join(cmd_dir, filename)
-        if os.path.isfile(src_file):
-            shutil.copy(src_file, dst_file)
-
-    # 处理力场文件
-    process_forcefield_files(cmd_dir, input_text)
+    # 链接cif文件和不需要修改的力场文件（分子.def、force_field.def等）到工作目录，
+    # force_field_mixing_rules.def和pseudo_atoms.def在处理力场文件时单独写入
+    link_file(find_p1_cif(cif_dir, cif_file), os.path.join(cmd_dir, cif_file))
+    FF_dir = os.path.join(curr_dir, "mix_FF")
+    link_directory_files(FF_dir, cmd_dir, exclude=PRUNED_FF_FILES)
+
+    # 处理力场文件（修剪后的力场文件按伪原子标签缓存，同一框架只生成一次）
+    framework_labels = None
+    if catalog is not None:
+        framework_labels = catalog.get_labels(os.path.join(cif_dir, cif_file))
+    ff_cache.stage(cmd_dir, input_text, cif_dir, framework_labels)
     
     cmd = ["gRASPA"]
     sim_input_path = os.path.join(cmd_dir, "simulation.input")
@@ -255,8 +119,10 @@ def work(cif_dir: str, cif_file: str, gRASPA_dir: str, result_file: str, compone
             output_dir = os.path.join(cmd_dir, "Output")
             output_file = next(f for f in os.listdir(output_dir) if f.startswith("System_0") and f.endswith(".data"))
             with open(os.path.join(output_dir, output_file), 'r') as f2:
-                result = get_result(f2.read(), components, cif_name)
+                output_str = f2.read()
+            result = get_result(output_str, components, cif_name)
             write_result(result_file, result, headers)
+            write_result(get_error_file(result_file), get_result(output_str, components, cif_name, part=1), headers)
             print("\033[0;30;42m\n{} has completed\n\033[0m".format(cif_name))
         except Exception as e:
             write_error(result_file, cif_name)
@@ -270,8 +136,8 @@ def work(cif_dir: str, cif_file: str, gRASPA_dir: str, result_file: str, compone
     q.put(1)
 
 
-def get_result(output_str: str, components: list, cif_name: str):
-    # 直接按行读取并用固定行号偏移提取
+def get_result(output_str: str, components: list, cif_name: str, part=0):
+    # 直接按行读取并用固定行号偏移提取，part为0时取"Average"，为1时取同一行的"ErrorBar"（写入误差文件）
     content = output_str.splitlines()
     res = {}
     res["name"] = cif_name
@@ -295,33 +161,33 @@ def get_result(output_str: str, components: list, cif_name: str):
     for i, line in enumerate(content):
         if "BLOCK AVERAGES (HEAT OF ADSORPTION: kJ/mol)" in line:
             try:
-                avg_heat_of_adsorption1 = content[i+7].split(',')[0].split()[-1].strip()
-                avg_heat_of_adsorption2 = content[i+15].split(',')[0].split()[-1].strip()
+                avg_heat_of_adsorption1 = content[i+7].split(',')[part].split()[-1].strip()
+                avg_heat_of_adsorption2 = content[i+15].split(',')[part].split()[-1].strip()
             except Exception:
                 pass
         if 'BLOCK AVERAGES (LOADING: # MOLECULES)' in line:
             try:
-                loading_units["# MOLECULES 1"] = content[i+16].split(',')[0].split()[-1].strip()
-                loading_units["# MOLECULES 2"] = content[i+25].split(',')[0].split()[-1].strip()
+                loading_units["# MOLECULES 1"] = content[i+16].split(',')[part].split()[-1].strip()
+                loading_units["# MOLECULES 2"] = content[i+25].split(',')[part].split()[-1].strip()
             except Exception:
                 pass
         if 'BLOCK AVERAGES (LOADING: mg/g)' in line:
             try:
                 loading_units['Framework mass'] = content[i+3].split(' ')[3].strip()
-                loading_units["mg/g 1"] = content[i+19].split(',')[0].split()[-1].strip()
-                loading_units["mg/g 2"] = content[i+29].split(',')[0].split()[-1].strip()
+                loading_units["mg/g 1"] = content[i+19].split(',')[part].split()[-1].strip()
+                loading_units["mg/g 2"] = content[i+29].split(',')[part].split()[-1].strip()
             except Exception:
                 pass
         if 'BLOCK AVERAGES (LOADING: mol/kg)' in line:
             try:
-                loading_units["mol/kg 1"] = content[i+19].split(',')[0].split()[-1].strip()
-                loading_units["mol/kg 2"] = content[i+29].split(',')[0].split()[-1].strip()
+                loading_units["mol/kg 1"] = content[i+19].split(',')[part].split()[-1].strip()
+                loading_units["mol/kg 2"] = content[i+29].split(',')[part].split()[-1].strip()
             except Exception:
                 pass
         if 'BLOCK AVERAGES (LOADING: g/L)' in line:
             try:
-                loading_units["g/L 1"] = content[i+8].split(',')[0].split()[-1].strip()
-                loading_units["g/L 2"] = content[i+17].split(',')[0].split()[-1].strip()
+                loading_units["g/L 1"] = content[i+8].split(',')[part].split()[-1].strip()
+                loading_units["g/L 2"] = content[i+17].split(',')[part].split()[-1].strip()
             except Exception:
                 pass
 
@@ -341,6 +207,11 @@ def get_result(output_str: str, components: list, cif_name: str):
     return res
 
 
+def get_error_file(result_file):
+    # 误差文件与结果文件同目录，名字为<结果文件名>_errors.csv，列与结果文件相同
+    return result_file[:-len('.csv')] + "_errors.csv"
+
+
 def get_field_headers(components: list):
     headers = ["name", "finished"]
     for c in components:
@@ -396,6 +267,12 @@ def check_parameters():
         print("缺少的选项 (missing options) : " + str(missing_options))
         exit()
 
+    # 可选参数：修剪后力场文件的缓存目录，可在不同批次的计算之间共享
+    ff_cache_dir = os.path.abspath(config.get(section, 'ff_cache_dir', fallback='ff_cache'))
+
+    # 可选参数：调度前并行检查所有cif文件，提前剔除必然失败的结构
+    preflight = config.get(section, 'preflight', fallback='yes').strip().lower() == 'yes'
+
     graspa_dir = option_dic['gRASPA_dir']
     cif_dir = option_dic['cif_location']
     cutoffvdm = option_dic['CutOffVDM']
@@ -445,7 +322,7 @@ def check_parameters():
         cifs = []
         cifs.append(os.path.basename(cif_dir))
         cif_dir = os.path.dirname(cif_dir)
-        return graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks
+        return graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressure, ff_cache_dir, preflight
 
     cifs = os.listdir(cif_dir)
     dels = []
@@ -458,13 +335,15 @@ def check_parameters():
         print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
         exit()
 
-    return graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressure
+    return graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressure, ff_cache_dir, preflight
 
 
 def main():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
-    graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressure = check_parameters()
+    graspa_dir, cif_dir, cifs, cutoffvdm, max_tasks, temperature, pressure, ff_cache_dir, preflight = check_parameters()
+    catalog = open_catalog(cif_dir)
+    ff_cache = ForceFieldCache(os.path.join(cur_path, "mix_FF"), ff_cache_dir)
     lock = Lock()
 
     with open("simulation_template.input", "r") as f:
@@ -479,16 +358,18 @@ def main():
         f"{components[0]}_{components[1]}_{temperature}_{pressure}.csv"
     )
 
-    if os.path.exists(result_file):
-        os.remove(result_file)
+    # 误差文件<结果文件名>_errors.csv与结果文件的列相同，只包含完成的结构
+    for file in (result_file, get_error_file(result_file)):
+        if os.path.exists(file):
+            os.remove(file)
 
-    with open(result_file, 'w') as f:
-        for i in range(len(headers)):
-            if i != len(headers) - 1:
-                f.write(headers[i] + ",")
-            else:
-                f.write(headers[i] + "\n")
-        f.close()
+        with open(file, 'w') as f:
+            for i in range(len(headers)):
+                if i != len(headers) - 1:
+                    f.write(headers[i] + ",")
+                else:
+                    f.write(headers[i] + "\n")
+            f.close()
 
     output_dir = os.path.join(cur_path, "gRASPA_Output")
     if os.path.exists(output_dir):
@@ -496,6 +377,13 @@ def main():
         exit()
     os.makedirs(output_dir)
 
+    # 预检查：剔除必然失败的结构，并在结果文件中写入错误行
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, template, os.path.join(cur_path, "mix_FF"), max_tasks, graspa=True)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            write_error(result_file, cif[:-4])
+
     q = Queue(maxsize=max_tasks)
     for i in range(max_tasks):
         q.put(1)
@@ -504,9 +392,9 @@ def main():
         q.get()
         input_text = generate_simulation_input(
             template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif, 
-            temperature=float(temperature), pressure=float(pressure))
+            temperature=float(temperature), pressure=float(pressure), catalog=catalog)
         thread = threading.Thread(target=work, args=(cif_dir, cif, graspa_dir,
-                                                     result_file, components, headers, input_text, lock, q))
+                                                     result_file, components, headers, input_text, lock, q, ff_cache, catalog))
         thread.start()
         time.sleep(0.3)
         os.chdir(cur_path)
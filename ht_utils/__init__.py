@@ -0,0 +1,4 @@
+'''
+    各驱动脚本共用的工具模块（CIF解析、结构库筛选等）
+    Shared helpers used by the driver scripts (CIF parsing, library selection, etc.)
+'''
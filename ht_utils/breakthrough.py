@@ -0,0 +1,282 @@
+import itertools
+
+import numpy as np
+
+from ht_utils.iast import iast
+from ht_utils.isotherm_fit import evaluate_by_model, isotherm_loading
+from ht_utils.widom_grid import GAS_CONSTANT
+
+
+def _loading(model, params, pressure):
+    return isotherm_loading(model, params, pressure[:, None])[:, 0]
+
+
+class PureEquilibrium():
+    '''
+        各组分的平衡吸附量由其分压下的单组分拟合等温线计算（不考虑竞争吸附，适用于单组分或稀释的吸附质）
+        isotherms: 每个组分一个(模型名数组(n,), 参数(n, 参数数))，n为结构数
+    '''
+
+    def __init__(self, isotherms, pressure_scale):
+        self.models = [np.asarray(m) for m, _ in isotherms]
+        self.params = [np.asarray(p, dtype=np.float64) for _, p in isotherms]
+        self.step = 1e-6 * pressure_scale
+
+    def __call__(self, partial_pressure, rows):
+        '''
+            partial_pressure: (len(rows), 网格数, 组分数)的分压，返回(平衡吸附量, 各组分吸附量对自身分压的导数)
+        '''
+        n, n_cells, n_components = partial_pressure.shape
+        q = np.empty_like(partial_pressure)
+        derivative = np.empty_like(partial_pressure)
+        for i in range(n_components):
+            models = np.repeat(self.models[i][rows], n_cells)
+            params = np.repeat(self.params[i][rows], n_cells, axis=0)
+            p = partial_pressure[:, :, i].reshape(-1)
+            h = 1e-4 * p + self.step
+            q[:, :, i] = evaluate_by_model(models, _loading, params, p).reshape(n, n_cells)
+            derivative[:, :, i] = ((evaluate_by_model(models, _loading, params, p + h) - q[:, :, i].reshape(-1)) /
+                                   h).reshape(n, n_cells)
+        return q, derivative
+
+
+class IASTEquilibrium():
+    '''
+        混合物的平衡吸附量由IAST计算：对每个结构在对数间距的分压网格（每个组分points个点，0到p_max）上预先求解IAST，
+        积分过程中对网格做多线性插值，避免每个时间步都求解IAST；网格坐标为ln(p + 1e-6 p_max)
+        isotherms: 每个组分一个(模型名数组(n,), 参数(n, 参数数))；网格共points^组分数个状态点，组分数较多时应减小points
+    '''
+
+    def __init__(self, isotherms, p_max, points=60, chunk_size=200000):
+        n_components = len(isotherms)
+        self.points = points
+        self.p0 = 1e-6 * p_max
+        self.nodes = np.linspace(np.log(self.p0), np.log(p_max + self.p0), points)
+        self.h = self.nodes[1] - self.nodes[0]
+        grid = np.exp(self.nodes) - self.p0
+        grid[0] = 0.0
+        # (points^组分数, 组分数)的分压组合，第一个组分变化最慢
+        partial = np.array(list(itertools.product(grid, repeat=n_components)))
+        total = partial.sum(axis=1)
+        states = np.flatnonzero(total > 0)
+        n_frameworks = len(isotherms[0][0])
+        self.table = np.zeros((n_frameworks, len(partial), n_components))
+        framework = np.repeat(np.arange(n_frameworks), len(states))
+        state = np.tile(states, n_frameworks)
+        for start in range(0, len(state), chunk_size):
+            s = slice(start, start + chunk_size)
+            result = iast([(np.asarray(m)[framework[s]], np.asarray(p)[framework[s]]) for m, p in isotherms],
+                          partial[state[s]], total[state[s]])
+            self.table[framework[s], state[s]] = np.where(result['converged'][:, None], result['loading'], np.nan)
+
+    def __call__(self, partial_pressure, rows):
+        '''
+            partial_pressure: (len(rows), 网格数, 组分数)的分压，
+            返回(平衡吸附量, 吸附量对各组分分压的导数矩阵(len(rows), 网格数, 组分数, 组分数))，[..., i, a]为∂q_i/∂p_a；
+            竞争吸附使交叉导数与对角项同量级，Newton方程只用对角项时收敛很慢
+        '''
+        n_components = partial_pressure.shape[2]
+        s = np.log(np.maximum(partial_pressure, 0.0) + self.p0)
+        # 弱吸附组分被置换时的浓度峰（roll-up）可以超过p_max，此时按最后一段线性外推而不是截断：
+        # 截断后吸附量不再变化而导数不为零，Newton只能线性收敛
+        u = np.maximum((s - self.nodes[0]) / self.h, 0)
+        k = np.minimum(np.floor(u).astype(np.int64), self.points - 2)
+        t = u - k
+        q = np.zeros_like(partial_pressure)
+        # 吸附量对ln(p_a + p0)的偏导数
+        slope = np.zeros(partial_pressure.shape + (n_components,))
+        strides = self.points ** np.arange(n_components - 1, -1, -1)
+        base = (k * strides).sum(axis=2)
+        for corner in itertools.product((0, 1), repeat=n_components):
+            corner = np.array(corner)
+            weights = np.where(corner == 1, t, 1 - t)
+            values = self.table[rows[:, None], base + (corner * strides).sum()]
+            q += weights.prod(axis=2)[:, :, None] * values
+            # 权重对u_a的导数为±(其它组分的权重之积)
+            others = np.stack([weights[:, :, np.arange(n_components) != a].prod(axis=2)
+                               for a in range(n_components)], axis=2)
+            slope += values[:, :, :, None] * (np.where(corner == 1, 1.0, -1.0) * others)[:, :, None, :]
+        return q, slope / self.h / (np.maximum(partial_pressure, 0.0) + self.p0)[:, :, None, :]
+
+
+def _solve_tridiagonal(lower, diagonal, upper, rhs):
+    # 沿第二维（网格）的批量三对角方程组（Thomas算法），lower[:, j]为第j行中x_{j-1}的系数，upper[:, j]为x_{j+1}的系数
+    n = rhs.shape[1]
+    factor = np.empty_like(rhs)
+    x = np.empty_like(rhs)
+    factor[:, 0] = upper[:, 0] / diagonal[:, 0]
+    x[:, 0] = rhs[:, 0] / diagonal[:, 0]
+    for j in range(1, n):
+        m = diagonal[:, j] - lower[:, j] * factor[:, j - 1]
+        factor[:, j] = upper[:, j] / m
+        x[:, j] = (rhs[:, j] - lower[:, j] * x[:, j - 1]) / m
+    for j in range(n - 2, -1, -1):
+        x[:, j] -= factor[:, j] * x[:, j + 1]
+    return x
+
+
+def _solve_block_tridiagonal(lower, diagonal, upper, rhs):
+    # 沿第二维（网格）的批量块三对角方程组（块Thomas算法）：对角块为diagonal[:, j]（组分数 × 组分数），
+    # 非对角块只有输运项，为对角矩阵diag(lower[:, j])与diag(upper[:, j])；lower、upper、rhs为(批量, 网格数, 组分数)
+    n_cells, n_components = rhs.shape[1], rhs.shape[2]
+    # 每个网格一次求解 M_j^-1 [diag(upper_j), r_j]，前组分数列为消元因子，最后一列为中间解
+    solution = np.empty(diagonal.shape[:3] + (n_components + 1,))
+    augmented = np.empty_like(solution)
+    augmented[:, :, :, :-1] = upper[:, :, None, :] * np.eye(n_components)
+    augmented[:, :, :, -1] = rhs
+    factor, x = solution[:, :, :, :-1], solution[:, :, :, -1]
+    solution[:, 0] = np.linalg.solve(diagonal[:, 0], augmented[:, 0])
+    for j in range(1, n_cells):
+        augmented[:, j, :, -1] -= lower[:, j] * x[:, j - 1]
+        solution[:, j] = np.linalg.solve(diagonal[:, j] - lower[:, j, :, None] * factor[:, j - 1], augmented[:, j])
+    for j in range(n_cells - 2, -1, -1):
+        x[:, j] -= np.einsum('nab,nb->na', factor[:, j], x[:, j + 1])
+    return x
+
+
+def _transport(c, c_feed, velocity, dispersion, dz):
+    # 一阶迎风对流与中心差分扩散：入口总通量为v c_feed（Danckwerts），出口没有扩散通量（∂c/∂z = 0）
+    faces = velocity * c[:, :-1] - dispersion * (c[:, 1:] - c[:, :-1]) / dz
+    inlet = np.broadcast_to(velocity * c_feed, (len(c), 1, c.shape[2]))
+    flux = np.concatenate([inlet, faces, velocity * c[:, -1:]], axis=1)
+    return (flux[:, :-1] - flux[:, 1:]) / dz
+
+
+def breakthrough(equilibrium, n_frameworks, feed_fractions, pressure, temperature, length, void_fraction, velocity,
+                 dispersion, ldf, bed_density, n_cells=50, threshold=0.05, max_time=1e5, max_change=0.05, tol=1e-6,
+                 max_newton=12, curve_times=None):
+    '''
+        等温轴向扩散活塞流固定床穿透曲线（线性推动力LDF传质），所有结构作为一个批量的常微分方程组同时积分：
+            ε ∂c/∂t + ρ_b ∂q/∂t = -ε v ∂c/∂z + ε D_L ∂²c/∂z²，  ∂q/∂t = k (q*(c) - q)
+        线方法：有限体积离散，一阶迎风对流加中心差分扩散，入口为Danckwerts边界条件，出口∂c/∂z = 0；
+        迎风格式的数值扩散v Δz / 2从D_L中扣除（D_L小于v Δz / 2时实际的扩散系数为v Δz / 2，应增加n_cells）
+        时间方向为全隐式的向后Euler：消去q后解Newton方程，PureEquilibrium的吸附量只依赖自身分压，每个组分为三对角方程；
+        IASTEquilibrium给出各组分之间的完整导数矩阵，为块三对角方程，
+        每个结构有自己的自适应时间步长（每步床层内的浓度变化不超过max_change c_feed，Newton不收敛时步长减半），
+        全部进料组分穿透的结构不再积分；假设流速不变、床层初始为空、理想气体（c = p / RT）
+
+        equilibrium: PureEquilibrium或IASTEquilibrium（单位Pa与mol/kg）；feed_fractions: 进料中各组分的摩尔分数；
+        pressure: 总压(Pa)；length: 床层长度(m)；void_fraction: 床层空隙率ε；velocity: 间隙流速v(m/s)；
+        dispersion: 轴向扩散系数D_L(m^2/s)；ldf: 各组分的LDF系数k(1/s)，(组分数,)或(结构数, 组分数)；
+        bed_density: 床层密度ρ_b(kg/m^3)，标量或(结构数,)；threshold: 穿透的出口浓度比c/c_feed；
+        tol: Newton残差相对于进料浓度的收敛容差（IAST网格插值的导数不连续，过小的容差会使Newton反复减半步长）；
+        curve_times: 可选的出口浓度记录时间(s)
+        返回{'breakthrough_time': 各组分出口浓度达到threshold的时间(结构数, 组分数)(s),
+             'dynamic_capacity': 各组分穿透时床层的平均吸附量(mol/kg), 'light_product': 最先穿透的组分,
+             'purity': 从0到第二个组分穿透时收集的最先穿透组分的纯度, 'recovery': 该组分的回收率,
+             'finished': 所有进料组分都已穿透, 'curves': curve_times处的出口c/c_feed(结构数, 时间数, 组分数)}
+    '''
+    y = np.asarray(feed_fractions, dtype=np.float64)
+    y = y / y.sum()
+    n_components = len(y)
+    rt = GAS_CONSTANT * temperature
+    c_feed = y * pressure / rt
+    fed = y > 0
+    c_scale = np.where(fed, c_feed, c_feed.max())
+    ldf = np.broadcast_to(np.asarray(ldf, dtype=np.float64), (n_frameworks, n_components))
+    ratio = np.broadcast_to(np.asarray(bed_density, dtype=np.float64), (n_frameworks,)) / void_fraction
+    dz = length / n_cells
+    dispersion = max(dispersion - 0.5 * velocity * dz, 0.0)
+    curve_times = np.asarray([] if curve_times is None else curve_times, dtype=np.float64)
+
+    # 输运项对浓度的导数（与浓度无关）：lower为c_{j-1}的系数，upper为c_{j+1}的系数
+    lower = np.full((1, n_cells, 1), (velocity + dispersion / dz) / dz)
+    upper = np.full((1, n_cells, 1), dispersion / dz ** 2)
+    centre = np.full((1, n_cells, 1), -(velocity + 2 * dispersion / dz) / dz)
+    centre[0, 0, 0] = -(velocity + dispersion / dz) / dz
+    centre[0, -1, 0] = -(velocity + dispersion / dz) / dz
+    lower[0, 0, 0] = 0.0
+    upper[0, -1, 0] = 0.0
+
+    breakthrough_time = np.full((n_frameworks, n_components), np.nan)
+    capacity = np.full((n_frameworks, n_components), np.nan)
+    # 每个组分穿透时出口累计流出的各组分物质的量（每单位空隙截面积），(结构数, 穿透组分, 组分)
+    eluted_at = np.full((n_frameworks, n_components, n_components), np.nan)
+    curves = np.full((n_frameworks, len(curve_times), n_components), np.nan)
+    failed = np.zeros(n_frameworks, dtype=bool)
+    next_curve = np.zeros(n_frameworks, dtype=np.int64)
+
+    rows = np.arange(n_frameworks)
+    c = np.zeros((n_frameworks, n_cells, n_components))
+    q = np.zeros((n_frameworks, n_cells, n_components))
+    eluted = np.zeros((n_frameworks, n_components))
+    time = np.zeros(n_frameworks)
+    step = np.full(n_frameworks, 0.1 * dz / velocity)
+    while len(rows) > 0:
+        dt = np.minimum(step, max_time - time)
+        kdt = ldf[rows][:, None, :] * dt[:, None, None]
+        # 向后Euler消去q后：c_new - c + s (q*(c_new) - q) - dt T(c_new) = 0，s = (ρ_b / ε) k dt / (1 + k dt)
+        s = ratio[rows][:, None, None] * kdt / (1 + kdt)
+        c_new = c.copy()
+        converged = np.zeros(len(rows), dtype=bool)
+        for _ in range(max_newton):
+            q_eq, slope = equilibrium(c_new * rt, rows)
+            residual = c_new - c + s * (q_eq - q) - dt[:, None, None] * _transport(c_new, c_feed, velocity,
+                                                                                     dispersion, dz)
+            converged = np.all(np.abs(residual) <= tol * c_scale, axis=(1, 2))
+            if converged.all():
+                break
+            diagonal = 1 - dt[:, None, None] * centre
+            newton_lower = np.broadcast_to(-dt[:, None, None] * lower, c.shape)
+            newton_upper = np.broadcast_to(-dt[:, None, None] * upper, c.shape)
+            if slope.ndim == 4:
+                # 完整的导数矩阵：每个网格的对角块为稠密矩阵
+                diagonal = s[:, :, :, None] * slope * rt + diagonal[:, :, :, None] * np.eye(n_components)
+                delta = _solve_block_tridiagonal(newton_lower, diagonal, newton_upper, -residual)
+            else:
+                delta = _solve_tridiagonal(newton_lower, diagonal + s * slope * rt, newton_upper, -residual)
+            c_new = np.maximum(c_new + delta, 0.0)
+        accepted = converged & np.all(np.isfinite(q_eq), axis=(1, 2))
+        # Newton不收敛的结构步长减半后重算，步长过小时视为失败
+        bad = ~accepted & (step < 1e-9 * dz / velocity)
+
+        q_new = (q + kdt * q_eq) / (1 + kdt)
+        mask = accepted[:, None, None]
+        change = np.max(np.abs(c_new - c) / c_scale, axis=(1, 2))
+        previous_outlet = c[:, -1] / c_scale
+        previous_eluted = eluted.copy()
+        eluted = np.where(accepted[:, None], eluted + 0.5 * dt[:, None] * velocity * (c[:, -1] + c_new[:, -1]),
+                          eluted)
+        c = np.where(mask, c_new, c)
+        q = np.where(mask, q_new, q)
+        time = np.where(accepted, time + dt, time)
+        step = np.where(accepted, dt * np.clip(0.9 * max_change / np.maximum(change, 1e-12), 0.3, 2.0), 0.5 * step)
+
+        outlet = c[:, -1] / c_scale
+        while True:
+            pending = accepted & (next_curve[rows] < len(curve_times))
+            pending[pending] &= curve_times[next_curve[rows][pending]] <= time[pending]
+            if not pending.any():
+                break
+            b = np.flatnonzero(pending)
+            w = ((curve_times[next_curve[rows[b]]] - time[b] + dt[b]) / dt[b])[:, None]
+            curves[rows[b], next_curve[rows[b]]] = previous_outlet[b] + w * (outlet[b] - previous_outlet[b])
+            next_curve[rows[b]] += 1
+        crossed = accepted[:, None] & fed & np.isnan(breakthrough_time[rows]) & (outlet >= threshold)
+        for b, i in zip(*np.nonzero(crossed)):
+            w = (threshold - previous_outlet[b, i]) / (outlet[b, i] - previous_outlet[b, i])
+            breakthrough_time[rows[b], i] = time[b] - dt[b] + w * dt[b]
+            eluted_at[rows[b], i] = previous_eluted[b] + w * (eluted[b] - previous_eluted[b])
+            capacity[rows[b], i] = q[b, :, i].mean()
+
+        failed[rows[bad]] = True
+        done = np.all(~np.isnan(breakthrough_time[rows]) | ~fed, axis=1) | (time >= max_time)
+        keep = ~bad & ~done
+        if not keep.all():
+            rows, c, q, eluted, time, step = rows[keep], c[keep], q[keep], eluted[keep], time[keep], step[keep]
+
+    # 最先穿透的组分为轻组分产品，收集到第二个组分穿透为止
+    order = np.argsort(np.where(fed, np.nan_to_num(breakthrough_time, nan=np.inf), np.inf), axis=1)
+    light = order[:, 0]
+    purity = np.full(n_frameworks, np.nan)
+    recovery = np.full(n_frameworks, np.nan)
+    if fed.sum() >= 2:
+        heavy = order[:, 1]
+        index = np.arange(n_frameworks)
+        window = eluted_at[index, heavy]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            purity = window[index, light] / window.sum(axis=1)
+            recovery = window[index, light] / (velocity * c_feed[light] * breakthrough_time[index, heavy])
+    finished = ~failed & np.all(~np.isnan(breakthrough_time) | ~fed, axis=1)
+    return {'breakthrough_time': breakthrough_time, 'dynamic_capacity': capacity, 'light_product': light,
+            'purity': purity, 'recovery': recovery, 'finished': finished, 'curves': curves}
@@ -0,0 +1,176 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ht_utils.cif_parser import CELL_KEYS, read_cif_loops, get_atom_site_loop, strip_label
+from ht_utils.elements import element_symbol
+
+SYMOP_KEYS = ['_symmetry_equiv_pos_as_xyz', '_space_group_symop_operation_xyz']
+
+
+def parse_cif_numbers(values):
+    '''
+        批量将CIF中的数值字符串转换为float数组，去掉不确定度括号（"0.1234(5)" -> 0.1234），"?"和"."转换为nan
+    '''
+    values = np.asarray(values, dtype=str)
+    if values.size == 0:
+        return np.zeros(values.shape, dtype=np.float64)
+    values = np.char.partition(values, '(')[..., 0]
+    values = np.where((values == '?') | (values == '.'), 'nan', values)
+    return values.astype(np.float64)
+
+
+def lattice_matrix(a, b, c, alpha, beta, gamma):
+    '''
+        由晶胞参数计算晶格矩阵（3x3，每行为一个晶格矢量，a沿x轴，b在xy平面内），角度单位为度
+        笛卡尔坐标 = 分数坐标 @ 晶格矩阵
+    '''
+    alpha, beta, gamma = np.radians([alpha, beta, gamma])
+    cos_a, cos_b, cos_g = np.cos(alpha), np.cos(beta), np.cos(gamma)
+    sin_g = np.sin(gamma)
+    cx = c * cos_b
+    cy = c * (cos_a - cos_b * cos_g) / sin_g
+    cz = np.sqrt(max(c * c - cx * cx - cy * cy, 0.0))
+    return np.array([[a, 0.0, 0.0],
+                     [b * cos_g, b * sin_g, 0.0],
+                     [cx, cy, cz]])
+
+
+class CifStructure():
+    '''
+        CIF文件中的结构：晶胞参数、原子标签、元素符号、分数坐标、电荷与对称操作
+        labels, symbols: 字符串数组(n,); frac: (n, 3)分数坐标; charges: (n,)，CIF中没有电荷时为None
+    '''
+
+    def __init__(self, name, cell, labels, symbols, frac, charges=None, symops=None):
+        self.name = name
+        self.cell = np.asarray(cell, dtype=np.float64)
+        self.labels = np.asarray(labels, dtype=str)
+        self.symbols = np.asarray(symbols, dtype=str)
+        self.frac = np.asarray(frac, dtype=np.float64).reshape(-1, 3)
+        self.charges = None if charges is None else np.asarray(charges, dtype=np.float64)
+        self.symops = list(symops) if symops else ['x,y,z']
+
+    @property
+    def n_atoms(self):
+        return len(self.frac)
+
+    @property
+    def pseudo_atoms(self):
+        '''
+            去掉数字后的原子标签（与力场文件中的伪原子名对应）
+        '''
+        return np.array([strip_label(label) for label in self.labels], dtype=str)
+
+    def lattice(self):
+        return lattice_matrix(*self.cell)
+
+    def volume(self):
+        return abs(np.linalg.det(self.lattice()))
+
+    def cartesian(self, wrap=False):
+        '''
+            返回笛卡尔坐标(n, 3)，wrap=True时先把分数坐标移入[0, 1)
+        '''
+        frac = self.frac - np.floor(self.frac) if wrap else self.frac
+        return frac @ self.lattice()
+
+    def is_p1(self):
+        ops = [op.replace(' ', '').lower() for op in self.symops]
+        return len(ops) == 1 and ops[0] in ('x,y,z', '+x,+y,+z')
+
+
+def _get_column(headers, rows, name):
+    if name not in headers:
+        return None
+    return rows[:, headers.index(name)]
+
+
+def read_cif_atoms(cif_location):
+    '''
+        读取CIF文件中的结构，返回CifStructure
+        支持多个loop、不确定度括号、引号与多行文本块；原子坐标取自包含_atom_site_fract_x的loop
+    '''
+    tags, loops = read_cif_loops(cif_location)
+    missing = [k for k in CELL_KEYS if k not in tags]
+    if len(missing) > 0:
+        raise ValueError("CIF文件缺少晶胞参数 (missing cell parameters): " + str(missing))
+    cell = parse_cif_numbers([tags[k] for k in CELL_KEYS])
+
+    headers, rows = get_atom_site_loop(loops)
+    if headers is None or len(rows) == 0 or '_atom_site_fract_x' not in headers:
+        raise ValueError("CIF文件中没有原子分数坐标 (no _atom_site_fract_x loop)")
+    rows = np.array(rows, dtype=str).reshape(len(rows), len(headers))
+
+    frac = parse_cif_numbers(np.stack([_get_column(headers, rows, '_atom_site_fract_' + x) for x in 'xyz'], axis=1))
+    if not np.isfinite(frac).all():
+        raise ValueError("CIF文件中的分数坐标不完整 (undefined fractional coordinates)")
+
+    labels = _get_column(headers, rows, '_atom_site_label')
+    symbols = _get_column(headers, rows, '_atom_site_type_symbol')
+    if labels is None:
+        labels = symbols
+    if symbols is None:
+        symbols = np.array([element_symbol(label) for label in labels], dtype=str)
+
+    charges = _get_column(headers, rows, '_atom_site_charge')
+    if charges is not None:
+        charges = parse_cif_numbers(charges)
+        if not np.isfinite(charges).all():
+            charges = None
+
+    symops = None
+    for sym_headers, sym_rows in loops:
+        for key in SYMOP_KEYS:
+            if key in sym_headers:
+                col = sym_headers.index(key)
+                symops = [row[col] for row in sym_rows]
+                break
+        if symops is not None:
+            break
+
+    name = os.path.basename(cif_location)[:-4]
+    return CifStructure(name, cell, labels, symbols, frac, charges, symops)
+
+
+def _read_worker(cif_location):
+    try:
+        return read_cif_atoms(cif_location)
+    except Exception as e:
+        return e
+
+
+def read_cif_library(cif_locations, max_processes=1, chunksize=64):
+    '''
+        使用进程池并行读取多个CIF文件，按输入顺序逐个返回(文件路径, CifStructure或异常对象)
+    '''
+    cif_locations = list(cif_locations)
+    with ProcessPoolExecutor(max_workers=max(1, max_processes)) as pool:
+        for path, result in zip(cif_locations, pool.map(_read_worker, cif_locations, chunksize=chunksize)):
+            yield path, result
+
+
+def write_cif(structure: CifStructure, cif_location):
+    '''
+        将结构写入CIF文件，原子loop放在文件末尾（gRASPA驱动脚本按行读取原子标签）
+        先写入临时文件再重命名，避免并行写入时出现不完整的文件
+    '''
+    lines = ["data_" + structure.name, "_symmetry_space_group_name_H-M    'P 1'" if structure.is_p1() else
+             "_symmetry_space_group_name_H-M    '?'"]
+    lines += ["{:<34}{:.6f}".format(name, value) for name, value in zip(CELL_KEYS, structure.cell)]
+    lines += ["", "loop_", "_symmetry_equiv_pos_as_xyz"]
+    lines += ["'{}'".format(op) for op in structure.symops]
+    lines += ["", "loop_", "_atom_site_label", "_atom_site_type_symbol",
+              "_atom_site_fract_x", "_atom_site_fract_y", "_atom_site_fract_z"]
+    if structure.charges is not None:
+        lines.append("_atom_site_charge")
+    for i in range(structure.n_atoms):
+        row = "{:<8} {:<4}{:>12.6f}{:>12.6f}{:>12.6f}".format(structure.labels[i], structure.symbols[i], *structure.frac[i])
+        if structure.charges is not None:
+            row += "{:>12.6f}".format(structure.charges[i])
+        lines.append(row)
+    tmp_location = cif_location + ".tmp{}".format(os.getpid())
+    with open(tmp_location, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_location, cif_location)
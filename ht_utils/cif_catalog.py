@@ -0,0 +1,178 @@
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+from ht_utils.cif_parser import read_cif_summary
+from ht_utils.supercell import get_unit_cell_numbers
+
+CATALOG_FILE_NAME = "cif_catalog.sqlite"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cifs (
+    name TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    sha1 TEXT,
+    a REAL, b REAL, c REAL,
+    alpha REAL, beta REAL, gamma REAL,
+    volume REAL,
+    n_atoms INTEGER,
+    labels TEXT,
+    has_charges INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS unit_cells (
+    name TEXT,
+    cutoff REAL,
+    na INTEGER, nb INTEGER, nc INTEGER,
+    PRIMARY KEY (name, cutoff)
+);
+'''
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _catalog_entry(path):
+    # 在子进程中解析单个cif文件，返回写入数据库的一行
+    stat = os.stat(path)
+    row = {'name': os.path.basename(path), 'mtime': stat.st_mtime, 'size': stat.st_size,
+           'sha1': file_sha1(path), 'error': None}
+    try:
+        summary = read_cif_summary(path)
+        summary['labels'] = ' '.join(summary['labels'])
+        summary['has_charges'] = int(summary['has_charges'])
+        row.update(summary)
+    except Exception as e:
+        row['error'] = repr(e)
+    return row
+
+
+def default_catalog_path(cif_dir):
+    return os.path.join(cif_dir, CATALOG_FILE_NAME)
+
+
+def build_catalog(cif_dir, catalog_path, cutoffs, max_processes=1):
+    '''
+        建立或增量更新cif_dir的结构目录（SQLite数据库）
+        文件的修改时间与大小未变时直接跳过；变化时比较SHA1，内容改变才重新解析
+        返回(新解析的数目, 总数)
+    '''
+    conn = sqlite3.connect(catalog_path)
+    conn.executescript(SCHEMA)
+    known = {row[0]: row[1:] for row in conn.execute("SELECT name, mtime, size, sha1 FROM cifs")}
+    cifs = sorted(cif for cif in os.listdir(cif_dir) if cif.endswith('.cif'))
+
+    to_parse = []
+    for cif in cifs:
+        path = os.path.join(cif_dir, cif)
+        stat = os.stat(path)
+        if cif in known:
+            mtime, size, sha1 = known[cif]
+            if mtime == stat.st_mtime and size == stat.st_size:
+                continue
+            if size == stat.st_size and sha1 == file_sha1(path):
+                conn.execute("UPDATE cifs SET mtime = ? WHERE name = ?", (stat.st_mtime, cif))
+                continue
+        to_parse.append(path)
+
+    # 删除已不存在的文件
+    removed = set(known) - set(cifs)
+    for cif in removed:
+        conn.execute("DELETE FROM cifs WHERE name = ?", (cif,))
+        conn.execute("DELETE FROM unit_cells WHERE name = ?", (cif,))
+
+    columns = ['name', 'mtime', 'size', 'sha1', 'a', 'b', 'c', 'alpha', 'beta', 'gamma',
+               'volume', 'n_atoms', 'labels', 'has_charges', 'error']
+    insert = "INSERT OR REPLACE INTO cifs ({}) VALUES ({})".format(
+        ', '.join(columns), ', '.join('?' * len(columns)))
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        for row in pool.map(_catalog_entry, to_parse, chunksize=64):
+            conn.execute(insert, [row.get(c) for c in columns])
+            conn.execute("DELETE FROM unit_cells WHERE name = ?", (row['name'],))
+
+    # 补全各截断半径下所需的晶胞数目
+    for cutoff in cutoffs:
+        rows = conn.execute(
+            "SELECT name, a, b, c, alpha, beta, gamma FROM cifs WHERE error IS NULL AND name NOT IN "
+            "(SELECT name FROM unit_cells WHERE cutoff = ?)", (cutoff,)).fetchall()
+        conn.executemany("INSERT OR REPLACE INTO unit_cells VALUES (?, ?, ?, ?, ?)",
+                         [(r[0], cutoff) + get_unit_cell_numbers(*r[1:], cutoff) for r in rows])
+    conn.commit()
+    conn.close()
+    return len(to_parse), len(cifs)
+
+
+class CifCatalog():
+    '''
+        结构目录的只读查询对象，可在多个线程中共享
+        只有当文件的修改时间和大小与目录中的记录一致时才返回结果，否则返回None，由调用者重新解析文件
+    '''
+
+    def __init__(self, catalog_path):
+        self.conn = sqlite3.connect(catalog_path, check_same_thread=False)
+        self.lock = Lock()
+
+    def lookup(self, cif_location):
+        '''
+            返回cif文件的记录（字典），记录不存在或已过期时返回None
+        '''
+        try:
+            stat = os.stat(cif_location)
+        except OSError:
+            return None
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM cifs WHERE name = ?", (os.path.basename(cif_location),))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            row = dict(zip([d[0] for d in cursor.description], row))
+        if row['mtime'] != stat.st_mtime or row['size'] != stat.st_size or row['error'] is not None:
+            return None
+        row['labels'] = row['labels'].split()
+        row['has_charges'] = bool(row['has_charges'])
+        return row
+
+    def get_unit_cell(self, cif_location, cutoff):
+        '''
+            返回UnitCells参数字符串（如"2 2 2"），与get_unit_cell()的返回值格式相同
+        '''
+        row = self.lookup(cif_location)
+        if row is None:
+            return None
+        with self.lock:
+            cached = self.conn.execute("SELECT na, nb, nc FROM unit_cells WHERE name = ? AND cutoff = ?",
+                                       (row['name'], float(cutoff))).fetchone()
+        if cached is None:
+            cached = get_unit_cell_numbers(row['a'], row['b'], row['c'],
+                                           row['alpha'], row['beta'], row['gamma'], float(cutoff))
+        return "{} {} {}".format(*cached)
+
+    def get_labels(self, cif_location):
+        '''
+            返回框架的伪原子标签列表（已去掉数字）
+        '''
+        row = self.lookup(cif_location)
+        if row is None:
+            return None
+        return row['labels']
+
+    def close(self):
+        self.conn.close()
+
+
+def open_catalog(cif_dir):
+    '''
+        若cif目录中存在结构目录(cif_catalog.sqlite)则打开它，否则返回None
+    '''
+    catalog_path = default_catalog_path(cif_dir)
+    if not os.path.isfile(catalog_path):
+        return None
+    return CifCatalog(catalog_path)
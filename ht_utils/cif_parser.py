@@ -0,0 +1,161 @@
+import math
+import re
+
+
+CELL_KEYS = ['_cell_length_a', '_cell_length_b', '_cell_length_c',
+             '_cell_angle_alpha', '_cell_angle_beta', '_cell_angle_gamma']
+
+
+def parse_cif_number(value: str):
+    '''
+        将CIF中的数值转换为float，去掉不确定度括号，如 "12.345(6)" -> 12.345
+    '''
+    return float(value.strip().split('(')[0])
+
+
+def read_cell_parameters(cif_location):
+    '''
+        读取CIF文件的晶胞参数，返回(a, b, c, alpha, beta, gamma)，长度单位为埃，角度单位为度
+    '''
+    values = {}
+    with open(cif_location, 'r') as f:
+        for line in f:
+            spline = line.split()
+            if len(spline) < 2 or spline[0] not in CELL_KEYS:
+                continue
+            values[spline[0]] = parse_cif_number(spline[1])
+            if len(values) == len(CELL_KEYS):
+                break
+    missing = [k for k in CELL_KEYS if k not in values]
+    if len(missing) > 0:
+        raise ValueError("CIF文件缺少晶胞参数 (missing cell parameters): " + str(missing))
+    return tuple(values[k] for k in CELL_KEYS)
+
+
+def get_cell_volume(a, b, c, alpha, beta, gamma):
+    '''
+        计算晶胞体积(A^3)，角度单位为度
+    '''
+    alpha, beta, gamma = [x * math.pi / 180 for x in (alpha, beta, gamma)]
+    return a * b * c * (1 + 2 * math.cos(alpha) * math.cos(beta) * math.cos(gamma) - (math.cos(alpha)) ** 2
+                        - (math.cos(beta)) ** 2 - (math.cos(gamma)) ** 2) ** 0.5
+
+
+def _tokenize(line: str):
+    # 按空白分割一行，保留引号内的空格，忽略#之后的注释
+    tokens = []
+    for m in re.finditer(r"'[^']*'|\"[^\"]*\"|\S+", line):
+        token = m.group(0)
+        if token.startswith('#'):
+            break
+        tokens.append(token.strip('\'"'))
+    return tokens
+
+
+def read_cif_loops(cif_location):
+    '''
+        读取CIF文件，返回(tags, loops)
+        tags: 字典，键为单值标签名（如_cell_length_a），值为字符串
+        loops: 列表，每个元素为(列名列表, 每行数据的列表)
+    '''
+    tags = {}
+    loops = []
+    headers = None
+    values = []
+
+    def close_loop():
+        if headers:
+            n = len(headers)
+            rows = [values[i:i + n] for i in range(0, len(values) - n + 1, n)]
+            loops.append((headers, rows))
+
+    with open(cif_location, 'r') as f:
+        lines = f.readlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        if line.startswith(';'):
+            # 多行文本块，整体跳过
+            while i < len(lines) and not lines[i].startswith(';'):
+                i += 1
+            i += 1
+            continue
+        if line.lower().startswith('loop_'):
+            close_loop()
+            headers, values = [], []
+            continue
+        if line.lower().startswith('data_'):
+            close_loop()
+            headers, values = None, []
+            continue
+        if line.startswith('_'):
+            if headers is not None and len(values) == 0:
+                headers.append(line.split()[0])
+                continue
+            close_loop()
+            headers, values = None, []
+            tokens = _tokenize(line)
+            if len(tokens) > 1:
+                tags[tokens[0]] = tokens[1]
+            elif i < len(lines) and not lines[i].strip().startswith(('_', ';')):
+                # 值写在下一行
+                next_tokens = _tokenize(lines[i])
+                if len(next_tokens) > 0:
+                    tags[tokens[0]] = next_tokens[0]
+                    i += 1
+            continue
+        if headers is not None:
+            values.extend(_tokenize(line))
+    close_loop()
+    return tags, loops
+
+
+def get_atom_site_loop(loops):
+    '''
+        返回包含原子坐标的loop（_atom_site_fract_x 或 _atom_site_label 所在的loop）
+    '''
+    for headers, rows in loops:
+        if '_atom_site_fract_x' in headers:
+            return headers, rows
+    for headers, rows in loops:
+        if '_atom_site_label' in headers:
+            return headers, rows
+    return None, []
+
+
+def strip_label(label: str):
+    '''
+        去掉原子标签中的数字（如 "Zn12" -> "Zn"），与gRASPA力场文件中的伪原子名对应
+    '''
+    return ''.join(i for i in label if not i.isdigit())
+
+
+def read_cif_summary(cif_location):
+    '''
+        读取CIF文件的概要信息：晶胞参数、体积、原子数、伪原子标签集合、是否含有电荷
+    '''
+    tags, loops = read_cif_loops(cif_location)
+    missing = [k for k in CELL_KEYS if k not in tags]
+    if len(missing) > 0:
+        raise ValueError("CIF文件缺少晶胞参数 (missing cell parameters): " + str(missing))
+    cell = [parse_cif_number(tags[k]) for k in CELL_KEYS]
+    headers, rows = get_atom_site_loop(loops)
+    labels = set()
+    has_charges = False
+    if headers is not None:
+        label_col = headers.index('_atom_site_label') if '_atom_site_label' in headers else 0
+        labels = set(strip_label(row[label_col]) for row in rows)
+        if '_atom_site_charge' in headers:
+            charge_col = headers.index('_atom_site_charge')
+            has_charges = any(row[charge_col] not in ('?', '.') for row in rows)
+    return {
+        'a': cell[0], 'b': cell[1], 'c': cell[2],
+        'alpha': cell[3], 'beta': cell[4], 'gamma': cell[5],
+        'volume': get_cell_volume(*cell),
+        'n_atoms': len(rows),
+        'labels': sorted(labels),
+        'has_charges': has_charges,
+    }
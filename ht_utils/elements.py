@@ -0,0 +1,34 @@
+import re
+
+# 元素的原子质量(g/mol)，数值抄自RASPA2力场文件pseudo_atoms.def中各元素的伪原子；
+# framework_descriptors给出力场的masses时优先使用力场中的质量，这里只作为力场中没有该伪原子时的后备
+ATOMIC_MASSES = {
+    'H': 1.00794, 'B': 10.811, 'C': 12.0107, 'N': 14.0067, 'O': 15.9994, 'F': 18.9984, 'Al': 26.98154,
+    'Si': 28.0855, 'P': 30.97376, 'S': 32.065, 'Cl': 35.453, 'Ga': 69.723, 'Ge': 72.64, 'As': 74.9216,
+    'Se': 78.96, 'Br': 79.904, 'In': 114.818, 'Sn': 118.71, 'Sb': 121.76, 'Te': 127.6, 'I': 126.9,
+    'Na': 22.98977, 'Mg': 24.305, 'K': 39.0983, 'Ca': 40.078, 'Sc': 44.95591, 'Ti': 47.867, 'V': 50.9415,
+    'Cr': 51.9961, 'Mn': 54.93805, 'Fe': 55.845, 'Co': 58.93319, 'Ni': 58.6934, 'Cu': 63.546, 'Zn': 65.409,
+    'Zr': 91.224, 'Mo': 95.94, 'Be': 9.01218, 'Rb': 85.4678, 'Sr': 87.62, 'Y': 88.90585, 'Nb': 92.90638,
+    'Tc': 98.9063, 'Ru': 101.07, 'Rh': 102.9055, 'Pd': 106.42, 'Ag': 107.8682, 'Cd': 112.411, 'Cs': 132.90545,
+    'Ba': 137.327, 'La': 138.90547, 'Ce': 140.116, 'Pr': 140.90465, 'Nd': 144.242, 'Pm': 146.9151,
+    'Sm': 150.36, 'Eu': 151.964, 'Gd': 157.25, 'Tb': 158.92535, 'Dy': 162.5, 'Ho': 164.93032, 'Er': 167.259,
+    'Tm': 168.93421, 'Yb': 173.04, 'Lu': 174.967, 'Hf': 178.49, 'Ta': 180.9479, 'W': 183.84, 'Re': 186.207,
+    'Os': 190.23, 'Ir': 192.217, 'Pt': 195.084, 'Au': 196.96657, 'Hg': 200.59, 'Tl': 204.3833, 'Pb': 207.2,
+    'Bi': 208.9804, 'Po': 208.9824, 'At': 209.9871, 'Rn': 222.0176, 'Ra': 226.0254, 'Ac': 227.0278,
+    'Th': 232.03806, 'Pa': 231.03588, 'U': 238.02891, 'Np': 237.0482, 'Pu': 244.0642, 'Am': 243.0614,
+    'Cm': 247.0703, 'Bk': 247.0703, 'Cf': 251.0796, 'Es': 252.0829, 'Fm': 257.0951, 'Md': 258.0951,
+    'No': 259.1009, 'Li': 6.94, 'Fr': 223.0, 'He': 4.0026, 'Ar': 39.948,
+}
+
+
+def element_symbol(label: str):
+    '''
+        原子标签开头的元素符号：先取前两个字母（如 "Zn12" -> "Zn"，"CL1" -> "Cl"），不是元素时只取第一个字母
+        （如 "H1A" -> "H"，"C1a" -> "C"，"OH" -> "O"）；标签不以字母开头时返回去掉数字后的标签
+    '''
+    letters = re.match(r'[A-Za-z]*', label).group(0)
+    if len(letters) == 0:
+        return ''.join(i for i in label if not i.isdigit())
+    if len(letters) >= 2 and letters[:2].capitalize() in ATOMIC_MASSES:
+        return letters[:2].capitalize()
+    return letters[0].upper()
@@ -0,0 +1,161 @@
+import math
+import os
+
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure
+
+
+def read_mixing_rules(ff_dir):
+    '''
+        读取力场目录中force_field_mixing_rules.def的Lennard-Jones参数
+        返回({伪原子: (epsilon[K], sigma[埃])}, 是否shifted, 是否使用长程校正)
+    '''
+    with open(os.path.join(ff_dir, "force_field_mixing_rules.def")) as f:
+        lines = [line.split('//')[0].strip() for line in f]
+    lines = [line for line in lines if len(line) > 0 and not line.startswith('#')]
+    shifted = lines[0].lower() == 'shifted'
+    tail_corrections = lines[1].lower() == 'yes'
+    n = int(lines[2].split()[0])
+    params = {}
+    for line in lines[3:3 + n]:
+        spline = line.split()
+        interaction = spline[1].lower()
+        if interaction == 'lennard-jones':
+            params[spline[0]] = (float(spline[2]), float(spline[3]))
+        elif interaction == 'none':
+            params[spline[0]] = (0.0, 0.0)
+        else:
+            raise ValueError("不支持的相互作用类型 (unsupported interaction): " + line)
+    return params, shifted, tail_corrections
+
+
+def get_pair_parameters(structure: CifStructure, params: dict, probe: str):
+    '''
+        按Lorentz-Berthelot规则返回探针与框架中每个原子的(epsilon, sigma)数组
+        与RASPA2一致，原子标签（去掉数字）在力场中找不到时使用元素符号
+    '''
+    if probe not in params:
+        raise ValueError("力场中缺少探针原子 (probe not in force field): " + probe)
+    eps_probe, sigma_probe = params[probe]
+    names = structure.pseudo_atoms
+    names = np.where(np.isin(names, list(params)), names, structure.symbols)
+    unique, inverse = np.unique(names, return_inverse=True)
+    missing = [name for name in unique if name not in params]
+    if len(missing) > 0:
+        raise ValueError("力场中缺少伪原子 (pseudo atoms not in force field): " + ' '.join(missing))
+    eps = np.array([params[name][0] for name in unique])[inverse]
+    sigma = np.array([params[name][1] for name in unique])[inverse]
+    return np.sqrt(eps * eps_probe), (sigma + sigma_probe) / 2
+
+
+def cell_widths(lattice):
+    '''
+        平行六面体三个方向的高（晶胞体积除以底面积）
+    '''
+    volume = abs(np.linalg.det(lattice))
+    return volume / np.linalg.norm(np.cross(lattice[[1, 2, 0]], lattice[[2, 0, 1]]), axis=1)
+
+
+def _periodic_images(frac, widths, cutoff):
+    # 距离晶胞不超过cutoff的所有原子镜像：分数坐标在[-pad, 1 + pad)内，返回(镜像分数坐标, 原子序号)
+    pad = cutoff / widths
+    nmax = np.ceil(pad).astype(int)
+    grid = np.meshgrid(*[np.arange(-n, n + 1) for n in nmax], indexing='ij')
+    shifts = np.stack([g.ravel() for g in grid], axis=1)
+    images = (frac[None, :, :] + shifts[:, None, :]).reshape(-1, 3)
+    index = np.tile(np.arange(len(frac)), len(shifts))
+    inside = ((images >= -pad) & (images < 1 + pad)).all(axis=1)
+    return images[inside], index[inside]
+
+
+def grid_blocks(lattice, axes, images, cutoff):
+    '''
+        元胞列表：把分数坐标网格(axes为三个方向的网格坐标)按宽度约为cutoff / 2的元胞分块，
+        逐块返回(三个方向的网格序号, 网格点的笛卡尔坐标, 距这些网格点可能小于cutoff的原子镜像序号)
+    '''
+    widths = cell_widths(lattice)
+    nbins = np.maximum(1, np.floor(2 * widths / cutoff)).astype(int)
+    reach = np.ceil(cutoff / widths * nbins).astype(int)
+    atom_bins = np.floor(images * nbins).astype(int)
+    point_bins = [np.floor(axis * n).astype(int) for axis, n in zip(axes, nbins)]
+    for b in np.ndindex(*nbins):
+        selected = np.nonzero((np.abs(atom_bins - np.array(b)) <= reach).all(axis=1))[0]
+        idx = [np.nonzero(pb == bi)[0] for pb, bi in zip(point_bins, b)]
+        if len(selected) == 0 or any(len(i) == 0 for i in idx):
+            continue
+        grid = np.meshgrid(*[axis[i] for axis, i in zip(axes, idx)], indexing='ij')
+        yield idx, np.stack([g.ravel() for g in grid], axis=1) @ lattice, selected
+
+
+def lj_energy_grid(structure: CifStructure, eps, sigma, cutoff=12.0, spacing=0.3, shifted=True,
+                   max_elements=2 ** 24):
+    '''
+        计算探针在晶胞内均匀网格点（分数坐标(i + 0.5) / n）上与框架的Lennard-Jones相互作用能，单位K
+        eps, sigma: 探针与每个框架原子的作用参数（get_pair_parameters）
+        使用元胞列表，只计算相邻元胞中的原子镜像，截断半径之外的作用为0
+        返回形状为(n_a, n_b, n_c)的能量数组
+    '''
+    lattice = structure.lattice()
+    widths = cell_widths(lattice)
+    shape = np.maximum(1, np.ceil(widths / spacing)).astype(int)
+    axes = [(np.arange(n) + 0.5) / n for n in shape]
+
+    frac = structure.frac - np.floor(structure.frac)
+    images, index = _periodic_images(frac, widths, cutoff)
+    atoms = images @ lattice
+    eps, sigma = np.asarray(eps)[index], np.asarray(sigma)[index]
+    sigma2 = sigma * sigma
+    if shifted:
+        sr6 = (sigma2 / (cutoff * cutoff)) ** 3
+        e_cut = 4 * eps * (sr6 * sr6 - sr6)
+    else:
+        e_cut = np.zeros(len(eps))
+
+    atoms_sq = (atoms * atoms).sum(axis=1)
+
+    energy = np.zeros(tuple(shape))
+    for idx, points, selected in grid_blocks(lattice, axes, images, cutoff):
+        a, a_sq = atoms[selected], atoms_sq[selected]
+        e, s2, ec = eps[selected], sigma2[selected], e_cut[selected]
+        values = np.empty(len(points))
+        step = max(1, max_elements // len(selected))
+        for start in range(0, len(points), step):
+            p = points[start:start + step]
+            # |p - a|^2 = |p|^2 + |a|^2 - 2 p.a，用矩阵乘法计算所有距离
+            r2 = np.maximum((p * p).sum(axis=1)[:, None] + a_sq[None, :] - 2 * p @ a.T, 1e-6)
+            sr6 = s2 / r2
+            sr6 = sr6 * sr6 * sr6
+            u = (4 * e * (sr6 * sr6 - sr6) - ec) * (r2 < cutoff * cutoff)
+            values[start:start + step] = u.sum(axis=1)
+        energy[np.ix_(*idx)] = values.reshape([len(i) for i in idx])
+    return energy
+
+
+def tail_correction(structure: CifStructure, eps, sigma, cutoff=12.0):
+    '''
+        cutoff之外Lennard-Jones作用的长程校正（探针插入一次的能量，单位K）
+    '''
+    eps, sigma = np.asarray(eps), np.asarray(sigma)
+    sr3 = (sigma / cutoff) ** 3
+    return float((16.0 / 3.0 * math.pi * eps * sigma ** 3 * (sr3 ** 3 / 3.0 - sr3)).sum() / structure.volume())
+
+
+def boltzmann_average(energy, temperature, shift=0.0):
+    '''
+        网格上Boltzmann因子exp(-U/T)的平均值，即RASPA2中Widom插入的平均Rosenbluth权重
+    '''
+    with np.errstate(over='ignore'):
+        return float(np.exp(-(energy + shift) / temperature).mean())
+
+
+def helium_void_fraction(structure: CifStructure, params: dict, shifted=True, tail_corrections=False, cutoff=12.0,
+                         temperature=298.0, spacing=0.3, probe='He'):
+    '''
+        由能量网格计算He孔隙率，对应RASPA2输出中的[helium] Average Widom Rosenbluth-weight
+        params: read_mixing_rules返回的Lennard-Jones参数
+    '''
+    eps, sigma = get_pair_parameters(structure, params, probe)
+    energy = lj_energy_grid(structure, eps, sigma, cutoff, spacing, shifted)
+    shift = tail_correction(structure, eps, sigma, cutoff) if tail_corrections else 0.0
+    return boltzmann_average(energy, temperature, shift)
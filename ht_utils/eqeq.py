@@ -0,0 +1,177 @@
+import math
+
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure
+
+# 库仑常数，单位 eV·Å
+COULOMB_K = 14.4
+
+# 第一电离能与电子亲和能(eV)，EQeq中 chi = (IP + EA) / 2, J = IP - EA
+# 氢的电子亲和能按EQeq的做法取-2.0 eV（可在调用时修改）
+IONIZATION_DATA = {
+    'H': (13.598, 0.754), 'Li': (5.392, 0.618), 'Be': (9.323, 0.0), 'B': (8.298, 0.277),
+    'C': (11.260, 1.262), 'N': (14.534, -0.07), 'O': (13.618, 1.461), 'F': (17.423, 3.401),
+    'Na': (5.139, 0.548), 'Mg': (7.646, 0.0), 'Al': (5.986, 0.433), 'Si': (8.152, 1.390),
+    'P': (10.487, 0.747), 'S': (10.360, 2.077), 'Cl': (12.968, 3.613), 'K': (4.341, 0.501),
+    'Ca': (6.113, 0.025), 'Sc': (6.561, 0.188), 'Ti': (6.828, 0.079), 'V': (6.746, 0.525),
+    'Cr': (6.767, 0.666), 'Mn': (7.434, 0.0), 'Fe': (7.902, 0.151), 'Co': (7.881, 0.662),
+    'Ni': (7.640, 1.156), 'Cu': (7.726, 1.236), 'Zn': (9.394, 0.0), 'Ga': (5.999, 0.430),
+    'Ge': (7.900, 1.233), 'As': (9.789, 0.804), 'Se': (9.752, 2.021), 'Br': (11.814, 3.364),
+    'Rb': (4.177, 0.486), 'Sr': (5.695, 0.048), 'Y': (6.217, 0.307), 'Zr': (6.634, 0.426),
+    'Nb': (6.759, 0.893), 'Mo': (7.092, 0.748), 'Ru': (7.361, 1.050), 'Rh': (7.459, 1.137),
+    'Pd': (8.337, 0.562), 'Ag': (7.576, 1.302), 'Cd': (8.994, 0.0), 'In': (5.786, 0.300),
+    'Sn': (7.344, 1.112), 'Sb': (8.608, 1.046), 'Te': (9.010, 1.971), 'I': (10.451, 3.059),
+    'Cs': (3.894, 0.472), 'Ba': (5.212, 0.145), 'La': (5.577, 0.470), 'Ce': (5.539, 0.500),
+    'Eu': (5.670, 0.116), 'Gd': (6.150, 0.137), 'Tb': (5.864, 0.131), 'Dy': (5.939, 0.0),
+    'Er': (6.108, 0.0), 'Yb': (6.254, 0.0), 'Hf': (6.825, 0.178), 'W': (7.864, 0.816),
+    'Pt': (8.959, 2.128), 'Au': (9.226, 2.309), 'Pb': (7.417, 0.364), 'Bi': (7.286, 0.942),
+}
+
+
+def erfc(x):
+    '''
+        互补误差函数的向量化近似（Abramowitz & Stegun 7.1.26，绝对误差 < 1.5e-7），避免依赖SciPy
+    '''
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return poly * np.exp(-x * x)
+
+
+def get_electronegativity(symbols, hydrogen_ea=-2.0):
+    '''
+        返回各原子的电负性chi与硬度J(eV)，未知元素抛出ValueError
+    '''
+    chi = np.empty(len(symbols))
+    J = np.empty(len(symbols))
+    for i, symbol in enumerate(symbols):
+        if symbol not in IONIZATION_DATA:
+            raise ValueError("缺少元素的电离能数据 (no ionization data for element): " + str(symbol))
+        ip, ea = IONIZATION_DATA[symbol]
+        if symbol == 'H':
+            ea = hydrogen_ea
+        chi[i] = (ip + ea) / 2
+        J[i] = ip - ea
+    return chi, J
+
+
+def _image_shifts(lattice, cutoff):
+    # 距离小于cutoff的原子对可能出现的所有晶胞平移（分数坐标差已移入[-0.5, 0.5)）
+    volume = abs(np.linalg.det(lattice))
+    widths = volume / np.linalg.norm(np.cross(lattice[[1, 2, 0]], lattice[[2, 0, 1]]), axis=1)
+    nmax = np.ceil(cutoff / widths + 0.5).astype(int)
+    grid = np.meshgrid(*[np.arange(-n, n + 1) for n in nmax], indexing='ij')
+    return np.stack([g.ravel() for g in grid], axis=1)
+
+
+def _reciprocal_vectors(lattice, kmax):
+    recip = 2 * np.pi * np.linalg.inv(lattice).T
+    mmax = np.ceil(kmax / np.linalg.norm(recip, axis=1)).astype(int)
+    grid = np.meshgrid(*[np.arange(-m, m + 1) for m in mmax], indexing='ij')
+    m = np.stack([g.ravel() for g in grid], axis=1)
+    k = m @ recip
+    k2 = (k * k).sum(axis=1)
+    mask = (k2 > 0) & (k2 <= kmax * kmax)
+    return k[mask], k2[mask]
+
+
+def build_eqeq_matrix(structure: CifStructure, lam=1.2, hydrogen_ea=-2.0, cutoff=12.0, max_elements=2 ** 22):
+    '''
+        构建EQeq的线性方程组 H q - mu = -chi, sum(q) = Q
+        库仑相互作用(lam * k / 2)用Ewald求和计算周期性的1/r，近距离的轨道重叠修正
+        e^{-a^2 r^2}(2a - a^2 r - 1/r)（a = sqrt(J_i J_j)/k）在cutoff内对所有镜像求和
+        实空间部分按行、倒空间部分按倒格矢分块计算，每块的临时数组不超过max_elements个元素，
+        除H外的内存与原子数成线性关系
+        返回(H, chi)，H为(n, n)矩阵
+    '''
+    chi, J = get_electronegativity(structure.symbols, hydrogen_ea)
+    lattice = structure.lattice()
+    volume = abs(np.linalg.det(lattice))
+    frac = structure.frac - np.floor(structure.frac)
+    n = len(frac)
+    alpha = 3.0 / cutoff
+
+    # 实空间部分
+    phi = np.zeros((n, n))
+    shifts = _image_shifts(lattice, cutoff) @ lattice
+    block = max(1, max_elements // (3 * max(n, 1)))
+    for start in range(0, n, block):
+        rows = slice(start, start + block)
+        dfrac = frac[rows, None, :] - frac[None, :, :]
+        dfrac -= np.round(dfrac)
+        dcart = dfrac @ lattice
+        a = np.sqrt(np.outer(J[rows], J)) / COULOMB_K
+        phi_rows = phi[rows]
+        for shift in shifts:
+            d = np.linalg.norm(dcart + shift, axis=2)
+            mask = (d > 1e-8) & (d < cutoff)
+            if not mask.any():
+                continue
+            dm = d[mask]
+            am = a[mask]
+            phi_rows[mask] += erfc(alpha * dm) / dm + np.exp(-am * am * dm * dm) * (2 * am - am * am * dm - 1 / dm)
+
+    # 倒空间部分：sum_k w_k cos(k.(r_i - r_j)) = C W C^T + S W S^T，按倒格矢分块累加
+    k, k2 = _reciprocal_vectors(lattice, 2 * alpha * 3.0)
+    w = 4 * np.pi / volume * np.exp(-k2 / (4 * alpha * alpha)) / k2
+    cart = frac @ lattice
+    k_block = max(1, max_elements // max(n, 1))
+    for start in range(0, len(k), k_block):
+        kr = cart @ k[start:start + k_block].T
+        wb = w[start:start + k_block]
+        C = np.cos(kr)
+        phi += (C * wb) @ C.T
+        np.sin(kr, out=C)
+        phi += (C * wb) @ C.T
+
+    # 自相互作用修正
+    phi[np.diag_indices(n)] -= 2 * alpha / math.sqrt(math.pi)
+    # EQeq中 J_ij = lam * k / 2 * [...]，r -> 0 时与原子硬度J_i一致
+    H = phi
+    H *= lam * COULOMB_K / 2
+    H[np.diag_indices(n)] += J
+    return H, chi
+
+
+def solve_charges(systems, total_charges=None):
+    '''
+        批量求解多个结构的EQeq方程组
+        systems: [(H, chi), ...]；不同大小的方程组补齐到相同维数后一次调用np.linalg.solve
+        返回电荷数组的列表
+    '''
+    if total_charges is None:
+        total_charges = [0.0] * len(systems)
+    size = max(len(chi) for _, chi in systems) + 1
+    A = np.zeros((len(systems), size, size))
+    b = np.zeros((len(systems), size))
+    for s, ((H, chi), Q) in enumerate(zip(systems, total_charges)):
+        n = len(chi)
+        A[s, :n, :n] = H
+        A[s, :n, size - 1] = -1.0
+        A[s, size - 1, :n] = 1.0
+        b[s, :n] = -chi
+        b[s, size - 1] = Q
+        # 补齐的行相互独立，解为0
+        pad = np.arange(n, size - 1)
+        A[s, pad, pad] = 1.0
+    x = np.linalg.solve(A, b[..., None])[..., 0]
+    return [x[s, :len(chi)] for s, (_, chi) in enumerate(systems)]
+
+
+def assign_charges(structures, lam=1.2, hydrogen_ea=-2.0, cutoff=12.0, max_elements=2 ** 25):
+    '''
+        为一组P1结构计算EQeq电荷，按原子数排序后分批求解，每批的矩阵元素总数不超过max_elements
+        返回与structures顺序对应的电荷数组列表
+    '''
+    order = sorted(range(len(structures)), key=lambda i: structures[i].n_atoms)
+    charges = [None] * len(structures)
+    batch = []
+    for i in order:
+        batch.append(i)
+        size = structures[i].n_atoms + 1
+        if len(batch) * size * size >= max_elements or i == order[-1]:
+            systems = [build_eqeq_matrix(structures[j], lam, hydrogen_ea, cutoff) for j in batch]
+            for j, q in zip(batch, solve_charges(systems)):
+                charges[j] = q
+            batch = []
+    return charges
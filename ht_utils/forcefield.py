@@ -0,0 +1,182 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from ht_utils.staging import link_file
+
+# 需要根据框架和吸附质修剪的力场文件，其余力场文件直接链接到任务目录
+PRUNED_FF_FILES = ("force_field_mixing_rules.def", "pseudo_atoms.def")
+
+
+def get_frameworks_from_input(input_text: str):
+    '''
+        从输入文本中获取框架名称
+    '''
+    frameworks = []
+    for line in input_text.splitlines():
+        if "FrameworkName" in line:
+            spline = line.split()
+            spline.pop(0)
+            frameworks = spline
+    return frameworks
+
+
+def get_adsorbates_from_input(input_text: str):
+    '''
+        从输入文本中获取吸附物名称
+    '''
+    adsorbates = []
+    for line in input_text.splitlines():
+        if "Component" in line:
+            spline = line.split()
+            adsorbates.append(spline[3])
+    return adsorbates
+
+
+def read_framework_pseudo_atoms(filename):
+    '''
+        读取框架伪原子的标签（去掉数字），_atom_ loop中列数不一致时抛出异常
+    '''
+    ncols = 0
+    count = 0
+    labels = set()
+    with open(filename) as f:
+        for line in f:
+            if "_atom_" in line:
+                ncols += 1
+            if ncols > 0 and count > 0 and "_atom_" not in line:
+                spline = line.split()
+                if not (ncols == len(spline)):
+                    raise Exception("CIF FILE WRONG!")
+                labels.add(''.join(i for i in spline[0] if not i.isdigit()))
+            count += 1
+    return labels
+
+
+def read_molecule_pseudo_atoms(filename):
+    '''
+        读取分子定义文件(.def)中伪原子的标签
+    '''
+    count = 0
+    NAtom = 0
+    Atomcount = 0
+    labels = set()
+    with open(filename) as f:
+        for line in f:
+            if count == 5:
+                spline = line.split()
+                NAtom = int(spline[0])
+            if NAtom > 0 and 'atomic positions' in line:
+                Atomcount = 0
+            if NAtom > 0 and Atomcount < NAtom and "#" not in line and count > 5:
+                spline = line.split()
+                if len(spline) > 1:
+                    labels.add(spline[1])
+                    Atomcount += 1
+            count += 1
+    return labels
+
+
+def _prune_file(input_file, output_file, labels: set, count_line: int, first_row: int):
+    # 保留表头与表尾，表格部分只保留labels中的伪原子，并更新表头中的数目
+    with open(input_file) as fr:
+        lines = fr.readlines()
+    oldlines = int(lines[count_line].split()[0])
+    rows = [line for line in lines[first_row:first_row + oldlines]
+            if len(line.split()) > 0 and line.split()[0] in labels]
+    with open(output_file, 'w') as fw:
+        header = lines[:first_row]
+        header[count_line] = str(len(rows)) + '\n'
+        fw.writelines(header)
+        fw.writelines(rows)
+        fw.writelines(lines[first_row + oldlines:])
+
+
+def prune_forcefield_files(labels: set, src_dir, dst_dir):
+    '''
+        根据伪原子标签修剪force_field_mixing_rules.def和pseudo_atoms.def，从src_dir读取，写入dst_dir
+    '''
+    _prune_file(os.path.join(src_dir, "force_field_mixing_rules.def"),
+                os.path.join(dst_dir, "force_field_mixing_rules.def"), labels, count_line=5, first_row=7)
+    _prune_file(os.path.join(src_dir, "pseudo_atoms.def"),
+                os.path.join(dst_dir, "pseudo_atoms.def"), labels, count_line=1, first_row=3)
+
+
+class ForceFieldCache():
+    '''
+        修剪后的力场文件缓存
+        以(伪原子标签集合, 原始力场文件内容)的哈希为键，每种组合只生成一次，
+        同一框架的不同压力、温度以及不同批次的计算都直接链接缓存中的文件
+    '''
+
+    def __init__(self, ff_dir, cache_dir):
+        self.ff_dir = os.path.abspath(ff_dir)
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        h = hashlib.sha1()
+        for filename in PRUNED_FF_FILES:
+            with open(os.path.join(self.ff_dir, filename), 'rb') as f:
+                h.update(f.read())
+        self.ff_hash = h.hexdigest()
+        self.lock = threading.Lock()
+        self.label_cache = {}
+
+    def _cached_labels(self, path, reader):
+        # 同一文件（路径与修改时间相同）只解析一次
+        key = (path, os.path.getmtime(path))
+        with self.lock:
+            if key in self.label_cache:
+                return self.label_cache[key]
+        labels = reader(path)
+        with self.lock:
+            self.label_cache[key] = labels
+        return labels
+
+    def get_framework_labels(self, cif_path):
+        return self._cached_labels(os.path.abspath(cif_path), read_framework_pseudo_atoms)
+
+    def get_molecule_labels(self, adsorbate):
+        def_path = os.path.join(self.ff_dir, adsorbate + '.def')
+        if not os.path.exists(def_path):
+            return set()
+        return self._cached_labels(def_path, read_molecule_pseudo_atoms)
+
+    def get(self, labels):
+        '''
+            返回包含修剪后力场文件的缓存目录，不存在时生成
+        '''
+        key = hashlib.sha1((self.ff_hash + '|' + ' '.join(sorted(labels))).encode()).hexdigest()
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry):
+            return entry
+        # 先写入临时目录再重命名，避免多个线程或进程同时生成时读到不完整的文件
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        prune_forcefield_files(set(labels), self.ff_dir, tmp_dir)
+        with open(os.path.join(tmp_dir, "labels.txt"), 'w') as f:
+            f.write(' '.join(sorted(labels)) + '\n')
+        try:
+            os.rename(tmp_dir, entry)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return entry
+
+    def stage(self, cmd_dir, input_text, cif_dir, framework_labels=None):
+        '''
+            为任务目录准备修剪后的力场文件（以链接的形式）
+            framework_labels为None时从cif文件中读取框架伪原子标签
+        '''
+        labels = set()
+        if framework_labels is not None:
+            labels.update(framework_labels)
+        else:
+            for framework in get_frameworks_from_input(input_text):
+                cif_path = os.path.join(cif_dir, framework + '.cif')
+                if os.path.exists(cif_path):
+                    labels.update(self.get_framework_labels(cif_path))
+        for adsorbate in get_adsorbates_from_input(input_text):
+            labels.update(self.get_molecule_labels(adsorbate))
+        entry = self.get(labels)
+        for filename in PRUNED_FF_FILES:
+            link_file(os.path.join(entry, filename), os.path.join(cmd_dir, filename))
@@ -0,0 +1,81 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure, read_cif_atoms
+from ht_utils.elements import ATOMIC_MASSES
+from ht_utils.symmetry import expand_to_p1
+
+# 1 amu/A^3 = 1660.539 kg/m^3
+AMU_PER_A3_TO_KG_PER_M3 = 1660.5390666
+
+
+def get_atomic_masses(symbols, pseudo_atoms=None, masses=None):
+    '''
+        返回各原子的质量数组：伪原子在masses（力场pseudo_atoms.def中的{伪原子: 质量}）中的原子使用力场的质量，
+        其余按元素取ATOMIC_MASSES，未知元素抛出ValueError
+    '''
+    symbols = np.asarray(symbols, dtype=str)
+    result = np.full(len(symbols), np.nan)
+    if masses is not None and pseudo_atoms is not None:
+        names, inverse = np.unique(np.asarray(pseudo_atoms, dtype=str), return_inverse=True)
+        result = np.array([masses.get(name, np.nan) for name in names], dtype=np.float64)[inverse.reshape(-1)]
+    missing = np.isnan(result)
+    unknown = sorted(set(symbols[missing].tolist()) - set(ATOMIC_MASSES))
+    if len(unknown) > 0:
+        raise ValueError("未知元素 (unknown elements): " + ' '.join(unknown))
+    if missing.any():
+        elements, inverse = np.unique(symbols[missing], return_inverse=True)
+        result[missing] = np.array([ATOMIC_MASSES[e] for e in elements])[inverse.reshape(-1)]
+    return result
+
+
+def framework_descriptors(structure: CifStructure, masses=None):
+    '''
+        由P1结构直接计算框架描述符：晶胞体积、单胞质量、框架密度与元素组成
+        框架密度与RASPA输出中的Framework Density含义相同（单胞质量/晶胞体积）
+        masses: 可选的力场质量{伪原子: 质量}（gcmc.read_pseudo_atom_masses），原子标签去掉数字后作为伪原子查找，
+        与RASPA2一致；为None或力场中没有该伪原子时按元素使用ATOMIC_MASSES
+    '''
+    volume = structure.volume()
+    pseudo_atoms = structure.pseudo_atoms if masses is not None else None
+    mass = get_atomic_masses(structure.symbols, pseudo_atoms, masses).sum()
+    elements, counts = np.unique(structure.symbols, return_counts=True)
+    density = mass / volume * AMU_PER_A3_TO_KG_PER_M3
+    return {
+        'volume_A^3': volume,
+        'framework_mass_g/mol': mass,
+        'Framework_density_kg/m^3': density,
+        'Framework_density_g/cm^3': density / 1000,
+        'n_atoms': structure.n_atoms,
+        'composition': ' '.join("{}:{}".format(e, c) for e, c in zip(elements, counts)),
+        'counts': dict(zip(elements.tolist(), counts.tolist())),
+    }
+
+
+def read_framework_descriptors(cif_location, tol=0.1, masses=None):
+    '''
+        读取cif文件并计算框架描述符，非P1结构先按对称操作展开
+    '''
+    structure = read_cif_atoms(cif_location)
+    if not structure.is_p1():
+        structure = expand_to_p1(structure, tol=tol)
+    return framework_descriptors(structure, masses)
+
+
+def _descriptor_worker(args):
+    try:
+        return read_framework_descriptors(*args)
+    except Exception as e:
+        return e
+
+
+def library_descriptors(cif_locations, max_processes=1, tol=0.1, chunksize=64, masses=None):
+    '''
+        使用进程池计算整个结构库的框架描述符，按输入顺序逐个返回(文件路径, 描述符字典或异常对象)
+    '''
+    cif_locations = list(cif_locations)
+    tasks = [(path, tol, masses) for path in cif_locations]
+    with ProcessPoolExecutor(max_workers=max(1, max_processes)) as pool:
+        for path, result in zip(cif_locations, pool.map(_descriptor_worker, tasks, chunksize=chunksize)):
+            yield path, result
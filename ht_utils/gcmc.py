@@ -0,0 +1,263 @@
+import math
+import os
+
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure
+from ht_utils.energy_grid import cell_widths, get_pair_parameters, lj_energy_grid
+from ht_utils.framework_descriptors import framework_descriptors
+from ht_utils.widom_grid import GAS_CONSTANT, interpolate_grid
+
+BOLTZMANN = 1.380649e-23
+AVOGADRO = 6.02214076e23
+# 标准状况下理想气体的摩尔体积(cm^3/mol)，与RASPA2的cm^3 (STP)单位一致
+STP_MOLAR_VOLUME = 22414.0
+# 与RASPA2输出的吸附量单位一致
+LOADING_UNITS = ('mol/uc', 'cm^3/g', 'mol/kg', 'mg/g', 'cm^3/cm^3')
+
+
+def read_critical_constants(def_location):
+    '''
+        读取RASPA格式分子定义文件开头的临界温度(K)、临界压力(Pa)与偏心因子
+    '''
+    with open(def_location) as f:
+        lines = [line.strip() for line in f if len(line.strip()) > 0 and not line.strip().startswith('#')]
+    return float(lines[0].split()[0]), float(lines[1].split()[0]), float(lines[2].split()[0])
+
+
+def read_pseudo_atom_masses(ff_dir):
+    '''
+        读取力场目录中pseudo_atoms.def定义的各伪原子质量(g/mol)，返回{伪原子: 质量}
+    '''
+    with open(os.path.join(ff_dir, "pseudo_atoms.def")) as f:
+        lines = [line for line in f.readlines() if len(line.strip()) > 0]
+    n = int(lines[1].split()[0])
+    masses = {}
+    for line in lines[3:3 + n]:
+        spline = line.split()
+        masses[spline[0]] = float(spline[5])
+    return masses
+
+
+def peng_robinson(temperature, pressure, tc, pc, omega, mol_fractions=None):
+    '''
+        Peng-Robinson状态方程（混合规则k_ij = 0）计算气相各组分的逸度系数与总摩尔密度(mol/m^3)
+        tc, pc, omega, mol_fractions为各组分的数组；立方方程有多个实根时取气相（最大的压缩因子）
+    '''
+    tc, pc, omega = np.atleast_1d(tc).astype(float), np.atleast_1d(pc).astype(float), np.atleast_1d(omega)
+    y = np.ones(1) if mol_fractions is None else np.asarray(mol_fractions, dtype=float)
+    y = y / y.sum()
+    kappa = 0.37464 + 1.54226 * omega - 0.26992 * omega * omega
+    alpha = (1 + kappa * (1 - np.sqrt(temperature / tc))) ** 2
+    a = 0.45724 * (GAS_CONSTANT * tc) ** 2 / pc * alpha
+    b = 0.07780 * GAS_CONSTANT * tc / pc
+    a_ij = np.sqrt(np.outer(a, a))
+    a_mix = y @ a_ij @ y
+    b_mix = y @ b
+    rt = GAS_CONSTANT * temperature
+    A = a_mix * pressure / (rt * rt)
+    B = b_mix * pressure / rt
+    roots = np.roots([1.0, -(1 - B), A - 3 * B * B - 2 * B, -(A * B - B * B - B ** 3)])
+    z = roots[np.abs(roots.imag) < 1e-10].real
+    z = z[z > B].max()
+    sqrt2 = math.sqrt(2)
+    log_phi = b / b_mix * (z - 1) - math.log(z - B) - A / (2 * sqrt2 * B) * \
+        (2 * (a_ij @ y) / a_mix - b / b_mix) * math.log((z + (1 + sqrt2) * B) / (z + (1 - sqrt2) * B))
+    return np.exp(log_phi), pressure / (z * rt)
+
+
+def bulk_fugacity(temperature, pressure, critical, mol_fractions=None, fugacity_coefficients=None):
+    '''
+        体相中各组分的逸度(Pa)与摩尔密度(mol/m^3)，critical为各组分的(临界温度, 临界压力, 偏心因子)
+        fugacity_coefficients中不为None的值（如模板中的FugacityCoefficient）代替Peng-Robinson状态方程的逸度系数
+    '''
+    tc, pc, omega = zip(*critical)
+    phi, density = peng_robinson(temperature, pressure, tc, pc, omega, mol_fractions)
+    y = np.ones(len(tc)) if mol_fractions is None else np.asarray(mol_fractions, dtype=float)
+    y = y / y.sum()
+    if fugacity_coefficients is not None:
+        phi = np.array([p if f is None else f for p, f in zip(phi, fugacity_coefficients)])
+    return y * pressure * phi, y * density
+
+
+def supercell(structure: CifStructure, cutoff):
+    '''
+        满足最小镜像约定（各方向的高不小于2倍截断半径）所需的晶胞数目(3,)
+    '''
+    return np.maximum(1, np.ceil(2 * cutoff / cell_widths(structure.lattice()))).astype(int)
+
+
+def framework_energy_grids(structure: CifStructure, params: dict, adsorbates, cutoff=12.0, spacing=0.2, shifted=True):
+    '''
+        各吸附质伪原子与框架的能量网格{伪原子: (n_a, n_b, n_c)数组}
+    '''
+    grids = {}
+    for name in set(adsorbates):
+        eps, sigma = get_pair_parameters(structure, params, name)
+        grids[name] = lj_energy_grid(structure, eps, sigma, cutoff, spacing, shifted)
+    return grids
+
+
+def gcmc(structure: CifStructure, params: dict, adsorbates, fugacities, temperature=298.0, cutoff=12.0, spacing=0.2,
+         shifted=True, cycles=200, initialization_cycles=100, seed=0, energy_grids=None, record_samples=False):
+    '''
+        刚性框架中单原子Lennard-Jones吸附质（可为多组分）的巨正则蒙特卡洛模拟
+        框架-吸附质作用来自能量网格（对Boltzmann因子做三线性插值），吸附质之间的作用在超晶胞中按最小镜像向量化计算
+        adsorbates: 各组分的伪原子名；fugacities: 各组分的逸度(Pa)
+        energy_grids: 可选的{伪原子: lj_energy_grid的结果}，同一结构计算多个压力时可以复用
+        每个循环max(20, N)步，每步等概率尝试平移或交换（插入/删除），组分随机选取
+        返回{'loading': 各组分平均每个晶胞的分子数, 'error': 5个数据块平均值的标准误差, 'acceptance': 平移的接受率}
+        record_samples为True时另外返回'n': 每个生产循环结束时超晶胞中各组分的分子数(cycles, n_comp)，
+        'energy': 对应的总能量(K)，'cells': 超晶胞的晶胞数，供直方图重加权使用
+    '''
+    rng = np.random.default_rng(seed)
+    n_comp = len(adsorbates)
+    cells = supercell(structure, cutoff)
+    box = structure.lattice() * cells[:, None]
+    inv_box = np.linalg.inv(box)
+    volume = abs(np.linalg.det(box))
+    beta_fv = np.asarray(fugacities, dtype=float) * volume * 1e-30 / (BOLTZMANN * temperature)
+
+    # 框架作用：每种伪原子一个Boltzmann因子网格，插值后取对数得到能量（因子为0时能量为无穷大）
+    if energy_grids is None:
+        energy_grids = framework_energy_grids(structure, params, adsorbates, cutoff, spacing, shifted)
+    factors = {}
+    for name in set(adsorbates):
+        with np.errstate(over='ignore'):
+            factors[name] = np.exp(-energy_grids[name] / temperature)
+    factor_list = [factors[name] for name in adsorbates]
+
+    def framework_energy(frac, c):
+        f = interpolate_grid(factor_list[c], ((frac * cells) % 1.0)[None, :])[0]
+        return -temperature * math.log(f) if f > 0 else math.inf
+
+    # 吸附质之间的Lorentz-Berthelot参数
+    eps = np.array([params[name][0] for name in adsorbates])
+    sigma = np.array([params[name][1] for name in adsorbates])
+    eps_ij = np.sqrt(np.outer(eps, eps))
+    sigma2_ij = ((sigma[:, None] + sigma[None, :]) / 2) ** 2
+    cutoff2 = cutoff * cutoff
+    sr6 = (sigma2_ij / cutoff2) ** 3
+    e_cut = 4 * eps_ij * (sr6 * sr6 - sr6) if shifted else np.zeros_like(eps_ij)
+
+    capacity = 64
+    frac = np.zeros((capacity, 3))
+    comp = np.zeros(capacity, dtype=int)
+    u_frame = np.zeros(capacity)
+    counts = np.zeros(n_comp, dtype=int)
+    n = 0
+    # 体系的总能量（框架与吸附质、吸附质之间），单位K
+    energy = 0.0
+
+    def guest_energy(point, c, exclude=-1):
+        if n == 0:
+            return 0.0
+        d = frac[:n] - point
+        d -= np.round(d)
+        d = d @ box
+        r2 = np.maximum((d * d).sum(axis=1), 1e-6)
+        s6 = (sigma2_ij[c, comp[:n]] / r2) ** 3
+        u = (4 * eps_ij[c, comp[:n]] * (s6 * s6 - s6) - e_cut[c, comp[:n]]) * (r2 < cutoff2)
+        if exclude >= 0:
+            u[exclude] = 0.0
+        return float(u.sum())
+
+    max_displacement = np.full(n_comp, 1.0)
+    attempts, accepted = np.zeros(n_comp), np.zeros(n_comp)
+    samples, energies = [], []
+    for cycle in range(initialization_cycles + cycles):
+        for _ in range(max(20, n)):
+            c = int(rng.integers(n_comp))
+            if rng.random() < 0.5:
+                # 平移
+                members = np.nonzero(comp[:n] == c)[0]
+                if len(members) == 0:
+                    continue
+                i = int(members[rng.integers(len(members))])
+                attempts[c] += 1
+                new = frac[i] + ((rng.random(3) - 0.5) * 2 * max_displacement[c]) @ inv_box
+                new -= np.floor(new)
+                u_new = framework_energy(new, c)
+                if u_new == math.inf:
+                    continue
+                delta = u_new - u_frame[i] + guest_energy(new, c, i) - guest_energy(frac[i], c, i)
+                if delta <= 0 or rng.random() < math.exp(-delta / temperature):
+                    frac[i], u_frame[i] = new, u_new
+                    energy += delta
+                    accepted[c] += 1
+            elif rng.random() < 0.5:
+                # 插入
+                new = rng.random(3)
+                u_new = framework_energy(new, c)
+                if u_new == math.inf:
+                    continue
+                delta = u_new + guest_energy(new, c)
+                if rng.random() < beta_fv[c] / (counts[c] + 1) * math.exp(min(-delta / temperature, 700.0)):
+                    if n == capacity:
+                        capacity *= 2
+                        frac = np.resize(frac, (capacity, 3))
+                        comp = np.resize(comp, capacity)
+                        u_frame = np.resize(u_frame, capacity)
+                    frac[n], comp[n], u_frame[n] = new, c, u_new
+                    energy += delta
+                    n += 1
+                    counts[c] += 1
+            else:
+                # 删除：与最后一个分子交换位置后移除
+                members = np.nonzero(comp[:n] == c)[0]
+                if len(members) == 0:
+                    continue
+                i = int(members[rng.integers(len(members))])
+                delta = -u_frame[i] - guest_energy(frac[i], c, i)
+                if beta_fv[c] == 0 or \
+                        rng.random() < counts[c] / beta_fv[c] * math.exp(min(-delta / temperature, 700.0)):
+                    n -= 1
+                    frac[i], comp[i], u_frame[i] = frac[n], comp[n], u_frame[n]
+                    energy += delta
+                    counts[c] -= 1
+        # 调整最大位移，使平移的接受率接近50%
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratio = np.where(attempts > 0, accepted / attempts, 0.5)
+        if cycle < initialization_cycles:
+            max_displacement = np.clip(max_displacement * np.where(ratio > 0.5, 1.05, 0.95), 0.05,
+                                       cell_widths(box).min() / 2)
+            attempts[:], accepted[:] = 0, 0
+        else:
+            samples.append(counts.copy())
+            energies.append(energy)
+
+    n_cells = int(np.prod(cells))
+    counts_samples = np.array(samples, dtype=int).reshape(-1, n_comp)
+    samples = counts_samples / n_cells
+    blocks = np.array([block.mean(axis=0) for block in np.array_split(samples, 5) if len(block) > 0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        acceptance = np.where(attempts > 0, accepted / attempts, np.nan)
+    result = {'loading': samples.mean(axis=0) if len(samples) > 0 else np.zeros(n_comp),
+              'error': blocks.std(axis=0) / math.sqrt(len(blocks)) if len(blocks) > 1 else np.zeros(n_comp),
+              'acceptance': acceptance}
+    if record_samples:
+        result.update({'n': counts_samples, 'energy': np.array(energies), 'cells': n_cells})
+    return result
+
+
+def loading_units(structure: CifStructure, molecules_per_cell, molar_mass, masses=None):
+    '''
+        把每个晶胞的分子数换算为RASPA2输出的各个单位，molar_mass为吸附质的摩尔质量(g/mol)
+        masses为力场的{伪原子: 质量}（read_pseudo_atom_masses），框架质量与RASPA2使用同一组质量
+        返回{单位: 数值}，单位见LOADING_UNITS
+    '''
+    descriptors = framework_descriptors(structure, masses)
+    cell_mass = float(descriptors['framework_mass_g/mol'])
+    density = float(descriptors['Framework_density_g/cm^3'])
+    mol_kg = molecules_per_cell / cell_mass * 1000
+    cm3_g = mol_kg * STP_MOLAR_VOLUME / 1000
+    return {'mol/uc': molecules_per_cell, 'cm^3/g': cm3_g, 'mol/kg': mol_kg, 'mg/g': mol_kg * molar_mass,
+            'cm^3/cm^3': cm3_g * density}
+
+
+def excess_molecules(structure: CifStructure, molecules_per_cell, molar_density, helium_void_fraction):
+    '''
+        过剩吸附量（每个晶胞的分子数）：绝对吸附量减去孔体积（He孔隙率乘以晶胞体积）中体相气体的分子数
+        molar_density为该组分在体相中的摩尔密度(mol/m^3)
+    '''
+    return molecules_per_cell - molar_density * AVOGADRO * 1e-30 * helium_void_fraction * float(structure.volume())
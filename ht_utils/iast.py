@@ -0,0 +1,205 @@
+import numpy as np
+
+from ht_utils.isotherm_fit import MODEL_PARAMETERS, evaluate_by_model, isotherm_loading
+
+# Toth模型约化铺展压的数值积分：在ln s上分三段做Gauss-Legendre求积，分段点取在被积函数变化最快的s = 1附近，
+# 积分下限ln x - 36以下的部分小于x e^-36
+_TOTH_NODES, _TOTH_WEIGHTS = np.polynomial.legendre.leggauss(16)
+
+
+def _toth_integral(x, t):
+    # ∫_0^x ds / (1 + s^t)^(1/t)，x与t形状相同
+    log_x = np.log(np.maximum(x, 1e-300))
+    a0 = log_x - 36
+    a2 = np.clip(0.0, a0, log_x)
+    a1 = np.clip(-6.0, a0, a2)
+    total = np.zeros_like(log_x)
+    for a, b in ((a0, a1), (a1, a2), (a2, log_x)):
+        v = (0.5 * (b - a))[..., None] * _TOTH_NODES + (0.5 * (a + b))[..., None]
+        s = np.exp(v)
+        with np.errstate(over='ignore'):
+            integrand = s / (1 + s ** t[..., None]) ** (1 / t[..., None])
+        total += 0.5 * (b - a) * (integrand * _TOTH_WEIGHTS).sum(axis=-1)
+    return np.where(x > 0, total, 0.0)
+
+
+def spreading_pressure(model: str, params, pressure):
+    '''
+        纯组分的约化铺展压 π A / RT = ∫_0^P q(p) / p dp（单位与吸附量相同）
+        params: (状态数, 参数数)；pressure: (状态数,)
+    '''
+    p = np.asarray(params, dtype=np.float64)
+    pressure = np.asarray(pressure, dtype=np.float64)
+    with np.errstate(over='ignore', invalid='ignore'):
+        if model == 'langmuir':
+            return p[:, 0] * np.log1p(p[:, 1] * pressure)
+        if model == 'dual_langmuir':
+            return p[:, 0] * np.log1p(p[:, 1] * pressure) + p[:, 2] * np.log1p(p[:, 3] * pressure)
+        if model == 'sips':
+            return p[:, 0] / p[:, 2] * np.log1p((p[:, 1] * pressure) ** p[:, 2])
+        if model == 'toth':
+            return p[:, 0] * _toth_integral(p[:, 1] * pressure, p[:, 2])
+    raise ValueError("unknown isotherm model: " + model)
+
+
+def _log_pressure_bracket(model, p, pi):
+    # 铺展压为pi时ln P的上下界
+    if model == 'dual_langmuir':
+        q = p[:, 0] + p[:, 2]
+        b_min, b_max = np.minimum(p[:, 1], p[:, 3]), np.maximum(p[:, 1], p[:, 3])
+        y = np.log(np.expm1(np.minimum(pi / q, 700)))
+        return y - np.log(b_max), np.where(pi / q > 700, pi / q, y) - np.log(b_min)
+    # Toth: max(1, s) <= (1 + s^t)^(1/t) <= 2^(1/t) max(1, s)，积分上下界的反函数
+    y = pi / p[:, 0]
+
+    def inverse(y):
+        return np.where(y <= 1, np.log(np.maximum(y, 1e-300)), y - 1)
+
+    return inverse(y) - np.log(p[:, 1]), inverse(y * 2 ** (1 / p[:, 2])) - np.log(p[:, 1])
+
+
+def pure_component_pressure(model: str, params, pi, u0=None, tol=1e-12, max_iter=100):
+    '''
+        约化铺展压为pi时的纯组分压力 P^0，返回ln P^0：
+        Langmuir与Sips用解析解，双位Langmuir与Toth用有上下界保护的Newton迭代（对ln P，u0为可选的初值）
+    '''
+    p = np.asarray(params, dtype=np.float64)
+    pi = np.asarray(pi, dtype=np.float64)
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        if model == 'langmuir':
+            y = pi / p[:, 0]
+            return np.where(y > 700, y, np.log(np.expm1(np.minimum(y, 700)))) - np.log(p[:, 1])
+        if model == 'sips':
+            y = p[:, 2] * pi / p[:, 0]
+            return np.where(y > 700, y, np.log(np.expm1(np.minimum(y, 700)))) / p[:, 2] - np.log(p[:, 1])
+    if model not in MODEL_PARAMETERS:
+        raise ValueError("unknown isotherm model: " + model)
+
+    lo, hi = _log_pressure_bracket(model, p, pi)
+    u = 0.5 * (lo + hi)
+    if u0 is not None:
+        u = np.where((u0 > lo) & (u0 < hi), u0, u)
+    active = np.flatnonzero(np.isfinite(u))
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        pressure = np.exp(u[active])
+        f = spreading_pressure(model, p[active], pressure) - pi[active]
+        lo[active] = np.where(f < 0, u[active], lo[active])
+        hi[active] = np.where(f > 0, u[active], hi[active])
+        q = isotherm_loading(model, p[active], pressure[:, None])[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_u = u[active] - f / q
+        done = (np.abs(new_u - u[active]) < tol * np.maximum(1, np.abs(u[active]))) | \
+            (hi[active] - lo[active] < tol * np.maximum(1, np.abs(u[active])))
+        # Newton步长离开上下界时改用二分
+        new_u = np.where(np.isfinite(new_u) & (new_u >= lo[active]) & (new_u <= hi[active]), new_u,
+                         0.5 * (lo[active] + hi[active]))
+        u[active] = new_u
+        active = active[~done]
+    return u
+
+
+def _loading(model, params, pressure):
+    return isotherm_loading(model, params, pressure[:, None])[:, 0]
+
+
+def iast(isotherms, mole_fractions, pressure, tol=1e-10, max_iter=100):
+    '''
+        理想吸附溶液理论（IAST）：同时求解所有状态点的铺展压方程 sum_i y_i P / P_i^0(π) = 1
+        isotherms: 每个组分一个(模型, 参数)，模型为字符串或(状态数,)的字符串数组，参数为(状态数, 参数数)
+                   （参数数不同的模型可以放在同一个数组中，多余的列被忽略）
+        mole_fractions: 气相组成(状态数, 组分数)，按行归一化；pressure: 总压(状态数,)，单位与等温线相同
+        π的解在各组分纯组分铺展压 π_i(P) 的最小值与最大值之间，在该区间内做有二分保护的Newton迭代
+        返回{'loading': 各组分吸附量(状态数, 组分数), 'adsorbed_fractions': 吸附相组成,
+             'spreading_pressure': 约化铺展压, 'pure_pressures': P_i^0, 'converged': 是否收敛}
+    '''
+    y = np.asarray(mole_fractions, dtype=np.float64)
+    y = y / y.sum(axis=1, keepdims=True)
+    pressure = np.asarray(pressure, dtype=np.float64)
+    n_states, n_components = y.shape
+    params = [np.asarray(p, dtype=np.float64).reshape(n_states, -1) for _, p in isotherms]
+    models = [np.full(n_states, m) if isinstance(m, str) else np.asarray(m, dtype=str) for m, _ in isotherms]
+    present = y > 0
+
+    def pure_log_pressures(pi):
+        return np.stack([evaluate_by_model(models[i], pure_component_pressure, params[i], pi)
+                         for i in range(n_components)], axis=1)
+
+    pure_pi = np.stack([evaluate_by_model(models[i], spreading_pressure, params[i], pressure)
+                        for i in range(n_components)], axis=1)
+    lo = np.min(np.where(present, pure_pi, np.inf), axis=1)
+    hi = np.max(np.where(present, pure_pi, -np.inf), axis=1)
+    pi = np.sqrt(lo * hi)
+    pi = np.where(np.isfinite(pi) & (pi > 0), pi, 0.5 * (lo + hi))
+    converged = ~np.isfinite(pi)
+    # 只有一个组分（或各组分铺展压相同）时区间退化为一点
+    converged |= hi - lo <= tol * np.abs(hi)
+    pi = np.where(hi - lo <= tol * np.abs(hi), hi, pi)
+
+    log_p0 = pure_log_pressures(pi)
+    for _ in range(max_iter):
+        active = np.flatnonzero(~converged)
+        if len(active) == 0:
+            break
+        ratio = np.where(present[active], y[active] * np.exp(np.log(pressure[active, None]) - log_p0[active]), 0.0)
+        f = ratio.sum(axis=1) - 1
+        lo[active] = np.where(f > 0, pi[active], lo[active])
+        hi[active] = np.where(f < 0, pi[active], hi[active])
+        # df/dπ = -sum_i y_i P / P_i^0 / q_i(P_i^0)
+        q0 = np.stack([evaluate_by_model(models[i][active], _loading, params[i][active], np.exp(log_p0[active, i]))
+                       for i in range(n_components)], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            derivative = -np.sum(np.where(present[active], ratio / q0, 0.0), axis=1)
+            new_pi = pi[active] - f / derivative
+        bisect = 0.5 * (lo[active] + hi[active])
+        done = (np.abs(f) < tol) | (np.abs(new_pi - pi[active]) <= tol * np.abs(pi[active])) | \
+            (hi[active] - lo[active] <= tol * np.abs(pi[active]))
+        new_pi = np.where(np.isfinite(new_pi) & (new_pi >= lo[active]) & (new_pi <= hi[active]), new_pi, bisect)
+        new_pi = np.where(np.abs(f) < tol, pi[active], new_pi)
+        pi[active] = new_pi
+        log_p0[active] = np.stack([evaluate_by_model(models[i][active], pure_component_pressure, params[i][active], new_pi,
+                                            log_p0[active, i]) for i in range(n_components)], axis=1)
+        converged[active[done]] = True
+
+    x = np.where(present, y * np.exp(np.log(pressure[:, None]) - log_p0), 0.0)
+    x /= x.sum(axis=1, keepdims=True)
+    q0 = np.stack([evaluate_by_model(models[i], _loading, params[i], np.exp(log_p0[:, i])) for i in range(n_components)],
+                  axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total = 1 / np.sum(np.where(present, x / q0, 0.0), axis=1)
+    return {'loading': x * total[:, None], 'adsorbed_fractions': x, 'spreading_pressure': pi,
+            'pure_pressures': np.exp(log_p0), 'converged': converged & np.isfinite(total)}
+
+
+def predict_mixtures(fits, components, compositions, pressures, temperature=None, model=None, chunk_size=200000):
+    '''
+        对fits（FittedIsotherms）中所有具有全部组分拟合结果的结构，在compositions（(组成数, 组分数)的气相组成）
+        与pressures的所有组合下做IAST；model为None时每条等温线使用其AICc最佳的模型
+        状态点每chunk_size个一起求解，以限制Toth积分等中间数组的内存
+        返回(结构名, 状态点的组成(状态数, 组分数), 状态点的压力, iast()的结果)，
+        状态按结构、组成、压力的顺序排列
+    '''
+    compositions = np.atleast_2d(np.asarray(compositions, dtype=np.float64))
+    pressures = np.atleast_1d(np.asarray(pressures, dtype=np.float64))
+    rows = []
+    for c in components:
+        found = fits.find(component=c, temperature=temperature)
+        rows.append(dict(zip(fits.names[found], found)))
+    names = sorted(set.intersection(*[set(r) for r in rows]))
+    n_repeat = len(compositions) * len(pressures)
+
+    models, params = [], []
+    for i in range(len(components)):
+        m, p = fits.model_parameters([rows[i][n] for n in names], model)
+        models.append(np.repeat(m, n_repeat))
+        params.append(np.repeat(p, n_repeat, axis=0))
+
+    y = np.tile(np.repeat(compositions, len(pressures), axis=0), (len(names), 1))
+    pressure = np.tile(pressures, len(names) * len(compositions))
+    chunks = []
+    for start in range(0, len(pressure), chunk_size):
+        s = slice(start, start + chunk_size)
+        chunks.append(iast([(models[i][s], params[i][s]) for i in range(len(components))], y[s], pressure[s]))
+    result = {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]} if len(chunks) > 0 else {}
+    return names, y, pressure, result
@@ -0,0 +1,108 @@
+import csv
+
+import numpy as np
+
+from ht_utils.isotherm_fit import evaluate_by_model, isotherm_loading, pressure_at_loading
+from ht_utils.widom_grid import GAS_CONSTANT
+
+
+def clausius_clapeyron(temperatures, pressure):
+    '''
+        Clausius-Clapeyron拟合 ln P = -Q_st / (R T) + C，pressure为(..., n_T)的等量压力（同一吸附量下各温度的压力），
+        沿最后一维做最小二乘，nan与不为正的压力被跳过（每行使用的温度可以不同）
+        返回(Q_st(kJ/mol), Q_st的标准误差(kJ/mol), 使用的温度数)，各为(...)的数组；
+        少于2个温度的行Q_st为nan，少于3个温度的行误差为nan
+    '''
+    x = np.broadcast_to(1.0 / np.asarray(temperatures, dtype=np.float64), np.shape(pressure))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.log(np.where(np.asarray(pressure) > 0, pressure, np.nan))
+        valid = np.isfinite(y)
+        n = valid.sum(axis=-1)
+        x_mean = np.where(valid, x, 0.0).sum(axis=-1) / n
+        y_mean = np.where(valid, y, 0.0).sum(axis=-1) / n
+        dx = np.where(valid, x - x_mean[..., None], 0.0)
+        dy = np.where(valid, y - y_mean[..., None], 0.0)
+        sxx = (dx * dx).sum(axis=-1)
+        slope = (dx * dy).sum(axis=-1) / sxx
+        residual = dy - slope[..., None] * dx
+        slope_error = np.sqrt((residual * residual).sum(axis=-1) / (n - 2) / sxx)
+    q_st = np.where(n >= 2, -slope * GAS_CONSTANT / 1000, np.nan)
+    return q_st, np.where(n >= 3, slope_error * GAS_CONSTANT / 1000, np.nan), n
+
+
+def _loading(model, params, pressure):
+    return isotherm_loading(model, params, pressure[:, None])[:, 0]
+
+
+def isosteric_heat(fits, loadings=None, n_loadings=10, model=None):
+    '''
+        由fits（FittedIsotherms）中同一结构、同一组分在不同温度下的拟合等温线计算等量吸附热Q_st(q)：
+        对每个吸附量求各温度拟合等温线的反函数P_T(q)，再对所有(结构, 组分, 吸附量)同时做Clausius-Clapeyron拟合
+        （理想气体近似，用压力代替逸度）
+        loadings为None时每个(结构, 组分)在所有温度都处于模拟压力范围内的吸附量区间上取n_loadings个等距点，
+        否则所有(结构, 组分)使用相同的loadings（与拟合的吸附量单位相同）；model为None时使用每条等温线AICc最佳的模型
+        返回{'names', 'components', 'temperatures': 所有温度(n_T,), 'loadings': (n, n_q), 'q_st': (n, n_q),
+             'q_st_error': (n, n_q), 'n_temperatures': (n, n_q), 'extrapolated': 超出某个温度模拟压力范围的点(n, n_q)}，
+        只有一个温度的(结构, 组分)不在结果中
+    '''
+    finite = np.isfinite(fits.temperatures)
+    temperatures = np.unique(np.round(fits.temperatures[finite], 2))
+    groups = {}
+    for i in np.flatnonzero(finite):
+        j = int(np.argmin(np.abs(temperatures - fits.temperatures[i])))
+        groups.setdefault((fits.names[i], fits.components[i]), {})[j] = i
+    keys = sorted(k for k, v in groups.items() if len(v) >= 2)
+    # (组数, 温度数)的行号，缺少的温度为-1
+    rows = np.full((len(keys), len(temperatures)), -1, dtype=np.int64)
+    for g, k in enumerate(keys):
+        for j, i in groups[k].items():
+            rows[g, j] = i
+    present = rows >= 0
+    flat = rows[present]
+    models, params = fits.model_parameters(flat, model)
+
+    # 各温度在模拟压力范围两端的吸附量，所有温度共同的吸附量区间为[max q(p_min), min q(p_max)]
+    q_range = np.full((2,) + rows.shape, np.nan)
+    q_range[0][present] = evaluate_by_model(models, _loading, params, fits.p_min[flat])
+    q_range[1][present] = evaluate_by_model(models, _loading, params, fits.p_max[flat])
+    with np.errstate(invalid='ignore'):
+        q_low = np.nanmax(np.where(present, q_range[0], np.nan), axis=1)
+        q_high = np.nanmin(np.where(present, q_range[1], np.nan), axis=1)
+    if loadings is None:
+        fraction = np.linspace(0, 1, n_loadings)
+        q = q_low[:, None] + (q_high - q_low)[:, None] * fraction
+        q = np.where((q_high > q_low)[:, None], q, np.nan)
+        extrapolated = ~np.isfinite(q)
+    else:
+        q = np.tile(np.asarray(loadings, dtype=np.float64), (len(keys), 1))
+        extrapolated = ~((q >= q_low[:, None]) & (q <= q_high[:, None]))
+
+    # 等量压力(组数, 吸附量数, 温度数)
+    n_q = q.shape[1]
+    pressure = np.full((len(keys), n_q, len(temperatures)), np.nan)
+    g_index, j_index = np.nonzero(present)
+    values = evaluate_by_model(np.repeat(models, n_q), pressure_at_loading, np.repeat(params, n_q, axis=0),
+                               q[g_index].reshape(-1))
+    pressure[np.repeat(g_index, n_q), np.tile(np.arange(n_q), len(g_index)), np.repeat(j_index, n_q)] = values
+    q_st, q_st_error, n_temperatures = clausius_clapeyron(temperatures, pressure)
+    return {'names': np.array([k[0] for k in keys], dtype=object),
+            'components': np.array([k[1] for k in keys], dtype=object), 'temperatures': temperatures,
+            'loadings': q, 'q_st': q_st, 'q_st_error': q_st_error, 'n_temperatures': n_temperatures,
+            'extrapolated': extrapolated}
+
+
+def write_isosteric_heat(output_file, result, loading_unit='mol/kg'):
+    '''
+        写入isosteric_heat()的结果：每个(结构, 组分, 吸附量)一行，Q_st为nan的点（如吸附量超过饱和吸附量）被跳过
+    '''
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'component', 'loading_' + loading_unit, 'Q_st_kJ/mol', 'Q_st_error_kJ/mol',
+                         'n_temperatures', 'extrapolated'])
+        for g in range(len(result['names'])):
+            for k in np.flatnonzero(np.isfinite(result['q_st'][g])):
+                error = result['q_st_error'][g, k]
+                writer.writerow([result['names'][g], result['components'][g],
+                                 "{:.6e}".format(result['loadings'][g, k]), "{:.4f}".format(result['q_st'][g, k]),
+                                 "{:.4f}".format(error) if np.isfinite(error) else '',
+                                 result['n_temperatures'][g, k], result['extrapolated'][g, k]])
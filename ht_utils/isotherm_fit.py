@@ -0,0 +1,503 @@
+import csv
+import os
+import re
+import warnings
+
+import numpy as np
+
+# 各模型的参数名（压力与吸附量的单位与结果文件一致），拟合时所有参数都在对数空间中优化以保证为正
+MODEL_PARAMETERS = {
+    'langmuir': ('q_sat', 'b'),
+    'dual_langmuir': ('q_sat1', 'b1', 'q_sat2', 'b2'),
+    'toth': ('q_sat', 'b', 't'),
+    'sips': ('q_sat', 'b', 'n'),
+}
+
+# 对数参数的取值范围，避免发散的拟合在exp中溢出
+_LOG_BOUND = 60.0
+
+
+def isotherm_loading(model: str, params, pressure):
+    '''
+        模型的吸附量：params为(..., 参数数)，pressure可与params[..., :1]广播，
+        如params为(结构数, 参数数)、pressure为(压力数,)或(结构数, 压力数)时返回(结构数, 压力数)
+    '''
+    p = np.asarray(params, dtype=np.float64)
+    pressure = np.asarray(pressure, dtype=np.float64)
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        if model == 'langmuir':
+            x = p[..., 1, None] * pressure
+            return p[..., 0, None] * x / (1 + x)
+        if model == 'dual_langmuir':
+            x1 = p[..., 1, None] * pressure
+            x2 = p[..., 3, None] * pressure
+            return p[..., 0, None] * x1 / (1 + x1) + p[..., 2, None] * x2 / (1 + x2)
+        if model == 'toth':
+            x = p[..., 1, None] * pressure
+            t = p[..., 2, None]
+            return p[..., 0, None] * x / (1 + x ** t) ** (1 / t)
+        if model == 'sips':
+            xn = (p[..., 1, None] * pressure) ** p[..., 2, None]
+            return p[..., 0, None] * xn / (1 + xn)
+    raise ValueError("unknown isotherm model: " + model)
+
+
+def pressure_at_loading(model: str, params, loading, tol=1e-12, max_iter=100):
+    '''
+        等温线的反函数：吸附量为loading时的压力；params: (n, 参数数)，loading: (n,)
+        Langmuir、Toth与Sips用解析解，双位Langmuir在ln P上做有上下界保护的Newton迭代
+        loading为负或不小于饱和吸附量时为nan
+    '''
+    p = np.asarray(params, dtype=np.float64)
+    q = np.asarray(loading, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if model == 'dual_langmuir':
+            theta = q / (p[:, 0] + p[:, 2])
+        else:
+            theta = q / p[:, 0]
+        valid = (theta >= 0) & (theta < 1)
+        if model == 'langmuir':
+            pressure = theta / (1 - theta) / p[:, 1]
+        elif model == 'sips':
+            pressure = (theta / (1 - theta)) ** (1 / p[:, 2]) / p[:, 1]
+        elif model == 'toth':
+            pressure = theta / (1 - theta ** p[:, 2]) ** (1 / p[:, 2]) / p[:, 1]
+        elif model == 'dual_langmuir':
+            # 总饱和量相同的单位Langmuir等温线给出上下界：b取两个位点中较大/较小的值
+            x = theta / (1 - theta)
+            lo = np.log(x / np.maximum(p[:, 1], p[:, 3]))
+            hi = np.log(x / np.minimum(p[:, 1], p[:, 3]))
+            u = 0.5 * (lo + hi)
+            active = np.flatnonzero(valid & (theta > 0))
+            for _ in range(max_iter):
+                if len(active) == 0:
+                    break
+                pa = p[active]
+                pressure = np.exp(u[active])
+                x1, x2 = pa[:, 1] * pressure, pa[:, 3] * pressure
+                f = pa[:, 0] * x1 / (1 + x1) + pa[:, 2] * x2 / (1 + x2) - q[active]
+                derivative = pa[:, 0] * x1 / (1 + x1) ** 2 + pa[:, 2] * x2 / (1 + x2) ** 2
+                lo[active] = np.where(f < 0, u[active], lo[active])
+                hi[active] = np.where(f > 0, u[active], hi[active])
+                new_u = u[active] - f / derivative
+                done = (np.abs(new_u - u[active]) < tol * np.maximum(1, np.abs(u[active]))) | \
+                    (hi[active] - lo[active] < tol * np.maximum(1, np.abs(u[active])))
+                new_u = np.where(np.isfinite(new_u) & (new_u >= lo[active]) & (new_u <= hi[active]), new_u,
+                                 0.5 * (lo[active] + hi[active]))
+                u[active] = new_u
+                active = active[~done]
+            pressure = np.where(theta > 0, np.exp(u), 0.0)
+        else:
+            raise ValueError("unknown isotherm model: " + model)
+    return np.where(valid, pressure, np.nan)
+
+
+def evaluate_by_model(models, func, params, *arrays):
+    '''
+        models为(n,)的模型名数组（每行可以是不同的模型），按模型分组调用func(模型, 参数, *arrays)，
+        params为(n, 最大参数数)，每个模型只取前面的参数列；未知模型（如没有拟合结果的''）的行为nan
+    '''
+    models = np.asarray(models)
+    if len(models) > 0 and models[0] in MODEL_PARAMETERS and np.all(models == models[0]):
+        return func(models[0], params[:, :len(MODEL_PARAMETERS[models[0]])], *arrays)
+    out = np.full(len(models), np.nan)
+    for m in np.unique(models):
+        if m not in MODEL_PARAMETERS:
+            continue
+        rows = np.flatnonzero(models == m)
+        out[rows] = func(m, params[rows, :len(MODEL_PARAMETERS[m])], *[a[rows] for a in arrays])
+    return out
+
+
+def _initial_langmuir(pressure, loading, valid):
+    # 饱和吸附量取最大吸附量的1.5倍，b取各点由Langmuir方程反解得到的值的中位数
+    q_max = np.nanmax(np.where(valid, loading, np.nan), axis=1)
+    q_sat = 1.5 * np.where(q_max > 0, q_max, 1.0)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        # 没有正吸附量的结构得到All-NaN的中位数，下面改用压力中位数的倒数
+        warnings.simplefilter('ignore', RuntimeWarning)
+        b = loading / ((q_sat[:, None] - loading) * pressure)
+        b = np.nanmedian(np.where(valid & (loading > 0) & (pressure > 0), b, np.nan), axis=1)
+        p_median = np.nanmedian(np.where(valid & (pressure > 0), pressure, np.nan), axis=1)
+    b = np.where(np.isfinite(b) & (b > 0), b, 1 / p_median)
+    return np.stack([q_sat, b], axis=1)
+
+
+def levenberg_marquardt(model: str, params0, pressure, loading, weights, max_iter=200, tol=1e-10):
+    '''
+        对所有结构同时做Levenberg-Marquardt最小二乘拟合（每个结构有自己的阻尼系数），
+        参数在对数空间中优化，Jacobian由前向差分得到；weights为0的点不参与拟合
+        params0: (结构数, 参数数)；pressure, loading, weights: (结构数, 压力数)
+        返回(参数, 是否收敛, 迭代次数)
+    '''
+    theta = np.clip(np.log(np.asarray(params0, dtype=np.float64)), -_LOG_BOUND, _LOG_BOUND)
+    n_rows, n_params = theta.shape
+    loading = np.where(weights > 0, loading, 0.0)
+    converged = np.zeros(n_rows, dtype=bool)
+    iterations = np.zeros(n_rows, dtype=np.int64)
+    damping = np.full(n_rows, 1e-3)
+
+    def residuals(theta, rows):
+        r = (isotherm_loading(model, np.exp(theta), pressure[rows]) - loading[rows]) * weights[rows]
+        return np.where(weights[rows] > 0, r, 0.0)
+
+    active = np.arange(n_rows)
+    r = residuals(theta, active)
+    cost = np.einsum('ij,ij->i', r, r)
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        th = theta[active]
+        r0 = r[active]
+        h = 1e-6
+        jacobian = np.empty(r0.shape + (n_params,))
+        for k in range(n_params):
+            shifted = th.copy()
+            shifted[:, k] += h
+            jacobian[:, :, k] = (residuals(shifted, active) - r0) / h
+        jacobian = np.where(np.isfinite(jacobian), jacobian, 0.0)
+        jtj = np.einsum('ink,inl->ikl', jacobian, jacobian)
+        gradient = np.einsum('ink,in->ik', jacobian, r0)
+        diagonal = np.diagonal(jtj, axis1=1, axis2=2)
+        diagonal = np.maximum(diagonal, 1e-12 * diagonal.max(axis=1, keepdims=True) + 1e-300)
+        lhs = jtj + damping[active, None, None] * diagonal[:, :, None] * np.eye(n_params)
+        step = -np.linalg.solve(lhs, gradient[:, :, None])[:, :, 0]
+        new_theta = np.clip(th + step, -_LOG_BOUND, _LOG_BOUND)
+        new_r = residuals(new_theta, active)
+        new_cost = np.einsum('ij,ij->i', new_r, new_r)
+        new_cost = np.where(np.isfinite(new_cost), new_cost, np.inf)
+        old_cost = cost[active]
+        accepted = new_cost < old_cost
+
+        iterations[active] += 1
+        rows = active[accepted]
+        theta[rows] = new_theta[accepted]
+        r[rows] = new_r[accepted]
+        cost[rows] = new_cost[accepted]
+        damping[rows] = np.maximum(damping[rows] / 3, 1e-12)
+        damping[active[~accepted]] *= 4
+
+        # 收敛：接受的步长使残差平方和的相对变化或参数变化足够小，或阻尼过大（已在极小值处）
+        small = accepted & ((old_cost - new_cost <= tol * old_cost) | (np.abs(step).max(axis=1) < 1e-9))
+        stalled = ~accepted & (damping[active] > 1e10)
+        done = small | stalled | (cost[active] <= 1e-30)
+        converged[active[done]] = True
+        active = active[~done]
+    return np.exp(theta), converged, iterations
+
+
+def fit_isotherms(pressure, loading, models=tuple(MODEL_PARAMETERS), sigma=None, max_iter=200):
+    '''
+        同时拟合多个结构的等温线：pressure与loading为(结构数, 压力数)，不足的位置用nan填充；
+        sigma为吸附量的误差（可选），每个结构只有在所有有效点的误差都为正时才按1/sigma加权
+        先拟合Langmuir模型，其余模型以Langmuir的结果为初值
+        返回{模型: {'params', 'converged', 'iterations', 'n_points', 'rss', 'rmse', 'r2', 'aicc'}}，
+        rss与aicc由拟合时最小化的加权残差计算，rmse与r2为未加权的残差；有效点数少于参数数的结构参数为nan
+    '''
+    pressure = np.asarray(pressure, dtype=np.float64)
+    loading = np.asarray(loading, dtype=np.float64)
+    valid = np.isfinite(pressure) & np.isfinite(loading) & (pressure >= 0)
+    weights = valid.astype(np.float64)
+    if sigma is not None:
+        sigma = np.asarray(sigma, dtype=np.float64)
+        good = np.isfinite(sigma) & (sigma > 0)
+        weighted = np.all(good | ~valid, axis=1)
+        with np.errstate(divide='ignore'):
+            weights = np.where(valid & weighted[:, None], 1 / np.where(good, sigma, 1.0), weights)
+    pressure = np.where(valid, pressure, 0.0)
+    loading = np.where(valid, loading, 0.0)
+    n_points = valid.sum(axis=1)
+
+    def fit(model, params0):
+        params = np.full((len(pressure), len(MODEL_PARAMETERS[model])), np.nan)
+        converged = np.zeros(len(pressure), dtype=bool)
+        iterations = np.zeros(len(pressure), dtype=np.int64)
+        rows = np.flatnonzero(n_points >= params.shape[1])
+        if len(rows) > 0:
+            params[rows], converged[rows], iterations[rows] = levenberg_marquardt(
+                model, params0[rows], pressure[rows], loading[rows], weights[rows], max_iter=max_iter)
+        return params, converged, iterations
+
+    langmuir = fit('langmuir', _initial_langmuir(pressure, loading, valid))
+    q_sat, b = langmuir[0][:, 0], langmuir[0][:, 1]
+    # Langmuir拟合失败（点数不足）的结构使用Langmuir的初值
+    fallback = _initial_langmuir(pressure, loading, valid)
+    q_sat = np.where(np.isfinite(q_sat), q_sat, fallback[:, 0])
+    b = np.where(np.isfinite(b), b, fallback[:, 1])
+    initial = {
+        'dual_langmuir': np.stack([0.7 * q_sat, 5 * b, 0.5 * q_sat, 0.2 * b], axis=1),
+        'toth': np.stack([q_sat, b, np.full_like(b, 0.9)], axis=1),
+        'sips': np.stack([q_sat, b, np.full_like(b, 0.9)], axis=1),
+    }
+
+    mean = np.sum(loading, axis=1) / np.maximum(n_points, 1)
+    ss_total = np.sum(np.where(valid, (loading - mean[:, None]) ** 2, 0.0), axis=1)
+    results = {}
+    for model in models:
+        params, converged, iterations = langmuir if model == 'langmuir' else fit(model, initial[model])
+        k = params.shape[1]
+        fitted = np.isfinite(params).all(axis=1)
+        residual = np.where(valid, loading - isotherm_loading(model, params, pressure), 0.0)
+        # rss为拟合时最小化的加权残差平方和（没有sigma时weights为1），rmse与r2为未加权的残差
+        rss = np.where(fitted, np.sum((weights * residual) ** 2, axis=1), np.nan)
+        unweighted_rss = np.where(fitted, np.sum(residual ** 2, axis=1), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rmse = np.sqrt(unweighted_rss / n_points)
+            r2 = np.where(ss_total > 0, 1 - unweighted_rss / ss_total, np.nan)
+            # 小样本修正的AIC，与拟合使用同一个（加权的）目标函数，用于在模型之间选择；点数不超过参数数+1时为inf
+            aicc = n_points * np.log(np.maximum(rss, 1e-300) / n_points) + 2 * k + \
+                np.where(n_points - k - 1 > 0, 2 * k * (k + 1) / (n_points - k - 1), np.inf)
+        aicc = np.where(np.isfinite(rss), aicc, np.nan)
+        results[model] = {'params': params, 'converged': converged, 'iterations': iterations,
+                          'n_points': n_points, 'rss': rss, 'rmse': rmse, 'r2': r2, 'aicc': aicc}
+    return results
+
+
+def best_models(results: dict):
+    '''
+        每个结构AICc最小的模型（所有AICc都为inf时取RMSE最小的模型），无法拟合的结构为''
+    '''
+    models = list(results)
+    aicc = np.stack([np.where(np.isnan(results[m]['aicc']), np.inf, results[m]['aicc']) for m in models], axis=1)
+    rmse = np.stack([np.where(np.isnan(results[m]['rmse']), np.inf, results[m]['rmse']) for m in models], axis=1)
+    choice = np.where(np.isfinite(aicc).any(axis=1), np.argmin(aicc, axis=1), np.argmin(rmse, axis=1))
+    fitted = np.isfinite(rmse).any(axis=1)
+    return np.where(fitted, np.array(models, dtype=object)[choice], '')
+
+
+class FittedIsotherms():
+    '''
+        整个结构库的拟合等温线，每一行对应一个(结构名, 温度, 组分)，用于查询任意压力下的吸附量
+    '''
+    '''
+    示例：
+        fits = FittedIsotherms.load('isotherm_fits.npz')
+        rows = fits.find(component='CO2')
+        q = fits.loading([1e4, 1e5], rows=rows)     # 每行最佳模型在两个压力下的吸附量
+    '''
+
+    def __init__(self, names, temperatures, components, params: dict, rmse: dict, best, p_min, p_max):
+        self.names = np.asarray(names, dtype=str)
+        self.temperatures = np.asarray(temperatures, dtype=np.float64)
+        self.components = np.asarray(components, dtype=str)
+        self.params = {m: np.asarray(v, dtype=np.float64) for m, v in params.items()}
+        self.rmse = {m: np.asarray(v, dtype=np.float64) for m, v in rmse.items()}
+        self.best = np.asarray(best, dtype=str)
+        self.p_min = np.asarray(p_min, dtype=np.float64)
+        self.p_max = np.asarray(p_max, dtype=np.float64)
+
+    def save(self, path):
+        arrays = {'names': self.names, 'temperatures': self.temperatures, 'components': self.components,
+                  'best': self.best, 'p_min': self.p_min, 'p_max': self.p_max}
+        for m in self.params:
+            arrays['params_' + m] = self.params[m]
+            arrays['rmse_' + m] = self.rmse[m]
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            models = [k[len('params_'):] for k in data.files if k.startswith('params_')]
+            return cls(data['names'], data['temperatures'], data['components'],
+                       {m: data['params_' + m] for m in models}, {m: data['rmse_' + m] for m in models},
+                       data['best'], data['p_min'], data['p_max'])
+
+    def __len__(self):
+        return len(self.names)
+
+    def find(self, name=None, component=None, temperature=None):
+        '''
+            返回满足条件的行号，温度相差0.01 K以内视为相同
+        '''
+        mask = np.ones(len(self), dtype=bool)
+        if name is not None:
+            mask &= self.names == name
+        if component is not None:
+            mask &= self.components == component
+        if temperature is not None:
+            mask &= np.abs(self.temperatures - float(temperature)) < 0.01
+        return np.flatnonzero(mask)
+
+    def loading(self, pressure, rows=None, model=None):
+        '''
+            rows（默认所有行）在pressure下的吸附量，返回(行数, 压力数)
+            model为None时每行使用AICc最佳的模型；没有拟合结果的行为nan
+            超出拟合压力范围[p_min, p_max]的值是外推值，可用in_range()检查
+        '''
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        pressure = np.atleast_1d(np.asarray(pressure, dtype=np.float64))
+        if model is not None:
+            return isotherm_loading(model, self.params[model][rows], pressure)
+        q = np.full((len(rows), len(pressure)), np.nan)
+        for m in self.params:
+            selected = np.flatnonzero(self.best[rows] == m)
+            if len(selected) > 0:
+                q[selected] = isotherm_loading(m, self.params[m][rows[selected]], pressure)
+        return q
+
+    def model_parameters(self, rows, model=None):
+        '''
+            rows的模型名(n,)与参数(n, 最大参数数)（不足的列为nan），model为None时每行使用AICc最佳的模型，
+            可直接用于evaluate_by_model()
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        models = np.full(len(rows), model) if model is not None else self.best[rows]
+        params = np.full((len(rows), max(len(v) for v in MODEL_PARAMETERS.values())), np.nan)
+        for m in np.unique(models):
+            if m not in self.params:
+                continue
+            selected = np.flatnonzero(models == m)
+            params[selected, :len(MODEL_PARAMETERS[m])] = self.params[m][rows[selected]]
+        return models.astype(str), params
+
+    def in_range(self, pressure, rows=None):
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        pressure = np.atleast_1d(np.asarray(pressure, dtype=np.float64))
+        return (pressure >= self.p_min[rows, None]) & (pressure <= self.p_max[rows, None])
+
+
+def _isotherm_file_base(file_name):
+    # <名字>_result.csv（RASPA2）或<名字>.csv（gRASPA）的<名字>，误差文件与其它文件返回None
+    if not file_name.endswith('.csv') or file_name.endswith('_errors.csv'):
+        return None
+    if file_name.endswith('_result.csv'):
+        return file_name[:-len('_result.csv')]
+    return file_name[:-len('.csv')]
+
+
+def _loading_columns(headers, loading_unit, loading_type):
+    # RASPA2的<组分>_<absolute|excess>_<单位>列，没有时使用gRASPA的<组分>_loading_<单位>列
+    columns = {}
+    for suffix in ('_' + loading_type + '_' + loading_unit, '_loading_' + loading_unit):
+        for i, h in enumerate(headers):
+            if h.endswith(suffix) and len(h) > len(suffix):
+                columns[h[:-len(suffix)]] = i
+        if len(columns) > 0:
+            break
+    return columns
+
+
+def _read_table(path, loading_unit, loading_type):
+    # 返回(组分, 压力数组, {组分: 吸附量数组})，Error行与未完成的行被跳过
+    with open(path, 'r', newline='') as f:
+        rows = list(csv.reader(f))
+    if len(rows) == 0 or 'pressure' not in rows[0]:
+        return None
+    headers = [h.strip() for h in rows[0]]
+    columns = _loading_columns(headers, loading_unit, loading_type)
+    if len(columns) == 0:
+        return None
+    i_pressure = headers.index('pressure')
+    i_finished = headers.index('finished') if 'finished' in headers else None
+    pressures = []
+    loadings = {c: [] for c in columns}
+    for row in rows[1:]:
+        if i_finished is not None and (len(row) <= i_finished or row[i_finished].strip() != 'True'):
+            continue
+        try:
+            values = {c: float(row[i]) for c, i in columns.items()}
+            p = float(row[i_pressure])
+        except (ValueError, IndexError):
+            continue
+        pressures.append(p)
+        for c in columns:
+            loadings[c].append(values[c])
+    return list(columns), np.array(pressures), {c: np.array(v) for c, v in loadings.items()}
+
+
+def split_isotherm_names(file_names, cif_names=None):
+    '''
+        解析一个结果目录中等温线文件名对应的(结构名, 温度)：重加权模式的附近温度与多温度的结果文件为
+        <cif名>_<温度>K_result.csv / <cif名>_<温度>K.csv，而cif名本身也可能以_<数字>K结尾（如X_77K）
+        给出cif_names（结构名的集合）时按结构名精确匹配；否则只有同目录中还有同一结构的无温度文件或其它温度的文件时
+        才把_<温度>K视为温度（单独一个以_<数字>K结尾的文件按结构名处理）
+        返回{文件名: (结构名, 温度（没有时为nan）)}，误差文件与其它文件不在其中
+    '''
+    bases = {}
+    for file_name in file_names:
+        base = _isotherm_file_base(os.path.basename(file_name))
+        if base is not None:
+            bases[file_name] = base
+    matches = {f: re.match(r'^(.+)_([0-9]+(?:\.[0-9]+)?)K$', base) for f, base in bases.items()}
+    if cif_names is not None:
+        cif_names = set(cif_names)
+    else:
+        plain = set(bases.values())
+        n_suffixed = {}
+        for m in matches.values():
+            if m is not None:
+                n_suffixed[m.group(1)] = n_suffixed.get(m.group(1), 0) + 1
+
+    result = {}
+    for file_name, base in bases.items():
+        m = matches[file_name]
+        if m is not None:
+            prefix = m.group(1)
+            if cif_names is not None:
+                is_temperature = base not in cif_names and prefix in cif_names
+            else:
+                is_temperature = prefix in plain or n_suffixed[prefix] > 1
+            if is_temperature:
+                result[file_name] = (prefix, float(m.group(2)))
+                continue
+        result[file_name] = (base, np.nan)
+    return result
+
+
+def read_isotherm_file(path, loading_unit='mol/kg', loading_type='absolute', name=None, temperature=np.nan):
+    '''
+        读取等温线驱动脚本写出的单个结构的结果文件：RASPA2的<cif名>_result.csv或gRASPA的<cif名>.csv
+        （重加权模式的附近温度为<cif名>_<温度>K_result.csv / <cif名>_<温度>K.csv）
+        同目录下存在误差文件<名字>_errors.csv时一并读取相同压力的误差
+        name/temperature为该文件的结构名与温度（由split_isotherm_names()按整个目录解析），
+        name为None时读取同目录的文件列表自行解析
+        返回[{'name', 'temperature', 'component', 'pressure', 'loading', 'sigma'}]，
+        temperature为文件名中的温度（没有时为nan），sigma没有误差文件时为None；不是等温线文件时返回[]
+    '''
+    base = _isotherm_file_base(os.path.basename(path))
+    if base is None:
+        return []
+    table = _read_table(path, loading_unit, loading_type)
+    if table is None:
+        return []
+    components, pressure, loadings = table
+    if name is None:
+        directory = os.path.dirname(path)
+        name, temperature = split_isotherm_names(os.listdir(directory if len(directory) > 0 else '.')).get(
+            os.path.basename(path), (base, np.nan))
+
+    errors = None
+    error_path = os.path.join(os.path.dirname(path), base + '_errors.csv')
+    if os.path.isfile(error_path):
+        error_table = _read_table(error_path, loading_unit, loading_type)
+        if error_table is not None:
+            errors = error_table
+    records = []
+    for c in components:
+        sigma = None
+        if errors is not None and c in errors[2]:
+            # 按压力匹配误差，找不到的点误差为nan（该结构不加权）
+            lookup = dict(zip(errors[1], errors[2][c]))
+            sigma = np.array([lookup.get(p, np.nan) for p in pressure])
+        records.append({'name': name, 'temperature': temperature, 'component': c, 'pressure': pressure,
+                        'loading': loadings[c], 'sigma': sigma})
+    return records
+
+
+def stack_isotherms(records):
+    '''
+        把read_isotherm_file()的记录按压力排序后堆叠为(记录数, 最大压力数)的数组，不足的位置为nan
+        返回(pressure, loading, sigma)
+    '''
+    width = max([len(r['pressure']) for r in records] + [1])
+    pressure = np.full((len(records), width), np.nan)
+    loading = np.full((len(records), width), np.nan)
+    sigma = np.full((len(records), width), np.nan)
+    for i, r in enumerate(records):
+        order = np.argsort(r['pressure'], kind='stable')
+        n = len(order)
+        pressure[i, :n] = r['pressure'][order]
+        loading[i, :n] = r['loading'][order]
+        if r['sigma'] is not None:
+            sigma[i, :n] = r['sigma'][order]
+    return pressure, loading, sigma
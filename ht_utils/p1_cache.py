@@ -0,0 +1,57 @@
+import os
+
+from ht_utils.cif_catalog import file_sha1
+
+P1_CACHE_DIR_NAME = "p1_cache"
+# EQeq电荷引擎写入的带电荷的P1结构
+EQEQ_CACHE_DIR_NAME = "eqeq_cache"
+
+# 进程内缓存的原始cif文件的SHA1：{路径: ((大小, 修改时间), sha1)}
+_source_sha1 = {}
+
+
+def default_p1_cache_dir(cif_dir):
+    return os.path.join(cif_dir, P1_CACHE_DIR_NAME)
+
+
+def default_eqeq_cache_dir(cif_dir):
+    return os.path.join(cif_dir, EQEQ_CACHE_DIR_NAME)
+
+
+def p1_cache_path(cache_dir, sha1):
+    '''
+        缓存中P1结构的路径，以原始cif文件内容的SHA1为键
+    '''
+    return os.path.join(cache_dir, sha1[:2], sha1 + ".cif")
+
+
+def source_sha1(cif_location):
+    '''
+        原始cif文件内容的SHA1：文件的大小与修改时间都没有改变时直接使用本进程上次计算的值（与cif_catalog的判断相同），
+        否则重新计算（驱动脚本对同一个结构的每个压力、温度都会查找缓存）
+    '''
+    stat = os.stat(cif_location)
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = _source_sha1.get(cif_location)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    sha1 = file_sha1(cif_location)
+    _source_sha1[cif_location] = (key, sha1)
+    return sha1
+
+
+def find_p1_cif(cif_dir, cif_file):
+    '''
+        返回任务中应使用的cif文件：优先使用eqeq_cache中带电荷的P1文件，其次是p1_cache中的P1文件，
+        都没有（或原始文件内容已改变）时返回原始cif文件的路径
+    '''
+    cif_location = os.path.join(cif_dir, cif_file)
+    cache_dirs = [d for d in (default_eqeq_cache_dir(cif_dir), default_p1_cache_dir(cif_dir)) if os.path.isdir(d)]
+    if len(cache_dirs) == 0:
+        return cif_location
+    sha1 = source_sha1(cif_location)
+    for cache_dir in cache_dirs:
+        cached_location = p1_cache_path(cache_dir, sha1)
+        if os.path.isfile(cached_location):
+            return cached_location
+    return cif_location
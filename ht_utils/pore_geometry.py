@@ -0,0 +1,259 @@
+import math
+
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure
+from ht_utils.energy_grid import cell_widths, grid_blocks, _periodic_images
+from ht_utils.framework_descriptors import framework_descriptors
+from ht_utils.surface_area import AVOGADRO, accessible_surface_area
+
+# CCDC范德华半径(埃)，表中没有的元素与CCDC一样取2.0
+ATOMIC_RADII = {
+    'H': 1.09, 'He': 1.40, 'Li': 1.82, 'C': 1.70, 'N': 1.55, 'O': 1.52, 'F': 1.47, 'Ne': 1.54, 'Na': 2.27,
+    'Mg': 1.73, 'Si': 2.10, 'P': 1.80, 'S': 1.80, 'Cl': 1.75, 'Ar': 1.88, 'K': 2.75, 'Ni': 1.63, 'Cu': 1.40,
+    'Zn': 1.39, 'Ga': 1.87, 'As': 1.85, 'Se': 1.90, 'Br': 1.85, 'Kr': 2.02, 'Pd': 1.63, 'Ag': 1.72, 'Cd': 1.58,
+    'In': 1.93, 'Sn': 2.17, 'Te': 2.06, 'I': 1.98, 'Xe': 2.16, 'Pt': 1.72, 'Au': 1.66, 'Hg': 1.55, 'Tl': 1.96,
+    'Pb': 2.02, 'U': 1.86,
+}
+DEFAULT_RADIUS = 2.0
+
+
+def get_atomic_radii(symbols):
+    return np.array([ATOMIC_RADII.get(symbol, DEFAULT_RADIUS) for symbol in symbols])
+
+
+def _surface_distances(points, atoms, radii, max_elements=2 ** 24):
+    # 每个点到所有原子球面的最小距离（点在原子内部时为负）
+    result = np.empty(len(points))
+    atoms_sq = (atoms * atoms).sum(axis=1)
+    step = max(1, max_elements // max(1, len(atoms)))
+    for start in range(0, len(points), step):
+        p = points[start:start + step]
+        r2 = np.maximum((p * p).sum(axis=1)[:, None] + atoms_sq[None, :] - 2 * p @ atoms.T, 0.0)
+        result[start:start + step] = (np.sqrt(r2) - radii[None, :]).min(axis=1)
+    return result
+
+
+def distance_grid(structure: CifStructure, radii, spacing=0.3, cutoff=8.0):
+    '''
+        计算晶胞内均匀网格点（分数坐标(i + 0.5) / n）到最近原子球面的距离（周期性边界条件），返回(n_a, n_b, n_c)数组
+        先用元胞列表在cutoff内查找，离所有原子都较远的网格点再加倍cutoff重新计算
+    '''
+    radii = np.asarray(radii, dtype=np.float64)
+    lattice = structure.lattice()
+    widths = cell_widths(lattice)
+    shape = np.maximum(1, np.ceil(widths / spacing)).astype(int)
+    axes = [(np.arange(n) + 0.5) / n for n in shape]
+    frac = structure.frac - np.floor(structure.frac)
+
+    images, index = _periodic_images(frac, widths, cutoff)
+    atoms = images @ lattice
+    grid = np.full(tuple(shape), np.inf)
+    for idx, points, selected in grid_blocks(lattice, axes, images, cutoff):
+        values = _surface_distances(points, atoms[selected], radii[index][selected])
+        grid[np.ix_(*idx)] = values.reshape([len(i) for i in idx])
+
+    # 只有最近的球面距离加最大半径不超过cutoff时，cutoff之外的原子才不可能更近
+    unresolved = np.argwhere(grid + radii.max() > cutoff)
+    while len(unresolved) > 0:
+        cutoff *= 2
+        images, index = _periodic_images(frac, widths, cutoff)
+        points = np.stack([axes[i][unresolved[:, i]] for i in range(3)], axis=1) @ lattice
+        values = _surface_distances(points, images @ lattice, radii[index])
+        grid[tuple(unresolved.T)] = values
+        unresolved = unresolved[values + radii.max() > cutoff]
+    return grid
+
+
+def largest_included_sphere(structure: CifStructure, radii, grid, spacing=0.3):
+    '''
+        最大内切球直径(LCD)：从距离网格的最大值出发，在周围逐步缩小的局部网格上细化球心位置
+    '''
+    radii = np.asarray(radii, dtype=np.float64)
+    lattice = structure.lattice()
+    shape = np.array(grid.shape)
+    center = ((np.array(np.unravel_index(np.argmax(grid), grid.shape)) + 0.5) / shape) @ lattice
+    best = grid.max()
+    frac = structure.frac - np.floor(structure.frac)
+    images, index = _periodic_images(frac, cell_widths(lattice), best + radii.max() + 2 * spacing)
+    atoms = images @ lattice
+    # 球心仍在晶胞附近，镜像的范围足以覆盖最近的原子
+    offsets = np.stack(np.meshgrid(*[np.linspace(-1, 1, 9)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+    step = spacing
+    for _ in range(4):
+        candidates = center + offsets * step
+        values = _surface_distances(candidates, atoms, radii[index])
+        if values.max() > best:
+            best = values.max()
+            center = candidates[np.argmax(values)]
+        step /= 4
+    return 2 * float(best)
+
+
+# 晶胞平移(i, j, k)压缩为一个整数 i * 2^42 + j * 2^21 + k（线性映射，加减法不变），各分量的绝对值小于2^20时一一对应
+SHIFT_PACK = (1 << 42, 1 << 21, 1)
+
+
+def _find(parent, off, x):
+    # x的根节点与x相对根节点的晶胞平移，同时把x直接挂到根节点上
+    root = parent[x]
+    shift = off[x]
+    moving = np.arange(len(x))
+    while len(moving) > 0:
+        up = parent[root[moving]]
+        moving = moving[up != root[moving]]
+        shift[moving] += off[root[moving]]
+        root[moving] = parent[root[moving]]
+    parent[x] = root
+    off[x] = shift
+    return root, shift
+
+
+def _link(parent, off, a, b, w):
+    # 把边(a, b, w)并入并查集（b在a所在晶胞平移w后的晶胞中），出现绕过晶胞的环时返回True
+    while len(a) > 0:
+        ra, oa = _find(parent, off, a)
+        rb, ob = _find(parent, off, b)
+        # rb所在的晶胞 - ra所在的晶胞
+        d = oa + w - ob
+        same = ra == rb
+        if d[same].any():
+            return True
+        a, b, w, ra, rb, d = a[~same], b[~same], w[~same], ra[~same], rb[~same], d[~same]
+        if len(a) == 0:
+            break
+        # 每个根只取一条边，把较大的根挂到较小的根上，其余的边在下一轮处理
+        high, low = np.maximum(ra, rb), np.minimum(ra, rb)
+        d = np.where(high == rb, d, -d)
+        order = np.lexsort((low, high))
+        first = order[np.r_[True, high[order][1:] != high[order][:-1]]]
+        parent[high[first]] = low[first]
+        off[high[first]] = d[first]
+    return False
+
+
+def percolation_radius(grid, chunk=4096):
+    '''
+        最大自由球半径(PLD / 2)：按距离从大到小把网格点加入并查集（周期性边界，记录每个点相对根节点的晶胞平移），
+        第一次出现绕过晶胞的环时，当前距离即为能穿过整个结构的最大球半径；不能贯通时返回0
+        网格点按距离分块加入（块大小逐次加倍），每块的边向量化地合并；出现环的块再二分查找第一条成环的边
+    '''
+    shape = np.array(grid.shape)
+    flat = grid.ravel()
+    positive = np.flatnonzero(flat > 0)
+    order = positive[np.argsort(-flat[positive], kind='stable')]
+    n = len(order)
+    # 按距离从大到小的序号，不在孔内的点为n（不会被加入）
+    rank = np.full(flat.size, n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    parent = np.arange(n)
+    off = np.zeros(n, dtype=np.int64)
+    start = 0
+    while start < n:
+        end = min(start + chunk, n)
+        # 本块的点与已加入的相邻点之间的边，按加入的顺序（较大的序号）排列
+        coords = np.stack(np.unravel_index(order[start:end], shape), axis=1)
+        own = np.arange(start, end)
+        a, b, w = [], [], []
+        for axis in range(3):
+            for delta in (1, -1):
+                c = coords.copy()
+                c[:, axis] += delta
+                shift = np.where((c[:, axis] < 0) | (c[:, axis] >= shape[axis]), delta * SHIFT_PACK[axis], 0)
+                c[:, axis] %= shape[axis]
+                neighbor = rank[np.ravel_multi_index(c.T, shape)]
+                keep = neighbor <= own
+                a.append(own[keep])
+                b.append(neighbor[keep])
+                w.append(shift[keep])
+        a, b, w = np.concatenate(a), np.concatenate(b), np.concatenate(w)
+        edge_order = np.argsort(a, kind='stable')
+        a, b, w = a[edge_order], b[edge_order], w[edge_order]
+
+        # 本块只会修改序号小于end的点
+        saved = parent[:end].copy(), off[:end].copy()
+        if _link(parent, off, a, b, w):
+            parent[:end], off[:end] = saved
+            lo, hi = 0, len(a) - 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                saved = parent[:end].copy(), off[:end].copy()
+                if _link(parent, off, a[lo:mid + 1], b[lo:mid + 1], w[lo:mid + 1]):
+                    parent[:end], off[:end] = saved
+                    hi = mid
+                else:
+                    lo = mid + 1
+            return float(flat[order[a[lo]]])
+        start = end
+        chunk *= 2
+    return 0.0
+
+
+def pore_size_distribution(grid, lattice, probe_radius=0.0, samples=2000, bin_width=0.2, seed=0,
+                           max_elements=2 ** 24):
+    '''
+        孔径分布：随机选取孔内的网格点，每个点的孔径为包含该点且不与原子重叠的最大球的直径
+        （候选球心为每隔一个网格点选取的孔内网格点，按半径从大到小查找）
+        返回(各区间中心的孔径, 各区间内样本点的比例)
+    '''
+    shape = np.array(grid.shape)
+    pore = np.argwhere(grid >= probe_radius)
+    if len(pore) == 0:
+        return np.zeros(0), np.zeros(0)
+    rng = np.random.default_rng(seed)
+    sample = pore[rng.choice(len(pore), min(samples, len(pore)), replace=False)]
+    points = (sample + 0.5) / shape
+    sizes = 2 * grid[tuple(sample.T)]
+
+    centers = np.argwhere(grid[::2, ::2, ::2] >= probe_radius) * 2
+    radii = grid[tuple(centers.T)]
+    # 球心的周期镜像，球与晶胞相交时才可能包含样本点
+    images, index = _periodic_images((centers + 0.5) / shape, cell_widths(lattice), radii.max())
+    order = np.argsort(-radii[index], kind='stable')
+    centers, radii = images[order] @ lattice, radii[index][order]
+    centers_sq = (centers * centers).sum(axis=1)
+    points = points @ lattice
+    points_sq = (points * points).sum(axis=1)
+
+    unresolved = np.arange(len(points))
+    step = max(1, max_elements // len(points))
+    for start in range(0, len(centers), step):
+        if len(unresolved) == 0:
+            break
+        c, r = centers[start:start + step], radii[start:start + step]
+        p = points[unresolved]
+        d2 = points_sq[unresolved, None] + centers_sq[None, start:start + step] - 2 * p @ c.T
+        covered = d2 <= (r * r)[None, :]
+        hit = covered.any(axis=1)
+        first = np.argmax(covered, axis=1)
+        sizes[unresolved[hit]] = np.maximum(sizes[unresolved[hit]], 2 * r[first[hit]])
+        unresolved = unresolved[~hit]
+
+    n_bins = int(math.ceil(sizes.max() / bin_width)) + 1
+    counts = np.bincount((sizes / bin_width).astype(int), minlength=n_bins)
+    return (np.arange(n_bins) + 0.5) * bin_width, counts / len(sizes)
+
+
+def pore_geometry(structure: CifStructure, spacing=0.2, area_probe=1.82, volume_probe=0.0, area_samples=2000,
+                  psd_samples=2000, psd_bin_width=0.2):
+    '''
+        计算与zeo++ -res -sa -vol相同的几何描述符，以及孔径分布
+        返回{'LCD', 'PLD', 'density', 'VSA', 'GSA', 'Vp', 'void_fraction', 'psd'}
+        (直径单位为埃，density为g/cm^3，VSA为m^2/cm^3，GSA为m^2/g，Vp为cm^3/g，psd为(孔径, 比例))
+        孔体积与表面积包含探针无法进入的孤立孔穴
+    '''
+    radii = get_atomic_radii(structure.symbols)
+    grid = distance_grid(structure, radii, spacing)
+    lattice = structure.lattice()
+    volume = float(structure.volume())
+    mass = float(framework_descriptors(structure)['framework_mass_g/mol'])
+    density = mass / AVOGADRO / (volume * 1e-24)
+
+    lcd = largest_included_sphere(structure, radii, grid, spacing)
+    pld = min(2 * percolation_radius(grid), lcd)
+    area = accessible_surface_area(structure, radii + area_probe, area_samples)
+    void_fraction = float((grid >= volume_probe).mean())
+    return {'LCD': lcd, 'PLD': pld, 'density': density,
+            'VSA': area * 1e4 / volume, 'GSA': area * 1e-20 * AVOGADRO / mass,
+            'Vp': void_fraction / density, 'void_fraction': void_fraction,
+            'psd': pore_size_distribution(grid, lattice, volume_probe, psd_samples, psd_bin_width)}
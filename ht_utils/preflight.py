@@ -0,0 +1,187 @@
+import csv
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from ht_utils.cif_parser import CELL_KEYS, parse_cif_number, get_cell_volume, read_cif_loops, get_atom_site_loop, \
+    strip_label, _tokenize
+from ht_utils.forcefield import read_framework_pseudo_atoms
+from ht_utils.p1_cache import find_p1_cif
+
+# 问题类别 (problem categories)
+UNREADABLE = "unreadable"
+MISSING_CELL = "missing_cell_parameters"
+INVALID_CELL = "invalid_cell"
+ATOM_LOOP = "inconsistent_atom_loop"
+NO_ATOMS = "no_atoms"
+UNKNOWN_PSEUDO_ATOMS = "unknown_pseudo_atoms"
+MISSING_CHARGES = "missing_charges"
+
+REPORT_HEADERS = ["name", "category", "message"]
+
+
+def read_pseudo_atom_names(ff_dir):
+    '''
+        读取力场目录中pseudo_atoms.def定义的伪原子名称集合，文件不存在时返回None
+    '''
+    path = os.path.join(ff_dir, "pseudo_atoms.def")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        lines = f.readlines()
+    n = int(lines[1].split()[0])
+    return set(line.split()[0] for line in lines[3:3 + n] if len(line.split()) > 0)
+
+
+def template_uses_cif_charges(template: str):
+    '''
+        模板中是否设置了UseChargesFromCIFFile yes（注释掉的行不算）
+    '''
+    return re.search(r'^\s*UseChargesFromCIFFile\s+yes', template, re.MULTILINE | re.IGNORECASE) is not None
+
+
+def get_raspa_forcefield_dir(raspa_dir, template: str):
+    '''
+        返回模板中Forcefield对应的RASPA2力场目录，找不到时返回None
+    '''
+    m = re.search(r'^\s*Forcefield\s+(\S+)', template, re.MULTILINE)
+    if m is None:
+        return None
+    ff_dir = os.path.join(raspa_dir, "share", "raspa", "forcefield", m.group(1))
+    return ff_dir if os.path.isdir(ff_dir) else None
+
+
+def _check_atom_loop_rows(cif_location):
+    # RASPA2按行读取原子坐标，atom_site loop中每一行的列数都必须与列名数目一致
+    with open(cif_location, 'r') as f:
+        lines = f.readlines()
+    i = 0
+    while i < len(lines):
+        if not lines[i].strip().lower().startswith('loop_'):
+            i += 1
+            continue
+        i += 1
+        headers = []
+        while i < len(lines) and lines[i].strip().startswith('_'):
+            headers.append(lines[i].split()[0])
+            i += 1
+        if not any(h.startswith('_atom_site_') for h in headers):
+            continue
+        while i < len(lines):
+            s = lines[i].strip()
+            if s.startswith(('_', ';')) or s.lower().startswith(('loop_', 'data_')):
+                break
+            if len(s) > 0 and not s.startswith('#') and len(_tokenize(s)) != len(headers):
+                return "line {}: {} columns, expected {}".format(i + 1, len(_tokenize(s)), len(headers))
+            i += 1
+    return None
+
+
+def check_cif(cif_location, pseudo_atoms=None, need_charges=False, graspa=False):
+    '''
+        检查单个cif文件能否被模拟程序正常读取，返回问题列表[(类别, 说明), ...]，没有问题时返回空列表
+        pseudo_atoms: 力场中定义的伪原子名称集合，为None时不检查
+        need_charges: 模板中设置了UseChargesFromCIFFile yes
+        graspa: 使用gRASPA驱动脚本的(更严格的)原子标签读取方式
+    '''
+    problems = []
+    try:
+        tags, loops = read_cif_loops(cif_location)
+    except Exception as e:
+        return [(UNREADABLE, repr(e))]
+
+    missing = [k for k in CELL_KEYS if k not in tags]
+    if len(missing) > 0:
+        problems.append((MISSING_CELL, ' '.join(missing)))
+    else:
+        try:
+            cell = [parse_cif_number(tags[k]) for k in CELL_KEYS]
+            volume = get_cell_volume(*cell)
+            if not (isinstance(volume, float) and volume > 0):
+                problems.append((INVALID_CELL, "cell volume is not positive"))
+        except (ValueError, TypeError) as e:
+            problems.append((INVALID_CELL, repr(e)))
+
+    headers, rows = get_atom_site_loop(loops)
+    if headers is None or len(rows) == 0:
+        problems.append((NO_ATOMS, "no _atom_site loop"))
+        return problems
+
+    if graspa:
+        try:
+            labels = read_framework_pseudo_atoms(cif_location)
+        except Exception as e:
+            problems.append((ATOM_LOOP, str(e)))
+            labels = None
+    else:
+        error = _check_atom_loop_rows(cif_location)
+        if error is not None:
+            problems.append((ATOM_LOOP, error))
+        label_col = headers.index('_atom_site_label') if '_atom_site_label' in headers else 0
+        type_col = headers.index('_atom_site_type_symbol') if '_atom_site_type_symbol' in headers else None
+        labels = set()
+        for row in rows:
+            label = strip_label(row[label_col])
+            # RASPA2在标签匹配不到时会使用_atom_site_type_symbol
+            if pseudo_atoms is not None and label not in pseudo_atoms and type_col is not None:
+                label = row[type_col]
+            labels.add(label)
+
+    if pseudo_atoms is not None and labels is not None:
+        unknown = sorted(labels - pseudo_atoms)
+        if len(unknown) > 0:
+            problems.append((UNKNOWN_PSEUDO_ATOMS, ' '.join(unknown)))
+
+    if need_charges:
+        if '_atom_site_charge' not in headers:
+            problems.append((MISSING_CHARGES, "no _atom_site_charge column"))
+        else:
+            col = headers.index('_atom_site_charge')
+            if any(row[col] in ('?', '.') for row in rows):
+                problems.append((MISSING_CHARGES, "undefined values in _atom_site_charge"))
+    return problems
+
+
+def _check_worker(args):
+    # 检查任务中实际使用的文件（p1_cache/eqeq_cache中的结构优先）
+    cif_dir, cif_file, pseudo_atoms, need_charges, graspa = args
+    return check_cif(find_p1_cif(cif_dir, cif_file), pseudo_atoms, need_charges, graspa)
+
+
+def run_preflight(cif_dir, cifs, template: str, ff_dir=None, max_processes=1, graspa=False):
+    '''
+        并行检查cif_dir中的所有cif文件，返回(可以计算的cif列表, {cif文件名: 问题列表})
+        ff_dir: 包含pseudo_atoms.def的力场目录，为None时不检查伪原子
+    '''
+    pseudo_atoms = read_pseudo_atom_names(ff_dir) if ff_dir is not None else None
+    need_charges = template_uses_cif_charges(template)
+    tasks = [(cif_dir, cif, pseudo_atoms, need_charges, graspa) for cif in cifs]
+    valid = []
+    problems = {}
+    with ProcessPoolExecutor(max_workers=max(1, max_processes)) as pool:
+        for cif, result in zip(cifs, pool.map(_check_worker, tasks, chunksize=64)):
+            if len(result) > 0:
+                problems[cif] = result
+            else:
+                valid.append(cif)
+    return valid, problems
+
+
+def write_preflight_report(report_file, problems: dict):
+    '''
+        写入预检查报告(name,category,message)，并在终端打印各类问题的数目
+    '''
+    counts = {}
+    with open(report_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADERS)
+        for cif in sorted(problems):
+            for category, message in problems[cif]:
+                writer.writerow([cif[:-4], category, message])
+                counts[category] = counts.get(category, 0) + 1
+    if len(problems) > 0:
+        print("\033[0;37;41m\n预检查发现 {} 个无法计算的结构，已跳过，详见 {} "
+              "({} structures failed the pre-flight check and are skipped, see {})\033[0m".format(
+                  len(problems), report_file, len(problems), report_file))
+        for category in sorted(counts):
+            print("    {}: {}".format(category, counts[category]))
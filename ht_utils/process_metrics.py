@@ -0,0 +1,215 @@
+import csv
+import os
+import re
+
+import numpy as np
+
+from ht_utils.isotherm_fit import read_isotherm_file, split_isotherm_names
+
+# 结果文件中与数值列在同一行的误差列（gRASPA亨利系数），其它结果的误差在同目录的<结果文件名>_errors.csv中
+ERROR_COLUMNS = {'Average_Henry_Coefficient': 'Henry_Coefficient_Error'}
+
+
+def get_error_file(result_file):
+    return result_file[:-len('.csv')] + '_errors.csv'
+
+
+def to_float(strings):
+    '''
+        字符串数组转为float64数组，空字符串与无法解析的值为nan
+    '''
+    strings = np.char.strip(np.asarray(strings, dtype=str))
+    values = np.full(strings.shape, np.nan)
+    filled = strings != ''
+    try:
+        values[filled] = strings[filled].astype(np.float64)
+    except ValueError:
+        def parse(s):
+            try:
+                return float(s)
+            except ValueError:
+                return np.nan
+        values[filled] = [parse(s) for s in strings[filled]]
+    return values
+
+
+def iter_table(path, columns, chunk_size=200000, offset=0):
+    '''
+        分块读取驱动脚本写出的结果表（第一行为表头，第一列为结构名），每块返回
+        (结构名数组(n,), 各列数值(n, len(columns)), 读到的文件字节位置)；
+        有finished列时未完成的行（包括Error行）数值为nan，表中没有的列为nan
+        offset不为0时从该字节位置继续读取（表头仍从文件开头读取），最后一行不完整（仍在写入）时留到下次读取
+    '''
+    with open(path, 'rb') as f:
+        headers = [h.strip() for h in next(csv.reader([f.readline().decode('utf8')]), [])]
+        index = [headers.index(c) if c in headers else None for c in columns]
+        i_finished = headers.index('finished') if 'finished' in headers else None
+        # 只切分到需要的最后一列
+        n_split = max([i for i in index if i is not None] + [i_finished or 0]) + 1
+        if offset > 0:
+            f.seek(offset)
+        while True:
+            lines = f.readlines(chunk_size * 128)
+            if len(lines) > 0 and not lines[-1].endswith(b'\n'):
+                f.seek(-len(lines[-1]), os.SEEK_CUR)
+                lines = lines[:-1]
+            if len(lines) == 0:
+                return
+            text = b''.join(lines).decode('utf8')
+            # 驱动脚本直接用逗号连接各列，没有引号时不需要csv模块
+            rows = list(csv.reader(text.splitlines())) if '"' in text else [l.split(',', n_split) for l in text.splitlines()]
+            rows = [r for r in rows if len(r) > 0 and len(r[0]) > 0]
+            names = np.array([r[0].strip() for r in rows], dtype=str)
+            values = np.full((len(rows), len(columns)), np.nan)
+            for k, i in enumerate(index):
+                if i is not None:
+                    values[:, k] = to_float([r[i] if len(r) > i else '' for r in rows])
+            if i_finished is not None:
+                finished = np.array([len(r) > i_finished and r[i_finished].strip() == 'True' for r in rows],
+                                    dtype=bool)
+                values[~finished] = np.nan
+            yield names, values, f.tell()
+
+
+def read_table(path, columns, chunk_size=200000):
+    '''
+        读取整个结果表的columns列，返回按结构名排序的(结构名(n,), 数值(n, len(columns)))，同一结构有多行时保留最后一行
+    '''
+    chunks = list(iter_table(path, columns, chunk_size))
+    if len(chunks) == 0:
+        return np.array([], dtype=str), np.zeros((0, len(columns)))
+    names = np.concatenate([c[0] for c in chunks])
+    values = np.concatenate([c[1] for c in chunks])
+    order = np.argsort(names, kind='stable')
+    names = names[order]
+    last = np.append(names[1:] != names[:-1], True)
+    return names[last], values[order[last]]
+
+
+def align(names, target):
+    '''
+        target中每个结构在names中的行号，names中没有的结构为-1
+    '''
+    if len(names) == 0:
+        return np.full(len(target), -1, dtype=np.int64)
+    order = np.argsort(names, kind='stable')
+    index = order[np.minimum(np.searchsorted(names[order], target), len(names) - 1)]
+    return np.where(names[index] == target, index, -1)
+
+
+def take(values, index):
+    # 按align()的行号取值，-1为nan
+    return np.where(index >= 0, values[np.maximum(index, 0)], np.nan)
+
+
+def read_column(path, column, chunk_size=200000):
+    '''
+        结果表中一列的数值与误差：误差取自同一行的误差列（<列名>_error或ERROR_COLUMNS），
+        其次是<结果文件名>_errors.csv中的同名列，都没有时为nan
+        返回(结构名(n,), 数值(n,), 误差(n,))
+    '''
+    with open(path, 'r', newline='') as f:
+        headers = [h.strip() for h in next(csv.reader(f), [])]
+    if column not in headers:
+        raise ValueError("{} has no column {}".format(path, column))
+    error_column = ERROR_COLUMNS.get(column, column + '_error')
+    if error_column in headers:
+        names, values = read_table(path, [column, error_column], chunk_size)
+        return names, values[:, 0], values[:, 1]
+    names, values = read_table(path, [column], chunk_size)
+    errors = np.full(len(names), np.nan)
+    error_file = get_error_file(path)
+    if os.path.isfile(error_file):
+        error_names, error_values = read_table(error_file, [column], chunk_size)
+        errors = take(error_values[:, 0], align(error_names, names))
+    return names, values[:, 0], errors
+
+
+def read_isotherm_point(results_dir, component, pressure, loading_unit='mol/kg', loading_type='absolute'):
+    '''
+        等温线驱动脚本的结果目录（每个结构一个文件）中各结构component在pressure下的吸附量与误差（<名字>_errors.csv），
+        带温度后缀的文件被跳过；返回(结构名(n,), 吸附量(n,), 误差(n,))
+    '''
+    names, values, errors = [], [], []
+    split = split_isotherm_names(os.listdir(results_dir))
+    for file in sorted(split):
+        for r in read_isotherm_file(os.path.join(results_dir, file), loading_unit, loading_type, *split[file]):
+            if r['component'] != component or np.isfinite(r['temperature']):
+                continue
+            match = np.flatnonzero(np.isclose(r['pressure'], pressure, rtol=1e-6, atol=0))
+            if len(match) == 0:
+                continue
+            names.append(r['name'])
+            values.append(r['loading'][match[-1]])
+            errors.append(np.nan if r['sigma'] is None else r['sigma'][match[-1]])
+    return np.array(names, dtype=str), np.array(values, dtype=np.float64), np.array(errors, dtype=np.float64)
+
+
+def join_columns(columns):
+    '''
+        columns: [(结构名, 数值, 误差)]，返回所有列都有的结构（排序后）以及对齐的数值(n, 列数)与误差(n, 列数)
+    '''
+    names = np.unique(columns[0][0])
+    for n, _, _ in columns[1:]:
+        names = np.intersect1d(names, n, assume_unique=True)
+    values = np.empty((len(names), len(columns)))
+    errors = np.empty((len(names), len(columns)))
+    for k, (n, v, e) in enumerate(columns):
+        index = align(n, names)
+        values[:, k] = take(v, index)
+        errors[:, k] = take(e, index)
+    return names, values, errors
+
+
+def process_metrics(inputs, mole_fractions=None):
+    '''
+        由已对齐的输入计算分离过程指标，所有结构一起向量化计算，误差按一阶泰勒展开传递（各输入的误差相互独立）
+        inputs: {'adsorption': 强吸附组分在吸附条件下的吸附量, 'desorption': 强吸附组分在脱附条件下的吸附量,
+                 'weak': 弱吸附组分在吸附条件下的吸附量, 'henry_strong'/'henry_weak': 两个组分的亨利系数}，
+                每项为(数值(n,), 误差(n,))，可以只给出一部分；mole_fractions: 吸附条件下的(强, 弱)气相摩尔分数
+        返回{指标: (数值, 误差)}，只包含输入齐全的指标：
+            working_capacity = N_ads - N_des，regenerability = (N_ads - N_des) / N_ads * 100 (%)，
+            adsorption_selectivity = (N_ads / N_weak) / (y_strong / y_weak)，henry_selectivity = K_strong / K_weak，
+            APS（吸附剂性能评分）= adsorption_selectivity * working_capacity
+    '''
+    metrics = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if 'adsorption' in inputs and 'desorption' in inputs:
+            a, sa = inputs['adsorption']
+            d, sd = inputs['desorption']
+            capacity = a - d
+            metrics['working_capacity'] = (capacity, np.hypot(sa, sd))
+            # R = 1 - N_des / N_ads，对N_ads与N_des分别求导
+            metrics['regenerability'] = (100 * capacity / a, 100 * np.hypot(sd, d / a * sa) / np.abs(a))
+        if 'adsorption' in inputs and 'weak' in inputs and mole_fractions is not None:
+            a, sa = inputs['adsorption']
+            w, sw = inputs['weak']
+            selectivity = a / w * mole_fractions[1] / mole_fractions[0]
+            metrics['adsorption_selectivity'] = (selectivity, np.abs(selectivity) * np.hypot(sa / a, sw / w))
+            if 'desorption' in inputs:
+                d, sd = inputs['desorption']
+                capacity = a - d
+                # APS = S(N_ads, N_weak) * (N_ads - N_des)，N_ads同时出现在两个因子中
+                metrics['APS'] = (selectivity * capacity,
+                                  np.sqrt((selectivity * capacity / a + selectivity) ** 2 * sa ** 2 +
+                                          (selectivity * capacity / w) ** 2 * sw ** 2 + selectivity ** 2 * sd ** 2))
+        if 'henry_strong' in inputs and 'henry_weak' in inputs:
+            ks, sks = inputs['henry_strong']
+            kw, skw = inputs['henry_weak']
+            selectivity = ks / kw
+            metrics['henry_selectivity'] = (selectivity, np.abs(selectivity) * np.hypot(sks / ks, skw / kw))
+    return metrics
+
+
+def write_table(output_file, names, columns: dict, fmt='%.6e', chunk_size=200000):
+    '''
+        写入每个结构一行的数值表：columns为{列名: 数值(n,)}，nan与inf写为空；按chunk_size行分块格式化
+    '''
+    line = ','.join(['%s'] + [fmt] * len(columns)) + '\n'
+    missing = re.compile(r'(?<=,)-?(nan|inf)(?=[,\n])')
+    with open(output_file, 'w', newline='') as f:
+        f.write(','.join(['name'] + list(columns)) + '\n')
+        for start in range(0, len(names), chunk_size):
+            s = slice(start, start + chunk_size)
+            rows = zip(np.asarray(names[s], dtype=str).tolist(), *[np.asarray(v[s]).tolist() for v in columns.values()])
+            f.write(missing.sub('', ''.join(line % row for row in rows)))
@@ -0,0 +1,257 @@
+import bisect
+import hashlib
+import os
+
+import numpy as np
+
+from ht_utils.process_metrics import iter_table
+
+
+def _fronts_2d(points):
+    # 两个目标的非支配排序（Jensen 2003）：按第一个目标从大到小排序后，每个点属于第一个“已有点的第二目标都小于该点”的前沿，
+    # 各前沿的最大第二目标单调不增，每个点二分查找一次，O(n log n)；points中不能有重复的点
+    order = np.lexsort((-points[:, 1], -points[:, 0]))
+    fronts = np.empty(len(points), dtype=np.int64)
+    best = []
+    for i, y in zip(order.tolist(), (-points[order, 1]).tolist()):
+        f = bisect.bisect_right(best, y)
+        if f == len(best):
+            best.append(y)
+        else:
+            best[f] = y
+        fronts[i] = f
+    return fronts
+
+
+def _skyline_3d(points):
+    # 三个目标的非支配点（Kung）：按第一个目标从大到小扫描，已扫描点在后两个目标上的非支配“阶梯”按第二目标升序保存，
+    # 判断与插入各二分查找一次，O(n log n)；points中不能有重复的点
+    order = np.lexsort((-points[:, 2], -points[:, 1], -points[:, 0]))
+    mask = np.zeros(len(points), dtype=bool)
+    ys, negative_zs = [], []
+    for i, y, z in zip(order.tolist(), points[order, 1].tolist(), points[order, 2].tolist()):
+        j = bisect.bisect_left(ys, y)
+        if j < len(ys) and -negative_zs[j] >= z:
+            continue
+        mask[i] = True
+        # 删除阶梯中被(y, z)支配的点：第二目标不大于y且第三目标不大于z，是紧挨在插入位置之前的连续一段
+        start = bisect.bisect_left(negative_zs, -z, 0, j)
+        end = j + 1 if j < len(ys) and ys[j] == y else j
+        ys[start:end] = [y]
+        negative_zs[start:end] = [-z]
+    return mask
+
+
+def _skyline_blocks(points, block=1024):
+    # 四个及以上目标的非支配点：按目标之和从大到小分块（被支配的点之和一定更小），每块与已有的前沿向量化比较，
+    # 复杂度为O(n * 前沿大小)
+    order = np.argsort(-points.sum(axis=1), kind='stable')
+    mask = np.zeros(len(points), dtype=bool)
+    skyline = np.empty((0, points.shape[1]))
+
+    def dominated_by(p, candidates, step=64):
+        # 每次与step个候选点比较，已被支配的点不再参与后面的比较
+        alive = np.arange(len(p))
+        for s in range(0, len(candidates), step):
+            c = candidates[s:s + step]
+            q = p[alive, None]
+            alive = alive[~((c[None] >= q).all(axis=2) & (c[None] > q).any(axis=2)).any(axis=1)]
+            if len(alive) == 0:
+                break
+        dominated = np.ones(len(p), dtype=bool)
+        dominated[alive] = False
+        return dominated
+
+    for start in range(0, len(order), block):
+        rows = order[start:start + block]
+        # 先与已有前沿比较（大部分点在这里被排除），剩下的点再两两比较
+        rows = rows[~dominated_by(points[rows], skyline)]
+        rows = rows[~dominated_by(points[rows], points[rows])]
+        mask[rows] = True
+        skyline = np.concatenate([skyline, points[rows]])
+    return mask
+
+
+def pareto_fronts(values, n_fronts=1):
+    '''
+        多目标非支配排序：values为(n, 目标数)，所有目标都是越大越好（需要越小越好的目标先乘以-1），
+        返回每行所在的前沿(n,)，0为Pareto前沿，第n_fronts个及之后的前沿与含nan的行为-1
+        一个目标时按数值排序，两个目标时一次O(n log n)扫描得到所有前沿，三个目标时每个前沿O(n log n)，
+        更多目标时逐块向量化比较；完全相同的行属于同一个前沿
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    fronts = np.full(len(values), -1, dtype=np.int64)
+    finite = np.flatnonzero(np.all(np.isfinite(values), axis=1))
+    if len(finite) == 0:
+        return fronts
+    points, inverse = np.unique(values[finite], axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if points.shape[1] == 1:
+        unique_fronts = np.arange(len(points) - 1, -1, -1)
+    elif points.shape[1] == 2:
+        unique_fronts = _fronts_2d(points)
+    else:
+        skyline = _skyline_3d if points.shape[1] == 3 else _skyline_blocks
+        unique_fronts = np.full(len(points), -1, dtype=np.int64)
+        remaining = np.arange(len(points))
+        for f in range(n_fronts):
+            if len(remaining) == 0:
+                break
+            mask = skyline(points[remaining])
+            unique_fronts[remaining[mask]] = f
+            remaining = remaining[~mask]
+    unique_fronts = np.where(unique_fronts < n_fronts, unique_fronts, -1)
+    fronts[finite] = unique_fronts[inverse]
+    return fronts
+
+
+def top_k(k, names, values):
+    '''
+        values中最大的k个（越大越好），nan被跳过
+        返回按数值从大到小（相同时按结构名）排序的(结构名, 数值)，最多k个
+    '''
+    finite = np.isfinite(values)
+    names, values = names[finite], values[finite]
+    if len(values) > k:
+        # 保留不小于第k大的值的所有记录（包括并列的），排序后再截断，使并列时的结果与输入顺序无关
+        selected = values >= -np.partition(-values, k - 1)[k - 1]
+        names, values = names[selected], values[selected]
+    order = np.lexsort((names, -values))[:k]
+    return names[order], values[order]
+
+
+def _last_rows(names, values):
+    # 同一结构有多行时保留最后一行
+    _, last = np.unique(names[::-1], return_index=True)
+    keep = np.sort(len(names) - 1 - last)
+    return names[keep], values[keep]
+
+
+def file_signature(path, offset, block=4096):
+    '''
+        结果文件已读取部分（offset之前）的签名：inode与开头、offset之前各block字节的SHA1，
+        用于发现被重新生成（不一定变短）的结果文件
+    '''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        h.update(str(os.fstat(f.fileno()).st_ino).encode())
+        h.update(f.read(min(block, offset)))
+        f.seek(max(0, offset - block))
+        h.update(f.read(offset - max(0, offset - block)))
+    return h.hexdigest()
+
+
+class IncrementalRanking():
+    '''
+        结果表的增量Pareto前沿与每个目标的top-K：每次update()只读取各结果文件上次读到的位置之后新写入的行，
+        每个结构只保存一行目标值（n个结构、k个目标为n*k个float），不保存结果表的其它列
+        objectives: [(结果文件, 列名, 是否越大越好)]，不同目标可以来自不同的文件，按结构名合并
+        同一结构在文件中出现多次（包括之后追加的行）时使用最后一行，结果与一次读取全部结果相同；
+        结果文件被重新生成（变短，或已读取部分的内容、inode改变）时从头重新统计
+
+        示例：
+            ranking = IncrementalRanking.load('ranking_state.npz', objectives, n_fronts=3, top_k=100)
+            ranking.update()
+            names, values, fronts = ranking.fronts()
+            ranking.save('ranking_state.npz')
+    '''
+
+    def __init__(self, objectives, n_fronts=1, top_k=100):
+        self.objectives = [(os.path.abspath(p), c, bool(m)) for p, c, m in objectives]
+        self.sign = np.array([1.0 if m else -1.0 for _, _, m in self.objectives])
+        self.n_fronts = n_fronts
+        self.top_k = top_k
+        self.reset()
+
+    def reset(self):
+        k = len(self.objectives)
+        self.offsets = {p: 0 for p, _, _ in self.objectives}
+        self.signatures = {p: '' for p, _, _ in self.objectives}
+        self.names = np.array([], dtype=str)
+        # 各结构的目标值（已乘以sign）与是否已经读到该目标
+        self.values = np.empty((0, k))
+        self.seen = np.empty((0, k), dtype=bool)
+
+    def save(self, path):
+        np.savez_compressed(path,
+                            objectives=np.array(['{}\t{}\t{}'.format(*o) for o in self.objectives]),
+                            offsets=np.array([self.offsets[p] for p, _, _ in self.objectives], dtype=np.int64),
+                            signatures=np.array([self.signatures[p] for p, _, _ in self.objectives]),
+                            names=self.names, values=self.values, seen=self.seen,
+                            settings=np.array([self.n_fronts, self.top_k]))
+
+    @classmethod
+    def load(cls, path, objectives, n_fronts=1, top_k=100):
+        '''
+            读取save()的状态，文件不存在或目标、前沿数、top_k与保存时不同时从头开始
+        '''
+        ranking = cls(objectives, n_fronts, top_k)
+        if not os.path.isfile(path):
+            return ranking
+        with np.load(path) as data:
+            if 'signatures' not in data or \
+                    data['objectives'].tolist() != ['{}\t{}\t{}'.format(*o) for o in ranking.objectives] or \
+                    data['settings'].tolist() != [n_fronts, top_k]:
+                return ranking
+            ranking.offsets = {p: int(o) for (p, _, _), o in zip(ranking.objectives, data['offsets'])}
+            ranking.signatures = {p: str(h) for (p, _, _), h in zip(ranking.objectives, data['signatures'])}
+            ranking.names, ranking.values, ranking.seen = data['names'], data['values'], data['seen']
+        return ranking
+
+    def _regenerated(self, path):
+        # 读过的结果文件变短，或已读取部分的签名改变
+        offset = self.offsets[path]
+        return offset > 0 and os.path.isfile(path) and \
+            (os.path.getsize(path) < offset or file_signature(path, offset) != self.signatures[path])
+
+    def update(self, chunk_size=200000):
+        '''
+            读取所有结果文件新写入的行并更新各结构的目标值，返回读到的新行数
+        '''
+        if any(self._regenerated(p) for p in self.offsets):
+            self.reset()
+        n_rows = 0
+        for path in self.offsets:
+            if not os.path.isfile(path):
+                continue
+            columns = [j for j, (p, _, _) in enumerate(self.objectives) if p == path]
+            for names, values, offset in iter_table(path, [self.objectives[j][1] for j in columns], chunk_size,
+                                                    self.offsets[path]):
+                self.offsets[path] = offset
+                n_rows += len(names)
+                names, values = _last_rows(names, values * self.sign[columns])
+                self._merge(names, values, columns)
+            self.signatures[path] = file_signature(path, self.offsets[path])
+        return n_rows
+
+    def _merge(self, names, values, columns):
+        # 新读到的行覆盖同一结构已有的目标值
+        all_names, inverse = np.unique(np.concatenate([self.names, names]), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        merged = np.full((len(all_names), len(self.objectives)), np.nan)
+        seen = np.zeros(merged.shape, dtype=bool)
+        merged[inverse[:len(self.names)]] = self.values
+        seen[inverse[:len(self.names)]] = self.seen
+        rows = inverse[len(self.names):]
+        merged[np.ix_(rows, columns)] = values
+        seen[np.ix_(rows, columns)] = True
+        self.names, self.values, self.seen = all_names, merged, seen
+
+    def fronts(self):
+        '''
+            返回前n_fronts个前沿中的(结构名, 目标值(原始符号), 前沿)，按前沿与第一个目标排序
+        '''
+        complete = self.seen.all(axis=1)
+        fronts = pareto_fronts(self.values[complete], self.n_fronts)
+        names, values = self.names[complete], self.values[complete]
+        ranked = fronts >= 0
+        names, values, fronts = names[ranked], values[ranked], fronts[ranked]
+        order = np.lexsort((-values[:, 0], fronts))
+        return names[order], values[order] * self.sign, fronts[order]
+
+    def top_values(self, j):
+        '''
+            第j个目标的top-K：(结构名, 数值(原始符号))，从最好到最差排列
+        '''
+        names, values = top_k(self.top_k, self.names, self.values[:, j])
+        return names, values * self.sign[j]
@@ -0,0 +1,260 @@
+import hashlib
+import os
+import re
+import shutil
+import socket
+import subprocess
+import time
+
+from ht_utils.cif_catalog import file_sha1
+from ht_utils.forcefield import read_molecule_pseudo_atoms
+from ht_utils.staging import link_file
+
+# 由本工具生成并管理的网格：框架网格目录中的完成标记与最近使用时间
+GRID_MARKER_PREFIX = ".ht_grid_"
+LAST_USED_FILE = ".ht_last_used"
+# 生成网格时复制到MakeGrid输入中的参数（影响框架与伪原子之间的作用）
+GRID_INPUT_KEYS = ("Forcefield", "UseChargesFromCIFFile", "RemoveAtomNumberCodeFromLabel", "CutOffVDW",
+                   "CutOffChargeCharge", "ChargeMethod", "EwaldPrecision")
+
+
+def get_adsorbate_pseudo_atoms(input_text: str, raspa_dir: str):
+    '''
+        模板中所有吸附质的伪原子（按出现顺序去重），分子定义取自RASPA2的share/raspa/molecules/<MoleculeDefinition>/
+        找不到分子定义文件时抛出FileNotFoundError
+    '''
+    atoms = []
+    for name, definition in re.findall(r'MoleculeName\s+(\S+)\s+MoleculeDefinition\s+(\S+)', input_text):
+        def_location = os.path.join(raspa_dir, "share", "raspa", "molecules", definition, name + ".def")
+        if not os.path.isfile(def_location):
+            raise FileNotFoundError(def_location)
+        for atom in sorted(read_molecule_pseudo_atoms(def_location)):
+            if atom not in atoms:
+                atoms.append(atom)
+    return atoms
+
+
+def _get_setting(input_text: str, key: str):
+    m = re.search(r'^\s*' + key + r'\s+(.+?)\s*$', input_text, re.MULTILINE | re.IGNORECASE)
+    return None if m is None else m.group(1)
+
+
+def _directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                size += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return size
+
+
+class RaspaGridCache():
+    '''
+        管理RASPA2的框架-伪原子能量网格（UseTabularGrid）
+        网格由RASPA2的MakeGrid写入$RASPA_DIR/share/raspa/grids/<力场>/<框架名>/，之后的模拟自动读取；
+        每个(框架, 力场, 伪原子, 网格间距)只生成一次，生成成功后写入完成标记，标记中记录cif文件内容（包括电荷）
+        与GRID_INPUT_KEYS参数的SHA1，两者改变后重新生成；并发的任务（包括其它驱动脚本）通过锁文件等待同一网格生成完毕
+        缓存超过max_bytes时，按最近使用时间删除本工具生成的框架网格目录（LRU）
+    '''
+
+    def __init__(self, raspa_dir, forcefield, pseudo_atoms, spacing=0.15, max_bytes=0, lock_timeout=600):
+        self.raspa_dir = raspa_dir
+        self.root = os.path.join(raspa_dir, "share", "raspa", "grids", forcefield)
+        self.pseudo_atoms = list(pseudo_atoms)
+        self.spacing = spacing
+        self.max_bytes = max_bytes
+        # 生成网格的任务每隔poll秒更新锁文件的修改时间，超过该时间（秒）没有更新的锁文件视为中断的任务留下的，可以删除
+        self.lock_timeout = lock_timeout
+
+    def framework_dir(self, framework):
+        return os.path.join(self.root, framework)
+
+    def marker(self, framework, atom):
+        return os.path.join(self.framework_dir(framework), "{}{}_{:g}".format(GRID_MARKER_PREFIX, atom, self.spacing))
+
+    def grid_key(self, cif_location, input_text: str):
+        '''
+            网格的内容键：cif文件内容（包括电荷）与模拟输入中GRID_INPUT_KEYS参数的SHA1
+        '''
+        h = hashlib.sha1(file_sha1(cif_location).encode())
+        for key in GRID_INPUT_KEYS:
+            h.update("|{}={}".format(key, _get_setting(input_text, key)).encode())
+        return h.hexdigest()
+
+    def is_current(self, framework, atom, key):
+        # 完成标记存在且第一行的内容键与key相同
+        try:
+            with open(self.marker(framework, atom)) as f:
+                return f.readline().strip() == key
+        except OSError:
+            return False
+
+    def missing(self, framework, key):
+        '''
+            该框架还没有生成或内容键与key不同（cif文件或参数已改变）的伪原子网格
+        '''
+        return [atom for atom in self.pseudo_atoms if not self.is_current(framework, atom, key)]
+
+    def use_grids(self, input_text: str):
+        '''
+            在模拟输入的第一个Component之前加入使用网格的参数
+        '''
+        lines = "UseTabularGrid                yes\n" \
+                "SpacingVDWGrid                {0:g}\n" \
+                "SpacingCoulombGrid            {0:g}\n" \
+                "NumberOfGrids                 {1}\n" \
+                "GridTypes                     {2}\n\n".format(self.spacing, len(self.pseudo_atoms),
+                                                               ' '.join(self.pseudo_atoms))
+        m = re.search(r'^\s*Component\s', input_text, re.MULTILINE)
+        if m is None:
+            return input_text + "\n" + lines
+        return input_text[:m.start()] + lines + input_text[m.start():]
+
+    def make_grid_input(self, input_text: str, atom: str):
+        '''
+            由模拟输入生成单个伪原子的MakeGrid输入，保留力场、电荷、截断半径与框架的设置
+        '''
+        lines = ["SimulationType                MakeGrid"]
+        for key in GRID_INPUT_KEYS:
+            value = _get_setting(input_text, key)
+            if value is not None:
+                lines.append("{:30s}{}".format(key, value))
+        lines += ["", "Framework 0",
+                  "FrameworkName {}".format(_get_setting(input_text, "FrameworkName")),
+                  "UnitCells {}".format(_get_setting(input_text, "UnitCells") or "1 1 1"), "",
+                  "NumberOfGrids                 1",
+                  "GridTypes                     {}".format(atom),
+                  "SpacingVDWGrid                {:g}".format(self.spacing),
+                  "SpacingCoulombGrid            {:g}".format(self.spacing),
+                  "UseTabularGrid                yes", ""]
+        return "\n".join(lines)
+
+    def _acquire(self, lock_file):
+        # 锁文件中记录持有者的主机名与进程号
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self._is_stale(lock_file):
+                try:
+                    os.remove(lock_file)
+                except OSError:
+                    pass
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write("{} {}\n".format(socket.gethostname(), os.getpid()))
+        return True
+
+    def _is_stale(self, lock_file):
+        # 持有者在本机且进程已经结束，或锁文件超过lock_timeout秒没有更新
+        try:
+            with open(lock_file) as f:
+                host, pid = f.read().split()
+            if host == socket.gethostname():
+                os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except (OSError, ValueError):
+            pass
+        try:
+            return time.time() - os.path.getmtime(lock_file) > self.lock_timeout
+        except OSError:
+            return False
+
+    def ensure(self, framework, cif_location, input_text: str, work_dir, poll=10):
+        '''
+            保证框架的所有伪原子网格已经存在且与cif文件和参数一致：缺少的网格在work_dir/grid_<伪原子>中运行MakeGrid生成
+            其它任务正在生成同一网格时等待其完成；生成失败时抛出RuntimeError
+        '''
+        framework_dir = self.framework_dir(framework)
+        os.makedirs(framework_dir, exist_ok=True)
+        key = self.grid_key(cif_location, input_text)
+        for atom in self.missing(framework, key):
+            marker = self.marker(framework, atom)
+            lock_file = marker + ".lock"
+            while not self.is_current(framework, atom, key):
+                if not self._acquire(lock_file):
+                    time.sleep(poll)
+                    continue
+                try:
+                    # 等待锁的期间其它任务可能已经生成了该网格
+                    if self.is_current(framework, atom, key):
+                        break
+                    job_dir = os.path.join(work_dir, "grid_" + atom)
+                    os.makedirs(job_dir, exist_ok=True)
+                    link_file(cif_location, os.path.join(job_dir, framework + ".cif"))
+                    with open(os.path.join(job_dir, "simulation.input"), "w") as f:
+                        f.write(self.make_grid_input(input_text, atom))
+                    process = subprocess.Popen([os.path.join(self.raspa_dir, "bin", "simulate"), "simulation.input"],
+                                               cwd=job_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                    while True:
+                        try:
+                            code = process.wait(timeout=poll)
+                            break
+                        except subprocess.TimeoutExpired:
+                            os.utime(lock_file)
+                    if code != 0:
+                        raise RuntimeError("MakeGrid failed for {} {} (exit code {})".format(framework, atom, code))
+                    with open(marker, "w") as f:
+                        f.write(key + "\n" + job_dir + "\n")
+                finally:
+                    os.remove(lock_file)
+        self.touch(framework)
+
+    def touch(self, framework):
+        '''
+            记录框架网格的最近使用时间（LRU）
+        '''
+        with open(os.path.join(self.framework_dir(framework), LAST_USED_FILE), "w") as f:
+            f.write(str(time.time()) + "\n")
+
+    def entries(self):
+        '''
+            本工具管理的框架网格目录：[(最近使用时间, 占用字节数, 框架名)]，按最近使用时间从早到晚排序
+        '''
+        result = []
+        if not os.path.isdir(self.root):
+            return result
+        for framework in os.listdir(self.root):
+            path = os.path.join(self.root, framework)
+            if not os.path.isdir(path) or not any(f.startswith(GRID_MARKER_PREFIX) for f in os.listdir(path)):
+                continue
+            last_used = os.path.join(path, LAST_USED_FILE)
+            mtime = os.path.getmtime(last_used) if os.path.isfile(last_used) else os.path.getmtime(path)
+            result.append((mtime, _directory_size(path), framework))
+        return sorted(result)
+
+    def evict(self, protected=()):
+        '''
+            缓存超过max_bytes（为0时不限制）时按LRU删除框架网格目录，protected中的框架与正在生成的网格不会被删除
+            返回被删除的框架名列表
+        '''
+        if self.max_bytes <= 0:
+            return []
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        protected = set(protected)
+        removed = []
+        for _, size, framework in entries:
+            if total <= self.max_bytes:
+                break
+            path = self.framework_dir(framework)
+            if framework in protected or any(f.endswith(".lock") for f in os.listdir(path)):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed.append(framework)
+        return removed
+
+
+def open_grid_cache(raspa_dir, template: str, spacing=0.15, max_gb=0.0):
+    '''
+        按模板中的Forcefield与吸附质创建网格缓存，max_gb为缓存的磁盘预算(GB，0为不限制)
+        模板中没有Forcefield时抛出ValueError，找不到分子定义时抛出FileNotFoundError
+    '''
+    forcefield = _get_setting(template, "Forcefield")
+    if forcefield is None:
+        raise ValueError("模板中没有Forcefield (no Forcefield in the template)")
+    atoms = get_adsorbate_pseudo_atoms(template, raspa_dir)
+    return RaspaGridCache(raspa_dir, forcefield, atoms, spacing, int(max_gb * 1024 ** 3))
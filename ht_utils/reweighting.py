@@ -0,0 +1,190 @@
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure
+from ht_utils.gcmc import framework_energy_grids, gcmc
+
+
+def _logsumexp(a, axis):
+    m = np.max(a, axis=axis, keepdims=True)
+    m = np.where(np.isfinite(m), m, 0.0)
+    with np.errstate(divide='ignore'):
+        return np.log(np.exp(a - m).sum(axis=axis)) + np.squeeze(m, axis=axis)
+
+
+def reduced_potentials(n, energy, temperatures, fugacities):
+    '''
+        巨正则系综中构型的约化势 u_k(x) = U / T_k - sum_c N_c ln(f_kc / T_k)（省略与状态无关的项）
+        n: (样本数, 组分数)的分子数；energy: (样本数,)的总能量(K)；temperatures: (状态数,)；fugacities: (状态数, 组分数)(Pa)
+        返回(状态数, 样本数)
+    '''
+    temperatures = np.asarray(temperatures, dtype=np.float64)
+    log_activity = np.log(np.asarray(fugacities, dtype=np.float64) / temperatures[:, None])
+    return np.asarray(energy)[None, :] / temperatures[:, None] - log_activity @ np.asarray(n, dtype=np.float64).T
+
+
+def mbar(u_kn, n_k, tol=1e-10, max_iter=500):
+    '''
+        多直方图重加权（MBAR / WHAM）：u_kn为所有样本在各模拟状态下的约化势(K, N)，n_k为各状态的样本数
+        对凸函数 sum_n log sum_k n_k exp(f_k - u_kn) - sum_k n_k f_k 做带步长回退的Newton迭代（f_0固定为0），
+        Newton步长不能降低目标函数时改用自洽迭代
+        返回(各状态的无量纲自由能f_k, 每个样本的log sum_k n_k exp(f_k - u_k))
+    '''
+    n_k = np.asarray(n_k, dtype=np.float64)
+    log_n = np.log(n_k)
+    # 初值：各状态样本在自身状态下的约化势平均值
+    f = np.array([u_kn[k].mean() for k in range(len(n_k))])
+    f -= f[0]
+
+    def objective(f):
+        log_denominator = _logsumexp(log_n[:, None] + f[:, None] - u_kn, axis=0)
+        return log_denominator.sum() - n_k @ f, log_denominator
+
+    value, log_denominator = objective(f)
+    for _ in range(max_iter):
+        w = np.exp(f[:, None] - u_kn - log_denominator[None, :])
+        gradient = n_k * (w.sum(axis=1) - 1)
+        if np.abs(gradient[1:]).max() < tol * n_k.sum():
+            break
+        # 自洽迭代 f_k = -log sum_n exp(-u_kn - log_denominator_n)，远离解时（重叠很小的状态权重下溢，
+        # Hessian接近奇异）Newton步长不可靠，取两者中目标函数较小的一个
+        candidates = [-_logsumexp(-u_kn - log_denominator[None, :], axis=1)]
+        hessian = np.diag(n_k * w.sum(axis=1)) - (n_k[:, None] * w) @ (n_k[:, None] * w).T
+        step = np.zeros_like(f)
+        step[1:] = np.linalg.lstsq(hessian[1:, 1:], -gradient[1:], rcond=None)[0]
+        scale = 1.0
+        while scale > 1e-8:
+            new_value, _ = objective(f + scale * step)
+            if new_value <= value:
+                candidates.append(f + scale * step)
+                break
+            scale /= 2
+        best = None
+        for candidate in candidates:
+            candidate = candidate - candidate[0]
+            new_value, new_log_denominator = objective(candidate)
+            if best is None or new_value < best[1]:
+                best = (candidate, new_value, new_log_denominator)
+        if best[1] > value:
+            break
+        f, value, log_denominator = best
+    return f, log_denominator
+
+
+def _expectations(n, energy, temperatures, fugacities, target_temperatures, target_fugacities, n_k):
+    u_kn = reduced_potentials(n, energy, temperatures, fugacities)
+    _, log_denominator = mbar(u_kn, n_k)
+    log_w = -reduced_potentials(n, energy, target_temperatures, target_fugacities) - log_denominator[None, :]
+    w = np.exp(log_w - log_w.max(axis=1, keepdims=True))
+    w /= w.sum(axis=1, keepdims=True)
+    n = np.asarray(n, dtype=np.float64)
+    mean_n = w @ n
+    mean_u = w @ energy
+    # 涨落公式 q_st = T - (<U N> - <U><N>) / (<N^2> - <N>^2)，单位K
+    cov = w @ (n * energy[:, None]) - mean_n * mean_u[:, None]
+    var = w @ (n * n) - mean_n * mean_n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        heat = np.asarray(target_temperatures, dtype=np.float64)[:, None] - cov / var
+    # 有效样本数，过小时说明目标状态与模拟状态的直方图重叠不足
+    effective = 1.0 / (w * w).sum(axis=1)
+    return mean_n, heat, effective
+
+
+def reweight_isotherm(runs, temperatures, fugacities, target_temperatures, target_fugacities, bootstrap=20, blocks=10,
+                      seed=0):
+    '''
+        由若干个GCMC模拟的(N, U)样本重加权得到任意(温度, 逸度)下的平均分子数与吸附热
+        runs: [(n(样本数, 组分数), energy(样本数,)), ...]，第k个模拟的温度与逸度为temperatures[k], fugacities[k]
+        误差：每个模拟的样本分为blocks个等长的连续数据块，重抽样数据块bootstrap次，取结果的标准差
+        返回{'n': (目标数, 组分数), 'n_error', 'heat': 吸附热(K，乘以R得到J/mol), 'heat_error', 'effective_samples'}
+    '''
+    n = np.concatenate([np.asarray(r[0]).reshape(len(r[1]), -1) for r in runs])
+    energy = np.concatenate([np.asarray(r[1], dtype=np.float64) for r in runs])
+    n_k = [len(r[1]) for r in runs]
+    target_temperatures = np.asarray(target_temperatures, dtype=np.float64)
+    target_fugacities = np.asarray(target_fugacities, dtype=np.float64).reshape(len(target_temperatures), -1)
+    fugacities = np.asarray(fugacities, dtype=np.float64).reshape(len(runs), -1)
+    mean_n, heat, effective = _expectations(n, energy, temperatures, fugacities, target_temperatures,
+                                            target_fugacities, n_k)
+
+    rng = np.random.default_rng(seed)
+    starts = np.cumsum([0] + n_k[:-1])
+    bootstrap_n, bootstrap_heat = [], []
+    for _ in range(bootstrap):
+        index, b_n_k = [], []
+        for start, size in zip(starts, n_k):
+            # 等长的连续数据块（丢弃末尾不足一块的样本），重抽样后该模拟的样本数为n_blocks * block_size
+            n_blocks = min(blocks, size)
+            block_size = size // n_blocks
+            chosen = rng.integers(n_blocks, size=n_blocks)
+            index.append((start + chosen[:, None] * block_size + np.arange(block_size)).ravel())
+            b_n_k.append(n_blocks * block_size)
+        index = np.concatenate(index)
+        b_n, b_heat, _ = _expectations(n[index], energy[index], temperatures, fugacities, target_temperatures,
+                                       target_fugacities, b_n_k)
+        bootstrap_n.append(b_n)
+        bootstrap_heat.append(b_heat)
+    if bootstrap > 1:
+        n_error, heat_error = np.std(bootstrap_n, axis=0), np.nanstd(bootstrap_heat, axis=0)
+    else:
+        n_error, heat_error = np.zeros_like(mean_n), np.zeros_like(heat)
+    return {'n': mean_n, 'n_error': n_error, 'heat': heat, 'heat_error': heat_error, 'effective_samples': effective}
+
+
+def adaptive_isotherm(simulate, fugacity, pressures, temperature, target_temperatures=(), min_effective=50.0,
+                      bootstrap=20, blocks=10):
+    '''
+        用尽量少的GCMC模拟重建整条等温线：先模拟最低与最高压力，之后每次在重加权有效样本数最少
+        （且低于min_effective）的目标压力处增加一个模拟，直到所有目标压力都满足要求
+        simulate(pressure) -> (n, energy)：在temperature下运行一次GCMC并返回样本
+        fugacity(pressure, temperature) -> 各组分的逸度(Pa)
+        返回{'simulated': 实际模拟的压力, 温度: reweight_isotherm的结果（目标为pressures）}，
+        温度包括temperature与target_temperatures（附近温度由同一组样本重加权，误差与有效样本数一并给出）
+    '''
+    pressures = [float(p) for p in pressures]
+    ordered = sorted(set(pressures))
+    simulated = {}
+    for p in dict.fromkeys([ordered[0], ordered[-1]]):
+        simulated[p] = simulate(p)
+    targets = [[fugacity(p, temperature)] for p in pressures]
+    while True:
+        keys = list(simulated)
+        result = reweight_isotherm([simulated[p] for p in keys], [temperature] * len(keys),
+                                   [fugacity(p, temperature) for p in keys], [temperature] * len(pressures),
+                                   targets, bootstrap=0)
+        candidates = [(e, p) for e, p in zip(result['effective_samples'], pressures)
+                      if e < min_effective and p not in simulated]
+        if len(candidates) == 0:
+            break
+        p = min(candidates)[1]
+        simulated[p] = simulate(p)
+
+    keys = sorted(simulated)
+    runs = [simulated[p] for p in keys]
+    results = {'simulated': keys}
+    for t in [temperature] + [float(t) for t in target_temperatures]:
+        results[t] = reweight_isotherm(runs, [temperature] * len(keys), [fugacity(p, temperature) for p in keys],
+                                       [t] * len(pressures), [fugacity(p, t) for p in pressures], bootstrap, blocks)
+    return results
+
+
+def gcmc_isotherm(structure: CifStructure, params: dict, adsorbates, fugacity, pressures, temperature,
+                  target_temperatures=(), cutoff=12.0, spacing=0.2, shifted=True, cycles=1000, initialization_cycles=500,
+                  min_effective=50.0, bootstrap=20, blocks=10):
+    '''
+        用NumPy GCMC（gcmc.gcmc，单原子吸附质）与adaptive_isotherm重建一个结构的等温线，所有模拟共用同一组能量网格
+        fugacity(pressure, temperature) -> 各组分的逸度(Pa)
+        返回adaptive_isotherm的结果，另加'cells': 模拟盒子（超晶胞）的晶胞数（结果中的分子数为整个模拟盒子的分子数）
+    '''
+    grids = framework_energy_grids(structure, params, adsorbates, cutoff, spacing, shifted)
+    cells = []
+
+    def simulate(pressure):
+        result = gcmc(structure, params, adsorbates, fugacity(pressure, temperature), temperature, cutoff, spacing,
+                      shifted, cycles, initialization_cycles, energy_grids=grids, record_samples=True)
+        cells.append(result['cells'])
+        return result['n'], result['energy']
+
+    result = adaptive_isotherm(simulate, fugacity, pressures, temperature, target_temperatures, min_effective,
+                               bootstrap, blocks)
+    result['cells'] = cells[0]
+    return result
@@ -0,0 +1,34 @@
+import os
+import shutil
+
+
+def link_file(src, dst):
+    '''
+        将不会被修改的输入文件放入任务目录：优先使用硬链接，其次符号链接，都失败时才复制
+        返回实际使用的方式："hardlink"、"symlink"或"copy"
+    '''
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(src), dst)
+        return "symlink"
+    except OSError:
+        pass
+    shutil.copy(src, dst)
+    return "copy"
+
+
+def link_directory_files(src_dir, dst_dir, exclude=()):
+    '''
+        将src_dir中的所有文件（不含子目录和exclude中的文件）链接到dst_dir
+    '''
+    for filename in os.listdir(src_dir):
+        src_file = os.path.join(src_dir, filename)
+        if filename in exclude or not os.path.isfile(src_file):
+            continue
+        link_file(src_file, os.path.join(dst_dir, filename))
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def standardize(X):
+    '''
+        按列标准化描述符矩阵（零均值、单位方差），方差为0的列保持为0
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    mean = X.mean(axis=0)
+    std = X.std(axis=0)
+    std[std == 0] = 1.0
+    return (X - mean) / std
+
+
+def _chunk_rows(n_centers, max_elements):
+    # 每块的行数，使距离矩阵(行数 x 中心数)不超过max_elements个元素
+    return max(1, int(max_elements // max(1, n_centers)))
+
+
+def assign_to_centers(X, centers, max_elements=2 ** 24):
+    '''
+        分块计算每个样本到最近中心的编号和平方距离，内存占用不超过max_elements个float64
+    '''
+    n = X.shape[0]
+    C = X[centers]
+    c_norm = (C ** 2).sum(axis=1)
+    labels = np.empty(n, dtype=np.int64)
+    dists = np.empty(n, dtype=np.float64)
+    step = _chunk_rows(len(centers), max_elements)
+    for start in range(0, n, step):
+        block = X[start:start + step]
+        d = (block ** 2).sum(axis=1)[:, None] - 2 * block @ C.T + c_norm[None, :]
+        labels[start:start + step] = d.argmin(axis=1)
+        dists[start:start + step] = np.maximum(d.min(axis=1), 0)
+    return labels, dists
+
+
+def farthest_point_sampling(X, k, seed=0):
+    '''
+        最远点采样，返回被选中样本的下标
+        每一步只需一次矩阵-向量乘积，内存占用为O(n)
+    '''
+    n = X.shape[0]
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    x_norm = (X ** 2).sum(axis=1)
+    selected = np.empty(k, dtype=np.int64)
+    selected[0] = rng.integers(n)
+    min_d = np.full(n, np.inf)
+    for i in range(1, k):
+        c = X[selected[i - 1]]
+        d = x_norm - 2 * (X @ c) + x_norm[selected[i - 1]]
+        np.minimum(min_d, d, out=min_d)
+        selected[i] = int(min_d.argmax())
+    return selected
+
+
+def k_medoids(X, k, seed=0, max_iter=20, sample_size=2000, max_elements=2 ** 24):
+    '''
+        k-medoids采样（交替分配/更新），以最远点采样结果作为初始中心
+        更新中心时每个簇最多随机抽取sample_size个成员求两两距离（CLARA思路），
+        因此内存占用与样本总数无关，适合10^5~10^6个结构
+    '''
+    n = X.shape[0]
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    medoids = farthest_point_sampling(X, k, seed=seed)
+    for _ in range(max_iter):
+        labels, _ = assign_to_centers(X, medoids, max_elements)
+        new_medoids = medoids.copy()
+        for j in range(k):
+            members = np.flatnonzero(labels == j)
+            if len(members) == 0:
+                continue
+            if len(members) > sample_size:
+                members = rng.choice(members, sample_size, replace=False)
+                members = np.union1d(members, [medoids[j]])
+            M = X[members]
+            m_norm = (M ** 2).sum(axis=1)
+            d = np.sqrt(np.maximum(m_norm[:, None] - 2 * M @ M.T + m_norm[None, :], 0))
+            new_medoids[j] = members[d.sum(axis=1).argmin()]
+        if np.array_equal(np.sort(new_medoids), np.sort(medoids)):
+            break
+        medoids = new_medoids
+    return medoids
@@ -0,0 +1,21 @@
+import math
+
+from ht_utils.cif_parser import get_cell_volume
+
+
+def get_unit_cell_numbers(a, b, c, alpha, beta, gamma, cutoff):
+    '''
+        根据截断半径计算各方向所需的晶胞数目，返回(na, nb, nc)，角度单位为度
+        与各驱动脚本中get_unit_cell()的算法相同
+    '''
+    V = get_cell_volume(a, b, c, alpha, beta, gamma)
+    alpha, beta, gamma = [x * math.pi / 180 for x in (alpha, beta, gamma)]
+
+    # 各个方向的最小距离，即平行六面体各个方向的高，等于体积除以底面积
+    perpendicular_length_x = V / (b * c * math.sin(alpha))
+    perpendicular_length_y = V / (a * c * math.sin(beta))
+    perpendicular_length_z = V / (a * b * math.sin(gamma))
+
+    return (math.ceil(2 * cutoff / perpendicular_length_x),
+            math.ceil(2 * cutoff / perpendicular_length_y),
+            math.ceil(2 * cutoff / perpendicular_length_z))
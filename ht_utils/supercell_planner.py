@@ -0,0 +1,49 @@
+import numpy as np
+
+
+def perpendicular_widths(cells):
+    '''
+        批量计算晶胞各方向的垂直宽度（平行六面体各个方向的高）
+        cells: (n, 6)数组，每行为a, b, c, alpha, beta, gamma，角度单位为度
+        返回(n, 3)数组
+    '''
+    cells = np.asarray(cells, dtype=np.float64)
+    a, b, c = cells[:, 0], cells[:, 1], cells[:, 2]
+    alpha, beta, gamma = np.radians(cells[:, 3]), np.radians(cells[:, 4]), np.radians(cells[:, 5])
+    V = a * b * c * (1 + 2 * np.cos(alpha) * np.cos(beta) * np.cos(gamma) - np.cos(alpha) ** 2
+                     - np.cos(beta) ** 2 - np.cos(gamma) ** 2) ** 0.5
+    return np.stack([V / (b * c * np.sin(alpha)),
+                     V / (a * c * np.sin(beta)),
+                     V / (a * b * np.sin(gamma))], axis=1)
+
+
+def plan_unit_cells(cells, cutoffs):
+    '''
+        一次性计算所有结构在所有截断半径下所需的晶胞数目
+        返回(n, m, 3)的整数数组，m为截断半径的个数，结果与get_unit_cell()一致
+    '''
+    widths = perpendicular_widths(cells)
+    cutoffs = np.asarray(cutoffs, dtype=np.float64)
+    return np.ceil(2 * cutoffs[None, :, None] / widths[:, None, :]).astype(np.int64)
+
+
+def estimate_cost(unit_cells, n_atoms):
+    '''
+        估算各截断半径下的计算量
+        每个吸附质原子的能量计算需要遍历超胞中的全部框架原子，因此以超胞原子数作为原子对数目的估计
+        unit_cells: plan_unit_cells()的返回值; n_atoms: (n,)每个结构单胞中的原子数
+        返回字典，各值均为长度为m的数组
+    '''
+    n_cells = unit_cells.prod(axis=2)
+    pair_cost = n_cells * np.asarray(n_atoms, dtype=np.float64)[:, None]
+    total = pair_cost.sum(axis=0)
+    # 与上一个截断半径相比，晶胞数目发生变化的结构数
+    n_changed = np.concatenate([[0], (n_cells[:, 1:] != n_cells[:, :-1]).sum(axis=0)])
+    return {
+        'total_unit_cells': n_cells.sum(axis=0),
+        'mean_unit_cells': n_cells.mean(axis=0),
+        'max_unit_cells': n_cells.max(axis=0),
+        'total_atom_pairs': total,
+        'relative_cost': total / total[0],
+        'n_changed': n_changed,
+    }
@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure
+from ht_utils.energy_grid import cell_widths, get_pair_parameters, _periodic_images
+from ht_utils.framework_descriptors import framework_descriptors
+
+AVOGADRO = 6.02214076e23
+# 与RASPA2的SurfaceAreaProbeDistance一致：Sigma为sigma_ij，Minimum为LJ势能最低点2^(1/6) sigma_ij
+PROBE_DISTANCE_SCALES = {'sigma': 1.0, 'minimum': 2 ** (1 / 6)}
+
+
+def sphere_points(n):
+    '''
+        单位球面上近似均匀分布的n个点（Fibonacci螺旋），返回(n, 3)
+    '''
+    i = np.arange(n) + 0.5
+    z = 1 - 2 * i / n
+    r = np.sqrt(1 - z * z)
+    phi = math.pi * (3 - math.sqrt(5)) * i
+    return np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=1)
+
+
+def accessible_surface_area(structure: CifStructure, radii, samples_per_atom=500, max_elements=2 ** 24):
+    '''
+        计算晶胞中的可及表面积(埃^2)：在每个原子半径为radii的球面上取点，不落在任何其它原子（含周期镜像）球内的点
+        计为可及，原子的贡献为4 pi R^2 乘以可及点的比例
+        使用元胞列表：元胞宽度不小于最大半径，只检查相邻元胞中的原子镜像
+    '''
+    radii = np.asarray(radii, dtype=np.float64)
+    r_max = radii.max()
+    lattice = structure.lattice()
+    widths = cell_widths(lattice)
+    frac = structure.frac - np.floor(structure.frac)
+
+    # 球面上的点距晶胞不超过r_max，可能遮挡它们的原子距晶胞不超过2 r_max
+    images, index = _periodic_images(frac, widths, 2 * r_max)
+    atoms = images @ lattice
+    atoms_sq = (atoms * atoms).sum(axis=1)
+    radii2 = radii[index] ** 2
+
+    nbins = np.maximum(1, np.floor(widths / r_max)).astype(int)
+    reach = np.ceil(2 * r_max / widths * nbins).astype(int)
+    atom_bins = np.floor(images * nbins).astype(int)
+    center_bins = np.floor(frac * nbins).astype(int)
+    centers = frac @ lattice
+    unit = sphere_points(samples_per_atom)
+
+    accessible = np.zeros(len(frac))
+    for b in np.unique(center_bins, axis=0):
+        members = np.nonzero((center_bins == b).all(axis=1))[0]
+        selected = np.nonzero((np.abs(atom_bins - b) <= reach).all(axis=1))[0]
+        a, a_sq, r2 = atoms[selected], atoms_sq[selected], radii2[selected]
+        step = max(1, max_elements // (samples_per_atom * len(selected)))
+        for start in range(0, len(members), step):
+            m = members[start:start + step]
+            points = (centers[m, None, :] + radii[m, None, None] * unit[None, :, :]).reshape(-1, 3)
+            d2 = (points * points).sum(axis=1)[:, None] + a_sq[None, :] - 2 * points @ a.T
+            # 点到自身原子的距离恰为R，留出相对误差避免被自身遮挡
+            buried = (d2 < r2[None, :] * (1 - 1e-9)).any(axis=1)
+            accessible[m] = 1 - buried.reshape(len(m), samples_per_atom).mean(axis=1)
+    return float((4 * math.pi * radii * radii * accessible).sum())
+
+
+def surface_area(structure: CifStructure, params: dict, probe='N_n2', probe_distance='sigma', samples_per_atom=500):
+    '''
+        返回{'A^2': 晶胞的可及表面积, 'm^2/g': 质量比表面积, 'm^2/cm^3': 体积比表面积}
+        原子球半径为原子与探针的Lorentz-Berthelot sigma_ij（probe_distance = minimum时乘以2^(1/6)）
+    '''
+    _, sigma = get_pair_parameters(structure, params, probe)
+    area = accessible_surface_area(structure, sigma * PROBE_DISTANCE_SCALES[probe_distance.lower()], samples_per_atom)
+    mass = float(framework_descriptors(structure)['framework_mass_g/mol'])
+    return {'A^2': area,
+            'm^2/g': area * 1e-20 * AVOGADRO / mass,
+            'm^2/cm^3': area * 1e4 / float(structure.volume())}
@@ -0,0 +1,93 @@
+import re
+from fractions import Fraction
+
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure
+
+_TERM = re.compile(r'([+-]?)([0-9.]+(?:/[0-9.]+)?)?\*?([xyz])?')
+
+
+def parse_symop(symop: str):
+    '''
+        解析对称操作字符串（如"-x+1/2,y,-z"），返回(R, t)，新的分数坐标 = R @ 坐标 + t
+    '''
+    parts = symop.replace(' ', '').lower().split(',')
+    if len(parts) != 3:
+        raise ValueError("无法解析的对称操作 (invalid symmetry operation): " + symop)
+    R = np.zeros((3, 3))
+    t = np.zeros(3)
+    for i, part in enumerate(parts):
+        pos = 0
+        while pos < len(part):
+            m = _TERM.match(part, pos)
+            if m is None or m.end() == pos:
+                raise ValueError("无法解析的对称操作 (invalid symmetry operation): " + symop)
+            sign = -1.0 if m.group(1) == '-' else 1.0
+            number = float(Fraction(m.group(2))) if m.group(2) else None
+            if m.group(3):
+                R[i, 'xyz'.index(m.group(3))] += sign * (number if number is not None else 1.0)
+            elif number is not None:
+                t[i] += sign * number
+            pos = m.end()
+    return R, t
+
+
+def _min_image_distances(frac_a, frac_b, lattice):
+    # frac_a: (..., 3), frac_b: (..., 3)，广播后计算最小镜像距离
+    d = frac_a - frac_b
+    d -= np.round(d)
+    return np.linalg.norm(d @ lattice, axis=-1)
+
+
+def _unique_images(images, lattice, tol, max_elements):
+    # images: (n, m, 3)，每个原子的m个对称像；返回(n, m)的布尔数组，标记每个原子中需要保留的像
+    n, m, _ = images.shape
+    keep = np.ones((n, m), dtype=bool)
+    step = max(1, max_elements // max(1, m * m * 3))
+    for start in range(0, n, step):
+        block = images[start:start + step]
+        dist = _min_image_distances(block[:, :, None, :], block[:, None, :, :], lattice)
+        # 与前面的某个像重合的像被丢弃
+        earlier = np.tril(np.ones((m, m), dtype=bool), k=-1)
+        keep[start:start + step] = ~((dist < tol) & earlier[None]).any(axis=2)
+    return keep
+
+
+def _unique_sites(frac, lattice, tol, max_elements):
+    # 不同原始位点之间的重复原子（保留先出现的）
+    n = len(frac)
+    keep = np.ones(n, dtype=bool)
+    step = max(1, max_elements // max(1, n * 3))
+    for start in range(0, n, step):
+        stop = min(n, start + step)
+        dist = _min_image_distances(frac[start:stop, None, :], frac[None, :, :], lattice)
+        earlier = np.arange(n)[None, :] < np.arange(start, stop)[:, None]
+        keep[start:stop] = ~((dist < tol) & earlier).any(axis=1)
+    return keep
+
+
+def expand_to_p1(structure: CifStructure, tol=0.1, max_elements=2 ** 24):
+    '''
+        将对称操作作用于不对称单元中的全部原子，得到P1结构
+        在周期性边界条件下，距离小于tol(埃)的原子视为同一原子，只保留一个
+    '''
+    ops = [parse_symop(op) for op in structure.symops]
+    R = np.stack([op[0] for op in ops])
+    t = np.stack([op[1] for op in ops])
+    lattice = structure.lattice()
+
+    # (n_atoms, n_ops, 3)
+    images = np.einsum('kij,nj->nki', R, structure.frac) + t[None, :, :]
+    images -= np.floor(images)
+    keep = _unique_images(images, lattice, tol, max_elements)
+
+    atom_index = np.nonzero(keep)[0]
+    frac = images[keep]
+    site_keep = _unique_sites(frac, lattice, tol, max_elements)
+    atom_index = atom_index[site_keep]
+    frac = frac[site_keep]
+
+    charges = None if structure.charges is None else structure.charges[atom_index]
+    return CifStructure(structure.name, structure.cell, structure.labels[atom_index],
+                        structure.symbols[atom_index], frac, charges, ['x,y,z'])
@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+
+from ht_utils.cif_atoms import CifStructure
+from ht_utils.energy_grid import get_pair_parameters, lj_energy_grid, tail_correction
+from ht_utils.framework_descriptors import framework_descriptors
+
+# 气体常数 J/(mol K)
+GAS_CONSTANT = 8.314462618
+
+
+def read_pseudo_atom_charges(ff_dir):
+    '''
+        读取力场目录中pseudo_atoms.def定义的各伪原子电荷，返回{伪原子: 电荷}
+    '''
+    with open(os.path.join(ff_dir, "pseudo_atoms.def")) as f:
+        lines = [line for line in f.readlines() if len(line.strip()) > 0]
+    n = int(lines[1].split()[0])
+    charges = {}
+    for line in lines[3:3 + n]:
+        spline = line.split()
+        charges[spline[0]] = float(spline[6])
+    return charges
+
+
+def read_molecule_definition(def_location):
+    '''
+        读取RASPA格式的分子定义文件，返回(伪原子名列表, 原子坐标(n, 3))，只支持刚性分子
+    '''
+    with open(def_location) as f:
+        lines = [line.strip() for line in f if len(line.strip()) > 0 and not line.strip().startswith('#')]
+    n_atoms = int(lines[3].split()[0])
+    n_groups = int(lines[4].split()[0])
+    names, positions = [], []
+    i = 5
+    for _ in range(n_groups):
+        if lines[i].lower() != 'rigid':
+            raise ValueError("只支持刚性分子 (only rigid molecules are supported): " + def_location)
+        n = int(lines[i + 1].split()[0])
+        for line in lines[i + 2:i + 2 + n]:
+            spline = line.split()
+            names.append(spline[1])
+            positions.append([float(x) for x in spline[2:5]])
+        i += 2 + n
+    if len(names) != n_atoms:
+        raise ValueError("分子定义中的原子数不一致 (inconsistent number of atoms): " + def_location)
+    return names, np.array(positions).reshape(-1, 3)
+
+
+def random_rotations(n, rng):
+    '''
+        均匀分布的随机旋转矩阵(n, 3, 3)（由单位四元数生成）
+    '''
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1)[:, None]
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1)], axis=1)
+
+
+def interpolate_grid(grid, frac):
+    '''
+        对周期性网格（网格点在分数坐标(i + 0.5) / n）做三线性插值，frac为(m, 3)的分数坐标
+        grid的形状为(..., n_a, n_b, n_c)，前面的维度（如不同温度）一起插值，返回(..., m)
+    '''
+    shape = np.array(grid.shape[-3:])
+    flat = grid.reshape(grid.shape[:-3] + (-1,))
+    x = frac * shape - 0.5
+    i0 = np.floor(x).astype(int)
+    t = x - i0
+    result = np.zeros(grid.shape[:-3] + frac.shape[:-1])
+    for corner in np.ndindex(2, 2, 2):
+        c = np.array(corner)
+        idx = (i0 + c) % shape
+        weight = np.prod(np.where(c == 1, t, 1 - t), axis=-1)
+        result += weight * flat[..., (idx[..., 0] * shape[1] + idx[..., 1]) * shape[2] + idx[..., 2]]
+    return result
+
+
+def widom_grid(structure: CifStructure, params: dict, names, positions, temperature=298.0, cutoff=12.0, spacing=0.3,
+               shifted=True, tail_corrections=False, insertions=200000, seed=0, return_error=False):
+    '''
+        用能量网格做Widom插入（刚性分子，只计算Lennard-Jones作用），返回(平均Rosenbluth权重<W>, <U W>/<W>)，能量单位K
+        每种伪原子计算一个能量网格；单原子分子直接对整个网格积分，多原子分子随机取insertions个位置与取向，
+        插值各原子的Boltzmann因子
+        return_error为True时另外返回<W>的误差：多原子分子为插入样本的标准误差，单原子分子为整个网格与每隔一个
+        网格点的粗网格平均值之差（网格离散误差的估计）
+        temperature可以是温度列表：所有温度共用同一组能量网格与插入位置，返回与温度对应的数组
+    '''
+    temperatures = np.atleast_1d(np.asarray(temperature, dtype=np.float64))
+    # 温度放在第一维，与网格或插入点的维度广播
+    t = temperatures[:, None]
+    grids = {}
+    shift = 0.0
+    for name in names:
+        eps, sigma = get_pair_parameters(structure, params, name)
+        # 没有Lennard-Jones作用的位点（如N2的质心N_com）不需要网格
+        if params[name][0] == 0:
+            continue
+        if name not in grids:
+            grids[name] = lj_energy_grid(structure, eps, sigma, cutoff, spacing, shifted)
+        if tail_corrections:
+            shift += tail_correction(structure, eps, sigma, cutoff)
+
+    if len(grids) == 0:
+        average_weight, average_energy = np.ones(len(temperatures)), np.zeros(len(temperatures))
+        error = np.zeros(len(temperatures))
+    else:
+        if len(names) == 1:
+            energy = grids[names[0]].ravel()[None, :] + shift
+            with np.errstate(over='ignore'):
+                weight = np.exp(-energy / t)
+                coarse = np.exp(-(grids[names[0]][::2, ::2, ::2].ravel()[None, :] + shift) / t).mean(axis=1)
+            error = np.abs(weight.mean(axis=1) - coarse)
+        else:
+            rng = np.random.default_rng(seed)
+            inv_lattice = np.linalg.inv(structure.lattice())
+            sites = np.asarray(positions) - np.asarray(positions).mean(axis=0)
+            # (insertions, n_sites, 3)的原子笛卡尔坐标相对分子中心的位移，转为分数坐标
+            displacement = np.einsum('nij,sj->nsi', random_rotations(insertions, rng), sites) @ inv_lattice
+            frac = rng.random((insertions, 1, 3)) + displacement
+            # 插值Boltzmann因子而不是能量：能量在原子附近急剧上升，线性插值会明显高估能量
+            with np.errstate(over='ignore'):
+                factors = {name: np.exp(-grid[None] / temperatures[:, None, None, None])
+                           for name, grid in grids.items()}
+            weight = np.repeat(np.exp(-shift / t), insertions, axis=1)
+            for k, name in enumerate(names):
+                if name not in grids:
+                    continue
+                weight *= interpolate_grid(factors[name], frac[:, k, :] - np.floor(frac[:, k, :]))
+            with np.errstate(divide='ignore'):
+                energy = -t * np.log(weight)
+            error = weight.std(axis=1) / np.sqrt(insertions)
+
+        average_weight = weight.mean(axis=1)
+        with np.errstate(invalid='ignore'):
+            energy_weight = np.where(weight > 0, energy * weight, 0.0).mean(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            average_energy = np.where(average_weight > 0, energy_weight / average_weight, np.nan)
+
+    if np.ndim(temperature) == 0:
+        if return_error:
+            return float(average_weight[0]), float(average_energy[0]), float(error[0])
+        return float(average_weight[0]), float(average_energy[0])
+    if return_error:
+        return average_weight, average_energy, error
+    return average_weight, average_energy
+
+
+def henry_coefficient(structure: CifStructure, params: dict, names, positions, temperature=298.0, cutoff=12.0,
+                      spacing=0.3, shifted=True, tail_corrections=False, insertions=200000, seed=0, masses=None):
+    '''
+        返回{'Henry_coefficient': 亨利系数(mol/kg/Pa), 'Henry_coefficient_error': 亨利系数的误差,
+        'Heat_of_adsorption': Widom插入法的吸附热(kJ/mol)}
+        K_H = <W> / (R T rho)，吸附热 = (<U W>/<W> - T) R，与RASPA2的[Widom] Average <U_gh>_1-<U_h>_0 - RT相同，
+        吸附放热时为负值
+        temperature为温度列表时，各个值都是与温度对应的数组；masses为力场的{伪原子: 质量}，用于计算框架密度
+    '''
+    average_weight, energy, error = widom_grid(structure, params, names, positions, temperature, cutoff, spacing,
+                                               shifted, tail_corrections, insertions, seed, return_error=True)
+    density = float(framework_descriptors(structure, masses)['Framework_density_kg/m^3'])
+    temperature = np.asarray(temperature, dtype=np.float64) if np.ndim(temperature) > 0 else temperature
+    return {'Henry_coefficient': average_weight / (GAS_CONSTANT * temperature * density),
+            'Henry_coefficient_error': error / (GAS_CONSTANT * temperature * density),
+            'Heat_of_adsorption': (energy - temperature) * GAS_CONSTANT / 1000}
+
+
+def vant_hoff_fit(temperatures, henry):
+    '''
+        van't Hoff拟合 ln K_H = ln K_0 - Q / (R T)，henry为(..., n_T)的亨利系数数组，沿最后一维做最小二乘
+        返回(Q(kJ/mol，与henry_coefficient的吸附热符号相同，吸附放热时为负值), K_0(与K_H单位相同), R^2)，
+        各为(...)的数组；K_H不为正的行返回nan
+    '''
+    x = 1.0 / np.asarray(temperatures, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.log(np.where(np.asarray(henry) > 0, henry, np.nan))
+        dx = x - x.mean()
+        dy = y - y.mean(axis=-1, keepdims=True)
+        slope = (dy * dx).sum(axis=-1) / (dx * dx).sum()
+        intercept = y.mean(axis=-1) - slope * x.mean()
+        residual = dy - slope[..., None] * dx
+        r2 = 1 - (residual * residual).sum(axis=-1) / (dy * dy).sum(axis=-1)
+    return -slope * GAS_CONSTANT / 1000, np.exp(intercept), r2
@@ -0,0 +1,66 @@
+import configparser
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_catalog import build_catalog, default_catalog_path
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "CATALOG_CONFIG"
+    full_options = ['cif_location', 'cutoffs', 'max_processes', 'catalog_file']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    cif_dir = os.path.abspath(option_dic['cif_location'])
+    if not os.path.isdir(cif_dir):
+        print('cif目录无效！(Invalid cif_location!)')
+        exit()
+
+    try:
+        cutoffs = [float(c) for c in option_dic['cutoffs'].split(',') if len(c.strip()) > 0]
+    except:
+        print("截断半径必须为数字！(cutoffs must be numerical !)")
+        exit()
+
+    try:
+        max_processes = int(option_dic['max_processes'])
+    except:
+        print("进程数必须为整数！(max_processes must be integer !)")
+        exit()
+
+    catalog_file = option_dic['catalog_file'].strip()
+    if len(catalog_file) == 0:
+        catalog_file = default_catalog_path(cif_dir)
+    catalog_file = os.path.abspath(catalog_file)
+
+    return cif_dir, cutoffs, max_processes, catalog_file
+
+
+def main():
+    cif_dir, cutoffs, max_processes, catalog_file = check_parameters()
+    start = time.time()
+    n_parsed, n_total = build_catalog(cif_dir, catalog_file, cutoffs, max_processes)
+    print("\033[0;30;42m\n完成！解析 {} / {} 个cif文件，用时 {:.1f} s (Finish, {} of {} cif files parsed in {:.1f} s)\n\033[0m".format(
+        n_parsed, n_total, time.time() - start, n_parsed, n_total, time.time() - start))
+    print(catalog_file)
+
+
+if __name__ == '__main__':
+    main()
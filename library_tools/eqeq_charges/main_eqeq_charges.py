@@ -0,0 +1,163 @@
+import configparser
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_atoms import CifStructure, read_cif_atoms, write_cif
+from ht_utils.cif_catalog import file_sha1
+from ht_utils.eqeq import assign_charges
+from ht_utils.p1_cache import default_eqeq_cache_dir, p1_cache_path
+from ht_utils.symmetry import expand_to_p1
+
+REPORT_HEADERS = ['name', 'status', 'n_atoms', 'max_abs_charge', 'message']
+PARAMS_FILE_NAME = "eqeq_params.txt"
+
+
+def charge_batch(args):
+    # 在子进程中处理一批cif文件：读取、展开为P1、批量求解EQeq电荷并写入缓存，返回报告中的行
+    cif_locations, cache_dir, params, only_missing, recompute = args
+    rows = {}
+    todo = []
+    for cif_location in cif_locations:
+        name = os.path.basename(cif_location)[:-4]
+        try:
+            target = p1_cache_path(cache_dir, file_sha1(cif_location))
+            if os.path.isfile(target) and not recompute:
+                rows[name] = [name, 'cached', '', '', '']
+                continue
+            structure = read_cif_atoms(cif_location)
+            if only_missing and structure.charges is not None:
+                rows[name] = [name, 'skipped', structure.n_atoms, '', 'charges already present']
+                continue
+            if not structure.is_p1():
+                structure = expand_to_p1(structure, tol=params['merge_tolerance'])
+            todo.append((name, structure, target))
+        except Exception as e:
+            rows[name] = [name, 'error', '', '', repr(e)]
+
+    if len(todo) > 0:
+        try:
+            charges = assign_charges([t[1] for t in todo], lam=params['lambda'],
+                                     hydrogen_ea=params['hydrogen_electron_affinity'],
+                                     cutoff=params['ewald_cutoff'])
+        except Exception:
+            # 批量求解失败时逐个求解，找出出错的结构
+            charges = []
+            for name, structure, target in todo:
+                try:
+                    charges.append(assign_charges([structure], lam=params['lambda'],
+                                                  hydrogen_ea=params['hydrogen_electron_affinity'],
+                                                  cutoff=params['ewald_cutoff'])[0])
+                except Exception as e:
+                    charges.append(e)
+        for (name, structure, target), q in zip(todo, charges):
+            if isinstance(q, Exception):
+                rows[name] = [name, 'error', structure.n_atoms, '', repr(q)]
+                continue
+            charged = CifStructure(structure.name, structure.cell, structure.labels, structure.symbols,
+                                   structure.frac, q, ['x,y,z'])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            write_cif(charged, target)
+            rows[name] = [name, 'charged', structure.n_atoms, "{:.4f}".format(np.abs(q).max()), '']
+    return [rows[os.path.basename(c)[:-4]] for c in cif_locations]
+
+
+def format_params(params):
+    return "\n".join("{} = {}".format(k, params[k]) for k in sorted(params)) + "\n"
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "EQEQ_CONFIG"
+    full_options = ['cif_location', 'only_missing_charges', 'lambda', 'hydrogen_electron_affinity',
+                    'ewald_cutoff', 'merge_tolerance', 'batch_size', 'max_processes']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    cif_dir = os.path.abspath(option_dic['cif_location'])
+    if not os.path.isdir(cif_dir):
+        print('cif目录无效！(Invalid cif_location!)')
+        exit()
+
+    only_missing = option_dic['only_missing_charges'].strip().lower() == 'yes'
+
+    params = {}
+    try:
+        for op in ['lambda', 'hydrogen_electron_affinity', 'ewald_cutoff', 'merge_tolerance']:
+            params[op] = float(option_dic[op])
+    except:
+        print("lambda, hydrogen_electron_affinity, ewald_cutoff, merge_tolerance必须为数字！"
+              "(lambda, hydrogen_electron_affinity, ewald_cutoff, merge_tolerance must be numerical !)")
+        exit()
+
+    try:
+        batch_size = int(option_dic['batch_size'])
+        max_processes = int(option_dic['max_processes'])
+    except:
+        print("batch_size, max_processes必须为整数！(batch_size, max_processes must be integer !)")
+        exit()
+
+    cifs = sorted(cif for cif in os.listdir(cif_dir) if cif.endswith('.cif'))
+    if len(cifs) == 0:
+        print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
+        exit()
+
+    return cif_dir, cifs, only_missing, params, batch_size, max_processes
+
+
+def main():
+    cif_dir, cifs, only_missing, params, batch_size, max_processes = check_parameters()
+    cache_dir = default_eqeq_cache_dir(cif_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    start = time.time()
+
+    # 参数改变后缓存中的电荷全部重新计算
+    params_file = os.path.join(cache_dir, PARAMS_FILE_NAME)
+    recompute = True
+    if os.path.isfile(params_file):
+        with open(params_file) as f:
+            recompute = f.read() != format_params(params)
+
+    paths = [os.path.join(cif_dir, cif) for cif in cifs]
+    tasks = [(paths[i:i + batch_size], cache_dir, params, only_missing, recompute)
+             for i in range(0, len(paths), batch_size)]
+    counts = {}
+    report_file = os.path.join(cache_dir, "eqeq_report.csv")
+    with open(report_file, 'w', newline='') as f, ProcessPoolExecutor(max_workers=max_processes) as pool:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADERS)
+        for rows in pool.map(charge_batch, tasks):
+            for row in rows:
+                writer.writerow(row)
+                counts[row[1]] = counts.get(row[1], 0) + 1
+
+    with open(params_file, 'w') as f:
+        f.write(format_params(params))
+
+    print("\033[0;30;42m\n完成！用时 {:.1f} s (Finish in {:.1f} s)\n\033[0m".format(time.time() - start, time.time() - start))
+    for status in ['charged', 'cached', 'skipped', 'error']:
+        print("    {}: {}".format(status, counts.get(status, 0)))
+    print(report_file)
+
+
+if __name__ == '__main__':
+    main()
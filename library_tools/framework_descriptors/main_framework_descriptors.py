@@ -0,0 +1,120 @@
+import configparser
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.framework_descriptors import read_framework_descriptors
+from ht_utils.gcmc import read_pseudo_atom_masses
+from ht_utils.p1_cache import find_p1_cif
+
+HEADERS = ['name', 'Framework_density_kg/m^3', 'Framework_density_g/cm^3', 'framework_mass_g/mol',
+           'volume_A^3', 'n_atoms', 'composition']
+
+
+def get_descriptors(args):
+    # 在子进程中计算单个结构的描述符，优先使用p1_cache/eqeq_cache中的P1结构
+    cif_dir, cif_file, tol, masses = args
+    try:
+        return read_framework_descriptors(find_p1_cif(cif_dir, cif_file), tol=tol, masses=masses)
+    except Exception as e:
+        return e
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "DESCRIPTOR_CONFIG"
+    full_options = ['cif_location', 'merge_tolerance', 'max_processes', 'output_file']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    cif_dir = os.path.abspath(option_dic['cif_location'])
+    if not os.path.isdir(cif_dir):
+        print('cif目录无效！(Invalid cif_location!)')
+        exit()
+
+    try:
+        tol = float(option_dic['merge_tolerance'])
+    except:
+        print("merge_tolerance必须为数字！(merge_tolerance must be numerical !)")
+        exit()
+
+    try:
+        max_processes = int(option_dic['max_processes'])
+    except:
+        print("进程数必须为整数！(max_processes must be integer !)")
+        exit()
+
+    output_file = os.path.abspath(option_dic['output_file'])
+
+    # 可选：原子质量取自力场目录中的pseudo_atoms.def
+    masses = None
+    ff_dir = config.get(section, 'forcefield_dir', fallback='').strip()
+    if len(ff_dir) > 0:
+        ff_dir = os.path.abspath(ff_dir)
+        if not os.path.isfile(os.path.join(ff_dir, 'pseudo_atoms.def')):
+            print('forcefield_dir中没有pseudo_atoms.def！(There is no pseudo_atoms.def in forcefield_dir !)')
+            exit()
+        try:
+            masses = read_pseudo_atom_masses(ff_dir)
+        except (ValueError, IndexError):
+            print('无法读取forcefield_dir中的pseudo_atoms.def！(Cannot read pseudo_atoms.def in forcefield_dir !)')
+            exit()
+
+    cifs = sorted(cif for cif in os.listdir(cif_dir) if cif.endswith('.cif'))
+    if len(cifs) == 0:
+        print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
+        exit()
+
+    return cif_dir, cifs, tol, max_processes, output_file, masses
+
+
+def main():
+    cif_dir, cifs, tol, max_processes, output_file, masses = check_parameters()
+    start = time.time()
+
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        results = list(pool.map(get_descriptors, [(cif_dir, cif, tol, masses) for cif in cifs], chunksize=64))
+
+    # 各元素的原子数目按整个结构库中出现的元素展开为单独的列
+    elements = sorted(set(e for r in results if not isinstance(r, Exception) for e in r['counts']))
+    n_errors = 0
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS + ['n_' + e for e in elements])
+        for cif, r in zip(cifs, results):
+            if isinstance(r, Exception):
+                writer.writerow([cif[:-4], 'Error'])
+                print("\033[0;37;41m{} error: {}\033[0m".format(cif[:-4], repr(r)))
+                n_errors += 1
+                continue
+            row = [cif[:-4]]
+            for h in HEADERS[1:]:
+                value = r[h]
+                row.append("{:.6f}".format(value) if isinstance(value, float) else value)
+            row += [r['counts'].get(e, 0) for e in elements]
+            writer.writerow(row)
+
+    print("\033[0;30;42m\n完成！共 {} 个结构，{} 个出错，用时 {:.1f} s (Finish, {} structures, {} errors, {:.1f} s)\n\033[0m".format(
+        len(cifs), n_errors, time.time() - start, len(cifs), n_errors, time.time() - start))
+    print(output_file)
+
+
+if __name__ == '__main__':
+    main()
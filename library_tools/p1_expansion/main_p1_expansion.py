@@ -0,0 +1,105 @@
+import configparser
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_atoms import read_cif_atoms, write_cif
+from ht_utils.cif_catalog import file_sha1
+from ht_utils.p1_cache import default_p1_cache_dir, p1_cache_path
+from ht_utils.symmetry import expand_to_p1
+
+REPORT_HEADERS = ['name', 'status', 'n_atoms', 'n_atoms_p1', 'message']
+
+
+def expand_cif(args):
+    # 在子进程中处理单个cif文件，返回报告中的一行
+    cif_location, cache_dir, tol = args
+    name = os.path.basename(cif_location)[:-4]
+    try:
+        p1_location = p1_cache_path(cache_dir, file_sha1(cif_location))
+        if os.path.isfile(p1_location):
+            return [name, 'cached', '', '', '']
+        structure = read_cif_atoms(cif_location)
+        if structure.is_p1():
+            return [name, 'p1', structure.n_atoms, structure.n_atoms, '']
+        p1 = expand_to_p1(structure, tol=tol)
+        os.makedirs(os.path.dirname(p1_location), exist_ok=True)
+        write_cif(p1, p1_location)
+        return [name, 'expanded', structure.n_atoms, p1.n_atoms, '']
+    except Exception as e:
+        return [name, 'error', '', '', repr(e)]
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "P1_CONFIG"
+    full_options = ['cif_location', 'merge_tolerance', 'max_processes']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    cif_dir = os.path.abspath(option_dic['cif_location'])
+    if not os.path.isdir(cif_dir):
+        print('cif目录无效！(Invalid cif_location!)')
+        exit()
+
+    try:
+        tol = float(option_dic['merge_tolerance'])
+    except:
+        print("merge_tolerance必须为数字！(merge_tolerance must be numerical !)")
+        exit()
+
+    try:
+        max_processes = int(option_dic['max_processes'])
+    except:
+        print("进程数必须为整数！(max_processes must be integer !)")
+        exit()
+
+    cifs = sorted(cif for cif in os.listdir(cif_dir) if cif.endswith('.cif'))
+    if len(cifs) == 0:
+        print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
+        exit()
+
+    return cif_dir, cifs, tol, max_processes
+
+
+def main():
+    cif_dir, cifs, tol, max_processes = check_parameters()
+    cache_dir = default_p1_cache_dir(cif_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    start = time.time()
+
+    counts = {}
+    report_file = os.path.join(cache_dir, "p1_report.csv")
+    with open(report_file, 'w', newline='') as f, ProcessPoolExecutor(max_workers=max_processes) as pool:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADERS)
+        tasks = [(os.path.join(cif_dir, cif), cache_dir, tol) for cif in cifs]
+        for row in pool.map(expand_cif, tasks, chunksize=16):
+            writer.writerow(row)
+            counts[row[1]] = counts.get(row[1], 0) + 1
+
+    print("\033[0;30;42m\n完成！用时 {:.1f} s (Finish in {:.1f} s)\n\033[0m".format(time.time() - start, time.time() - start))
+    for status in ['expanded', 'cached', 'p1', 'error']:
+        print("    {}: {}".format(status, counts.get(status, 0)))
+    print(report_file)
+
+
+if __name__ == '__main__':
+    main()
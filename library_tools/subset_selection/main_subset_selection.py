@@ -0,0 +1,175 @@
+import configparser
+import csv
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.cif_parser import read_cell_parameters, get_cell_volume
+from ht_utils.subset import standardize, farthest_point_sampling, k_medoids
+
+ZEO_COLUMNS = ['LCD', 'PLD', 'desity(g/cm^3)', 'VSA(m^2/cm^3)', 'GSA(m^2/g)', 'Vp(cm^3/g)', 'void_fraction']
+CELL_COLUMNS = ['a', 'b', 'c', 'alpha', 'beta', 'gamma', 'volume']
+
+
+def read_cell_descriptors(cif_path):
+    try:
+        cell = read_cell_parameters(cif_path)
+    except Exception:
+        return None
+    return list(cell) + [get_cell_volume(*cell)]
+
+
+def get_cell_matrix(cif_dir, cifs, max_processes):
+    X = np.full((len(cifs), len(CELL_COLUMNS)), np.nan)
+    paths = [os.path.join(cif_dir, cif) for cif in cifs]
+    # 结构目录中已有的记录直接使用，其余的cif文件并行解析
+    catalog = open_catalog(cif_dir)
+    todo = []
+    for i, path in enumerate(paths):
+        row = catalog.lookup(path) if catalog is not None else None
+        if row is not None:
+            X[i] = [row[c] for c in CELL_COLUMNS]
+        else:
+            todo.append(i)
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        rows = pool.map(read_cell_descriptors, [paths[i] for i in todo], chunksize=256)
+        for i, row in zip(todo, rows):
+            if row is not None:
+                X[i] = row
+    return X
+
+
+def get_zeo_matrix(zeo_result, cifs):
+    index = {cif[:-4]: i for i, cif in enumerate(cifs)}
+    X = np.full((len(cifs), len(ZEO_COLUMNS)), np.nan)
+    with open(zeo_result, 'r') as f:
+        for row in csv.DictReader(f):
+            i = index.get(row['name'])
+            if i is None:
+                continue
+            try:
+                X[i] = [float(row[c]) for c in ZEO_COLUMNS]
+            except (TypeError, ValueError):
+                # zeo++计算失败的行（name,error）
+                pass
+    return X
+
+
+def write_subset(cif_dir, cifs, output_dir):
+    os.makedirs(output_dir)
+    for cif in cifs:
+        src = os.path.join(cif_dir, cif)
+        dst = os.path.join(output_dir, cif)
+        try:
+            os.symlink(src, dst)
+        except OSError:
+            shutil.copy(src, dst)
+    with open(os.path.join(output_dir, "subset_list.txt"), 'w') as f:
+        for cif in cifs:
+            f.write(cif + "\n")
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "SUBSET_CONFIG"
+    full_options = ['cif_location', 'zeo_result', 'use_cell_parameters', 'method', 'subset_size',
+                    'random_seed', 'max_processes', 'output_dir']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    cif_dir = os.path.abspath(option_dic['cif_location'])
+    zeo_result = option_dic['zeo_result'].strip()
+    use_cell = option_dic['use_cell_parameters'].strip().lower() == 'yes'
+    method = option_dic['method'].strip().lower()
+    output_dir = os.path.abspath(option_dic['output_dir'])
+
+    if not os.path.isdir(cif_dir):
+        print('cif目录无效！(Invalid cif_location!)')
+        exit()
+
+    if len(zeo_result) > 0:
+        zeo_result = os.path.abspath(zeo_result)
+        if not os.path.isfile(zeo_result):
+            print('zeo++结果文件无效！(Invalid zeo_result!)')
+            exit()
+
+    if len(zeo_result) == 0 and not use_cell:
+        print("至少需要一种描述符！(At least one kind of descriptor is required !)")
+        exit()
+
+    if method not in ['fps', 'kmedoids']:
+        print("采样方法必须为fps或kmedoids！(method must be fps or kmedoids !)")
+        exit()
+
+    try:
+        subset_size = int(option_dic['subset_size'])
+        random_seed = int(option_dic['random_seed'])
+        max_processes = int(option_dic['max_processes'])
+    except:
+        print("subset_size, random_seed, max_processes必须为整数！(subset_size, random_seed, max_processes must be integer !)")
+        exit()
+
+    if os.path.exists(output_dir):
+        print("输出目录已存在，请手动删除后重试！(The output_dir already exists, please delete it and try again !)")
+        exit()
+
+    cifs = sorted(cif for cif in os.listdir(cif_dir) if cif.endswith('.cif'))
+    if len(cifs) == 0:
+        print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
+        exit()
+
+    return cif_dir, cifs, zeo_result, use_cell, method, subset_size, random_seed, max_processes, output_dir
+
+
+def main():
+    cif_dir, cifs, zeo_result, use_cell, method, subset_size, random_seed, max_processes, output_dir = check_parameters()
+
+    blocks = []
+    if len(zeo_result) > 0:
+        blocks.append(get_zeo_matrix(zeo_result, cifs))
+    if use_cell:
+        blocks.append(get_cell_matrix(cif_dir, cifs, max_processes))
+    X = np.hstack(blocks)
+
+    # 丢弃描述符不完整的结构
+    valid = np.flatnonzero(np.isfinite(X).all(axis=1))
+    if len(valid) < len(cifs):
+        print("{} 个结构缺少描述符，已跳过 ({} structures without complete descriptors are skipped)".format(
+            len(cifs) - len(valid), len(cifs) - len(valid)))
+    if len(valid) == 0:
+        print("没有可用的结构！(No structures with complete descriptors !)")
+        exit()
+    X = standardize(X[valid])
+
+    if method == 'fps':
+        selected = farthest_point_sampling(X, subset_size, seed=random_seed)
+    else:
+        selected = k_medoids(X, subset_size, seed=random_seed)
+    subset = [cifs[valid[i]] for i in np.unique(selected)]
+
+    write_subset(cif_dir, subset, output_dir)
+    print("\033[0;30;42m\n完成！共选出 {} 个结构 (Finish, {} structures selected)\n\033[0m".format(
+        len(subset), len(subset)))
+
+
+if __name__ == '__main__':
+    main()
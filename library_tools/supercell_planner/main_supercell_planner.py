@@ -0,0 +1,148 @@
+import configparser
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.cif_parser import read_cif_summary
+from ht_utils.supercell_planner import plan_unit_cells, estimate_cost
+
+CELL_COLUMNS = ['a', 'b', 'c', 'alpha', 'beta', 'gamma']
+
+
+def read_cell_and_atoms(cif_path):
+    try:
+        summary = read_cif_summary(cif_path)
+    except Exception:
+        return None
+    return [summary[c] for c in CELL_COLUMNS] + [summary['n_atoms']]
+
+
+def get_cells(cif_dir, cifs, max_processes):
+    '''
+        返回(n, 7)数组：晶胞参数和单胞原子数，无法解析的结构为nan
+    '''
+    X = np.full((len(cifs), len(CELL_COLUMNS) + 1), np.nan)
+    paths = [os.path.join(cif_dir, cif) for cif in cifs]
+    catalog = open_catalog(cif_dir)
+    todo = []
+    for i, path in enumerate(paths):
+        row = catalog.lookup(path) if catalog is not None else None
+        if row is not None:
+            X[i] = [row[c] for c in CELL_COLUMNS] + [row['n_atoms']]
+        else:
+            todo.append(i)
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        rows = pool.map(read_cell_and_atoms, [paths[i] for i in todo], chunksize=256)
+        for i, row in zip(todo, rows):
+            if row is not None:
+                X[i] = row
+    return X
+
+
+def parse_cutoffs(cutoffs_str: str):
+    cutoffs = []
+    for item in cutoffs_str.split(','):
+        item = item.strip()
+        if len(item) == 0:
+            continue
+        if ':' in item:
+            start, stop, step = [float(x) for x in item.split(':')]
+            cutoffs.extend(np.arange(start, stop + step / 2, step).round(6).tolist())
+        else:
+            cutoffs.append(float(item))
+    return sorted(set(cutoffs))
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "PLANNER_CONFIG"
+    full_options = ['cif_location', 'cutoffs', 'max_processes', 'output_file', 'detail_file']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    cif_dir = os.path.abspath(option_dic['cif_location'])
+    if not os.path.isdir(cif_dir):
+        print('cif目录无效！(Invalid cif_location!)')
+        exit()
+
+    try:
+        cutoffs = parse_cutoffs(option_dic['cutoffs'])
+    except:
+        print("截断半径必须为数字！(cutoffs must be numerical !)")
+        exit()
+    if len(cutoffs) == 0:
+        print("至少需要一个截断半径！(At least one cutoff is required !)")
+        exit()
+
+    try:
+        max_processes = int(option_dic['max_processes'])
+    except:
+        print("进程数必须为整数！(max_processes must be integer !)")
+        exit()
+
+    cifs = sorted(cif for cif in os.listdir(cif_dir) if cif.endswith('.cif'))
+    if len(cifs) == 0:
+        print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
+        exit()
+
+    return cif_dir, cifs, cutoffs, max_processes, option_dic['output_file'].strip(), option_dic['detail_file'].strip()
+
+
+def main():
+    cif_dir, cifs, cutoffs, max_processes, output_file, detail_file = check_parameters()
+
+    X = get_cells(cif_dir, cifs, max_processes)
+    valid = np.flatnonzero(np.isfinite(X).all(axis=1))
+    if len(valid) < len(cifs):
+        print("{} 个结构无法解析，已跳过 ({} structures could not be parsed and are skipped)".format(
+            len(cifs) - len(valid), len(cifs) - len(valid)))
+    if len(valid) == 0:
+        print("没有可用的结构！(No valid structures !)")
+        exit()
+
+    unit_cells = plan_unit_cells(X[valid, :6], cutoffs)
+    cost = estimate_cost(unit_cells, X[valid, 6])
+
+    headers = ["cutoff", "total_unit_cells", "mean_unit_cells", "max_unit_cells", "total_atom_pairs",
+               "relative_cost", "n_changed"]
+    with open(output_file, 'w') as f:
+        f.write(",".join(headers) + "\n")
+        for j, cutoff in enumerate(cutoffs):
+            f.write("{},{},{:.4f},{},{:.6e},{:.4f},{}\n".format(
+                cutoff, cost['total_unit_cells'][j], cost['mean_unit_cells'][j], cost['max_unit_cells'][j],
+                cost['total_atom_pairs'][j], cost['relative_cost'][j], cost['n_changed'][j]))
+
+    if len(detail_file) > 0:
+        with open(detail_file, 'w') as f:
+            f.write(",".join(["name"] + ["unitcell_{}".format(c) for c in cutoffs]) + "\n")
+            for k, i in enumerate(valid):
+                f.write(",".join([cifs[i][:-4]] + ["{} {} {}".format(*unit_cells[k, j])
+                                                   for j in range(len(cutoffs))]) + "\n")
+
+    print("{:>8} {:>14} {:>10} {:>10}".format("cutoff", "unit_cells", "rel_cost", "changed"))
+    for j, cutoff in enumerate(cutoffs):
+        print("{:>8} {:>14} {:>10.3f} {:>10}".format(
+            cutoff, cost['total_unit_cells'][j], cost['relative_cost'][j], cost['n_changed'][j]))
+    print("\033[0;30;42m\n完成！(Finish)\n\033[0m")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,26 @@ import configparser
 import math
 import os
 import re
-import shutil
+import sys
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from queue import Queue
 from threading import Lock
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_atoms import read_cif_atoms
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.energy_grid import read_mixing_rules, helium_void_fraction
+from ht_utils.gcmc import LOADING_UNITS, excess_molecules, framework_energy_grids, gcmc, loading_units, \
+    peng_robinson, read_critical_constants, read_pseudo_atom_masses
+from ht_utils.p1_cache import find_p1_cif
+from ht_utils.preflight import run_preflight, write_preflight_report, get_raspa_forcefield_dir
+from ht_utils.raspa_grids import open_grid_cache
+from ht_utils.staging import link_file
+from ht_utils.symmetry import expand_to_p1
+from ht_utils.widom_grid import read_molecule_definition, read_pseudo_atom_charges
+
 
 class RASPA_Output_Data():
     '''
@@ -99,6 +113,24 @@ class RASPA_Output_Data():
             result[i] = j
         return result
 
+    def get_adsorption_errors(self, unit='cm^3/g', loading_type='absolute'):
+        '''
+            指定单位，返回绝对吸附量（loading_type='absolute'）或超额吸附量（'excess'）的误差（"+/-"后的数值），
+            返回值是一个字典，键是吸附质的名称，值是误差
+        '''
+        labels = {'mol/uc': r"molecules/unit cell", 'cm^3/g': r"cm\^3 \(STP\)/gr framework",
+                  'mol/kg': r"mol/kg framework", 'mg/g': r"milligram/gram framework",
+                  'cm^3/cm^3': r"cm\^3 \(STP\)/cm\^3 framework"}
+        if unit not in labels.keys():
+            raise ValueError('单位错误！')
+        pattern = r"Average loading " + loading_type + r" \[" + labels[unit] + \
+                  r"\]\s+-?\d+\.?\d*\s+\+/-\s+(-?\d+\.?\d*)\s+"
+        result = {}
+        data = re.findall(pattern, self.output_string)
+        for i, j in zip(self.components, data):
+            result[i] = j
+        return result
+
 
 
 def get_unit_cell(cif_location, cutoff):
@@ -140,35 +172,54 @@ def get_unit_cell(cif_location, cutoff):
 
 
 def generate_simulation_input(template: str, cutoff: float, cif_dir: str,
-                              cif_file: str):
-    unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+                              cif_file: str, catalog=None):
+    # 优先从结构目录(cif_catalog.sqlite)中读取UnitCells参数，避免重复解析cif文件
+    unitcell = None
+    if catalog is not None:
+        unitcell = catalog.get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+    if unitcell is None:
+        unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
     cif_name = cif_file[:-4]
     return template.format(cif_name=cif_name, cutoff=cutoff, unitcell=unitcell)
 
 
 def work(cif_dir: str, cif_file: str, RASPA_dir: str, result_file: str, components: str, headers: str, input_text: str,
-         lock: Lock, q: Queue):
+         lock: Lock, q: Queue, grid_cache=None):
     cif_name = cif_file[:-4]
     curr_dir = os.path.abspath(os.path.dirname(__file__))
     output_dir = os.path.join(curr_dir, "RASPA_Output")
     cmd_dir = os.path.join(output_dir, cif_name)
     if not os.path.exists(cmd_dir):
         os.makedirs(cmd_dir)
-    shutil.copy(os.path.join(cif_dir, cif_file), cmd_dir)
+    link_file(find_p1_cif(cif_dir, cif_file), os.path.join(cmd_dir, cif_file))
     cmd = os.path.join(RASPA_dir, "bin", "simulate") + " simulation.input"
     with open(os.path.join(cmd_dir, "simulation.input"), "w") as f1:
         f1.write(input_text)
         f1.close()
     os.chdir(cmd_dir)
+    # 使用网格缓存时，先保证该框架的能量网格已经生成（缺少时在本任务目录中运行MakeGrid）
+    if grid_cache is not None:
+        try:
+            grid_cache.ensure(cif_name, os.path.join(cmd_dir, cif_file), input_text, cmd_dir)
+        except Exception as e:
+            lock.acquire()
+            write_error(result_file, cif_name)
+            print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(e)))
+            lock.release()
+            q.put(1)
+            return
     if os.system(cmd) == 0:
         lock.acquire()
         try:
             output_file = os.listdir(os.path.join(
                 cmd_dir, "Output", "System_0"))[0]
             with open(os.path.join(cmd_dir, "Output", "System_0", output_file), 'r') as f2:
-                result = get_result(f2.read(), components, cif_name)
+                output_str = f2.read()
                 f2.close()
+            result = get_result(output_str, components, cif_name)
             write_result(result_file, result, headers)
+            if result["finished"] == 'True':
+                write_result(get_error_file(result_file), get_errors(output_str, components, cif_name), headers)
             print("\033[0;30;42m\n{} has completed\n\033[0m".format(
                 cif_name))
         except Exception as e:
@@ -210,6 +261,96 @@ def get_result(output_str: str, components: list, cif_name: str):
     return res
 
 
+def get_errors(output_str: str, components: list, cif_name: str):
+    '''
+        与get_result()相同的列，吸附量列为RASPA输出中的误差，写入误差文件
+    '''
+    res = {"name": cif_name, "finished": "True", "warning": ""}
+    output = RASPA_Output_Data(output_str)
+    for unit in ['mol/uc', 'cm^3/g', 'mol/kg', 'mg/g', 'cm^3/cm^3']:
+        absolute_error = output.get_adsorption_errors(unit=unit, loading_type='absolute')
+        excess_error = output.get_adsorption_errors(unit=unit, loading_type='excess')
+        for c in components:
+            res[c + "_absolute_" + unit] = absolute_error.get(c, " ")
+            res[c + "_excess_" + unit] = excess_error.get(c, " ")
+    return res
+
+
+def get_error_file(result_file):
+    # 误差文件与结果文件同目录，名字为<结果文件名>_errors.csv，列与结果文件相同
+    return result_file[:-len('.csv')] + "_errors.csv"
+
+
+def gcmc_work(args):
+    '''
+        在子进程中对单个结构运行NumPy GCMC（单原子Lennard-Jones吸附质），结果的列与get_result()相同
+        框架质量使用力场pseudo_atoms.def中的质量masses，与RASPA2一致
+    '''
+    cif_dir, cif_file, params, components, cutoff, temperature, spacing, shifted, helium_fraction, cycles, \
+        initialization_cycles, warning, masses = args
+    cif_name = cif_file[:-4]
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif_file))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+        atoms = [atom for _, atom, _, _, _ in components]
+        grids = framework_energy_grids(structure, params, atoms, cutoff, spacing, shifted)
+        result = gcmc(structure, params, atoms, [fugacity for _, _, _, fugacity, _ in components], temperature,
+                      cutoff, spacing, shifted, cycles, initialization_cycles, energy_grids=grids)
+        # 模板中没有HeliumVoidFraction时由He的能量网格计算
+        if helium_fraction is None:
+            helium_fraction = helium_void_fraction(structure, params, shifted, False, cutoff, 298.0, spacing)
+        res = {"name": cif_name, "finished": "True", "warning": warning}
+        errors = {"name": cif_name, "finished": "True", "warning": ""}
+        for (c, _, molar_mass, _, density), loading, error in zip(components, result['loading'], result['error']):
+            absolute = loading_units(structure, loading, molar_mass, masses)
+            excess = loading_units(structure, excess_molecules(structure, loading, density, helium_fraction),
+                                   molar_mass, masses)
+            # 过剩吸附量只差一个常数，误差与绝对吸附量相同
+            error = loading_units(structure, error, molar_mass, masses)
+            for unit in LOADING_UNITS:
+                res[c + "_absolute_" + unit] = "{:.10f}".format(absolute[unit])
+                res[c + "_excess_" + unit] = "{:.10f}".format(excess[unit])
+                errors[c + "_absolute_" + unit] = "{:.10f}".format(error[unit])
+                errors[c + "_excess_" + unit] = "{:.10f}".format(error[unit])
+    except Exception as e:
+        return cif_name, e
+    return cif_name, (res, errors)
+
+
+def get_definition_locations(input_text: str, ff_dir: str, raspa_dir: str):
+    '''
+        模板中各组分的分子定义文件：优先使用力场目录中的<分子名>.def，其次是RASPA2的share/raspa/molecules/<MoleculeDefinition>/
+        返回{组分名: 文件路径}，找不到定义文件时返回None
+    '''
+    locations = {}
+    for name, definition in re.findall(r'MoleculeName\s+(\S+)\s+MoleculeDefinition\s+(\S+)', input_text):
+        def_location = os.path.join(ff_dir, name + ".def")
+        if not os.path.isfile(def_location):
+            def_location = os.path.join(raspa_dir, "share", "raspa", "molecules", definition, name + ".def")
+        if not os.path.isfile(def_location):
+            return None
+        locations[name] = def_location
+    return locations
+
+
+def get_component_settings(input_text: str, key: str, default=None):
+    '''
+        模板中每个Component块内的参数值（如MolFraction、FugacityCoefficient），没有设置时为default
+    '''
+    blocks = re.split(r'^\s*Component\s+\d+', input_text, flags=re.MULTILINE)[1:]
+    values = []
+    for block in blocks:
+        m = re.search(r'^\s*' + key + r'\s+(\S+)', block, re.MULTILINE)
+        values.append(float(m.group(1)) if m is not None else default)
+    return values
+
+
+def get_setting_from_input(input_text: str, key: str, default=None):
+    m = re.search(r'^\s*' + key + r'\s+(\S+)', input_text, re.MULTILINE)
+    return float(m.group(1)) if m is not None else default
+
+
 def get_field_headers(components: list):
     headers = ["name", "finished"]
     units = ['mol/uc', 'cm^3/g', 'mol/kg', 'mg/g', 'cm^3/cm^3']
@@ -263,6 +404,46 @@ def check_parameters():
         print("缺少的选项 (missing options) : " + str(missing_options))
         exit()
 
+    # 可选参数：调度前并行检查所有cif文件，提前剔除必然失败的结构
+    preflight = config.get(section, 'preflight', fallback='yes').strip().lower() == 'yes'
+    # 可选参数：吸附模拟的方式，raspa为RASPA2，numpy为本地的NumPy GCMC（只支持单原子Lennard-Jones吸附质）
+    engine = config.get(section, 'adsorption_engine', fallback='raspa').strip().lower()
+    gcmc_ff_dir = config.get(section, 'gcmc_forcefield_dir', fallback='').strip()
+    gcmc_spacing = config.get(section, 'gcmc_grid_spacing', fallback='0.2')
+    gcmc_cycles = config.get(section, 'gcmc_cycles', fallback='').strip()
+    gcmc_initialization_cycles = config.get(section, 'gcmc_initialization_cycles', fallback='').strip()
+
+    if engine not in ('raspa', 'numpy'):
+        print("adsorption_engine只能为raspa或numpy！(adsorption_engine must be raspa or numpy !)")
+        exit()
+
+    try:
+        gcmc_spacing = float(gcmc_spacing)
+        gcmc_cycles = int(gcmc_cycles) if len(gcmc_cycles) > 0 else None
+        gcmc_initialization_cycles = int(gcmc_initialization_cycles) if len(gcmc_initialization_cycles) > 0 else None
+    except:
+        print("gcmc_grid_spacing必须为数字，gcmc_cycles和gcmc_initialization_cycles必须为整数！"
+              "(gcmc_grid_spacing must be numerical, gcmc_cycles and gcmc_initialization_cycles must be integers !)")
+        exit()
+
+    if len(gcmc_ff_dir) > 0:
+        gcmc_ff_dir = os.path.abspath(gcmc_ff_dir)
+        if not os.path.isfile(os.path.join(gcmc_ff_dir, "force_field_mixing_rules.def")):
+            print('gcmc_forcefield_dir中没有force_field_mixing_rules.def！'
+                  '(There is no force_field_mixing_rules.def in gcmc_forcefield_dir !)')
+            exit()
+    gcmc_options = (gcmc_ff_dir, gcmc_spacing, gcmc_cycles, gcmc_initialization_cycles)
+    # 可选参数：RASPA2能量网格缓存（UseTabularGrid），每个框架的伪原子网格只生成一次，之后的任务直接读取
+    raspa_grids = config.get(section, 'raspa_grids', fallback='no').strip().lower() == 'yes'
+    try:
+        raspa_grid_spacing = float(config.get(section, 'raspa_grid_spacing', fallback='0.15'))
+        raspa_grid_cache_gb = float(config.get(section, 'raspa_grid_cache_gb', fallback='0'))
+    except:
+        print("raspa_grid_spacing和raspa_grid_cache_gb必须为数字！"
+              "(raspa_grid_spacing and raspa_grid_cache_gb must be numerical !)")
+        exit()
+    grid_cache_options = (raspa_grid_spacing, raspa_grid_cache_gb) if raspa_grids else None
+
     raspa_dir = option_dic['raspa_dir']
     cif_dir = option_dic['cif_location']
     cutoffvdm = option_dic['cutoffvdm']
@@ -274,7 +455,8 @@ def check_parameters():
     if len(cif_dir) > 0:
         cif_dir = os.path.abspath(cif_dir)
 
-    if not os.path.exists(os.path.join(raspa_dir, "bin", "simulate")):
+    # numpy模式下指定了gcmc_forcefield_dir时不需要RASPA
+    if not (engine == 'numpy' and len(gcmc_ff_dir) > 0) and not os.path.exists(os.path.join(raspa_dir, "bin", "simulate")):
         print('RASPA目录无效！(Invalid RASPA_dir!)')
         exit()
 
@@ -298,7 +480,7 @@ def check_parameters():
         cifs = []
         cifs.append(os.path.basename(cif_dir))
         cif_dir = os.path.dirname(cif_dir)
-        return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads
+        return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, grid_cache_options, engine, gcmc_options
 
     cifs = os.listdir(cif_dir)
     dels = []
@@ -311,13 +493,89 @@ def check_parameters():
         print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
         exit()
 
-    return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads
+    return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, grid_cache_options, engine, gcmc_options
+
+
+def gcmc_main(raspa_dir, cif_dir, cifs, cutoffvdm, max_processes, preflight, gcmc_options, template, result_file,
+              headers):
+    '''
+        使用NumPy GCMC计算所有结构的吸附量，力场参数取自gcmc_forcefield_dir（为空时使用模板中Forcefield对应的RASPA2力场）
+        温度、压力、各组分的摩尔分数与模拟的循环数取自模板，体相逸度由Peng-Robinson状态方程计算
+    '''
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    gcmc_ff_dir, spacing, cycles, initialization_cycles = gcmc_options
+    ff_dir = gcmc_ff_dir if len(gcmc_ff_dir) > 0 else get_raspa_forcefield_dir(raspa_dir, template)
+    if ff_dir is None:
+        print("找不到模板中的力场目录！(The force field in the template is not found !)")
+        exit()
+    params, shifted, _ = read_mixing_rules(ff_dir)
+    locations = get_definition_locations(template, ff_dir, raspa_dir)
+    if locations is None:
+        print("找不到模板中吸附质的分子定义文件！(The molecule definition of an adsorbate is not found !)")
+        exit()
+    temperature = get_setting_from_input(template, "ExternalTemperature", 298.0)
+    pressure = get_setting_from_input(template, "ExternalPressure", 1e5)
+    helium_fraction = get_setting_from_input(template, "HeliumVoidFraction")
+    if cycles is None:
+        cycles = int(get_setting_from_input(template, "NumberOfCycles", 200))
+    if initialization_cycles is None:
+        initialization_cycles = int(get_setting_from_input(template, "NumberOfInitializationCycles", 100))
+
+    names = list(locations)
+    atoms = []
+    for name in names:
+        molecule_atoms, _ = read_molecule_definition(locations[name])
+        if len(molecule_atoms) != 1:
+            print("numpy模式只支持单原子吸附质！(The numpy engine only supports single-site adsorbates !) " + name)
+            exit()
+        atoms.append(molecule_atoms[0])
+    masses = read_pseudo_atom_masses(ff_dir)
+    charges = read_pseudo_atom_charges(ff_dir)
+
+    # 体相：Peng-Robinson状态方程给出各组分的逸度系数与摩尔密度，模板中设置了FugacityCoefficient时使用该值
+    mol_fractions = get_component_settings(template, "MolFraction", 1.0)
+    tc, pc, omega = zip(*[read_critical_constants(locations[name]) for name in names])
+    phi, density = peng_robinson(temperature, pressure, tc, pc, omega, mol_fractions)
+    y = [f / sum(mol_fractions) for f in mol_fractions]
+    phi = [p if f is None else f for p, f in zip(phi, get_component_settings(template, "FugacityCoefficient"))]
+    components = [(name, atom, masses[atom], y[i] * pressure * phi[i], y[i] * density)
+                  for i, (name, atom) in enumerate(zip(names, atoms))]
+
+    charged = [name for name, atom in zip(names, atoms) if charges.get(atom, 0.0) != 0]
+    warning = "Coulomb interactions of {} not included; ".format(' '.join(charged)) if len(charged) > 0 else ""
+    # 没有HeliumVoidFraction且力场中没有He时无法计算孔体积，过剩吸附量等于绝对吸附量
+    if helium_fraction is None and "He" not in params:
+        helium_fraction = 0.0
+        warning += "HeliumVoidFraction not set, excess equals absolute; "
+
+    # 预检查：不使用电荷，只检查晶胞、原子loop和伪原子
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, "", ff_dir, max_processes)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            write_error(result_file, cif[:-4])
+
+    tasks = [(cif_dir, cif, params, components, cutoffvdm, temperature, spacing, shifted, helium_fraction, cycles,
+              initialization_cycles, warning, masses) for cif in cifs]
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        for cif_name, result in pool.map(gcmc_work, tasks):
+            if isinstance(result, Exception):
+                write_error(result_file, cif_name)
+                print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(result)))
+            else:
+                write_result(result_file, result[0], headers)
+                write_result(get_error_file(result_file), result[1], headers)
+                print("\033[0;30;42m\n{} has completed\n\033[0m".format(cif_name))
+
+    print("\033[0;30;42m\n完成！(Finish)\n\033[0m")
 
 
 def main():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
-    raspa_dir, cif_dir, cifs, cutoffvdm, max_threads = check_parameters()
+    raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, grid_cache_options, engine, gcmc_options = \
+        check_parameters()
+    catalog = open_catalog(cif_dir)
 
     # 设置环境变量(如果不设置，slurm系统可能出现raspa路径错误)
     os.environ['RASPA_DIR'] = raspa_dir
@@ -331,16 +589,23 @@ def main():
     components = get_components_from_input(template)
     headers = get_field_headers(components)
 
-    if os.path.exists(result_file):
-        os.remove(result_file)
+    # 误差文件adsorption_results_errors.csv与结果文件的列相同，只包含完成的结构
+    for file in (result_file, get_error_file(result_file)):
+        if os.path.exists(file):
+            os.remove(file)
 
-    with open(result_file, 'w') as f:
-        for i in range(len(headers)):
-            if i != len(headers) - 1:
-                f.write(headers[i] + ",")
-            else:
-                f.write(headers[i] + "\n")
-        f.close()
+        with open(file, 'w') as f:
+            for i in range(len(headers)):
+                if i != len(headers) - 1:
+                    f.write(headers[i] + ",")
+                else:
+                    f.write(headers[i] + "\n")
+            f.close()
+
+    if engine == 'numpy':
+        gcmc_main(raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, gcmc_options, template, result_file,
+                  headers)
+        return
 
     output_dir = os.path.join(cur_path, "RASPA_Output")
     if os.path.exists(output_dir):
@@ -348,6 +613,23 @@ def main():
         exit()
     os.makedirs(output_dir)
 
+    # 预检查：剔除必然失败的结构，并在结果文件中写入错误行
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, template, get_raspa_forcefield_dir(raspa_dir, template), max_threads)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            write_error(result_file, cif[:-4])
+
+    # RASPA2能量网格缓存：调度前按LRU清理超出磁盘预算的网格（本次计算的结构不会被清理）
+    grid_cache = None
+    if grid_cache_options is not None:
+        try:
+            grid_cache = open_grid_cache(raspa_dir, template, *grid_cache_options)
+        except (ValueError, FileNotFoundError) as e:
+            print("无法创建网格缓存！(Unable to set up the grid cache !) " + str(e))
+            exit()
+        grid_cache.evict(protected=[cif[:-4] for cif in cifs])
+
     q = Queue(maxsize=max_threads)
     for i in range(max_threads):
         q.put(1)
@@ -355,9 +637,12 @@ def main():
     for cif in cifs:
         q.get()
         input_text = generate_simulation_input(
-            template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif)
+            template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif, catalog=catalog)
+        if grid_cache is not None:
+            input_text = grid_cache.use_grids(input_text)
         thread = threading.Thread(target=work, args=(cif_dir, cif, raspa_dir,
-                                                     result_file, components, headers, input_text, lock, q))
+                                                     result_file, components, headers, input_text, lock, q,
+                                                     grid_cache))
         thread.start()
         time.sleep(0.3)
         os.chdir(cur_path)
@@ -366,6 +651,9 @@ def main():
         if t.is_alive() and t.name != "MainThread":
             t.join()
 
+    if grid_cache is not None:
+        grid_cache.evict()
+
     print("\033[0;30;42m\n完成！(Finish)\n\033[0m")
 
 
@@ -2,12 +2,19 @@ import configparser
 import math
 import os
 import re
-import shutil
+import sys
 import threading
 import time
 from queue import Queue
 from threading import Lock
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.p1_cache import find_p1_cif
+from ht_utils.preflight import run_preflight, write_preflight_report, get_raspa_forcefield_dir
+from ht_utils.raspa_grids import open_grid_cache
+from ht_utils.staging import link_file
+
 
 class RASPA_Output_Data():
     '''
@@ -224,26 +231,42 @@ def get_unit_cell(cif_location, cutoff):
 
 
 def generate_simulation_input(template: str, cutoff: float, cif_dir: str,
-                              cif_file: str):
-    unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+                              cif_file: str, catalog=None):
+    # 优先从结构目录(cif_catalog.sqlite)中读取UnitCells参数，避免重复解析cif文件
+    unitcell = None
+    if catalog is not None:
+        unitcell = catalog.get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+    if unitcell is None:
+        unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
     cif_name = cif_file[:-4]
     return template.format(cif_name=cif_name, cutoff=cutoff, unitcell=unitcell)
 
 
 def work(cif_dir: str, cif_file: str, RASPA_dir: str, result_file: str, components: str, headers: str, input_text: str,
-         lock: Lock, q: Queue):
+         lock: Lock, q: Queue, grid_cache=None):
     cif_name = cif_file[:-4]
     curr_dir = os.path.abspath(os.path.dirname(__file__))
     output_dir = os.path.join(curr_dir, "RASPA_Output")
     cmd_dir = os.path.join(output_dir, cif_name)
     if not os.path.exists(cmd_dir):
         os.makedirs(cmd_dir)
-    shutil.copy(os.path.join(cif_dir, cif_file), cmd_dir)
+    link_file(find_p1_cif(cif_dir, cif_file), os.path.join(cmd_dir, cif_file))
     cmd = os.path.join(RASPA_dir, "bin", "simulate") + " simulation.input"
     with open(os.path.join(cmd_dir, "simulation.input"), "w") as f1:
         f1.write(input_text)
         f1.close()
     os.chdir(cmd_dir)
+    # 使用网格缓存时，先保证该框架的能量网格已经生成（缺少时在本任务目录中运行MakeGrid）
+    if grid_cache is not None:
+        try:
+            grid_cache.ensure(cif_name, os.path.join(cmd_dir, cif_file), input_text, cmd_dir)
+        except Exception as e:
+            lock.acquire()
+            write_error(result_file, cif_name)
+            print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(e)))
+            lock.release()
+            q.put(1)
+            return
     if os.system(cmd) == 0:
         lock.acquire()
         try:
@@ -337,6 +360,19 @@ def check_parameters():
         print("缺少的选项 (missing options) : " + str(missing_options))
         exit()
 
+    # 可选参数：调度前并行检查所有cif文件，提前剔除必然失败的结构
+    preflight = config.get(section, 'preflight', fallback='yes').strip().lower() == 'yes'
+    # 可选参数：RASPA2能量网格缓存（UseTabularGrid），每个框架的伪原子网格只生成一次，之后的任务直接读取
+    raspa_grids = config.get(section, 'raspa_grids', fallback='no').strip().lower() == 'yes'
+    try:
+        raspa_grid_spacing = float(config.get(section, 'raspa_grid_spacing', fallback='0.15'))
+        raspa_grid_cache_gb = float(config.get(section, 'raspa_grid_cache_gb', fallback='0'))
+    except:
+        print("raspa_grid_spacing和raspa_grid_cache_gb必须为数字！"
+              "(raspa_grid_spacing and raspa_grid_cache_gb must be numerical !)")
+        exit()
+    grid_cache_options = (raspa_grid_spacing, raspa_grid_cache_gb) if raspa_grids else None
+
     raspa_dir = option_dic['raspa_dir']
     cif_dir = option_dic['cif_location']
     cutoffvdm = option_dic['cutoffvdm']
@@ -372,7 +408,7 @@ def check_parameters():
         cifs = []
         cifs.append(os.path.basename(cif_dir))
         cif_dir = os.path.dirname(cif_dir)
-        return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads
+        return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, grid_cache_options
 
     cifs = os.listdir(cif_dir)
     dels = []
@@ -385,13 +421,14 @@ def check_parameters():
         print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
         exit()
 
-    return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads
+    return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, grid_cache_options
 
 
 def main():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
-    raspa_dir, cif_dir, cifs, cutoffvdm, max_threads = check_parameters()
+    raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, grid_cache_options = check_parameters()
+    catalog = open_catalog(cif_dir)
 
     # 设置环境变量(如果不设置，slurm系统可能出现raspa路径错误)
     os.environ['RASPA_DIR'] = raspa_dir
@@ -422,6 +459,23 @@ def main():
         exit()
     os.makedirs(output_dir)
 
+    # 预检查：剔除必然失败的结构，并在结果文件中写入错误行
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, template, get_raspa_forcefield_dir(raspa_dir, template), max_threads)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            write_error(result_file, cif[:-4])
+
+    # RASPA2能量网格缓存：调度前按LRU清理超出磁盘预算的网格（本次计算的结构不会被清理）
+    grid_cache = None
+    if grid_cache_options is not None:
+        try:
+            grid_cache = open_grid_cache(raspa_dir, template, *grid_cache_options)
+        except (ValueError, FileNotFoundError) as e:
+            print("无法创建网格缓存！(Unable to set up the grid cache !) " + str(e))
+            exit()
+        grid_cache.evict(protected=[cif[:-4] for cif in cifs])
+
     q = Queue(maxsize=max_threads)
     for i in range(max_threads):
         q.put(1)
@@ -429,9 +483,12 @@ def main():
     for cif in cifs:
         q.get()
         input_text = generate_simulation_input(
-            template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif)
+            template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif, catalog=catalog)
+        if grid_cache is not None:
+            input_text = grid_cache.use_grids(input_text)
         thread = threading.Thread(target=work, args=(cif_dir, cif, raspa_dir,
-                                                     result_file, components, headers, input_text, lock, q))
+                                                     result_file, components, headers, input_text, lock, q,
+                                                     grid_cache))
         thread.start()
         time.sleep(0.3)
         os.chdir(cur_path)
@@ -440,6 +497,9 @@ def main():
         if t.is_alive() and t.name != "MainThread":
             t.join()
 
+    if grid_cache is not None:
+        grid_cache.evict()
+
     print("\033[0;30;42m\n完成！(Finish)\n\033[0m".encode("utf-8").decode("latin1"))
 
 
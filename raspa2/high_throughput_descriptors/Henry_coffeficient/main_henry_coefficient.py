@@ -2,12 +2,25 @@ import configparser
 import math
 import os
 import re
-import shutil
+import sys
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from queue import Queue
 from threading import Lock
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from ht_utils.cif_atoms import read_cif_atoms
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.energy_grid import read_mixing_rules
+from ht_utils.gcmc import read_pseudo_atom_masses
+from ht_utils.p1_cache import find_p1_cif
+from ht_utils.preflight import run_preflight, write_preflight_report, get_raspa_forcefield_dir
+from ht_utils.raspa_grids import open_grid_cache
+from ht_utils.staging import link_file
+from ht_utils.symmetry import expand_to_p1
+from ht_utils.widom_grid import henry_coefficient, read_molecule_definition, read_pseudo_atom_charges, vant_hoff_fit
+
 
 class RASPA_Output_Data():
     '''
@@ -222,26 +235,42 @@ def get_unit_cell(cif_location, cutoff):
 
 
 def generate_simulation_input(template: str, cutoff: float, cif_dir: str,
-                              cif_file: str):
-    unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+                              cif_file: str, catalog=None):
+    # 优先从结构目录(cif_catalog.sqlite)中读取UnitCells参数，避免重复解析cif文件
+    unitcell = None
+    if catalog is not None:
+        unitcell = catalog.get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+    if unitcell is None:
+        unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
     cif_name = cif_file[:-4]
     return template.format(cif_name=cif_name, cutoff=cutoff, unitcell=unitcell)
 
 
 def work(cif_dir: str, cif_file: str, RASPA_dir: str, result_file: str, components: str, headers: str, input_text: str,
-         lock: Lock, q: Queue):
+         lock: Lock, q: Queue, grid_cache=None):
     cif_name = cif_file[:-4]
     curr_dir = os.path.abspath(os.path.dirname(__file__))
     output_dir = os.path.join(curr_dir, "RASPA_Output")
     cmd_dir = os.path.join(output_dir, cif_name)
     if not os.path.exists(cmd_dir):
         os.makedirs(cmd_dir)
-    shutil.copy(os.path.join(cif_dir, cif_file), cmd_dir)
+    link_file(find_p1_cif(cif_dir, cif_file), os.path.join(cmd_dir, cif_file))
     cmd = os.path.join(RASPA_dir, "bin", "simulate") + " simulation.input"
     with open(os.path.join(cmd_dir, "simulation.input"), "w") as f1:
         f1.write(input_text)
         f1.close()
     os.chdir(cmd_dir)
+    # 使用网格缓存时，先保证该框架的能量网格已经生成（缺少时在本任务目录中运行MakeGrid）
+    if grid_cache is not None:
+        try:
+            grid_cache.ensure(cif_name, os.path.join(cmd_dir, cif_file), input_text, cmd_dir)
+        except Exception as e:
+            lock.acquire()
+            write_error(result_file, cif_name)
+            print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(e)))
+            lock.release()
+            q.put(1)
+            return
     if os.system(cmd) == 0:
         lock.acquire()
         try:
@@ -285,13 +314,83 @@ def get_result(output_str: str, components: list, cif_name: str):
     return res
 
 
-def get_field_headers(components: list):
+def grid_work(args):
+    '''
+        在子进程中用能量网格做Widom插入，计算单个结构中各组分的亨利系数与吸附热，不需要运行RASPA
+        temperatures的第一个为模板温度，其余温度共用同一组能量网格，结果写入温度表的列与van't Hoff拟合
+    '''
+    cif_dir, cif_file, params, molecules, cutoff, temperatures, spacing, shifted, tail_corrections, insertions, \
+        masses = args
+    cif_name = cif_file[:-4]
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif_file))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+        res = {"name": cif_name, "finished": "True", "warning": ""}
+        for c, (names, positions) in molecules.items():
+            result = henry_coefficient(structure, params, names, positions, temperatures, cutoff, spacing, shifted,
+                                       tail_corrections, insertions, masses=masses)
+            henry, heat = result['Henry_coefficient'], result['Heat_of_adsorption']
+            res[c + "_Henry coefficient_mol/kg/Pa"] = "{:.6e}".format(henry[0])
+            res[c + "_Heat_of_adsorption_mol/kJ"] = "{:.6f}".format(heat[0])
+            if len(temperatures) > 1:
+                for t, k, q in zip(temperatures[1:], henry[1:], heat[1:]):
+                    res[c + "_Henry coefficient_mol/kg/Pa_{:g}K".format(t)] = "{:.6e}".format(k)
+                    res[c + "_Heat_of_adsorption_mol/kJ_{:g}K".format(t)] = "{:.6f}".format(q)
+                q_fit, k0, r2 = vant_hoff_fit(temperatures[1:], henry[1:])
+                res[c + "_vant_Hoff_heat_kJ/mol"] = "{:.6f}".format(q_fit)
+                res[c + "_vant_Hoff_K0_mol/kg/Pa"] = "{:.6e}".format(k0)
+                res[c + "_vant_Hoff_R2"] = "{:.6f}".format(r2)
+    except Exception as e:
+        return cif_name, e
+    return cif_name, res
+
+
+def get_molecules_from_input(input_text: str, ff_dir: str, raspa_dir: str):
+    '''
+        读取模板中各组分的分子定义：优先使用力场目录中的<分子名>.def，其次是RASPA2的share/raspa/molecules/<MoleculeDefinition>/
+        返回{组分名: (伪原子名列表, 原子坐标)}，找不到定义文件时返回None
+    '''
+    molecules = {}
+    for name, definition in re.findall(r'MoleculeName\s+(\S+)\s+MoleculeDefinition\s+(\S+)', input_text):
+        def_location = os.path.join(ff_dir, name + ".def")
+        if not os.path.isfile(def_location):
+            def_location = os.path.join(raspa_dir, "share", "raspa", "molecules", definition, name + ".def")
+        if not os.path.isfile(def_location):
+            return None
+        molecules[name] = read_molecule_definition(def_location)
+    return molecules
+
+
+def get_temperature_from_input(input_text: str):
+    temperature = re.findall(r'ExternalTemperature\s+(\S+)', input_text)
+    return float(temperature[0]) if len(temperature) > 0 else 298.0
+
+
+def get_field_headers(components: list, engine='raspa'):
     headers = ["name", "finished"]
     for c in components:
-        headers.append(c + "_Henry coefficient_mol/kg/Pa")          
+        headers.append(c + "_Henry coefficient_mol/kg/Pa")
+        # grid模式同时输出Widom插入法的吸附热，列名与HenryCoffeficient_HeatofAdsorption一致
+        if engine == 'grid':
+            headers.append(c + "_Heat_of_adsorption_mol/kJ")
     headers.append("warning")
     return headers
 
+def get_temperature_table_headers(components: list, temperatures: list):
+    '''
+        温度表(henry_coefficient_temperatures.csv)的列：每个温度的亨利系数与吸附热，以及van't Hoff拟合结果
+    '''
+    headers = ["name", "finished"]
+    for c in components:
+        for t in temperatures:
+            headers.append(c + "_Henry coefficient_mol/kg/Pa_{:g}K".format(t))
+            headers.append(c + "_Heat_of_adsorption_mol/kJ_{:g}K".format(t))
+        headers += [c + "_vant_Hoff_heat_kJ/mol", c + "_vant_Hoff_K0_mol/kg/Pa", c + "_vant_Hoff_R2"]
+    headers.append("warning")
+    return headers
+
+
 def get_components_from_input(input_text: str):
     components = re.findall(r'MoleculeName\s+(.+)', input_text)
     return components
@@ -334,6 +433,64 @@ def check_parameters():
         print("缺少的选项 (missing options) : " + str(missing_options))
         exit()
 
+    # 可选参数：调度前并行检查所有cif文件，提前剔除必然失败的结构
+    preflight = config.get(section, 'preflight', fallback='yes').strip().lower() == 'yes'
+    # 可选参数：RASPA2能量网格缓存（UseTabularGrid），每个框架的伪原子网格只生成一次，之后的任务直接读取
+    raspa_grids = config.get(section, 'raspa_grids', fallback='no').strip().lower() == 'yes'
+    try:
+        raspa_grid_spacing = float(config.get(section, 'raspa_grid_spacing', fallback='0.15'))
+        raspa_grid_cache_gb = float(config.get(section, 'raspa_grid_cache_gb', fallback='0'))
+    except:
+        print("raspa_grid_spacing和raspa_grid_cache_gb必须为数字！"
+              "(raspa_grid_spacing and raspa_grid_cache_gb must be numerical !)")
+        exit()
+    grid_cache_options = (raspa_grid_spacing, raspa_grid_cache_gb) if raspa_grids else None
+    # 可选参数：亨利系数的计算方式，raspa为RASPA2的Widom插入，grid为本地的能量网格
+    engine = config.get(section, 'henry_engine', fallback='raspa').strip().lower()
+    grid_spacing = config.get(section, 'grid_spacing', fallback='0.3')
+    grid_ff_dir = config.get(section, 'grid_forcefield_dir', fallback='').strip()
+    widom_insertions = config.get(section, 'widom_insertions', fallback='200000')
+    # 可选参数：grid模式下额外计算的温度列表，为空时只计算模板温度
+    temperatures = config.get(section, 'temperatures', fallback='').replace(',', ' ').split()
+
+    if engine not in ('raspa', 'grid'):
+        print("henry_engine只能为raspa或grid！(henry_engine must be raspa or grid !)")
+        exit()
+
+    try:
+        grid_spacing = float(grid_spacing)
+    except:
+        print("grid_spacing必须为数字！(grid_spacing must be numerical !)")
+        exit()
+
+    try:
+        widom_insertions = int(widom_insertions)
+    except:
+        print("widom_insertions必须为整数！(widom_insertions must be integer !)")
+        exit()
+
+    try:
+        temperatures = [float(t) for t in temperatures]
+    except:
+        print("temperatures必须为数字！(temperatures must be numerical !)")
+        exit()
+
+    if len(temperatures) == 1 or any(t <= 0 for t in temperatures):
+        print("temperatures至少需要两个大于0的温度！(temperatures needs at least two positive temperatures !)")
+        exit()
+
+    if len(temperatures) > 0 and engine != 'grid':
+        print("temperatures只能在grid模式下使用！(temperatures is only supported with henry_engine = grid !)")
+        exit()
+
+    if len(grid_ff_dir) > 0:
+        grid_ff_dir = os.path.abspath(grid_ff_dir)
+        if not os.path.isfile(os.path.join(grid_ff_dir, "force_field_mixing_rules.def")):
+            print('grid_forcefield_dir中没有force_field_mixing_rules.def！'
+                  '(There is no force_field_mixing_rules.def in grid_forcefield_dir !)')
+            exit()
+    grid_options = (grid_spacing, grid_ff_dir, widom_insertions, temperatures)
+
     raspa_dir = option_dic['raspa_dir']
     cif_dir = option_dic['cif_location']
     cutoffvdm = option_dic['cutoffvdm']
@@ -345,7 +502,8 @@ def check_parameters():
     if len(cif_dir) > 0:
         cif_dir = os.path.abspath(cif_dir)
 
-    if not os.path.exists(os.path.join(raspa_dir, "bin", "simulate")):
+    # grid模式下指定了grid_forcefield_dir时不需要RASPA
+    if not (engine == 'grid' and len(grid_ff_dir) > 0) and not os.path.exists(os.path.join(raspa_dir, "bin", "simulate")):
         print('RASPA目录无效！(Invalid RASPA_dir!)')
         exit()
 
@@ -369,7 +527,7 @@ def check_parameters():
         cifs = []
         cifs.append(os.path.basename(cif_dir))
         cif_dir = os.path.dirname(cif_dir)
-        return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads
+        return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, engine, grid_options, grid_cache_options
 
     cifs = os.listdir(cif_dir)
     dels = []
@@ -382,13 +540,80 @@ def check_parameters():
         print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
         exit()
 
-    return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads
+    return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, engine, grid_options, grid_cache_options
+
+
+def grid_main(raspa_dir, cif_dir, cifs, cutoffvdm, max_processes, preflight, grid_options, template, result_file,
+              headers):
+    '''
+        使用能量网格计算所有结构的亨利系数与吸附热，力场参数取自grid_forcefield_dir（为空时使用模板中Forcefield对应的RASPA2力场）
+    '''
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    grid_spacing, grid_ff_dir, widom_insertions, temperatures = grid_options
+    ff_dir = grid_ff_dir if len(grid_ff_dir) > 0 else get_raspa_forcefield_dir(raspa_dir, template)
+    if ff_dir is None:
+        print("找不到模板中的力场目录！(The force field in the template is not found !)")
+        exit()
+    params, shifted, tail_corrections = read_mixing_rules(ff_dir)
+    molecules = get_molecules_from_input(template, ff_dir, raspa_dir)
+    if molecules is None:
+        print("找不到模板中吸附质的分子定义文件！(The molecule definition of an adsorbate is not found !)")
+        exit()
+    temperature = get_temperature_from_input(template)
+
+    # 能量网格只包含Lennard-Jones作用，带电荷的吸附质的亨利系数没有意义，不能使用grid模式
+    charges, masses = {}, None
+    if os.path.isfile(os.path.join(ff_dir, "pseudo_atoms.def")):
+        charges = read_pseudo_atom_charges(ff_dir)
+        masses = read_pseudo_atom_masses(ff_dir)
+    charged = [c for c, (names, _) in molecules.items() if any(charges.get(name, 0.0) != 0 for name in names)]
+    if len(charged) > 0:
+        print("{}带电荷，亨利系数不包含静电作用，不能使用henry_engine = grid，请设置henry_engine = raspa！"
+              "({} charged and the Henry coefficient has no electrostatics, set henry_engine = raspa !)".format(
+                  ' '.join(charged), ' '.join(charged)))
+        exit()
+
+    # 多个温度时另写一个(结构 × 温度)的表，所有温度由同一组能量网格得到
+    table_file = os.path.join(cur_path, "henry_coefficient_temperatures.csv")
+    if os.path.exists(table_file):
+        os.remove(table_file)
+    if len(temperatures) > 0:
+        table_headers = get_temperature_table_headers(list(molecules), temperatures)
+        with open(table_file, 'w') as f:
+            f.write(",".join(table_headers) + "\n")
+
+    # 预检查：网格计算不使用电荷，只检查晶胞、原子loop和伪原子
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, "", ff_dir, max_processes)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            write_error(result_file, cif[:-4])
+            if len(temperatures) > 0:
+                write_error(table_file, cif[:-4])
+
+    tasks = [(cif_dir, cif, params, molecules, cutoffvdm, [temperature] + temperatures, grid_spacing, shifted, tail_corrections,
+              widom_insertions, masses) for cif in cifs]
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        for cif_name, result in pool.map(grid_work, tasks):
+            if isinstance(result, Exception):
+                write_error(result_file, cif_name)
+                if len(temperatures) > 0:
+                    write_error(table_file, cif_name)
+                print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(result)))
+            else:
+                write_result(result_file, result, headers)
+                if len(temperatures) > 0:
+                    write_result(table_file, result, table_headers)
+                print("\033[0;30;42m\n{} has completed\n\033[0m".format(cif_name))
+
+    print("\033[0;30;42m\n完成！(Finish)\n\033[0m".encode("utf-8").decode("latin1"))
 
 
 def main():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
-    raspa_dir, cif_dir, cifs, cutoffvdm, max_threads = check_parameters()
+    raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, engine, grid_options, grid_cache_options = check_parameters()
+    catalog = open_catalog(cif_dir)
 
     # 设置环境变量(如果不设置，slurm系统可能出现raspa路径错误)
     os.environ['RASPA_DIR'] = raspa_dir
@@ -400,7 +625,7 @@ def main():
         template = f.read()
     result_file = os.path.join(cur_path, "henry_coefficient.csv")
     components = get_components_from_input(template)
-    headers = get_field_headers(components)
+    headers = get_field_headers(components, engine)
 
     if os.path.exists(result_file):
         os.remove(result_file)
@@ -413,12 +638,34 @@ def main():
                 f.write(headers[i] + "\n")
         f.close()
 
+    if engine == 'grid':
+        grid_main(raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, grid_options, template, result_file,
+                  headers)
+        return
+
     output_dir = os.path.join(cur_path, "RASPA_Output")
     if os.path.exists(output_dir):
         print("RASPA_Output目录已存在，请手动删除后重试！(The RASPA_Output fold already exists, please delete it and try again !)")
         exit()
     os.makedirs(output_dir)
 
+    # 预检查：剔除必然失败的结构，并在结果文件中写入错误行
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, template, get_raspa_forcefield_dir(raspa_dir, template), max_threads)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            write_error(result_file, cif[:-4])
+
+    # RASPA2能量网格缓存：调度前按LRU清理超出磁盘预算的网格（本次计算的结构不会被清理）
+    grid_cache = None
+    if grid_cache_options is not None:
+        try:
+            grid_cache = open_grid_cache(raspa_dir, template, *grid_cache_options)
+        except (ValueError, FileNotFoundError) as e:
+            print("无法创建网格缓存！(Unable to set up the grid cache !) " + str(e))
+            exit()
+        grid_cache.evict(protected=[cif[:-4] for cif in cifs])
+
     q = Queue(maxsize=max_threads)
     for i in range(max_threads):
         q.put(1)
@@ -426,9 +673,12 @@ def main():
     for cif in cifs:
         q.get()
         input_text = generate_simulation_input(
-            template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif)
+            template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif, catalog=catalog)
+        if grid_cache is not None:
+            input_text = grid_cache.use_grids(input_text)
         thread = threading.Thread(target=work, args=(cif_dir, cif, raspa_dir,
-                                                     result_file, components, headers, input_text, lock, q))
+                                                     result_file, components, headers, input_text, lock, q,
+                                                     grid_cache))
         thread.start()
         time.sleep(0.3)
         os.chdir(cur_path)
@@ -437,6 +687,9 @@ def main():
         if t.is_alive() and t.name != "MainThread":
             t.join()
 
+    if grid_cache is not None:
+        grid_cache.evict()
+
     print("\033[0;30;42m\n完成！(Finish)\n\033[0m".encode("utf-8").decode("latin1"))
 
 
@@ -2,12 +2,23 @@ import configparser
 import math
 import os
 import re
-import shutil
+import sys
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from queue import Queue
 from threading import Lock
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from ht_utils.cif_atoms import read_cif_atoms
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.energy_grid import read_mixing_rules
+from ht_utils.p1_cache import find_p1_cif
+from ht_utils.preflight import run_preflight, write_preflight_report, get_raspa_forcefield_dir
+from ht_utils.staging import link_file
+from ht_utils.surface_area import surface_area
+from ht_utils.symmetry import expand_to_p1
+
 
 class RASPA_Output_Data():
     '''
@@ -163,8 +174,13 @@ def get_unit_cell(cif_location, cutoff):
 
 
 def generate_simulation_input(template: str, cutoff: float, cif_dir: str,
-                              cif_file: str):
-    unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+                              cif_file: str, catalog=None):
+    # 优先从结构目录(cif_catalog.sqlite)中读取UnitCells参数，避免重复解析cif文件
+    unitcell = None
+    if catalog is not None:
+        unitcell = catalog.get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+    if unitcell is None:
+        unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
     cif_name = cif_file[:-4]
     return template.format(cif_name=cif_name, cutoff=cutoff, unitcell=unitcell)
 
@@ -177,7 +193,7 @@ def work(cif_dir: str, cif_file: str, RASPA_dir: str, result_file: str, componen
     cmd_dir = os.path.join(output_dir, cif_name)
     if not os.path.exists(cmd_dir):
         os.makedirs(cmd_dir)
-    shutil.copy(os.path.join(cif_dir, cif_file), cmd_dir)
+    link_file(find_p1_cif(cif_dir, cif_file), os.path.join(cmd_dir, cif_file))
     cmd = os.path.join(RASPA_dir, "bin", "simulate") + " simulation.input"
     with open(os.path.join(cmd_dir, "simulation.input"), "w") as f1:
         f1.write(input_text)
@@ -228,6 +244,30 @@ def get_result(output_str: str, components: list, cif_name: str):
     return res
 
 
+def numpy_work(args):
+    '''
+        在子进程中用NumPy在原子球面上取点计算单个结构的可及表面积，不需要运行RASPA
+    '''
+    cif_dir, cif_file, params, probe_atom, probe_distance, samples_per_atom = args
+    cif_name = cif_file[:-4]
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif_file))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+        area = surface_area(structure, params, probe_atom, probe_distance, samples_per_atom)
+    except Exception as e:
+        return cif_name, e
+    res = {"name": cif_name, "finished": "True", "warning": ""}
+    for unit in area:
+        res["Surface_area_" + unit] = "{:.6f}".format(area[unit])
+    return cif_name, res
+
+
+def get_probe_distance_from_input(input_text: str):
+    probe_distance = re.findall(r'SurfaceAreaProbeDistance\s+(\S+)', input_text)
+    return probe_distance[0] if len(probe_distance) > 0 else "Minimum"
+
+
 def get_field_headers(components: list):
     headers = ["name", "finished"]
     units = ['A^2', 'm^2/g', 'm^2/cm^3']
@@ -278,6 +318,31 @@ def check_parameters():
         print("缺少的选项 (missing options) : " + str(missing_options))
         exit()
 
+    # 可选参数：调度前并行检查所有cif文件，提前剔除必然失败的结构
+    preflight = config.get(section, 'preflight', fallback='yes').strip().lower() == 'yes'
+    # 可选参数：表面积的计算方式，raspa为RASPA2的蒙特卡洛探针，numpy为本地的球面取点
+    engine = config.get(section, 'surface_area_engine', fallback='raspa').strip().lower()
+    samples_per_atom = config.get(section, 'samples_per_atom', fallback='500')
+    probe_atom = config.get(section, 'probe_atom', fallback='N_n2').strip()
+    numpy_ff_dir = config.get(section, 'numpy_forcefield_dir', fallback='').strip()
+
+    if engine not in ('raspa', 'numpy'):
+        print("surface_area_engine只能为raspa或numpy！(surface_area_engine must be raspa or numpy !)")
+        exit()
+
+    try:
+        samples_per_atom = int(samples_per_atom)
+    except:
+        print("samples_per_atom必须为整数！(samples_per_atom must be integer !)")
+        exit()
+
+    if len(numpy_ff_dir) > 0:
+        numpy_ff_dir = os.path.abspath(numpy_ff_dir)
+        if not os.path.isfile(os.path.join(numpy_ff_dir, "force_field_mixing_rules.def")):
+            print('numpy_forcefield_dir中没有force_field_mixing_rules.def！'
+                  '(There is no force_field_mixing_rules.def in numpy_forcefield_dir !)')
+            exit()
+
     raspa_dir = option_dic['raspa_dir']
     cif_dir = option_dic['cif_location']
     cutoffvdm = option_dic['cutoffvdm']
@@ -289,7 +354,8 @@ def check_parameters():
     if len(cif_dir) > 0:
         cif_dir = os.path.abspath(cif_dir)
 
-    if not os.path.exists(os.path.join(raspa_dir, "bin", "simulate")):
+    # numpy模式下指定了numpy_forcefield_dir时不需要RASPA
+    if not (engine == 'numpy' and len(numpy_ff_dir) > 0) and not os.path.exists(os.path.join(raspa_dir, "bin", "simulate")):
         print('RASPA目录无效！(Invalid RASPA_dir!)')
         exit()
 
@@ -313,7 +379,7 @@ def check_parameters():
         cifs = []
         cifs.append(os.path.basename(cif_dir))
         cif_dir = os.path.dirname(cif_dir)
-        return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads
+        return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, engine, samples_per_atom, probe_atom, numpy_ff_dir
 
     cifs = os.listdir(cif_dir)
     dels = []
@@ -326,13 +392,48 @@ def check_parameters():
         print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
         exit()
 
-    return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads
+    return raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, engine, samples_per_atom, probe_atom, numpy_ff_dir
+
+
+def numpy_main(raspa_dir, cif_dir, cifs, max_processes, preflight, samples_per_atom, probe_atom, numpy_ff_dir, template,
+               result_file, headers):
+    '''
+        使用NumPy计算所有结构的表面积，力场参数取自numpy_forcefield_dir（为空时使用模板中Forcefield对应的RASPA2力场）
+    '''
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    ff_dir = numpy_ff_dir if len(numpy_ff_dir) > 0 else get_raspa_forcefield_dir(raspa_dir, template)
+    if ff_dir is None:
+        print("找不到模板中的力场目录！(The force field in the template is not found !)")
+        exit()
+    params, _, _ = read_mixing_rules(ff_dir)
+    probe_distance = get_probe_distance_from_input(template)
+
+    # 预检查：表面积计算不使用电荷，只检查晶胞、原子loop和伪原子
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, "", ff_dir, max_processes)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            write_error(result_file, cif[:-4])
+
+    tasks = [(cif_dir, cif, params, probe_atom, probe_distance, samples_per_atom) for cif in cifs]
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        for cif_name, result in pool.map(numpy_work, tasks, chunksize=16):
+            if isinstance(result, Exception):
+                write_error(result_file, cif_name)
+                print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(result)))
+            else:
+                write_result(result_file, result, headers)
+                print("\033[0;30;42m\n{} has completed\n\033[0m".format(cif_name))
+
+    print("\033[0;30;42m\n完成！(Finish)\n\033[0m".encode("utf-8").decode("latin1"))
 
 
 def main():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
-    raspa_dir, cif_dir, cifs, cutoffvdm, max_threads = check_parameters()
+    raspa_dir, cif_dir, cifs, cutoffvdm, max_threads, preflight, engine, samples_per_atom, probe_atom, numpy_ff_dir = \
+        check_parameters()
+    catalog = open_catalog(cif_dir)
 
     # 设置环境变量(如果不设置，slurm系统可能出现raspa路径错误)
     os.environ['RASPA_DIR'] = raspa_dir
@@ -357,12 +458,24 @@ def main():
                 f.write(headers[i] + "\n")
         f.close()
 
+    if engine == 'numpy':
+        numpy_main(raspa_dir, cif_dir, cifs, max_threads, preflight, samples_per_atom, probe_atom, numpy_ff_dir, template,
+                   result_file, headers)
+        return
+
     output_dir = os.path.join(cur_path, "RASPA_Output")
     if os.path.exists(output_dir):
         print("RASPA_Output目录已存在，请手动删除后重试！(The RASPA_Output fold already exists, please delete it and try again !)")
         exit()
     os.makedirs(output_dir)
 
+    # 预检查：剔除必然失败的结构，并在结果文件中写入错误行
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, template, get_raspa_forcefield_dir(raspa_dir, template), max_threads)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            write_error(result_file, cif[:-4])
+
     q = Queue(maxsize=max_threads)
     for i in range(max_threads):
         q.put(1)
@@ -370,7 +483,7 @@ def main():
     for cif in cifs:
         q.get()
         input_text = generate_simulation_input(
-            template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif)
+            template=template, cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif, catalog=catalog)
         thread = threading.Thread(target=work, args=(cif_dir, cif, raspa_dir,
                                                      result_file, components, headers, input_text, lock, q))
         thread.start()
@@ -2,12 +2,32 @@ import configparser
 import math
 import os
 import re
-import shutil
+import sys
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from queue import Queue
 from threading import Lock
 
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.cif_atoms import read_cif_atoms
+from ht_utils.cif_catalog import open_catalog
+from ht_utils.energy_grid import read_mixing_rules, helium_void_fraction
+from ht_utils.gcmc import LOADING_UNITS, bulk_fugacity, excess_molecules, framework_energy_grids, gcmc, loading_units, \
+    read_critical_constants, read_pseudo_atom_masses
+from ht_utils.isosteric_heat import isosteric_heat, write_isosteric_heat
+from ht_utils.isotherm_fit import FittedIsotherms, best_models, fit_isotherms, read_isotherm_file, \
+    split_isotherm_names, stack_isotherms
+from ht_utils.p1_cache import find_p1_cif
+from ht_utils.preflight import run_preflight, write_preflight_report, get_raspa_forcefield_dir
+from ht_utils.raspa_grids import open_grid_cache
+from ht_utils.reweighting import gcmc_isotherm
+from ht_utils.staging import link_file
+from ht_utils.symmetry import expand_to_p1
+from ht_utils.widom_grid import henry_coefficient, read_molecule_definition, read_pseudo_atom_charges
+
 
 class RASPA_Output_Data():
     '''
@@ -138,20 +158,37 @@ def get_unit_cell(cif_location, cutoff):
 
 
 def generate_simulation_input(template: str, temperature: str, pressure: str, cutoff: float, cif_dir: str,
-                              cif_file: str):
-    unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+                              cif_file: str, catalog=None):
+    # 优先从结构目录(cif_catalog.sqlite)中读取UnitCells参数，避免重复解析cif文件
+    unitcell = None
+    if catalog is not None:
+        unitcell = catalog.get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
+    if unitcell is None:
+        unitcell = get_unit_cell(os.path.join(cif_dir, cif_file), cutoff)
     cif_name = cif_file[:-4]
     return template.format(cif_name=cif_name, cutoff=cutoff, unitcell=unitcell, temperature=temperature,
                            pressure=pressure)
 
 
-def work(cif_dir: str, cif_file: str, RASPA_dir: str, pressure: str, input_text: str, lock: Lock, q: Queue):
-    cif_name = cif_file[:-4]
-    curr_dir = os.path.abspath(os.path.dirname(__file__))
-    result_file = os.path.join(curr_dir, "results", cif_name + "_result.csv")
+def get_result_file(results_dir: str, cif_name: str, temperature: str, temperatures: list):
+    # 只有一个温度时为<cif名>_result.csv，多个温度时为<cif名>_<温度>K_result.csv（与重加权模式的附近温度相同）
+    if len(temperatures) == 1:
+        return os.path.join(results_dir, cif_name + "_result.csv")
+    return os.path.join(results_dir, "{}_{:g}K_result.csv".format(cif_name, float(temperature)))
+
+
+def get_output_dir(raspa_output_dir: str, cif_name: str, temperature: str, pressure: str, temperatures: list):
+    # 只有一个温度时为RASPA_Output/<cif名>/<压力>，多个温度时为RASPA_Output/<cif名>/<温度>K/<压力>
+    if len(temperatures) == 1:
+        return os.path.join(raspa_output_dir, cif_name, pressure)
+    return os.path.join(raspa_output_dir, cif_name, "{:g}K".format(float(temperature)), pressure)
+
+
+def work(cif_dir: str, cif_file: str, RASPA_dir: str, pressure: str, input_text: str, lock: Lock, q: Queue,
+         result_file: str, cmd_dir: str, grid_cache=None):
+    cif_name = os.path.basename(result_file)[:-len("_result.csv")]
     components = get_components_from_input(input_text)
     headers = get_field_headers(components)
-    cmd_dir = os.path.join(curr_dir, "RASPA_Output", cif_name, pressure)
     lock.acquire()
     if not os.path.exists(result_file):
         with open(result_file, 'w') as f:
@@ -165,12 +202,23 @@ def work(cif_dir: str, cif_file: str, RASPA_dir: str, pressure: str, input_text:
         os.makedirs(cmd_dir)
     lock.release()
 
-    shutil.copy(os.path.join(cif_dir, cif_file), cmd_dir)
+    link_file(find_p1_cif(cif_dir, cif_file), os.path.join(cmd_dir, cif_file))
     cmd = os.path.join(RASPA_dir, "bin", "simulate") + " simulation.input"
     with open(os.path.join(cmd_dir, "simulation.input"), "w") as f1:
         f1.write(input_text)
         f1.close()
     os.chdir(cmd_dir)
+    # 使用网格缓存时，先保证该框架的能量网格已经生成（同一框架的其它压力与温度等待同一网格，不会重复生成）
+    if grid_cache is not None:
+        try:
+            grid_cache.ensure(cif_name, os.path.join(cmd_dir, cif_file), input_text, cmd_dir)
+        except Exception as e:
+            lock.acquire()
+            write_error(result_file, pressure)
+            print("\033[0;37;41m\n{}__{} error: {} !\n\033[0m".format(cif_name, pressure, repr(e)))
+            lock.release()
+            q.put(1)
+            return
     if os.system(cmd) == 0:
         lock.acquire()
         try:
@@ -253,6 +301,448 @@ def write_error(result_file, pressure):
         f.close()
 
 
+def get_definition_locations(input_text: str, ff_dir: str, raspa_dir: str):
+    '''
+        模板中各组分的分子定义文件：优先使用力场目录中的<分子名>.def，其次是RASPA2的share/raspa/molecules/<MoleculeDefinition>/
+        返回{组分名: 文件路径}，找不到定义文件时返回None
+    '''
+    locations = {}
+    for name, definition in re.findall(r'MoleculeName\s+(\S+)\s+MoleculeDefinition\s+(\S+)', input_text):
+        def_location = os.path.join(ff_dir, name + ".def")
+        if not os.path.isfile(def_location):
+            def_location = os.path.join(raspa_dir, "share", "raspa", "molecules", definition, name + ".def")
+        if not os.path.isfile(def_location):
+            return None
+        locations[name] = def_location
+    return locations
+
+
+def get_component_settings(input_text: str, key: str, default=None):
+    '''
+        模板中每个Component块内的参数值（如MolFraction、FugacityCoefficient），没有设置时为default
+    '''
+    blocks = re.split(r'^\s*Component\s+\d+', input_text, flags=re.MULTILINE)[1:]
+    values = []
+    for block in blocks:
+        m = re.search(r'^\s*' + key + r'\s+(\S+)', block, re.MULTILINE)
+        values.append(float(m.group(1)) if m is not None else default)
+    return values
+
+
+def get_setting_from_input(input_text: str, key: str, default=None):
+    m = re.search(r'^\s*' + key + r'\s+(\S+)', input_text, re.MULTILINE)
+    return float(m.group(1)) if m is not None else default
+
+
+def henry_work(args):
+    '''
+        在子进程中用能量网格Widom插入计算单个结构中各组分的亨利系数（只计算Lennard-Jones作用），
+        返回(cif名, {温度: {压力: (是否所有组分的K_H f都低于阈值, 与get_result()相同列的解析结果)}})
+        亨利区的吸附量为K_H f（f为体相中该组分的逸度），误差 f dK_H 记录在warning列中
+        多个温度由同一次网格计算得到（widom_grid对温度列表只计算一次能量网格）
+    '''
+    cif_dir, cif_file, params, components, critical, mol_fractions, fugacity_coefficients, cutoff, temperatures, \
+        pressures, spacing, shifted, tail_corrections, insertions, helium_fraction, threshold, warning, masses = args
+    cif_name = cif_file[:-4]
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif_file))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+        if helium_fraction is None:
+            helium_fraction = helium_void_fraction(structure, params, shifted, False, cutoff, 298.0, spacing)
+        henry = [henry_coefficient(structure, params, names, positions, [float(t) for t in temperatures], cutoff,
+                                   spacing, shifted, tail_corrections, insertions, masses=masses)
+                 for _, names, positions, _ in components]
+        res = {}
+        for j, temperature in enumerate(temperatures):
+            res[temperature] = {}
+            for pressure in pressures:
+                fugacities, densities = bulk_fugacity(float(temperature), float(pressure), critical, mol_fractions,
+                                                      fugacity_coefficients)
+                row = {"pressure": pressure, "finished": "True", "warning": warning + "Henry regime K_H*f, error"}
+                in_regime = True
+                for (c, _, _, molar_mass), h, f, density in zip(components, henry, fugacities, densities):
+                    mol_kg = h['Henry_coefficient'][j] * f
+                    in_regime = in_regime and mol_kg < threshold
+                    # mol/kg换算为每个晶胞的分子数
+                    loading = mol_kg / loading_units(structure, 1.0, molar_mass, masses)['mol/kg']
+                    absolute = loading_units(structure, loading, molar_mass, masses)
+                    excess = loading_units(structure, excess_molecules(structure, loading, density, helium_fraction),
+                                           molar_mass, masses)
+                    for unit in LOADING_UNITS:
+                        row[c + "_absolute_" + unit] = "{:.10f}".format(absolute[unit])
+                        row[c + "_excess_" + unit] = "{:.10f}".format(excess[unit])
+                    row["warning"] += " {} {:.3g} mol/kg".format(c, h['Henry_coefficient_error'][j] * f)
+                row["warning"] += "; "
+                res[temperature][pressure] = (in_regime, row)
+    except Exception as e:
+        return cif_name, e
+    return cif_name, res
+
+
+def henry_prescreen(raspa_dir, cif_dir, cifs, temperatures, pressures, cutoffvdm, max_processes, henry_options,
+                    template):
+    '''
+        对所有结构并行计算亨利系数，返回{cif名: henry_work的结果}，计算失败的结构不在返回的字典中（所有压力都运行RASPA2）
+        力场取自模板中Forcefield对应的RASPA2力场，MolFraction、FugacityCoefficient与HeliumVoidFraction取自模板
+        亨利系数只包含Lennard-Jones作用，有带电荷的吸附质时低压下的吸附量被明显低估，因此不允许使用
+    '''
+    threshold, spacing, insertions = henry_options
+    ff_dir = get_raspa_forcefield_dir(raspa_dir, template)
+    locations = get_definition_locations(template, ff_dir, raspa_dir) if ff_dir is not None else None
+    if locations is None:
+        print("找不到模板中的力场或吸附质的分子定义，不计算亨利系数！"
+              "(The force field or a molecule definition in the template is not found, Henry coefficients skipped !)")
+        return {}
+    params, shifted, tail_corrections = read_mixing_rules(ff_dir)
+    masses = read_pseudo_atom_masses(ff_dir)
+    charges = read_pseudo_atom_charges(ff_dir)
+    components = []
+    for name, def_location in locations.items():
+        names, positions = read_molecule_definition(def_location)
+        components.append((name, names, positions, sum(masses[atom] for atom in names)))
+    critical = [read_critical_constants(locations[name]) for name, _, _, _ in components]
+    mol_fractions = get_component_settings(template, "MolFraction", 1.0)
+    fugacity_coefficients = get_component_settings(template, "FugacityCoefficient")
+    helium_fraction = get_setting_from_input(template, "HeliumVoidFraction")
+
+    charged = [name for name, names, _, _ in components if any(charges.get(atom, 0.0) != 0 for atom in names)]
+    if len(charged) > 0:
+        print("{}带电荷，亨利系数不包含静电作用，不能使用henry_prescreen，请设置henry_prescreen = no！"
+              "({} charged and the Henry coefficient has no electrostatics, set henry_prescreen = no !)".format(
+                  ' '.join(charged), ' '.join(charged)))
+        exit()
+    warning = ""
+    if helium_fraction is None and "He" not in params:
+        helium_fraction = 0.0
+        warning += "HeliumVoidFraction not set, excess equals absolute; "
+
+    tasks = [(cif_dir, cif, params, components, critical, mol_fractions, fugacity_coefficients, cutoffvdm,
+              temperatures, pressures, spacing, shifted, tail_corrections, insertions, helium_fraction,
+              threshold, warning, masses) for cif in cifs]
+    henry = {}
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        for cif_name, result in pool.map(henry_work, tasks):
+            if isinstance(result, Exception):
+                print("\033[0;37;41m\n{} Henry error: {} !\n\033[0m".format(cif_name, repr(result)))
+            else:
+                henry[cif_name] = result
+    return henry
+
+
+def get_gcmc_rows(structure, loadings, loading_errors, components, pressures, densities, helium_fraction, warnings,
+                  masses=None):
+    '''
+        把NumPy GCMC（或重加权）得到的每个晶胞的分子数转换为与get_result()相同的列，返回(结果行列表, 误差行列表)
+        loadings[i][k]与loading_errors[i][k]: 第i个压力下第k个组分每个晶胞的分子数与误差；components: [(组分名, 摩尔质量)]
+        densities[i]: 第i个压力下各组分的体相摩尔密度(mol/m^3)，用于计算过剩吸附量；warnings[i]: 第i个压力的warning列
+        masses: 力场的{伪原子: 质量}，用于计算框架质量
+    '''
+    rows, error_rows = [], []
+    for i, pressure in enumerate(pressures):
+        row = {"pressure": pressure, "finished": "True", "warning": warnings[i]}
+        error_row = dict(row)
+        for k, (c, molar_mass) in enumerate(components):
+            loading = loadings[i][k]
+            absolute = loading_units(structure, loading, molar_mass, masses)
+            excess = loading_units(structure, excess_molecules(structure, loading, densities[i][k], helium_fraction),
+                                   molar_mass, masses)
+            # 过剩吸附量只差一个常数，误差与绝对吸附量相同
+            error = loading_units(structure, loading_errors[i][k], molar_mass, masses)
+            for unit in LOADING_UNITS:
+                row[c + "_absolute_" + unit] = "{:.10f}".format(absolute[unit])
+                row[c + "_excess_" + unit] = "{:.10f}".format(excess[unit])
+                error_row[c + "_absolute_" + unit] = "{:.10f}".format(error[unit])
+                error_row[c + "_excess_" + unit] = "{:.10f}".format(error[unit])
+        rows.append(row)
+        error_rows.append(error_row)
+    return rows, error_rows
+
+
+def get_reweighting_rows(structure, result, components, cells, pressures, densities, helium_fraction, warning,
+                         min_effective, masses=None):
+    '''
+        把reweight_isotherm的结果转换为与get_result()相同的列，返回(结果行列表, 误差行列表)
+        有效样本数不足min_effective的压力在warning列中注明
+    '''
+    warnings = [warning + ("low effective samples ({:.0f}); ".format(n) if n < min_effective else "")
+                for n in result['effective_samples']]
+    return get_gcmc_rows(structure, np.asarray(result['n']) / cells, np.asarray(result['n_error']) / cells,
+                         components, pressures, densities, helium_fraction, warnings, masses)
+
+
+def reweighting_work(args):
+    '''
+        在子进程中用NumPy GCMC模拟单个结构的少数几个压力，记录每个循环的(分子数, 能量)，
+        再由多直方图重加权得到配置的所有压力（以及附近温度）下的吸附量与误差
+        返回(cif名, {温度: (结果行列表, 误差行列表)})
+    '''
+    cif_dir, cif_file, params, components, critical, mol_fractions, fugacity_coefficients, cutoff, temperature, \
+        pressures, target_temperatures, spacing, shifted, helium_fraction, cycles, initialization_cycles, bootstrap, \
+        min_effective, warning, masses = args
+    cif_name = cif_file[:-4]
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif_file))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+        # 模板中没有HeliumVoidFraction时由He的能量网格计算
+        if helium_fraction is None:
+            helium_fraction = helium_void_fraction(structure, params, shifted, False, cutoff, 298.0, spacing)
+
+        def fugacity(pressure, t):
+            return bulk_fugacity(t, pressure, critical, mol_fractions, fugacity_coefficients)[0]
+
+        isotherm = gcmc_isotherm(structure, params, [atom for _, atom, _ in components], fugacity,
+                                 [float(p) for p in pressures], temperature, target_temperatures, cutoff, spacing,
+                                 shifted, cycles, initialization_cycles, min_effective, bootstrap)
+        warning += "reweighted from simulations at {} Pa; ".format(' '.join("{:g}".format(p)
+                                                                          for p in isotherm['simulated']))
+        res = {}
+        for t in [temperature] + list(target_temperatures):
+            densities = [bulk_fugacity(t, float(p), critical, mol_fractions, fugacity_coefficients)[1]
+                         for p in pressures]
+            res[t] = get_reweighting_rows(structure, isotherm[t], [(c, m) for c, _, m in components],
+                                          isotherm['cells'], pressures, densities, helium_fraction, warning,
+                                          min_effective, masses)
+    except Exception as e:
+        return cif_name, e
+    return cif_name, res
+
+
+def gcmc_work(args):
+    '''
+        在子进程中对单个结构的每个温度与压力运行NumPy GCMC，能量网格只计算一次，所有温度与压力共用
+        返回(cif名, {温度: (结果行列表, 误差行列表)})，列与get_result()相同
+    '''
+    cif_dir, cif_file, params, components, critical, mol_fractions, fugacity_coefficients, cutoff, temperatures, \
+        pressures, spacing, shifted, helium_fraction, cycles, initialization_cycles, warning, masses = args
+    cif_name = cif_file[:-4]
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif_file))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+        # 模板中没有HeliumVoidFraction时由He的能量网格计算
+        if helium_fraction is None:
+            helium_fraction = helium_void_fraction(structure, params, shifted, False, cutoff, 298.0, spacing)
+        atoms = [atom for _, atom, _ in components]
+        grids = framework_energy_grids(structure, params, atoms, cutoff, spacing, shifted)
+        res = {}
+        for temperature in temperatures:
+            loadings, errors, densities = [], [], []
+            for pressure in pressures:
+                fugacities, density = bulk_fugacity(float(temperature), float(pressure), critical, mol_fractions,
+                                                    fugacity_coefficients)
+                result = gcmc(structure, params, atoms, fugacities, float(temperature), cutoff, spacing, shifted,
+                              cycles, initialization_cycles, energy_grids=grids)
+                loadings.append(result['loading'])
+                errors.append(result['error'])
+                densities.append(density)
+            res[temperature] = get_gcmc_rows(structure, loadings, errors, [(c, m) for c, _, m in components],
+                                             pressures, densities, helium_fraction, [warning] * len(pressures),
+                                             masses)
+    except Exception as e:
+        return cif_name, e
+    return cif_name, res
+
+
+def get_error_file(result_file):
+    # 误差文件与结果文件同目录，<cif名>[_<温度>K]_result.csv对应<cif名>[_<温度>K]_errors.csv，列与结果文件相同
+    return result_file[:-len("_result.csv")] + "_errors.csv"
+
+
+def get_reweighting_result_files(results_dir, cif_name, temperature, target_temperatures):
+    '''
+        重加权模式的结果文件：{温度: (结果文件, 误差文件)}，模拟温度为<cif名>_result.csv，
+        附近温度为<cif名>_<温度>K_result.csv
+    '''
+    files = {temperature: (os.path.join(results_dir, cif_name + "_result.csv"),
+                           os.path.join(results_dir, cif_name + "_errors.csv"))}
+    for t in target_temperatures:
+        files[t] = (os.path.join(results_dir, "{}_{:g}K_result.csv".format(cif_name, t)),
+                    os.path.join(results_dir, "{}_{:g}K_errors.csv".format(cif_name, t)))
+    return files
+
+
+def read_gcmc_setup(raspa_dir, template, ff_dir, cycles, initialization_cycles, engine):
+    '''
+        reweighting与numpy模式共用的设置：力场参数取自ff_dir（为空时使用模板中Forcefield对应的RASPA2力场），
+        只支持单原子Lennard-Jones吸附质；MolFraction、FugacityCoefficient、HeliumVoidFraction与循环数（cycles为None时）取自模板
+        返回(力场目录, 力场参数, 是否截断平移, [(组分名, 伪原子, 摩尔质量)], 伪原子质量, 临界参数, 摩尔分数, 逸度系数,
+             He孔隙率, 循环数, 初始化循环数, warning)
+    '''
+    if len(ff_dir) == 0:
+        ff_dir = get_raspa_forcefield_dir(raspa_dir, template)
+    if ff_dir is None:
+        print("找不到模板中的力场目录！(The force field in the template is not found !)")
+        exit()
+    params, shifted, _ = read_mixing_rules(ff_dir)
+    locations = get_definition_locations(template, ff_dir, raspa_dir)
+    if locations is None:
+        print("找不到模板中吸附质的分子定义文件！(The molecule definition of an adsorbate is not found !)")
+        exit()
+    masses = read_pseudo_atom_masses(ff_dir)
+    charges = read_pseudo_atom_charges(ff_dir)
+    components = []
+    for name, def_location in locations.items():
+        molecule_atoms, _ = read_molecule_definition(def_location)
+        if len(molecule_atoms) != 1:
+            print("{}模式只支持单原子吸附质！(The {} engine only supports single-site adsorbates !) ".format(
+                engine, engine) + name)
+            exit()
+        components.append((name, molecule_atoms[0], masses[molecule_atoms[0]]))
+    critical = [read_critical_constants(locations[name]) for name, _, _ in components]
+    mol_fractions = get_component_settings(template, "MolFraction", 1.0)
+    fugacity_coefficients = get_component_settings(template, "FugacityCoefficient")
+    helium_fraction = get_setting_from_input(template, "HeliumVoidFraction")
+    if cycles is None:
+        cycles = int(get_setting_from_input(template, "NumberOfCycles", 1000))
+    if initialization_cycles is None:
+        initialization_cycles = int(get_setting_from_input(template, "NumberOfInitializationCycles", 500))
+
+    charged = [name for name, atom, _ in components if charges.get(atom, 0.0) != 0]
+    warning = "Coulomb interactions of {} not included; ".format(' '.join(charged)) if len(charged) > 0 else ""
+    # 没有HeliumVoidFraction且力场中没有He时无法计算孔体积，过剩吸附量等于绝对吸附量
+    if helium_fraction is None and "He" not in params:
+        helium_fraction = 0.0
+        warning += "HeliumVoidFraction not set, excess equals absolute; "
+    return ff_dir, params, shifted, components, masses, critical, mol_fractions, fugacity_coefficients, \
+        helium_fraction, cycles, initialization_cycles, warning
+
+
+def reweighting_main(raspa_dir, cif_dir, cifs, temperature, pressures, cutoffvdm, max_processes, preflight,
+                     reweighting_options, template, results_dir):
+    '''
+        重加权模式：力场参数取自reweighting_forcefield_dir（为空时使用模板中Forcefield对应的RASPA2力场），
+        只支持单原子Lennard-Jones吸附质；MolFraction、FugacityCoefficient与HeliumVoidFraction取自模板
+        每个结构在一个子进程中自适应地选择模拟的压力，结果与误差按RASPA2模式的列写入每个温度的csv文件
+    '''
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    ff_dir, target_temperatures, spacing, cycles, initialization_cycles, bootstrap, min_effective = \
+        reweighting_options
+    ff_dir, params, shifted, components, masses, critical, mol_fractions, fugacity_coefficients, helium_fraction, \
+        cycles, initialization_cycles, warning = read_gcmc_setup(raspa_dir, template, ff_dir, cycles,
+                                                                 initialization_cycles, 'reweighting')
+    headers = get_field_headers([name for name, _, _ in components])
+
+    def create_result_files(cif_name):
+        files = get_reweighting_result_files(results_dir, cif_name, temperature, target_temperatures)
+        for pair in files.values():
+            for result_file in pair:
+                with open(result_file, 'w') as f:
+                    f.write(",".join(headers) + "\n")
+        return files
+
+    # 预检查：不使用电荷，只检查晶胞、原子loop和伪原子
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, "", ff_dir, max_processes)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            for result_file, _ in create_result_files(cif[:-4]).values():
+                for pressure in pressures:
+                    write_error(result_file, pressure)
+
+    tasks = [(cif_dir, cif, params, components, critical, mol_fractions, fugacity_coefficients, cutoffvdm,
+              temperature, pressures, target_temperatures, spacing, shifted, helium_fraction, cycles,
+              initialization_cycles, bootstrap, min_effective, warning, masses) for cif in cifs]
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        for cif_name, result in pool.map(reweighting_work, tasks):
+            files = create_result_files(cif_name)
+            if isinstance(result, Exception):
+                for result_file, _ in files.values():
+                    for pressure in pressures:
+                        write_error(result_file, pressure)
+                print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(result)))
+                continue
+            for t, (rows, error_rows) in result.items():
+                for row, error_row in zip(rows, error_rows):
+                    write_result(files[t][0], row, headers)
+                    write_result(files[t][1], error_row, headers)
+            print("\033[0;30;42m\n{} has completed\n\033[0m".format(cif_name))
+
+    print("\033[0;30;42m\n完成！(Finish)\n\033[0m")
+
+
+def gcmc_main(raspa_dir, cif_dir, cifs, temperatures, pressures, cutoffvdm, max_processes, preflight, gcmc_options,
+              template, results_dir):
+    '''
+        numpy模式：每个结构在一个子进程中对所有温度与压力运行NumPy GCMC（共用一次计算的能量网格），不运行RASPA2
+        结果按RASPA2模式的文件与列写入（每行一个压力），误差（数据块平均值的标准误差）写入对应的_errors.csv
+    '''
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    ff_dir, _, spacing, cycles, initialization_cycles, _, _ = gcmc_options
+    ff_dir, params, shifted, components, masses, critical, mol_fractions, fugacity_coefficients, helium_fraction, \
+        cycles, initialization_cycles, warning = read_gcmc_setup(raspa_dir, template, ff_dir, cycles,
+                                                                 initialization_cycles, 'numpy')
+    headers = get_field_headers([name for name, _, _ in components])
+
+    def create_result_files(cif_name):
+        files = {}
+        for temperature in temperatures:
+            result_file = get_result_file(results_dir, cif_name, temperature, temperatures)
+            files[temperature] = (result_file, get_error_file(result_file))
+            for path in files[temperature]:
+                with open(path, 'w') as f:
+                    f.write(",".join(headers) + "\n")
+        return files
+
+    # 预检查：不使用电荷，只检查晶胞、原子loop和伪原子
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, "", ff_dir, max_processes)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        for cif in problems:
+            for result_file, _ in create_result_files(cif[:-4]).values():
+                for pressure in pressures:
+                    write_error(result_file, pressure)
+
+    tasks = [(cif_dir, cif, params, components, critical, mol_fractions, fugacity_coefficients, cutoffvdm,
+              temperatures, pressures, spacing, shifted, helium_fraction, cycles, initialization_cycles, warning,
+              masses) for cif in cifs]
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        for cif_name, result in pool.map(gcmc_work, tasks):
+            files = create_result_files(cif_name)
+            if isinstance(result, Exception):
+                for result_file, _ in files.values():
+                    for pressure in pressures:
+                        write_error(result_file, pressure)
+                print("\033[0;37;41m\n{} error: {} !\n\033[0m".format(cif_name, repr(result)))
+                continue
+            for t, (rows, error_rows) in result.items():
+                for row, error_row in zip(rows, error_rows):
+                    write_result(files[t][0], row, headers)
+                    write_result(files[t][1], error_row, headers)
+            print("\033[0;30;42m\n{} has completed\n\033[0m".format(cif_name))
+
+
+def isosteric_heat_main(results_dir, cifs, temperature, isosteric_options, output_file):
+    '''
+        用fit_isotherms（按AICc选择模型）拟合results目录中各温度的绝对吸附量(mol/kg)等温线，
+        由拟合等温线的Clausius-Clapeyron关系计算每个结构、每个组分的等量吸附热Q_st(q)并写入output_file
+        没有温度后缀的结果文件（重加权模式的模拟温度）的温度为temperature，文件名按cifs中的结构名解析温度后缀
+    '''
+    loadings, n_loadings = isosteric_options
+    files = sorted(f for f in os.listdir(results_dir) if f.endswith("_result.csv"))
+    split = split_isotherm_names(files, cif_names=[cif[:-4] for cif in cifs])
+    records = []
+    for f in files:
+        records += read_isotherm_file(os.path.join(results_dir, f), 'mol/kg', 'absolute', *split[f])
+    records = [r for r in records if len(r['pressure']) > 0]
+    if len(records) == 0:
+        return
+    for r in records:
+        if np.isnan(r['temperature']):
+            r['temperature'] = float(temperature)
+    pressure, loading, sigma = stack_isotherms(records)
+    results = fit_isotherms(pressure, loading, sigma=sigma)
+    fits = FittedIsotherms([r['name'] for r in records], [r['temperature'] for r in records],
+                           [r['component'] for r in records], {m: res['params'] for m, res in results.items()},
+                           {m: res['rmse'] for m, res in results.items()}, best_models(results),
+                           [r['pressure'].min() for r in records], [r['pressure'].max() for r in records])
+    result = isosteric_heat(fits, loadings, n_loadings)
+    write_isosteric_heat(output_file, result)
+    print("\033[0;30;42m\n等量吸附热 (isosteric heat) : {} 条 (structure, component)，{}\n\033[0m".format(
+        len(result['names']), output_file))
+
+
 def check_parameters():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
@@ -275,9 +765,90 @@ def check_parameters():
         print("缺少的选项 (missing options) : " + str(missing_options))
         exit()
 
+    # 可选参数：调度前并行检查所有cif文件，提前剔除必然失败的结构
+    preflight = config.get(section, 'preflight', fallback='yes').strip().lower() == 'yes'
+
+    # 可选参数：等温线的计算方式，raspa为每个压力运行一次RASPA2，reweighting为NumPy GCMC加多直方图重加权，
+    # numpy为每个压力运行一次NumPy GCMC
+    engine = config.get(section, 'isotherm_engine', fallback='raspa').strip().lower()
+    reweighting_ff_dir = config.get(section, 'reweighting_forcefield_dir', fallback='').strip()
+    reweighting_temperatures = config.get(section, 'reweighting_temperatures', fallback='').strip()
+    gcmc_spacing = config.get(section, 'gcmc_grid_spacing', fallback='0.2')
+    gcmc_cycles = config.get(section, 'gcmc_cycles', fallback='').strip()
+    gcmc_initialization_cycles = config.get(section, 'gcmc_initialization_cycles', fallback='').strip()
+    bootstrap_samples = config.get(section, 'bootstrap_samples', fallback='20')
+    min_effective_samples = config.get(section, 'min_effective_samples', fallback='50')
+
+    if engine not in ('raspa', 'reweighting', 'numpy'):
+        print("isotherm_engine只能为raspa、reweighting或numpy！(isotherm_engine must be raspa, reweighting or numpy !)")
+        exit()
+
+    try:
+        reweighting_temperatures = [float(t) for t in reweighting_temperatures.replace(',', ' ').split()]
+        gcmc_spacing = float(gcmc_spacing)
+        gcmc_cycles = int(gcmc_cycles) if len(gcmc_cycles) > 0 else None
+        gcmc_initialization_cycles = int(gcmc_initialization_cycles) if len(gcmc_initialization_cycles) > 0 else None
+        bootstrap_samples = int(bootstrap_samples)
+        min_effective_samples = float(min_effective_samples)
+    except:
+        print("reweighting_temperatures、gcmc_grid_spacing与min_effective_samples必须为数字，"
+              "gcmc_cycles、gcmc_initialization_cycles与bootstrap_samples必须为整数！"
+              "(reweighting_temperatures, gcmc_grid_spacing and min_effective_samples must be numerical, gcmc_cycles, "
+              "gcmc_initialization_cycles and bootstrap_samples must be integers !)")
+        exit()
+
+    if len(reweighting_ff_dir) > 0:
+        reweighting_ff_dir = os.path.abspath(reweighting_ff_dir)
+        if not os.path.isfile(os.path.join(reweighting_ff_dir, "force_field_mixing_rules.def")):
+            print('reweighting_forcefield_dir中没有force_field_mixing_rules.def！'
+                  '(There is no force_field_mixing_rules.def in reweighting_forcefield_dir !)')
+            exit()
+    # 可选参数：先用能量网格Widom插入计算亨利系数，所有组分的K_H f都低于henry_loading_threshold(mol/kg)的压力不运行RASPA2
+    henry_prescreen = config.get(section, 'henry_prescreen', fallback='no').strip().lower() == 'yes'
+    henry_loading_threshold = config.get(section, 'henry_loading_threshold', fallback='0.01')
+    henry_grid_spacing = config.get(section, 'henry_grid_spacing', fallback='0.3')
+    henry_insertions = config.get(section, 'henry_insertions', fallback='200000')
+    try:
+        henry_loading_threshold = float(henry_loading_threshold)
+        henry_grid_spacing = float(henry_grid_spacing)
+        henry_insertions = int(henry_insertions)
+    except:
+        print("henry_loading_threshold与henry_grid_spacing必须为数字，henry_insertions必须为整数！"
+              "(henry_loading_threshold and henry_grid_spacing must be numerical, henry_insertions must be integer !)")
+        exit()
+    henry_options = (henry_loading_threshold, henry_grid_spacing, henry_insertions) if henry_prescreen else None
+
+    # 可选参数：RASPA2能量网格缓存（UseTabularGrid），每个框架的伪原子网格只生成一次，所有压力与温度直接读取
+    raspa_grids = config.get(section, 'raspa_grids', fallback='no').strip().lower() == 'yes'
+    try:
+        raspa_grid_spacing = float(config.get(section, 'raspa_grid_spacing', fallback='0.15'))
+        raspa_grid_cache_gb = float(config.get(section, 'raspa_grid_cache_gb', fallback='0'))
+    except:
+        print("raspa_grid_spacing和raspa_grid_cache_gb必须为数字！"
+              "(raspa_grid_spacing and raspa_grid_cache_gb must be numerical !)")
+        exit()
+    grid_cache_options = (raspa_grid_spacing, raspa_grid_cache_gb) if raspa_grids else None
+
+    # 可选参数：有多个温度时由拟合等温线的Clausius-Clapeyron关系计算等量吸附热
+    isosteric_heat_enabled = config.get(section, 'isosteric_heat', fallback='yes').strip().lower() == 'yes'
+    isosteric_heat_loadings = config.get(section, 'isosteric_heat_loadings', fallback='').strip()
+    isosteric_heat_points = config.get(section, 'isosteric_heat_points', fallback='10')
+    try:
+        isosteric_heat_loadings = [float(q) for q in isosteric_heat_loadings.replace(',', ' ').split()]
+        isosteric_heat_points = int(isosteric_heat_points)
+    except:
+        print("isosteric_heat_loadings必须为数字，isosteric_heat_points必须为整数！"
+              "(isosteric_heat_loadings must be numerical, isosteric_heat_points must be integer !)")
+        exit()
+    isosteric_options = (isosteric_heat_loadings if len(isosteric_heat_loadings) > 0 else None,
+                         isosteric_heat_points) if isosteric_heat_enabled else None
+
+    reweighting_options = (reweighting_ff_dir, reweighting_temperatures, gcmc_spacing, gcmc_cycles,
+                           gcmc_initialization_cycles, bootstrap_samples, min_effective_samples)
+
     raspa_dir = option_dic['raspa_dir']
     cif_dir = option_dic['cif_location']
-    temperature = option_dic['temperature']
+    temperatures = [t.strip() for t in option_dic['temperature'].split(",") if len(t.strip()) > 0]
     pressures_str = option_dic['pressures']
     cutoffvdm = option_dic['cutoffvdm']
     max_threads = option_dic['max_threads']
@@ -288,7 +859,9 @@ def check_parameters():
     if len(cif_dir) > 0:
         cif_dir = os.path.abspath(cif_dir)
 
-    if not os.path.exists(os.path.join(raspa_dir, "bin", "simulate")):
+    # reweighting与numpy模式下指定了reweighting_forcefield_dir时不需要RASPA
+    if not (engine in ('reweighting', 'numpy') and len(reweighting_ff_dir) > 0) and \
+            not os.path.exists(os.path.join(raspa_dir, "bin", "simulate")):
         print('RASPA目录无效！(Invalid RASPA_dir!)')
         exit()
 
@@ -305,10 +878,18 @@ def check_parameters():
         exit()
 
     try:
-        float(temperature)
+        for t in temperatures:
+            float(t)
     except:
         print("温度必须为数字！(Temperature must be numerical !)")
         exit()
+    if len(temperatures) == 0 or len(set(float(t) for t in temperatures)) != len(temperatures):
+        print("温度不能为空或重复！(Temperatures must be non-empty and distinct !)")
+        exit()
+    if engine == 'reweighting' and len(temperatures) > 1:
+        print("reweighting模式只能设置一个temperature，其它温度请使用reweighting_temperatures！"
+              "(The reweighting engine takes a single temperature, use reweighting_temperatures for the others !)")
+        exit()
 
     try:
         cutoffvdm = float(cutoffvdm)
@@ -326,7 +907,8 @@ def check_parameters():
         cifs = []
         cifs.append(os.path.basename(cif_dir))
         cif_dir = os.path.dirname(cif_dir)
-        return raspa_dir, cif_dir, cifs, temperature, pressures, cutoffvdm, max_threads
+        return raspa_dir, cif_dir, cifs, temperatures, pressures, cutoffvdm, max_threads, preflight, engine, \
+            reweighting_options, henry_options, isosteric_options, grid_cache_options
 
     cifs = os.listdir(cif_dir)
     dels = []
@@ -339,13 +921,16 @@ def check_parameters():
         print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_location)')
         exit()
 
-    return raspa_dir, cif_dir, cifs, temperature, pressures, cutoffvdm, max_threads
+    return raspa_dir, cif_dir, cifs, temperatures, pressures, cutoffvdm, max_threads, preflight, engine, \
+        reweighting_options, henry_options, isosteric_options, grid_cache_options
 
 
 def main():
     cur_path = os.path.abspath(os.path.dirname(__file__))
     os.chdir(cur_path)
-    raspa_dir, cif_dir, cifs, temperature, pressures, cutoffvdm, max_threads = check_parameters()
+    raspa_dir, cif_dir, cifs, temperatures, pressures, cutoffvdm, max_threads, preflight, engine, \
+        reweighting_options, henry_options, isosteric_options, grid_cache_options = check_parameters()
+    catalog = open_catalog(cif_dir)
     
     # 设置环境变量(如果不设置，slurm系统可能出现raspa路径错误)
     os.environ['RASPA_DIR'] = raspa_dir
@@ -360,6 +945,26 @@ def main():
     if os.path.exists(results_dir):
         print("results目录已存在，请手动删除后重试！(The results fold already exists, please delete it and try again !)")
         exit()
+
+    if engine == 'reweighting':
+        os.makedirs(results_dir)
+        reweighting_main(raspa_dir, cif_dir, cifs, float(temperatures[0]), pressures, cutoffvdm, max_threads,
+                         preflight, reweighting_options, template, results_dir)
+        if isosteric_options is not None and len(reweighting_options[1]) > 0:
+            isosteric_heat_main(results_dir, cifs, temperatures[0], isosteric_options,
+                                os.path.join(cur_path, "isosteric_heat.csv"))
+        return
+
+    if engine == 'numpy':
+        os.makedirs(results_dir)
+        gcmc_main(raspa_dir, cif_dir, cifs, temperatures, pressures, cutoffvdm, max_threads, preflight,
+                  reweighting_options, template, results_dir)
+        if isosteric_options is not None and len(temperatures) > 1:
+            isosteric_heat_main(results_dir, cifs, temperatures[0], isosteric_options,
+                                os.path.join(cur_path, "isosteric_heat.csv"))
+        print("\033[0;30;42m\n完成！(Finish)\n\033[0m")
+        return
+
     raspa_output_dir = os.path.join(cur_path, "RASPA_Output")
     if os.path.exists(raspa_output_dir):
         print("RASPA_Output 目录已存在，请手动删除后重试！(The RASPA_Output fold already exists, please delete it and try again !)")
@@ -367,16 +972,66 @@ def main():
     os.makedirs(results_dir)
     os.makedirs(raspa_output_dir)
 
+    # 预检查：剔除必然失败的结构，并在其结果文件中为每个压力写入错误行
+    if preflight:
+        cifs, problems = run_preflight(cif_dir, cifs, template, get_raspa_forcefield_dir(raspa_dir, template), max_threads)
+        write_preflight_report(os.path.join(cur_path, "preflight_report.csv"), problems)
+        headers = get_field_headers(get_components_from_input(template))
+        for cif in problems:
+            for temperature in temperatures:
+                result_file = get_result_file(results_dir, cif[:-4], temperature, temperatures)
+                with open(result_file, 'w') as f:
+                    f.write(",".join(headers) + "\n")
+                for pressure in pressures:
+                    write_error(result_file, pressure)
+
+    # 亨利区预筛选：所有组分的K_H f都低于阈值的压力直接写入解析吸附量
+    henry = {}
+    if henry_options is not None:
+        henry = henry_prescreen(raspa_dir, cif_dir, cifs, temperatures, pressures, cutoffvdm, max_threads,
+                                henry_options, template)
+        headers = get_field_headers(get_components_from_input(template))
+
+    # RASPA2能量网格缓存：调度前按LRU清理超出磁盘预算的网格（本次计算的结构不会被清理）
+    grid_cache = None
+    if grid_cache_options is not None:
+        try:
+            grid_cache = open_grid_cache(raspa_dir, template, *grid_cache_options)
+        except (ValueError, FileNotFoundError) as e:
+            print("无法创建网格缓存！(Unable to set up the grid cache !) " + str(e))
+            exit()
+        grid_cache.evict(protected=[cif[:-4] for cif in cifs])
+
     q = Queue(maxsize=max_threads)
     for i in range(max_threads):
         q.put(1)
     for cif in cifs:
-        for pressure in pressures:
+        tasks = []
+        for temperature in temperatures:
+            result_file = get_result_file(results_dir, cif[:-4], temperature, temperatures)
+            raspa_pressures = pressures
+            if cif[:-4] in henry:
+                with open(result_file, 'w') as f:
+                    f.write(",".join(headers) + "\n")
+                raspa_pressures = []
+                for pressure in pressures:
+                    in_regime, row = henry[cif[:-4]][temperature][pressure]
+                    if in_regime:
+                        write_result(result_file, row, headers)
+                    else:
+                        raspa_pressures.append(pressure)
+            tasks += [(pressures.index(pressure), temperature, pressure, result_file) for pressure in raspa_pressures]
+        # 同一结构的所有温度按压力交错调度（温度在最内层），使该结构各温度的等温线几乎同时完成
+        tasks.sort(key=lambda t: t[0])
+        for _, temperature, pressure, result_file in tasks:
             q.get()
             input_text = generate_simulation_input(template=template, temperature=temperature, pressure=pressure,
-                                                   cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif)
-            thread = threading.Thread(target=work, args=(cif_dir, cif, raspa_dir,
-                                                         pressure, input_text, lock, q))
+                                                   cutoff=cutoffvdm, cif_dir=cif_dir, cif_file=cif, catalog=catalog)
+            if grid_cache is not None:
+                input_text = grid_cache.use_grids(input_text)
+            cmd_dir = get_output_dir(raspa_output_dir, cif[:-4], temperature, pressure, temperatures)
+            thread = threading.Thread(target=work, args=(cif_dir, cif, raspa_dir, pressure, input_text, lock, q,
+                                                         result_file, cmd_dir, grid_cache))
 
             thread.start()
             time.sleep(0.4)
@@ -386,6 +1041,13 @@ def main():
         if t.is_alive() and t.name != "MainThread":
             t.join()
 
+    if grid_cache is not None:
+        grid_cache.evict()
+
+    if isosteric_options is not None and len(temperatures) > 1:
+        isosteric_heat_main(results_dir, cifs, temperatures[0], isosteric_options,
+                            os.path.join(cur_path, "isosteric_heat.csv"))
+
     print("\033[0;30;42m\n完成！(Finish)\n\033[0m")
 
 
@@ -0,0 +1,249 @@
+import configparser
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.breakthrough import IASTEquilibrium, PureEquilibrium, breakthrough
+from ht_utils.framework_descriptors import read_framework_descriptors
+from ht_utils.isotherm_fit import MODEL_PARAMETERS, FittedIsotherms
+from ht_utils.p1_cache import find_p1_cif
+
+
+def parse_numbers(text: str):
+    return [float(x) for x in text.replace(',', ' ').split()]
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "BREAKTHROUGH_CONFIG"
+    full_options = ['fit_file', 'components', 'feed_mole_fractions', 'pressure', 'equilibrium', 'model',
+                    'column_length', 'bed_void_fraction', 'interstitial_velocity', 'axial_dispersion',
+                    'ldf_coefficients', 'bed_density', 'n_cells', 'breakthrough_threshold', 'max_time', 'batch_size',
+                    'output_file']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    fit_file = os.path.abspath(option_dic['fit_file'])
+    if not os.path.isfile(fit_file):
+        print('拟合结果文件不存在，请先运行isotherm_fitting！(The fit_file does not exist, run isotherm_fitting first !)')
+        exit()
+
+    components = [c.strip() for c in option_dic['components'].split(',') if len(c.strip()) > 0]
+    try:
+        feed = parse_numbers(option_dic['feed_mole_fractions'])
+        ldf = parse_numbers(option_dic['ldf_coefficients'])
+        column = {k: float(option_dic[k]) for k in ['pressure', 'column_length', 'bed_void_fraction',
+                                                     'interstitial_velocity', 'axial_dispersion', 'max_time',
+                                                     'breakthrough_threshold']}
+        n_cells = int(option_dic['n_cells'])
+        batch_size = int(option_dic['batch_size'])
+        table_points = int(config.get(section, 'table_points', fallback='60'))
+    except:
+        print("床层参数必须为数字或者使用科学计数法！(The column parameters must be numerical or use scientific notation !)")
+        exit()
+    if len(components) == 0 or len(feed) != len(components) or min(feed) < 0 or sum(feed) <= 0:
+        print("feed_mole_fractions需要为每个组分给出一个非负的摩尔分数！"
+              "(feed_mole_fractions needs one non-negative mole fraction per component !)")
+        exit()
+    if len(ldf) == 1:
+        ldf = ldf * len(components)
+    if len(ldf) != len(components) or min(ldf) <= 0:
+        print("ldf_coefficients需要为每个组分给出一个正数！(ldf_coefficients needs one positive value per component !)")
+        exit()
+    if not 0 < column['bed_void_fraction'] < 1 or not 0 < column['breakthrough_threshold'] < 1 or \
+            min(column['pressure'], column['column_length'], column['interstitial_velocity'], column['max_time']) <= 0 \
+            or n_cells < 2 or batch_size < 1:
+        print("床层参数超出范围！(The column parameters are out of range !)")
+        exit()
+
+    temperature = config.get(section, 'temperature', fallback='').strip()
+    try:
+        temperature = float(temperature) if len(temperature) > 0 else None
+    except:
+        print("温度必须为数字！(Temperature must be numerical !)")
+        exit()
+
+    equilibrium = option_dic['equilibrium'].strip().lower()
+    if equilibrium not in ('iast', 'pure'):
+        print("equilibrium只能为iast或pure！(equilibrium must be iast or pure !)")
+        exit()
+    model = option_dic['model'].strip().lower()
+    if model != 'best' and model not in MODEL_PARAMETERS:
+        print("未知的模型 (unknown model) : {}，可选 (available) : best, {}".format(model, ", ".join(MODEL_PARAMETERS)))
+        exit()
+
+    # bed_density为crystal时由cif计算晶体密度，床层密度为晶体密度 * (1 - 空隙率)
+    bed_density = option_dic['bed_density'].strip().lower()
+    cif_location = config.get(section, 'cif_location', fallback='').strip()
+    if bed_density == 'crystal':
+        if not os.path.isdir(cif_location):
+            print("bed_density = crystal需要cif_location！(bed_density = crystal requires cif_location !)")
+            exit()
+        bed_density = None
+    else:
+        try:
+            bed_density = float(bed_density)
+        except:
+            print("bed_density必须为数字或crystal！(bed_density must be numerical or crystal !)")
+            exit()
+
+    candidate_file = config.get(section, 'candidate_file', fallback='').strip()
+    candidates = None
+    if len(candidate_file) > 0:
+        try:
+            top_n = int(config.get(section, 'top_n', fallback='0') or 0)
+        except:
+            print("top_n必须为整数！(top_n must be an integer !)")
+            exit()
+        candidates = (os.path.abspath(candidate_file), config.get(section, 'candidate_column', fallback='').strip(),
+                      top_n)
+
+    curve_file = config.get(section, 'curve_file', fallback='').strip()
+    curve_times = None
+    if len(curve_file) > 0:
+        try:
+            interval = float(config.get(section, 'curve_interval', fallback=''))
+        except:
+            print("curve_interval必须为数字！(curve_interval must be numerical !)")
+            exit()
+        curve_times = np.arange(interval, column['max_time'] + 0.5 * interval, interval)
+        curve_file = os.path.abspath(curve_file)
+
+    return fit_file, components, feed, temperature, equilibrium, None if model == 'best' else model, column, ldf, \
+        bed_density, cif_location, n_cells, table_points, batch_size, candidates, \
+        os.path.abspath(option_dic['output_file']), curve_file, curve_times
+
+
+def read_candidates(candidate_file, candidate_column, top_n):
+    # 候选结构文件（如mix_adsorption的结果）的name列，给出candidate_column与top_n时只取该列最大的top_n个结构
+    if not os.path.isfile(candidate_file):
+        print("候选结构文件不存在！(The candidate_file does not exist !)")
+        exit()
+    with open(candidate_file, 'r', newline='') as f:
+        rows = list(csv.reader(f))
+    headers = [h.strip() for h in rows[0]]
+    if len(candidate_column) == 0:
+        return [row[0] for row in rows[1:] if len(row) > 0]
+    if candidate_column not in headers:
+        print("候选结构文件中没有{}列！(The candidate_file has no {} column !)".format(candidate_column, candidate_column))
+        exit()
+    column = headers.index(candidate_column)
+    values = {}
+    for row in rows[1:]:
+        try:
+            values[row[0]] = float(row[column])
+        except (ValueError, IndexError):
+            continue
+    names = sorted(values, key=lambda n: -values[n])
+    return names[:top_n] if top_n > 0 else names
+
+
+def get_bed_density(names, bed_density, cif_location, void_fraction):
+    if bed_density is not None:
+        return np.full(len(names), bed_density)
+    density = np.full(len(names), np.nan)
+    for i, name in enumerate(names):
+        try:
+            density[i] = read_framework_descriptors(find_p1_cif(cif_location, name + '.cif'))['Framework_density_kg/m^3']
+        except Exception:
+            continue
+    return density * (1 - void_fraction)
+
+
+def main():
+    fit_file, components, feed, temperature, equilibrium, model, column, ldf, bed_density, cif_location, n_cells, \
+        table_points, batch_size, candidates, output_file, curve_file, curve_times = check_parameters()
+    start = time.time()
+    fits = FittedIsotherms.load(fit_file)
+    temperatures = np.unique(fits.temperatures[np.isfinite(fits.temperatures)])
+    if temperature is None:
+        if len(temperatures) != 1:
+            print("拟合结果中有多个温度 {}，请设置temperature！(The fits have several temperatures {}, set temperature !)".format(
+                temperatures.tolist(), temperatures.tolist()))
+            exit()
+        temperature = float(temperatures[0])
+
+    rows = []
+    for c in components:
+        found = fits.find(component=c, temperature=temperature)
+        rows.append(dict(zip(fits.names[found], found)))
+    names = sorted(set.intersection(*[set(r) for r in rows]))
+    if candidates is not None:
+        selected = set(read_candidates(*candidates))
+        names = [n for n in names if n in selected]
+    if len(names) == 0:
+        print("没有同时具有{}拟合结果的结构！(No structures have fits for all of {} !)".format(components, components))
+        exit()
+    density = get_bed_density(names, bed_density, cif_location, column['bed_void_fraction'])
+
+    headers = ['name', 'bed_density_kg/m^3'] + ['breakthrough_time_{}_s'.format(c) for c in components] + \
+              ['dynamic_capacity_{}_mol/kg'.format(c) for c in components] + \
+              ['light_product', 'light_product_purity', 'light_product_recovery', 'breakthrough_finished']
+    n_finished = 0
+    with open(output_file, 'w', newline='') as f, \
+            (open(curve_file, 'w', newline='') if curve_times is not None else open(os.devnull, 'w')) as g:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        curve_writer = csv.writer(g)
+        curve_writer.writerow(['name', 'time_s'] + ['c/c0_' + c for c in components])
+        for begin in range(0, len(names), batch_size):
+            batch = names[begin:begin + batch_size]
+            batch_density = density[begin:begin + batch_size]
+            valid = np.isfinite(batch_density)
+            batch = [n for n, v in zip(batch, valid) if v]
+            batch_density = batch_density[valid]
+            if len(batch) == 0:
+                continue
+            isotherms = [fits.model_parameters([rows[i][n] for n in batch], model) for i in range(len(components))]
+            if equilibrium == 'iast' and len(components) > 1:
+                eq = IASTEquilibrium(isotherms, column['pressure'], points=table_points)
+            else:
+                eq = PureEquilibrium(isotherms, column['pressure'])
+            result = breakthrough(eq, len(batch), feed, column['pressure'], temperature, column['column_length'],
+                                  column['bed_void_fraction'], column['interstitial_velocity'],
+                                  column['axial_dispersion'], ldf, batch_density, n_cells=n_cells,
+                                  threshold=column['breakthrough_threshold'], max_time=column['max_time'],
+                                  curve_times=curve_times)
+            for b, name in enumerate(batch):
+                row = [name, "{:.2f}".format(batch_density[b])]
+                row += ["{:.4f}".format(v) if np.isfinite(v) else '' for v in result['breakthrough_time'][b]]
+                row += ["{:.6e}".format(v) if np.isfinite(v) else '' for v in result['dynamic_capacity'][b]]
+                row += [components[result['light_product'][b]]]
+                row += ["{:.6f}".format(v) if np.isfinite(v) else '' for v in (result['purity'][b],
+                                                                                result['recovery'][b])]
+                row.append(result['finished'][b])
+                writer.writerow(row)
+                if curve_times is not None:
+                    for k in np.flatnonzero(np.all(np.isfinite(result['curves'][b]), axis=1)):
+                        curve_writer.writerow([name, "{:g}".format(curve_times[k])] +
+                                              ["{:.6f}".format(v) for v in result['curves'][b, k]])
+            n_finished += int(result['finished'].sum())
+            print("{} / {} 个结构 (structures), {:.1f} s".format(min(begin + batch_size, len(names)), len(names),
+                                                                   time.time() - start))
+
+    print("\033[0;30;42m\n完成！共 {} 个结构，{} 个全部穿透，用时 {:.1f} s "
+          "(Finish, {} structures, {} fully broken through, {:.1f} s)\n\033[0m".format(
+              len(names), n_finished, time.time() - start, len(names), n_finished, time.time() - start))
+    print(output_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import configparser
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.iast import predict_mixtures
+from ht_utils.isotherm_fit import MODEL_PARAMETERS, FittedIsotherms
+
+
+def parse_numbers(text: str):
+    return [float(x) for x in text.replace(',', ' ').split()]
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "IAST_CONFIG"
+    full_options = ['fit_file', 'components', 'compositions', 'pressures', 'model', 'loading_unit', 'output_file']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    fit_file = os.path.abspath(option_dic['fit_file'])
+    if not os.path.isfile(fit_file):
+        print('拟合结果文件不存在，请先运行isotherm_fitting！(The fit_file does not exist, run isotherm_fitting first !)')
+        exit()
+
+    components = [c.strip() for c in option_dic['components'].split(',') if len(c.strip()) > 0]
+    if len(components) < 2:
+        print("至少需要两个组分！(At least two components are required !)")
+        exit()
+
+    try:
+        compositions = [parse_numbers(c) for c in option_dic['compositions'].split(';') if len(c.strip()) > 0]
+        pressures = parse_numbers(option_dic['pressures'])
+    except:
+        print("组成与压力必须为数字或者使用科学计数法！(Compositions and pressures must be numerical or use scientific notation !)")
+        exit()
+    if len(compositions) == 0 or len(pressures) == 0 or any(len(c) != len(components) for c in compositions) or \
+            any(min(c) < 0 or sum(c) <= 0 for c in compositions):
+        print("每个组成需要为每个组分给出一个非负的摩尔分数！"
+              "(Every composition needs one non-negative mole fraction per component !)")
+        exit()
+
+    temperature = config.get(section, 'temperature', fallback='').strip()
+    try:
+        temperature = float(temperature) if len(temperature) > 0 else None
+    except:
+        print("温度必须为数字！(Temperature must be numerical !)")
+        exit()
+
+    model = option_dic['model'].strip().lower()
+    if model != 'best' and model not in MODEL_PARAMETERS:
+        print("未知的模型 (unknown model) : {}，可选 (available) : best, {}".format(model, ", ".join(MODEL_PARAMETERS)))
+        exit()
+
+    validation_file = config.get(section, 'validation_file', fallback='').strip()
+    validation = None
+    if len(validation_file) > 0:
+        validation_file = os.path.abspath(validation_file)
+        try:
+            validation_pressure = float(os.path.basename(validation_file)[:-len('.csv')].rsplit('_', 1)[1])
+            validation_fractions = parse_numbers(config.get(section, 'validation_mole_fractions', fallback=''))
+        except:
+            print("无法从验证文件名中读取压力，或validation_mole_fractions不是数字！"
+                  "(Cannot read the pressure from the validation file name, or validation_mole_fractions is not numerical !)")
+            exit()
+        if not os.path.isfile(validation_file) or len(validation_fractions) != len(components):
+            print("验证文件不存在或validation_mole_fractions与组分数不一致！"
+                  "(The validation_file does not exist or validation_mole_fractions does not match the components !)")
+            exit()
+        validation = (validation_file, validation_pressure, validation_fractions,
+                      os.path.abspath(config.get(section, 'validation_output_file', fallback='iast_validation.csv')))
+
+    return fit_file, components, compositions, pressures, temperature, None if model == 'best' else model, \
+        option_dic['loading_unit'].strip(), os.path.abspath(option_dic['output_file']), validation
+
+
+def check_temperature(fits, temperature):
+    # 拟合结果中有多个温度时必须指定temperature
+    temperatures = np.unique(fits.temperatures[np.isfinite(fits.temperatures)])
+    if temperature is None and len(temperatures) > 1:
+        print("拟合结果中有多个温度 {}，请设置temperature！(The fits have several temperatures {}, set temperature !)".format(
+            temperatures.tolist(), temperatures.tolist()))
+        exit()
+
+
+def write_results(output_file, names, components, n_states, y, pressure, result, loading_unit, temperature):
+    headers = ['name', 'temperature', 'pressure'] + ['y_' + c for c in components] + \
+              [c + '_loading_' + loading_unit for c in components] + ['total_loading_' + loading_unit] + \
+              ['x_' + c for c in components]
+    if len(components) == 2:
+        headers.append('selectivity_{}/{}'.format(components[1], components[0]))
+    headers.append('converged')
+    loading = result['loading']
+    x = result['adsorbed_fractions']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        selectivity = (x[:, 1] / y[:, 1]) / (x[:, 0] / y[:, 0]) if len(components) == 2 else None
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for i in range(len(pressure)):
+            row = [names[i // n_states], '' if temperature is None else "{:g}".format(temperature),
+                   "{:g}".format(pressure[i])]
+            row += ["{:g}".format(v) for v in y[i]]
+            row += ["{:.6e}".format(v) for v in loading[i]] + ["{:.6e}".format(loading[i].sum())]
+            row += ["{:.6f}".format(v) for v in x[i]]
+            if selectivity is not None:
+                row.append("{:.6e}".format(selectivity[i]))
+            row.append(result['converged'][i])
+            writer.writerow(row)
+
+
+def read_validation(validation_file, components, loading_unit):
+    # graspa/mix_adsorption的结果文件：{结构名: 各组分吸附量}，Error行被跳过
+    gcmc = {}
+    with open(validation_file, 'r', newline='') as f:
+        rows = list(csv.reader(f))
+    headers = [h.strip() for h in rows[0]]
+    columns = [headers.index(c + '_loading_' + loading_unit) if c + '_loading_' + loading_unit in headers else None
+               for c in components]
+    if any(i is None for i in columns):
+        print("验证文件中缺少{}吸附量的列！(The validation file has no {} loading columns !)".format(
+            loading_unit, loading_unit))
+        exit()
+    for row in rows[1:]:
+        if len(row) < 2 or row[1].strip() != 'True':
+            continue
+        try:
+            gcmc[row[0]] = [float(row[i]) for i in columns]
+        except (ValueError, IndexError):
+            continue
+    return gcmc
+
+
+def validate(fits, components, temperature, model, loading_unit, validation):
+    validation_file, pressure, fractions, output_file = validation
+    gcmc = read_validation(validation_file, components, loading_unit)
+    names, _, _, result = predict_mixtures(fits, components, [fractions], [pressure], temperature=temperature,
+                                           model=model)
+    index = {n: i for i, n in enumerate(names)}
+    common = [n for n in sorted(gcmc) if n in index]
+    deviations = []
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name'] + [c + '_gcmc_' + loading_unit for c in components] +
+                        [c + '_iast_' + loading_unit for c in components] +
+                        [c + '_relative_deviation' for c in components])
+        for n in common:
+            q_gcmc = np.array(gcmc[n])
+            q_iast = result['loading'][index[n]]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                deviation = (q_iast - q_gcmc) / q_gcmc
+            deviations.append(deviation)
+            writer.writerow([n] + ["{:.6e}".format(v) for v in q_gcmc] + ["{:.6e}".format(v) for v in q_iast] +
+                            ["{:.4f}".format(v) for v in deviation])
+    print("验证 (validation) : {} 个结构 (structures), {} 个没有拟合结果 (without fits)".format(
+        len(common), len(gcmc) - len(common)))
+    if len(deviations) > 0:
+        deviations = np.abs(np.array(deviations))
+        for j, c in enumerate(components):
+            finite = np.isfinite(deviations[:, j])
+            if finite.any():
+                print("  {}: 平均相对偏差 (mean absolute relative deviation) {:.3f}, 中位数 (median) {:.3f}".format(
+                    c, deviations[finite, j].mean(), np.median(deviations[finite, j])))
+    print(output_file)
+
+
+def main():
+    fit_file, components, compositions, pressures, temperature, model, loading_unit, output_file, validation = \
+        check_parameters()
+    start = time.time()
+    fits = FittedIsotherms.load(fit_file)
+    check_temperature(fits, temperature)
+
+    names, y, pressure, result = predict_mixtures(fits, components, compositions, pressures,
+                                                  temperature=temperature, model=model)
+    if len(names) == 0:
+        print("没有同时具有{}拟合结果的结构！(No structures have fits for all of {} !)".format(components, components))
+        exit()
+    if temperature is None:
+        temperatures = np.unique(fits.temperatures[np.isfinite(fits.temperatures)])
+        temperature = temperatures[0] if len(temperatures) == 1 else None
+    write_results(output_file, names, components, len(compositions) * len(pressures), y, pressure, result,
+                  loading_unit, temperature)
+    n_failed = int(np.sum(~result['converged']))
+    print("\033[0;30;42m\n完成！共 {} 个结构，{} 个状态点，{} 个未收敛，用时 {:.1f} s "
+          "(Finish, {} structures, {} state points, {} not converged, {:.1f} s)\n\033[0m".format(
+              len(names), len(pressure), n_failed, time.time() - start, len(names), len(pressure), n_failed,
+              time.time() - start))
+    print(output_file)
+
+    if validation is not None:
+        validate(fits, components, temperature, model, loading_unit, validation)
+
+
+if __name__ == '__main__':
+    main()
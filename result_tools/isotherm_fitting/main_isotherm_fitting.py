@@ -0,0 +1,164 @@
+import configparser
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.isotherm_fit import MODEL_PARAMETERS, FittedIsotherms, best_models, fit_isotherms, \
+    isotherm_loading, read_isotherm_file, split_isotherm_names, stack_isotherms
+
+
+def read_records(args):
+    # 在子进程中读取单个结果文件
+    path, loading_unit, loading_type, name, temperature = args
+    try:
+        return read_isotherm_file(path, loading_unit, loading_type, name, temperature)
+    except Exception as e:
+        print("\033[0;37;41m{} error: {}\033[0m".format(os.path.basename(path), repr(e)))
+        return []
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "FIT_CONFIG"
+    full_options = ['result_location', 'loading_unit', 'loading_type', 'models', 'max_iterations', 'max_processes',
+                    'output_file', 'fit_file']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    result_dirs = [os.path.abspath(d.strip()) for d in option_dic['result_location'].split(',') if len(d.strip()) > 0]
+    if len(result_dirs) == 0 or not all(os.path.isdir(d) for d in result_dirs):
+        print('结果目录无效！(Invalid result_location!)')
+        exit()
+
+    temperature = config.get(section, 'temperature', fallback='').strip()
+    try:
+        temperature = float(temperature) if len(temperature) > 0 else np.nan
+    except:
+        print("温度必须为数字！(Temperature must be numerical !)")
+        exit()
+
+    loading_type = option_dic['loading_type'].strip().lower()
+    if loading_type not in ('absolute', 'excess'):
+        print("loading_type只能为absolute或excess！(loading_type must be absolute or excess !)")
+        exit()
+
+    models = [m.strip().lower() for m in option_dic['models'].split(',') if len(m.strip()) > 0]
+    unknown = [m for m in models if m not in MODEL_PARAMETERS]
+    if len(models) == 0 or len(unknown) > 0:
+        print("未知的模型 (unknown models) : {}，可选 (available) : {}".format(unknown, list(MODEL_PARAMETERS)))
+        exit()
+
+    try:
+        max_iterations = int(option_dic['max_iterations'])
+        max_processes = int(option_dic['max_processes'])
+    except:
+        print("max_iterations与max_processes必须为整数！(max_iterations and max_processes must be integers !)")
+        exit()
+
+    use_errors = config.get(section, 'use_errors', fallback='yes').strip().lower() == 'yes'
+    residual_file = config.get(section, 'residual_file', fallback='').strip()
+    return result_dirs, temperature, option_dic['loading_unit'].strip(), loading_type, models, use_errors, \
+        max_iterations, max_processes, option_dic['output_file'].strip(), residual_file, option_dic['fit_file'].strip()
+
+
+def write_fits(output_file, records, results, best):
+    headers = ['name', 'temperature', 'component', 'n_points', 'p_min', 'p_max', 'best_model']
+    for m in results:
+        headers += [m + '_' + p for p in MODEL_PARAMETERS[m]]
+        headers += [m + '_rmse', m + '_r2', m + '_aicc', m + '_converged']
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        for i, r in enumerate(records):
+            row = [r['name'], '' if np.isnan(r['temperature']) else "{:g}".format(r['temperature']), r['component'],
+                   len(r['pressure'])]
+            row += ["{:.6e}".format(r['pressure'].min()), "{:.6e}".format(r['pressure'].max())] \
+                if len(r['pressure']) > 0 else ['', '']
+            row.append(best[i])
+            for m, res in results.items():
+                row += ["{:.6e}".format(v) for v in res['params'][i]]
+                row += ["{:.6e}".format(res['rmse'][i]), "{:.6f}".format(res['r2'][i]),
+                        "{:.4f}".format(res['aicc'][i]), res['converged'][i]]
+            writer.writerow(row)
+
+
+def write_residuals(residual_file, records, results, pressure, loading):
+    with open(residual_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'temperature', 'component', 'pressure', 'loading'] +
+                        [m + '_residual' for m in results])
+        fitted = {m: isotherm_loading(m, res['params'], pressure) for m, res in results.items()}
+        for i, r in enumerate(records):
+            temperature = '' if np.isnan(r['temperature']) else "{:g}".format(r['temperature'])
+            for j in np.flatnonzero(np.isfinite(pressure[i]) & np.isfinite(loading[i])):
+                writer.writerow([r['name'], temperature, r['component'], "{:g}".format(pressure[i, j]),
+                                 "{:.6e}".format(loading[i, j])] +
+                                ["{:.6e}".format(loading[i, j] - fitted[m][i, j]) for m in results])
+
+
+def main():
+    result_dirs, temperature, loading_unit, loading_type, models, use_errors, max_iterations, max_processes, \
+        output_file, residual_file, fit_file = check_parameters()
+    start = time.time()
+
+    # 文件名中的温度后缀按每个目录的文件列表解析（见split_isotherm_names）
+    tasks = []
+    for d in result_dirs:
+        split = split_isotherm_names(os.listdir(d))
+        tasks += [(os.path.join(d, f), loading_unit, loading_type) + split[f] for f in split]
+    tasks.sort()
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        records = [r for rs in pool.map(read_records, tasks, chunksize=64) for r in rs]
+    if len(records) == 0:
+        print("结果目录中没有包含{}吸附量的等温线文件！(No isotherm files with {} loadings in result_location !)".format(
+            loading_unit, loading_unit))
+        exit()
+    for r in records:
+        if np.isnan(r['temperature']):
+            r['temperature'] = temperature
+        if not use_errors:
+            r['sigma'] = None
+
+    pressure, loading, sigma = stack_isotherms(records)
+    results = fit_isotherms(pressure, loading, models=models, sigma=sigma if use_errors else None,
+                            max_iter=max_iterations)
+    best = best_models(results)
+
+    write_fits(output_file, records, results, best)
+    if len(residual_file) > 0:
+        write_residuals(residual_file, records, results, pressure, loading)
+    p_min = [r['pressure'].min() if len(r['pressure']) > 0 else np.nan for r in records]
+    p_max = [r['pressure'].max() if len(r['pressure']) > 0 else np.nan for r in records]
+    FittedIsotherms([r['name'] for r in records], [r['temperature'] for r in records],
+                    [r['component'] for r in records], {m: res['params'] for m, res in results.items()},
+                    {m: res['rmse'] for m, res in results.items()}, best, p_min, p_max).save(fit_file)
+
+    print("{:>14} {:>10} {:>12} {:>8}".format("model", "converged", "median_r2", "best"))
+    for m, res in results.items():
+        print("{:>14} {:>10} {:>12.6f} {:>8}".format(m, int(res['converged'].sum()), np.nanmedian(res['r2']),
+                                                     int(np.sum(best == m))))
+    print("\033[0;30;42m\n完成！共 {} 条等温线，用时 {:.1f} s (Finish, {} isotherms, {:.1f} s)\n\033[0m".format(
+        len(records), time.time() - start, len(records), time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
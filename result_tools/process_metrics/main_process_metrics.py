@@ -0,0 +1,128 @@
+import configparser
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.process_metrics import join_columns, process_metrics, read_column, read_isotherm_point, write_table
+
+INPUTS = ['adsorption_loading', 'desorption_loading', 'weak_loading', 'henry_strong', 'henry_weak']
+# 配置文件中的输入对应process_metrics()的键
+INPUT_KEYS = {'adsorption_loading': 'adsorption', 'desorption_loading': 'desorption', 'weak_loading': 'weak',
+              'henry_strong': 'henry_strong', 'henry_weak': 'henry_weak'}
+
+
+def parse_source(text: str):
+    '''
+        "<结果文件> : <列名>"或"<等温线结果目录> : <组分> @ <压力>"，返回(路径, 列名或组分, 压力或None)
+    '''
+    path, column = text.rsplit(':', 1)
+    pressure = None
+    if '@' in column:
+        column, pressure = column.split('@')
+        pressure = float(pressure)
+    return os.path.abspath(path.strip()), column.strip(), pressure
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "METRICS_CONFIG"
+    full_options = ['strong_component', 'weak_component', 'mole_fractions', 'loading_unit', 'loading_type',
+                    'output_file'] + INPUTS
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    sources = {}
+    for op in INPUTS:
+        if len(option_dic[op].strip()) == 0:
+            continue
+        try:
+            sources[op] = parse_source(option_dic[op])
+        except ValueError:
+            print("{}的格式应为 <文件> : <列名> 或 <目录> : <组分> @ <压力>！"
+                  "({} must be <file> : <column> or <directory> : <component> @ <pressure> !)".format(op, op))
+            exit()
+        path, _, pressure = sources[op]
+        if (pressure is None and not os.path.isfile(path)) or (pressure is not None and not os.path.isdir(path)):
+            print("{}的结果文件或目录不存在！(The result file or directory of {} does not exist !)".format(op, op))
+            exit()
+    if len(sources) == 0:
+        print("至少需要一个输入！(At least one input is required !)")
+        exit()
+
+    mole_fractions = option_dic['mole_fractions'].strip()
+    try:
+        mole_fractions = [float(x) for x in mole_fractions.replace(',', ' ').split()] if len(mole_fractions) > 0 \
+            else None
+    except ValueError:
+        print("摩尔分数必须为数字！(Mole fractions must be numerical !)")
+        exit()
+    if mole_fractions is not None and (len(mole_fractions) != 2 or min(mole_fractions) <= 0):
+        print("mole_fractions需要两个正数（强吸附组分, 弱吸附组分）！"
+              "(mole_fractions needs two positive values (strong, weak component) !)")
+        exit()
+
+    loading_type = option_dic['loading_type'].strip()
+    if loading_type not in ('absolute', 'excess'):
+        print("loading_type只能为absolute或excess！(loading_type must be absolute or excess !)")
+        exit()
+
+    return option_dic['strong_component'].strip(), option_dic['weak_component'].strip(), mole_fractions, sources, \
+        option_dic['loading_unit'].strip(), loading_type, os.path.abspath(option_dic['output_file'])
+
+
+def main():
+    strong, weak, mole_fractions, sources, loading_unit, loading_type, output_file = check_parameters()
+    start = time.time()
+    columns = []
+    for op, (path, column, pressure) in sources.items():
+        try:
+            if pressure is None:
+                columns.append(read_column(path, column))
+            else:
+                columns.append(read_isotherm_point(path, column, pressure, loading_unit, loading_type))
+        except ValueError as e:
+            print("{}: 结果文件中没有该列！(The result file has no such column !) {}".format(op, e))
+            exit()
+        print("{}: {} 个结构 (structures)".format(op, len(columns[-1][0])))
+    names, values, errors = join_columns(columns)
+    if len(names) == 0:
+        print("没有同时出现在所有输入中的结构！(No structure appears in all inputs !)")
+        exit()
+
+    inputs = {INPUT_KEYS[op]: (values[:, k], errors[:, k]) for k, op in enumerate(sources)}
+    metrics = process_metrics(inputs, mole_fractions)
+    units = {'working_capacity': '_{}_{}'.format(strong, loading_unit), 'regenerability': '_percent',
+             'adsorption_selectivity': '_{}/{}'.format(strong, weak),
+             'henry_selectivity': '_{}/{}'.format(strong, weak), 'APS': '_{}'.format(loading_unit)}
+    table = {}
+    for k, op in enumerate(sources):
+        table[op] = values[:, k]
+        table[op + '_error'] = errors[:, k]
+    for m, (value, error) in metrics.items():
+        table[m + units[m]] = value
+        table[m + '_error' + units[m]] = error
+    write_table(output_file, names, table)
+
+    print("\033[0;30;42m\n完成！共 {} 个结构，{} 个指标，用时 {:.1f} s "
+          "(Finish, {} structures, {} metrics, {:.1f} s)\n\033[0m".format(
+              len(names), len(metrics), time.time() - start, len(names), len(metrics), time.time() - start))
+    print(output_file)
+
+
+if __name__ == '__main__':
+    main()
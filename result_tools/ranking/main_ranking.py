@@ -0,0 +1,123 @@
+import configparser
+import csv
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from ht_utils.ranking import IncrementalRanking
+
+
+def parse_objective(text: str):
+    '''
+        "<结果文件> : <列名> : <max|min>"，返回(路径, 列名, 是否越大越好)
+    '''
+    path, column, direction = [x.strip() for x in text.rsplit(':', 2)]
+    if direction.lower() not in ('max', 'min'):
+        raise ValueError(direction)
+    return os.path.abspath(path), column, direction.lower() == 'max'
+
+
+def check_parameters():
+    cur_path = os.path.abspath(os.path.dirname(__file__))
+    os.chdir(cur_path)
+    config = configparser.ConfigParser()
+    config.read("config.ini", encoding='utf8')
+    section = "RANKING_CONFIG"
+    full_options = ['objectives', 'n_fronts', 'top_k', 'state_file', 'watch_interval', 'output_file', 'top_k_file']
+    options_in_config = config.options(section)
+    missing_options = []
+    option_dic = {}
+    for op in full_options:
+        if op not in options_in_config:
+            missing_options.append(op)
+        else:
+            option_dic[op] = config.get(section, op)
+
+    if len(missing_options) > 0:
+        print("配置文件中参数不完整! (The parameters in the configuration file are incomplete !)")
+        print("缺少的选项 (missing options) : " + str(missing_options))
+        exit()
+
+    try:
+        objectives = [parse_objective(o) for o in option_dic['objectives'].replace(';', '\n').splitlines()
+                      if len(o.strip()) > 0]
+    except ValueError:
+        print("每个目标的格式应为 <结果文件> : <列名> : <max|min>！"
+              "(Every objective must be <result file> : <column> : <max|min> !)")
+        exit()
+    if len(objectives) == 0:
+        print("至少需要一个目标！(At least one objective is required !)")
+        exit()
+    for path, _, _ in objectives:
+        if not os.path.isfile(path):
+            print("结果文件不存在 (The result file does not exist) : " + path)
+            exit()
+
+    try:
+        n_fronts = int(option_dic['n_fronts'])
+        top_k = int(option_dic['top_k'])
+        watch_interval = float(option_dic['watch_interval'] or 0)
+    except ValueError:
+        print("n_fronts与top_k必须为整数，watch_interval必须为数字！"
+              "(n_fronts and top_k must be integers and watch_interval must be numerical !)")
+        exit()
+    if n_fronts < 1 or top_k < 1:
+        print("n_fronts与top_k必须为正整数！(n_fronts and top_k must be positive integers !)")
+        exit()
+
+    state_file = option_dic['state_file'].strip()
+    return objectives, n_fronts, top_k, os.path.abspath(state_file) if len(state_file) > 0 else None, \
+        watch_interval, os.path.abspath(option_dic['output_file']), os.path.abspath(option_dic['top_k_file'])
+
+
+def write_fronts(output_file, ranking):
+    names, values, fronts = ranking.fronts()
+    with open(output_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name'] + [c for _, c, _ in ranking.objectives] + ['pareto_front'])
+        for i in range(len(names)):
+            writer.writerow([names[i]] + ["{:.6e}".format(v) for v in values[i]] + [fronts[i] + 1])
+    return len(names)
+
+
+def write_top_k(top_k_file, ranking):
+    with open(top_k_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['objective', 'rank', 'name', 'value'])
+        for j, (_, column, _) in enumerate(ranking.objectives):
+            names, values = ranking.top_values(j)
+            for rank, (name, value) in enumerate(zip(names, values)):
+                writer.writerow([column, rank + 1, name, "{:.6e}".format(value)])
+
+
+def main():
+    objectives, n_fronts, top_k, state_file, watch_interval, output_file, top_k_file = check_parameters()
+    if state_file is not None:
+        ranking = IncrementalRanking.load(state_file, objectives, n_fronts, top_k)
+    else:
+        ranking = IncrementalRanking(objectives, n_fronts, top_k)
+
+    # watch_interval大于0时每隔watch_interval秒读取新写入的结果并更新排名，按Ctrl+C停止
+    while True:
+        start = time.time()
+        n_rows = ranking.update()
+        n_ranked = write_fronts(output_file, ranking)
+        write_top_k(top_k_file, ranking)
+        if state_file is not None:
+            ranking.save(state_file)
+        print("\033[0;30;42m\n完成！新读取 {} 行，前 {} 个前沿共 {} 个结构，用时 {:.1f} s "
+              "(Finish, {} new rows, {} structures in the first {} fronts, {:.1f} s)\n\033[0m".format(
+                  n_rows, n_fronts, n_ranked, time.time() - start, n_rows, n_ranked, n_fronts, time.time() - start))
+        if watch_interval <= 0:
+            break
+        try:
+            time.sleep(watch_interval)
+        except KeyboardInterrupt:
+            break
+    print(output_file)
+    print(top_k_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
 import configparser
 import os
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from threading import Lock
 import shutil
 import sys
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ht_utils.cif_atoms import read_cif_atoms
+from ht_utils.p1_cache import find_p1_cif
+from ht_utils.pore_geometry import pore_geometry
+from ht_utils.symmetry import expand_to_p1
+
 
 class ProcessBar:
     def __init__(self, total):
@@ -65,6 +71,44 @@ def work(root_cmd, cif_dir, cif, lock, output_file, zeo_output_dir, process_bar)
         lock.release()
 
 
+def numpy_work(args):
+    '''
+        在子进程中用NumPy计算单个结构的几何描述符，不需要zeo++
+    '''
+    cif_dir, cif, spacing, area_radius, volume_radius, area_samples = args
+    try:
+        structure = read_cif_atoms(find_p1_cif(cif_dir, cif))
+        if not structure.is_p1():
+            structure = expand_to_p1(structure)
+        return cif[:-4], pore_geometry(structure, spacing, area_radius, volume_radius, area_samples)
+    except Exception as e:
+        return cif[:-4], e
+
+
+def numpy_main(cif_dir, cifs, max_processes, spacing, area_radius, volume_radius, area_samples, output_file,
+               psd_file):
+    process_bar = ProcessBar(len(cifs))
+    tasks = [(cif_dir, cif, spacing, area_radius, volume_radius, area_samples) for cif in cifs]
+    with open(psd_file, 'w') as f:
+        f.write('name,pore_diameter(A),fraction\n')
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        for cif_name, res in pool.map(numpy_work, tasks):
+            with open(output_file, 'a') as f:
+                if isinstance(res, Exception):
+                    f.write("{},error\n".format(cif_name))
+                else:
+                    f.write("{},{:.4f},{:.4f},{:.6f},{:.4f},{:.4f},{:.6f},{:.6f}\n".format(
+                        cif_name, res['LCD'], res['PLD'], res['density'], res['VSA'], res['GSA'], res['Vp'],
+                        res['void_fraction']))
+            if not isinstance(res, Exception):
+                with open(psd_file, 'a') as f:
+                    for diameter, fraction in zip(*res['psd']):
+                        if fraction > 0:
+                            f.write("{},{:.2f},{:.6f}\n".format(cif_name, diameter, fraction))
+            process_bar.incr()
+            process_bar.run()
+
+
 def get_LCD_PLD(string):
     strs = string.split()
     PLD = strs[2]
@@ -118,6 +162,9 @@ if __name__ == "__main__":
     porosity_monte_carlo_samples = option_dic["porosity_monte_carlo_samples"]
     output_file = option_dic["output_file_name"]
     zeo_output_dir = "zeo_results"
+    # 可选参数：计算方式(zeo++、numpy或auto，auto在找不到zeo++时使用numpy)与numpy模式的网格间距
+    engine = config.get(section, 'engine', fallback='zeo++').strip().lower()
+    grid_spacing = config.get(section, 'grid_spacing', fallback='0.2')
 
     if len(zeo_dir) > 0:
         zeo_dir = os.path.abspath(zeo_dir)
@@ -125,7 +172,21 @@ if __name__ == "__main__":
     if len(cif_dir) > 0:
         cif_dir = os.path.abspath(cif_dir)
 
-    if not os.path.isfile(os.path.join(zeo_dir, 'network')):
+    if engine not in ('zeo++', 'numpy', 'auto'):
+        print('engine只能为zeo++、numpy或auto！(engine must be zeo++, numpy or auto !)')
+        exit()
+
+    try:
+        grid_spacing = float(grid_spacing)
+    except:
+        print("grid_spacing必须为数字！(grid_spacing must be numerical !)")
+        exit()
+
+    if engine == 'auto':
+        engine = 'zeo++' if os.path.isfile(os.path.join(zeo_dir, 'network')) else 'numpy'
+        print("使用{}计算 (using {})".format(engine, engine))
+
+    if engine == 'zeo++' and not os.path.isfile(os.path.join(zeo_dir, 'network')):
         print('zeo++目录无效！(Invalid zeo++_dir!)')
         exit()
 
@@ -145,6 +206,16 @@ if __name__ == "__main__":
         print('cif目录中缺乏有效的cif文件！(There are no valid cif files in the cif_dir)')
         exit()
 
+    if engine == 'numpy':
+        with open(output_file, 'w') as f:
+            f.write(
+                'name,LCD,PLD,desity(g/cm^3),VSA(m^2/cm^3),GSA(m^2/g),Vp(cm^3/g),void_fraction\n')
+        print("calculating.....")
+        numpy_main(cif_dir, cifs, max_threads, grid_spacing, float(area_radius), float(volume_radius),
+                   int(area_monte_carlo_samples), output_file, os.path.join(cur_path, "psd_result.csv"))
+        print("\033[0;30;42m\n完成！(Finish)\n\033[0m")
+        exit()
+
     if os.path.exists(os.path.join(cur_path, zeo_output_dir)):
         print("zeo_results目录已存在，请手动删除后重试！(The zeo_results fold already exists, please delete it and try again !)")
         exit()